@@ -34,6 +34,7 @@ from MAVProxy.modules.lib import rline
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_substitute
 from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib import telemetry_store
 from MAVProxy.modules.mavproxy_link import preferred_ports
 
 # adding all this allows pyinstaller to build a working windows executable
@@ -73,8 +74,9 @@ class MPStatus(object):
     '''hold status information about the mavproxy'''
     def __init__(self):
         self.gps = None
-        self.msgs = {}
-        self.msg_count = {}
+        # preallocate slots for the message types of the dialect
+        self.msgs = telemetry_store.TelemetryStore([c.msgname for c in mavutil.mavlink.mavlink_map.values()])
+        self.msg_count = self.msgs.msg_count
         self.counters = {'MasterIn' : [], 'MasterOut' : 0, 'FGearIn' : 0, 'FGearOut' : 0, 'Slave' : 0}
         self.bytecounters = {'MasterIn': []}
         self.setup_mode = opts.setup
@@ -268,6 +270,7 @@ class MPState(object):
             MPSetting('wpupdates', bool, True, 'Announce waypoint updates'),
             MPSetting('wpterrainadjust', bool, True, 'Adjust alt of moved wp using terrain'),
             MPSetting('wp_use_mission_int', bool, True, 'use MISSION_ITEM_INT messages'),
+            MPSetting('wp_max_window', int, 32, 'maximum outstanding mission item requests', range=(2, 255)),
             MPSetting('wp_use_waypoint_set_current', bool, False, 'use deprecated WAYPOINT_SET_CURRENT message'),
 
             MPSetting('basealt', int, 0, 'Base Altitude', range=(0, 30000), increment=1, tab='Altitude'),
@@ -295,6 +298,7 @@ class MPState(object):
             MPSetting('checkdelay', bool, True, 'check for link delay'),
             MPSetting('param_ftp', bool, True, 'try ftp for parameter download'),
             MPSetting('param_docs', bool, True, 'show help for parameters'),
+            MPSetting('param_ftp_load', int, 100, 'use ftp for param load of at least this many changes, 0 to disable'),
 
             MPSetting('vehicle_name', str, '', 'Vehicle Name', tab='Vehicle'),
 
@@ -333,6 +337,9 @@ class MPState(object):
         # SITL output
         self.sitl_output = None
 
+        # RTCM injection scheduler shared by GPS correction modules
+        self.rtcm_injector = None
+
         self.mav_param_by_sysid = {}
         self.mav_param_by_sysid[(self.settings.target_system, self.settings.target_component)] = mavparm.MAVParmDict()
         self.modules = []
@@ -463,6 +470,13 @@ class MPState(object):
                 continue
             closure(self.mav_master[linkNumber].mav)
 
+    def sysid_links(self, sysid):
+        # return the links a vehicle with this sysid has been seen on. Unlike master(sysid)
+        # this does not fall back to the current link, so it is empty for an unknown sysid.
+        # Safe to call from module threads, as the map is copied before iterating
+        return [self.mav_master[linkNumber] for (linkNumber, vehicleList) in list(self.vehicle_link_map.items())
+                if linkNumber < len(self.mav_master) and any(v[0] == sysid for v in list(vehicleList))]
+
     def notify_click(self):
         notify_mods = ['map', 'misseditor']
         for modname in notify_mods:
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+'''
+array based store of traffic tracks, with vectorized distance and closest
+point of approach calculations and a grid index for range queries
+
+AP_FLAKE8_CLEAN
+'''
+
+import numpy as np
+
+from MAVProxy.modules.lib.mp_util import radius_of_earth
+
+DEG_TO_M = radius_of_earth * np.pi / 180.0
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    '''great circle distance in metres between arrays of points in degrees, with broadcasting'''
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    dlat = lat2 - lat1
+    dlon = np.radians(lon2) - np.radians(lon1)
+    a = np.sin(0.5 * dlat)**2 + np.sin(0.5 * dlon)**2 * np.cos(lat1) * np.cos(lat2)
+    return 2.0 * radius_of_earth * np.arctan2(np.sqrt(a), np.sqrt(np.maximum(1.0 - a, 0.0)))
+
+
+def closest_approach(north, east, down, vn, ve, vd, horizon):
+    '''time and distance of closest approach for relative positions and velocities,
+    with times limited to 0..horizon seconds'''
+    vsq = vn * vn + ve * ve + vd * vd
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = -(north * vn + east * ve + down * vd) / vsq
+    t = np.clip(np.nan_to_num(t, nan=0.0, posinf=0.0, neginf=0.0), 0.0, horizon)
+    dist = np.sqrt((north + vn * t)**2 + (east + ve * t)**2 + (down + vd * t)**2)
+    return t, dist
+
+
+class GridIndex(object):
+    '''points bucketed into lat/lon cells of roughly cell_size metres, for range queries'''
+
+    def __init__(self, lat, lon, cell_size=5000.0):
+        self.cell_lat = cell_size / DEG_TO_M
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        # longitude cells are sized at the most poleward point so a query never needs more columns
+        max_lat = min(np.abs(lat).max(), 89.0) if len(lat) else 0.0
+        self.cell_lon = self.cell_lat / np.cos(np.radians(max_lat))
+        self.lat = lat
+        self.lon = lon
+        keys = self.cell_key(np.floor(lat / self.cell_lat), np.floor(lon / self.cell_lon))
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    @staticmethod
+    def cell_key(row, col):
+        return row.astype(np.int64) * (1 << 32) + col.astype(np.int64)
+
+    def query(self, lat, lon, radius):
+        '''return indices of points within radius metres of lat, lon'''
+        if len(self.keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        dlat = radius / DEG_TO_M
+        dlon = dlat / max(np.cos(np.radians(min(abs(lat) + dlat, 89.0))), 1.0e-6)
+        rows = np.arange(np.floor((lat - dlat) / self.cell_lat), np.floor((lat + dlat) / self.cell_lat) + 1)
+        cols = np.arange(np.floor((lon - dlon) / self.cell_lon), np.floor((lon + dlon) / self.cell_lon) + 1)
+        # each row of cells is one contiguous run of sorted keys
+        first = self.cell_key(rows, np.full(len(rows), cols[0]))
+        last = self.cell_key(rows, np.full(len(rows), cols[-1]))
+        starts = np.searchsorted(self.keys, first, side='left')
+        ends = np.searchsorted(self.keys, last, side='right')
+        idx = np.concatenate([self.order[s:e] for (s, e) in zip(starts, ends)])
+        dist = haversine_distance(lat, lon, self.lat[idx], self.lon[idx])
+        return np.sort(idx[dist <= radius])
+
+
+class TrackTable(object):
+    '''struct of arrays holding track state, indexed by row, with a map of track id to row'''
+
+    # lat/lon in degrees, alt in metres AMSL, velocities in m/s NED, times in seconds
+    fields = ('lat', 'lon', 'alt', 'vn', 've', 'vd', 'update_time', 'radius', 'height')
+
+    def __init__(self, capacity=64):
+        self.ids = []
+        self.rows = {}
+        self.capacity = capacity
+        for f in self.fields:
+            setattr(self, '_' + f, np.zeros(capacity))
+        self._evading = np.zeros(capacity, dtype=bool)
+        self.grid = None
+        self.grid_cell_size = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.rows
+
+    def __getattr__(self, name):
+        # expose the used part of each array, e.g. table.lat
+        if name in TrackTable.fields or name == 'evading':
+            return self.__dict__['_' + name][:len(self.__dict__['ids'])]
+        raise AttributeError(name)
+
+    def grow(self):
+        self.capacity *= 2
+        for f in self.fields + ('evading',):
+            old = getattr(self, '_' + f)
+            new = np.zeros(self.capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, '_' + f, new)
+
+    def update(self, id, **values):
+        '''add or update a track, returning its row'''
+        row = self.rows.get(id)
+        if row is None:
+            row = len(self.ids)
+            if row == self.capacity:
+                self.grow()
+            self.ids.append(id)
+            self.rows[id] = row
+            self._evading[row] = False
+        for (name, value) in values.items():
+            getattr(self, '_' + name)[row] = value
+        self.grid = None
+        return row
+
+    def get(self, id, name):
+        '''get one field of one track'''
+        return getattr(self, '_' + name)[self.rows[id]]
+
+    def remove(self, mask):
+        '''remove all tracks where mask is True, returning their ids'''
+        n = len(self.ids)
+        mask = np.asarray(mask, dtype=bool)
+        if not mask.any():
+            return []
+        keep = np.flatnonzero(~mask)
+        for f in self.fields + ('evading',):
+            a = getattr(self, '_' + f)
+            a[:len(keep)] = a[:n][keep]
+        removed = [self.ids[i] for i in np.flatnonzero(mask)]
+        self.ids = [self.ids[i] for i in keep]
+        self.rows = {id: i for (i, id) in enumerate(self.ids)}
+        self.grid = None
+        return removed
+
+    def in_range(self, lat, lon, radius, cell_size=5000.0):
+        '''return ids of tracks within radius metres of a point'''
+        if len(self.ids) == 0:
+            return []
+        if self.grid is None or self.grid_cell_size != cell_size:
+            self.grid = GridIndex(self.lat, self.lon, cell_size)
+            self.grid_cell_size = cell_size
+        return [self.ids[i] for i in self.grid.query(lat, lon, radius)]
@@ -5,6 +5,7 @@ class to project a camera view onto the map
 
 import json
 import math
+import sys
 import time
 
 import numpy
@@ -195,6 +196,23 @@ class uavxfer:
         self.Rp = self.Rp_i = array(eye(4,4))
         self.z_earth = -600
 
+def gps_offset_array(lat, lon, east, north):
+    '''
+    vectorised mp_util.gps_offset for numpy arrays of east and north offsets
+    from one position, returning (lat, lon) arrays
+    '''
+    lat1 = mp_util.constrain(math.radians(lat), -pi/2+1.0e-15, pi/2-1.0e-15)
+    lon1 = math.radians(lon)
+    lat2 = numpy.clip(lat1 + north / mp_util.radius_of_earth, -pi/2 + 1.0e-15, pi/2 - 1.0e-15)
+    dlat = lat2 - lat1
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        dphi = numpy.log(numpy.tan(lat2/2+pi/4)/math.tan(lat1/2+pi/4))
+        q = numpy.where(numpy.abs(dlat) < 1.0e-15, math.cos(lat1), dlat/dphi)
+        dlon = (east / mp_util.radius_of_earth) / q
+    lon2 = numpy.fmod(lon1+dlon+pi, 2*pi)-pi
+    return (numpy.degrees(lat2), numpy.degrees(lon2))
+
+
 class CameraProjection:
     def __init__(self, C, elevation_model=None, terrain_source="SRTM3"):
         self.C = C
@@ -202,6 +220,113 @@ class CameraProjection:
         if elevation_model is None:
             self.elevation_model = mp_elevation.ElevationModel(database=terrain_source)
 
+    def get_elevation_array(self, lat, lon):
+        '''get terrain heights for arrays of lat/lon, NaN where unknown'''
+        if hasattr(self.elevation_model, 'GetElevationArray'):
+            return self.elevation_model.GetElevationArray(lat, lon)
+        ret = numpy.full(numpy.shape(lat), numpy.nan)
+        for i in range(len(ret)):
+            alt = self.elevation_model.GetElevation(lat[i], lon[i])
+            if alt is not None:
+                ret[i] = alt
+        return ret
+
+    def pixel_rays(self, xpos, ypos, roll_deg, pitch_deg, yaw_deg):
+        '''
+        get ray directions in the NED frame for arrays of pixel positions,
+        with angles as for pixel_position_flat. The rays are scaled to
+        the ones uavxfer.imageToWorld() uses
+
+        return is a Nx3 array
+        '''
+        src = numpy.zeros((len(xpos),1,2), numpy.float32)
+        src[:,0,0] = xpos
+        src[:,0,1] = ypos
+        K = self.C.K
+        dst = cv2.undistortPoints(src, K, self.C.D, eye(3), K).reshape(-1,2)
+
+        # image to world transform as in uavxfer, as one 3x3 matrix
+        Rc = transpose(rotationMatrix(0.0, 0.0, pi/2))
+        Rp = transpose(rotationMatrix(math.radians(roll_deg), math.radians(pitch_deg+90), math.radians(yaw_deg)))
+        M = dot(dot(Rp, Rc), linalg.inv(K))
+        uv = numpy.ones((len(dst),3))
+        uv[:,:2] = dst
+        return dot(uv, M.T)
+
+    def get_posned_array(self, xpos, ypos, clat, clon, calt_amsl, roll_deg, pitch_deg, yaw_deg):
+        '''
+        get NED from the camera position to the ground for arrays of pixel positions,
+        as get_posned() does for one pixel
+
+        return is (north, east, down) arrays, NaN where there is no projection
+        '''
+        xpos = numpy.asarray(xpos, dtype=numpy.float64).ravel()
+        ypos = numpy.asarray(ypos, dtype=numpy.float64).ravel()
+        n = len(xpos)
+        nan = numpy.full(n, numpy.nan)
+        theight = self.elevation_model.GetElevation(clat, clon)
+        if n == 0 or theight is None or calt_amsl <= theight:
+            return (nan, nan.copy(), nan.copy())
+
+        # project with flat earth
+        height_agl = calt_amsl - theight
+        rays = self.pixel_rays(xpos, ypos, roll_deg, pitch_deg, yaw_deg)
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            scale = height_agl / rays[:,2]
+            # negative scale means camera pointing above horizon
+            valid = numpy.isfinite(scale) & (scale >= 0)
+            north = numpy.where(valid, scale * rays[:,0], 0.0)
+            east = numpy.where(valid, scale * rays[:,1], 0.0)
+            down = numpy.full(n, height_agl)
+
+            # iterate to make more accurate, accounting for difference in terrain height at each point
+            (lat, lon) = gps_offset_array(clat, clon, east, north)
+            for i in range(3):
+                ground_alt = self.get_elevation_array(lat, lon)
+                sr = numpy.sqrt(north**2 + east**2 + down**2)
+                valid &= numpy.isfinite(ground_alt) & (sr > 1)
+                posd2 = calt_amsl - ground_alt
+                sin_pitch = down / sr
+                # adjust for height at this point
+                sr2 = sr - (down - posd2) / sin_pitch
+                ratio = numpy.where(valid, sr2 / sr, 0.0)
+                north *= ratio
+                east *= ratio
+                down *= ratio
+                (lat, lon) = gps_offset_array(clat, clon, east, north)
+        return (numpy.where(valid, north, numpy.nan),
+                numpy.where(valid, east, numpy.nan),
+                numpy.where(valid, down, numpy.nan))
+
+    def get_latlonalt_for_pixels(self, xpos, ypos, clat, clon, calt_amsl, roll_deg, pitch_deg, yaw_deg):
+        '''
+        get lat,lon,alt of projected pixels from camera for arrays of pixel positions
+        x,y are pixel coordinates, 0,0 is top-left corner
+
+        return is (lat, lon, alt) arrays, NaN where there is no projection
+        '''
+        (north, east, down) = self.get_posned_array(xpos, ypos, clat, clon, calt_amsl, roll_deg, pitch_deg, yaw_deg)
+        with numpy.errstate(invalid='ignore'):
+            valid = down > 0
+        north = numpy.where(valid, north, 0.0)
+        east = numpy.where(valid, east, 0.0)
+        (lat, lon) = gps_offset_array(clat, clon, east, north)
+        return (numpy.where(valid, lat, numpy.nan),
+                numpy.where(valid, lon, numpy.nan),
+                numpy.where(valid, calt_amsl-down, numpy.nan))
+
+    def get_latlonalt_grid(self, nx, ny, clat, clon, calt_amsl, roll_deg, pitch_deg, yaw_deg):
+        '''
+        project a grid of nx by ny pixels spread evenly over the image
+
+        return is (lat, lon, alt) arrays of shape (ny, nx), NaN where there is no projection
+        '''
+        xs = (numpy.arange(nx) + 0.5) * (self.C.xresolution / float(nx))
+        ys = (numpy.arange(ny) + 0.5) * (self.C.yresolution / float(ny))
+        (gx, gy) = numpy.meshgrid(xs, ys)
+        ret = self.get_latlonalt_for_pixels(gx.ravel(), gy.ravel(), clat, clon, calt_amsl, roll_deg, pitch_deg, yaw_deg)
+        return tuple(a.reshape(ny, nx) for a in ret)
+
     def pixel_position_flat(self, xpos, ypos, height_agl, roll_deg, pitch_deg, yaw_deg):
         '''
         find the NED offset on the ground in meters of a pixel in a ground image
@@ -310,22 +435,80 @@ class CameraProjection:
         ret = []
         xres = self.C.xresolution
         yres = self.C.yresolution
-        for (x,y) in [(0,0), (xres, 0), (xres, yres), (0,yres)]:
-            y0 = 0
-            while True:
-                latlonalt = self.get_latlonalt_for_pixel(x,y+y0,clat,clon,calt_amsl,roll_deg,pitch_deg,yaw_deg)
-                if latlonalt is not None:
-                    break
-                # chop off the top 10 pixels and try again
-                y0 += 10
-                if y0 >= self.C.yresolution:
-                    # give up
-                    return None
-            ret.append((latlonalt[0],latlonalt[1]))
+        corners = [(0,0), (xres, 0), (xres, yres), (0,yres)]
+        (lat, lon, alt) = self.get_latlonalt_for_pixels([c[0] for c in corners], [c[1] for c in corners],
+                                                        clat,clon,calt_amsl,roll_deg,pitch_deg,yaw_deg)
+        y0s = numpy.arange(10, yres, 10)
+        for i in range(len(corners)):
+            if not numpy.isnan(lat[i]):
+                ret.append((float(lat[i]),float(lon[i])))
+                continue
+            # chop off the top 10 pixels at a time until the corner projects
+            (x,y) = corners[i]
+            (clat2, clon2, calt2) = self.get_latlonalt_for_pixels(numpy.full(len(y0s), x), y+y0s,
+                                                                  clat,clon,calt_amsl,roll_deg,pitch_deg,yaw_deg)
+            ok = numpy.flatnonzero(~numpy.isnan(clat2))
+            if len(ok) == 0:
+                # give up
+                return None
+            ret.append((float(clat2[ok[0]]),float(clon2[ok[0]])))
         ret.append(ret[0])
         return ret
 
 
+class SlopeElevationModel:
+    '''simple terrain rising to the north, for tests'''
+    def __init__(self, lat, base=580.0, slope=0.1):
+        self.lat = lat
+        self.base = base
+        self.slope = slope
+
+    def GetElevation(self, lat, lon, timeout=0):
+        return self.base + (lat - self.lat) * 111319.5 * self.slope
+
+    def GetElevationArray(self, lat, lon, timeout=0):
+        return self.base + (numpy.asarray(lat) - self.lat) * 111319.5 * self.slope
+
+
+def test_pixel_batch():
+    '''check batched projection against projecting one pixel at a time'''
+    lat, lon = -35.363261, 149.165230
+    C = CameraParams(xresolution=640, yresolution=512, FOV=24.2)
+    cproj = CameraProjection(C, elevation_model=SlopeElevationModel(lat))
+    pose = (lat, lon, 700.0, 3.0, -40.0, 20.0)
+    xs = [0, 100, 320, 639, 600]
+    ys = [0, 50, 256, 511, 20]
+    (blat, blon, balt) = cproj.get_latlonalt_for_pixels(xs, ys, *pose)
+    for i in range(len(xs)):
+        r = cproj.get_latlonalt_for_pixel(xs[i], ys[i], *pose)
+        if r is None:
+            assert numpy.isnan(blat[i])
+            continue
+        assert mp_util.gps_distance(r[0], r[1], blat[i], blon[i]) < 0.01
+        assert abs(r[2] - balt[i]) < 0.01
+
+
+def benchmark_projection(nx=64, ny=48):
+    '''compare projecting a grid of pixels in one batch with one pixel at a time'''
+    lat, lon = -35.363261, 149.165230
+    C = CameraParams(xresolution=640, yresolution=512, FOV=24.2)
+    cproj = CameraProjection(C, elevation_model=SlopeElevationModel(lat))
+    pose = (lat, lon, 700.0, 0.0, -50.0, 30.0)
+    t0 = time.time()
+    (glat, glon, galt) = cproj.get_latlonalt_grid(nx, ny, *pose)
+    t1 = time.time()
+    xs = (numpy.arange(nx) + 0.5) * (C.xresolution / float(nx))
+    ys = (numpy.arange(ny) + 0.5) * (C.yresolution / float(ny))
+    count = 0
+    for y in ys:
+        for x in xs:
+            if cproj.get_latlonalt_for_pixel(x, y, *pose) is not None:
+                count += 1
+    t2 = time.time()
+    print("Projected %ux%u grid: batch %.1fms (%u points) single %.1fms (%u points)" % (
+        nx, ny, (t1-t0)*1000, numpy.count_nonzero(~numpy.isnan(glat)), (t2-t1)*1000, count))
+
+
 def test_pixel_position():
     C = CameraParams(lens=4.0, sensorwidth=5.0, xresolution=1024, yresolution=768)
     cproj = CameraProjection(C)
@@ -345,6 +528,7 @@ if __name__ == "__main__":
     print("Lens: %.2f" % C2.lens)
 
     test_pixel_position()
+    test_pixel_batch()
 
     from argparse import ArgumentParser
     parser = ArgumentParser("camera_projection.py [options]")
@@ -369,7 +553,12 @@ if __name__ == "__main__":
     parser.add_argument("--grid", default=False, action='store_true', help="add a UTM grid")
     parser.add_argument("--verbose", action='store_true', default=False, help="show mount actions")
     parser.add_argument("--terrain-source", type=str, default="SRTM1", choices=["SRTM1", "SRTM3", "None"], help="Elevation model")
+    parser.add_argument("--benchmark", action='store_true', default=False, help="benchmark batched projection and exit")
     args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_projection()
+        sys.exit(0)
     
     from MAVProxy.modules.mavproxy_map import mp_slipmap
     sm = mp_slipmap.MPSlipMap(lat=args.lat,
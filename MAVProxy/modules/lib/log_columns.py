@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+'''
+columnar access to binary dataflash logs
+
+Extracts all instances of a message type as numpy arrays straight from
+the memory mapped log using the offsets index pymavlink builds when the
+log is opened, without creating a message object per record.
+
+AP_FLAKE8_CLEAN
+'''
+
+import numpy as np
+
+from pymavlink import DFReader
+
+# numpy equivalents of DFReader.FORMAT_TO_STRUCT
+FORMAT_TO_NUMPY = {
+    "a": ("<i2", (32,)),
+    "b": ("i1", None),
+    "B": ("u1", None),
+    "g": ("<f2", None),
+    "h": ("<i2", None),
+    "H": ("<u2", None),
+    "i": ("<i4", None),
+    "I": ("<u4", None),
+    "f": ("<f4", None),
+    "n": ("S4", None),
+    "N": ("S16", None),
+    "Z": ("S64", None),
+    "c": ("<i2", None),
+    "C": ("<u2", None),
+    "e": ("<i4", None),
+    "E": ("<u4", None),
+    "L": ("<i4", None),
+    "d": ("<f8", None),
+    "M": ("i1", None),
+    "q": ("<i8", None),
+    "Q": ("<u8", None),
+}
+
+HEADER_LEN = 3
+
+# number of records gathered at a time, bounding the size of the index array
+CHUNK_SIZE = 65536
+
+
+def have_columns(mlog):
+    '''return True if columnar access is possible for this log. This
+    needs a binary log with microsecond timestamps'''
+    if not isinstance(mlog, DFReader.DFReader_binary):
+        return False
+    return isinstance(getattr(mlog, 'clock', None), DFReader.DFReaderClock_usec)
+
+
+def format_dtype(fmt):
+    '''return numpy structured dtype for a DFFormat'''
+    fields = []
+    for i in range(len(fmt.columns)):
+        (dt, shape) = FORMAT_TO_NUMPY[fmt.format[i]]
+        if shape is None:
+            fields.append((fmt.columns[i], dt))
+        else:
+            fields.append((fmt.columns[i], dt, shape))
+    return np.dtype(fields)
+
+
+def message_count(mlog, mtype):
+    '''return number of messages of a type in a binary log'''
+    mid = mlog.name_to_id.get(mtype, None)
+    if mid is None:
+        return 0
+    return mlog.counts[mid]
+
+
+def get_columns(mlog, mtype, fields=None):
+    '''return dict of numpy arrays, one per field, for all messages of
+    type mtype, with multipliers applied as DFReader does. The
+    '_timestamp' entry holds the message timestamps and '_offset' the
+    file offset of each message, giving the order of messages of
+    different types. Returns None if columnar access isn't possible for
+    this log or type'''
+    if not have_columns(mlog):
+        return None
+    mid = mlog.name_to_id.get(mtype, None)
+    if mid is None:
+        return None
+    fmt = mlog.formats[mid]
+    if len(fmt.columns) == 0 or fmt.columns[0] != 'TimeUS':
+        return None
+    if fields is None:
+        fields = fmt.columns
+    for f in fields:
+        if f not in fmt.colhash:
+            return None
+    count = mlog.counts[mid]
+    dtype = format_dtype(fmt)
+    if count == 0:
+        ret = {f: np.zeros(0, dtype=dtype[f]) for f in fields}
+        ret['_timestamp'] = np.zeros(0)
+        ret['_offset'] = np.zeros(0, dtype=np.int64)
+        return ret
+
+    # gather the payload bytes for every record into one contiguous
+    # buffer then view it as a structured array
+    data = np.frombuffer(mlog.data_map, dtype=np.uint8)
+    offsets = np.asarray(mlog.offsets[mid][:count], dtype=np.int64) + HEADER_LEN
+    if offsets[-1] + dtype.itemsize > len(data):
+        # truncated last record
+        offsets = offsets[offsets + dtype.itemsize <= len(data)]
+    records = np.empty(len(offsets), dtype=dtype)
+    raw = records.view(np.uint8).reshape(len(offsets), dtype.itemsize)
+    cols = np.arange(dtype.itemsize)
+    for i in range(0, len(offsets), CHUNK_SIZE):
+        raw[i:i+CHUNK_SIZE] = data[offsets[i:i+CHUNK_SIZE, None] + cols]
+
+    ret = {}
+    for f in fields:
+        idx = fmt.colhash[f]
+        col = records[f]
+        mul = fmt.msg_mults[idx]
+        if mul is not None:
+            col = col * mul
+        ret[f] = col
+    ret['_timestamp'] = mlog.clock.timebase + records['TimeUS'] * 1.0e-6
+    ret['_offset'] = offsets - HEADER_LEN
+    return ret
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+'''
+single pass log scanning for multiple consumers
+
+Consumers register the message types they need and are all fed from
+one pass over the log. Results are cached per log, keyed by path, mtime
+and size, both in memory and on disk, so reopening a log does not need
+another pass.
+
+AP_FLAKE8_CLEAN
+'''
+
+import hashlib
+import os
+import pickle
+
+from MAVProxy.modules.lib import mp_util
+
+# in-memory cache of results, keyed by log key then consumer name
+_cache = {}
+
+
+class LogScanConsumer(object):
+    '''base class for something fed messages by a LogScan'''
+
+    # unique name used as the cache key for this consumer's result
+    name = None
+    # message types this consumer wants to see
+    types = set()
+    # bump when the result format changes to invalidate cached results
+    version = 1
+
+    def start(self, mlog):
+        '''called before the first message'''
+        pass
+
+    def handle(self, mlog, m):
+        '''called for each matching message'''
+        pass
+
+    def finish(self, mlog):
+        '''called after the last message, returns the (picklable) result'''
+        return None
+
+    def restore(self, mlog, result):
+        '''apply a cached result to a newly opened log'''
+        pass
+
+
+def log_key(filename):
+    '''return cache key for a log file, or None if it can't be cached'''
+    if filename is None:
+        return None
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (os.path.abspath(filename), st.st_mtime, st.st_size)
+
+
+def log_filename(mlog):
+    '''return the filename of an open log, or None if not known'''
+    filename = getattr(mlog, 'filename', None)
+    if filename is not None:
+        return filename
+    for attr in ['filehandle', 'f']:
+        f = getattr(mlog, attr, None)
+        if f is not None and isinstance(getattr(f, 'name', None), str):
+            return f.name
+    return None
+
+
+class LogScan(object):
+    '''feed registered consumers from a single pass over a log'''
+
+    def __init__(self, mlog, filename=None, use_disk_cache=True):
+        self.mlog = mlog
+        self.key = log_key(filename)
+        self.use_disk_cache = use_disk_cache
+        self.consumers = []
+        self.results = {}
+        self.scanned = False
+
+    def add_consumer(self, consumer):
+        '''register a consumer'''
+        self.consumers.append(consumer)
+
+    def cache_filename(self):
+        '''return on-disk cache filename for this log'''
+        h = hashlib.sha1(repr(self.key).encode('utf-8')).hexdigest()
+        return os.path.join(mp_util.dot_mavproxy('logcache'), h + '.pck')
+
+    def load_cache(self):
+        '''return cached results for this log, or an empty dict'''
+        if self.key is None:
+            return {}
+        if self.key in _cache:
+            return _cache[self.key]
+        if not self.use_disk_cache:
+            return {}
+        try:
+            with open(self.cache_filename(), 'rb') as f:
+                (key, cached) = pickle.load(f)
+        except Exception:
+            return {}
+        if key != self.key:
+            return {}
+        _cache[self.key] = cached
+        return cached
+
+    def save_cache(self, cached):
+        '''save results for this log'''
+        if self.key is None:
+            return
+        _cache[self.key] = cached
+        if not self.use_disk_cache:
+            return
+        try:
+            mp_util.mkdir_p(mp_util.dot_mavproxy('logcache'))
+            fname = self.cache_filename()
+            tmpname = fname + '.tmp'
+            with open(tmpname, 'wb') as f:
+                pickle.dump((self.key, cached), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, fname)
+        except Exception as ex:
+            print("Failed to save log cache: %s" % ex)
+
+    def run(self):
+        '''run the scan, returning a dict of results by consumer name'''
+        cached = self.load_cache()
+        pending = []
+        for c in self.consumers:
+            entry = cached.get(c.name, None)
+            if entry is not None and entry[0] == c.version:
+                c.restore(self.mlog, entry[1])
+                self.results[c.name] = entry[1]
+            else:
+                pending.append(c)
+        if len(pending) == 0:
+            return self.results
+
+        # build a dispatch table from message type to consumers
+        dispatch = {}
+        for c in pending:
+            for t in c.types:
+                dispatch.setdefault(t, []).append(c)
+
+        mlog = self.mlog
+        mlog.rewind()
+        for c in pending:
+            c.start(mlog)
+        types = set(dispatch.keys())
+        while True:
+            m = mlog.recv_match(type=types)
+            if m is None:
+                break
+            for c in dispatch.get(m.get_type(), []):
+                c.handle(mlog, m)
+        for c in pending:
+            self.results[c.name] = c.finish(mlog)
+        mlog.rewind()
+        self.scanned = True
+
+        cached = dict(cached)
+        for c in pending:
+            cached[c.name] = (c.version, self.results[c.name])
+        self.save_cache(cached)
+        return self.results
+
+    def cached(self, name, version, compute):
+        '''return a result computed outside a scan pass, calling compute()
+        and caching its result if there is no cached result of this
+        version'''
+        cached = self.load_cache()
+        entry = cached.get(name, None)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        result = compute()
+        cached = dict(cached)
+        cached[name] = (version, result)
+        self.save_cache(cached)
+        return result
+
+    def result(self, name, default=None):
+        '''get the result of one consumer'''
+        return self.results.get(name, default)
@@ -15,6 +15,7 @@ from pymavlink.rotmat import Vector3
 from pymavlink.rotmat import Matrix3
 from pymavlink.rotmat import rotations
 from MAVProxy.modules.lib import grapher
+from MAVProxy.modules.lib import multiproc
 from MAVProxy.modules.lib.multiproc_util import MPDataLogChildTask
 
 import matplotlib
@@ -65,66 +66,90 @@ def StringToRotationID(s):
             return i
     return 0
 
-def correct(MAG, BAT, c):
-    '''correct a mag sample, returning a Vector3'''
-    mag = Vector3(MAG.MagX, MAG.MagY, MAG.MagZ)
-
-    # add the given offsets
-    mag += c.offsets
-
-    # multiply by scale factor
-    mag *= c.scaling
-
-    # apply elliptical corrections
-    mat = Matrix3(
-        Vector3(c.diag.x,    c.offdiag.x,  c.offdiag.y),
-        Vector3(c.offdiag.x, c.diag.y,     c.offdiag.z),
-        Vector3(c.offdiag.y, c.offdiag.z,  c.diag.z))
-
-    mag = mat * mag
+class MagData:
+    '''magnetometer samples with their attitude and battery current,
+    held as arrays so the fit error can be evaluated for all samples at
+    once'''
+    def __init__(self, data):
+        n = len(data)
+        self.mag = numpy.empty((n, 3))
+        roll = numpy.empty(n)
+        pitch = numpy.empty(n)
+        self.att_yaw = numpy.empty(n)
+        self.curr = numpy.zeros(n)
+        for i in range(n):
+            (MAG, ATT, BAT) = data[i]
+            self.mag[i] = (MAG.MagX, MAG.MagY, MAG.MagZ)
+            roll[i] = ATT.Roll
+            pitch[i] = ATT.Pitch
+            self.att_yaw[i] = ATT.Yaw
+            if BAT is not None and hasattr(BAT, 'Curr') and not math.isnan(BAT.Curr):
+                self.curr[i] = BAT.Curr
+        roll = numpy.radians(roll)
+        pitch = numpy.radians(pitch)
+        self.sr = numpy.sin(roll)
+        self.cr = numpy.cos(roll)
+        self.sp = numpy.sin(pitch)
+        self.cp = numpy.cos(pitch)
+        # bottom row of the DCM matrix, which doesn't depend on yaw
+        self.dcm_c = numpy.column_stack((-self.sp, self.sr * self.cp, self.cr * self.cp))
+
+    def __len__(self):
+        return self.mag.shape[0]
+
+def correction_matrix(c):
+    '''return elliptical correction matrix'''
+    return numpy.array([[c.diag.x,    c.offdiag.x,  c.offdiag.y],
+                        [c.offdiag.x, c.diag.y,     c.offdiag.z],
+                        [c.offdiag.y, c.offdiag.z,  c.diag.z]])
+
+def correct(d, c):
+    '''correct all mag samples, returning an Nx3 array'''
+    # add the given offsets and multiply by scale factor
+    mag = (d.mag + [c.offsets.x, c.offsets.y, c.offsets.z]) * c.scaling
+
+    # apply elliptical corrections, the matrix is symmetric
+    mag = mag.dot(correction_matrix(c))
 
     # apply compassmot corrections
-    if BAT is not None and hasattr(BAT, 'Curr') and not math.isnan(BAT.Curr):
-        mag += c.cmot * BAT.Curr
-
+    mag += numpy.outer(d.curr, [c.cmot.x, c.cmot.y, c.cmot.z])
     return mag
 
-def get_yaw(ATT,MAG,BAT,c):
-    '''calculate heading from raw magnetometer and new offsets'''
-
-    mag = correct(MAG, BAT, c)
-
-    # go via a DCM matrix to match the APM calculation
-    dcm_matrix = mavextra.rotation_df(ATT)
-    cos_pitch_sq = 1.0-(dcm_matrix.c.x*dcm_matrix.c.x)
-    headY = mag.y * dcm_matrix.c.z - mag.z * dcm_matrix.c.y
-    headX = mag.x * cos_pitch_sq - dcm_matrix.c.x * (mag.y * dcm_matrix.c.y + mag.z * dcm_matrix.c.z)
-
-    global declination
-    yaw = math.degrees(math.atan2(-headY,headX)) + declination
-    if yaw < 0:
-        yaw += 360
-    return yaw
-
-def expected_field(ATT, yaw):
-    '''return expected magnetic field for attitude'''
-    global earth_field
-
-    roll = ATT.Roll
-    pitch = ATT.Pitch
-
-    rot = Matrix3()
-    rot.from_euler(math.radians(roll), math.radians(pitch), math.radians(yaw))
-
-    field = rot.transposed() * earth_field
-
-    return field
+def heading_components(d, mag):
+    '''return (headX, headY) for corrected mag samples, matching the
+    APM calculation'''
+    (cx, cy, cz) = (d.dcm_c[:,0], d.dcm_c[:,1], d.dcm_c[:,2])
+    cos_pitch_sq = 1.0 - cx*cx
+    headY = mag[:,1] * cz - mag[:,2] * cy
+    headX = mag[:,0] * cos_pitch_sq - cx * (mag[:,1] * cy + mag[:,2] * cz)
+    return (headX, headY)
+
+def get_yaw(d, mag):
+    '''calculate heading in degrees from corrected mag samples'''
+    (headX, headY) = heading_components(d, mag)
+    yaw = numpy.degrees(numpy.arctan2(-headY, headX)) + declination
+    return numpy.where(yaw < 0, yaw + 360, yaw)
+
+def rotation_rows(d, yaw):
+    '''return top two rows of the DCM matrix for each sample'''
+    yaw = numpy.radians(yaw)
+    sy = numpy.sin(yaw)
+    cy = numpy.cos(yaw)
+    (sr, cr, sp, cp) = (d.sr, d.cr, d.sp, d.cp)
+    a = numpy.column_stack((cp * cy, sr * sp * cy - cr * sy, cr * sp * cy + sr * sy))
+    b = numpy.column_stack((cp * sy, sr * sp * sy + cr * cy, cr * sp * sy - sr * cy))
+    return (a, b)
+
+def expected_field(d, yaw):
+    '''return expected magnetic field for each sample as an Nx3 array'''
+    (a, b) = rotation_rows(d, yaw)
+    return a * earth_field.x + b * earth_field.y + d.dcm_c * earth_field.z
 
 data = None
 old_corrections = Correction()
 
-def wmm_error(p):
-    '''world magnetic model error with correction fit'''
+def correction_from_params(p):
+    '''return a Correction from an optimiser parameter vector'''
     p = list(p)
     c = copy.copy(old_corrections)
 
@@ -139,20 +164,62 @@ def wmm_error(p):
 
     if margs['CMOT']:
         c.cmot = Vector3(p.pop(0), p.pop(0), p.pop(0))
+    return c
 
-    ret = 0
-
-    for (MAG,ATT,BAT) in data:
-        yaw = get_yaw(ATT,MAG,BAT,c)
-        expected = expected_field(ATT, yaw)
-        observed = correct(MAG,BAT,c)
-
-        error = (expected - observed).length()
-        ret += error
-
-    ret /= len(data)
-
-    return ret
+def wmm_error(p):
+    '''world magnetic model error with correction fit'''
+    c = correction_from_params(p)
+    observed = correct(data, c)
+    expected = expected_field(data, get_yaw(data, observed))
+    return numpy.mean(numpy.linalg.norm(expected - observed, axis=1))
+
+def wmm_error_gradient(p):
+    '''analytic gradient of wmm_error with respect to the parameters'''
+    c = correction_from_params(p)
+    d = data
+    n = len(d)
+    M = correction_matrix(c)
+    m0 = d.mag + [c.offsets.x, c.offsets.y, c.offsets.z]
+    observed = (m0 * c.scaling).dot(M) + numpy.outer(d.curr, [c.cmot.x, c.cmot.y, c.cmot.z])
+
+    # derivative of the observed field for each parameter, Nx3xP
+    dobs = [numpy.broadcast_to(M[:,k] * c.scaling, (n, 3)) for k in range(3)]
+    dobs.append(m0.dot(M))
+    if margs['Elliptical']:
+        zero = numpy.zeros(n)
+        s = c.scaling
+        for k in range(3):
+            col = [zero, zero, zero]
+            col[k] = s * m0[:,k]
+            dobs.append(numpy.column_stack(col))
+        dobs.append(s * numpy.column_stack((m0[:,1], m0[:,0], zero)))
+        dobs.append(s * numpy.column_stack((m0[:,2], zero, m0[:,0])))
+        dobs.append(s * numpy.column_stack((zero, m0[:,2], m0[:,1])))
+    if margs['CMOT']:
+        for k in range(3):
+            col = numpy.zeros((n, 3))
+            col[:,k] = d.curr
+            dobs.append(col)
+    dobs = numpy.stack(dobs, axis=2)
+
+    # chain through the yaw calculation
+    (headX, headY) = heading_components(d, observed)
+    (cx, cy, cz) = (d.dcm_c[:,0:1], d.dcm_c[:,1:2], d.dcm_c[:,2:3])
+    dheadY = dobs[:,1,:] * cz - dobs[:,2,:] * cy
+    dheadX = dobs[:,0,:] * (1.0 - cx*cx) - cx * (dobs[:,1,:] * cy + dobs[:,2,:] * cz)
+    hsq = (headX*headX + headY*headY)[:,None]
+    dyaw = (headY[:,None] * dheadX - headX[:,None] * dheadY) / hsq
+
+    yaw = numpy.degrees(numpy.arctan2(-headY, headX)) + declination
+    (a, b) = rotation_rows(d, yaw)
+    expected = a * earth_field.x + b * earth_field.y + d.dcm_c * earth_field.z
+    dexp_dyaw = a * earth_field.y - b * earth_field.x
+
+    diff = expected - observed
+    err = numpy.linalg.norm(diff, axis=1)
+    err[err == 0] = 1.0
+    ddiff = dexp_dyaw[:,:,None] * dyaw[:,None,:] - dobs
+    return numpy.einsum('ni,nip->p', diff / err[:,None], ddiff) / n
 
 def fit_WWW():
     from scipy import optimize
@@ -194,25 +261,19 @@ def fit_WWW():
             for i in range(3):
                 bounds.append((-max_cmot,max_cmot))
 
-    (p,err,iterations,imode,smode) = optimize.fmin_slsqp(wmm_error, p, bounds=bounds, full_output=True)
+    # use the analytic gradient unless asked to let the optimiser
+    # estimate it by finite differences
+    if margs.get('Jacobian', True):
+        fprime = wmm_error_gradient
+    else:
+        fprime = None
+    (p,err,iterations,imode,smode) = optimize.fmin_slsqp(wmm_error, p, fprime=fprime, bounds=bounds, full_output=True)
     if imode != 0:
         print("Fit failed: %s" % smode)
         sys.exit(1)
-    p = list(p)
 
-    c.offsets = Vector3(p.pop(0), p.pop(0), p.pop(0))
-    c.scaling = p.pop(0)
-
-    if margs['Elliptical']:
-        c.diag = Vector3(p.pop(0), p.pop(0), p.pop(0))
-        c.offdiag = Vector3(p.pop(0), p.pop(0), p.pop(0))
-    else:
-        c.diag = Vector3(1.0, 1.0, 1.0)
-        c.offdiag = Vector3(0.0, 0.0, 0.0)
-
-    if margs['CMOT']:
-        c.cmot = Vector3(p.pop(0), p.pop(0), p.pop(0))
-    else:
+    c = correction_from_params(p)
+    if not margs['CMOT']:
         c.cmot = Vector3(0.0, 0.0, 0.0)
     return c
 
@@ -270,13 +331,17 @@ def magfit(mlog, timestamp_in_range, save_plot=None):
     count = 0
     parameters = {}
 
-    # get parameters
-    mlog.rewind()
-    while True:
-        msg = mlog.recv_match(type=['PARM'])
-        if msg is None:
-            break
-        parameters[msg.Name] = msg.Value
+    # get parameters, using those already gathered by a previous pass
+    # over the log (eg. by MAVExplorer) when available
+    if len(mlog.params) > 0:
+        parameters = mlog.params
+    else:
+        mlog.rewind()
+        while True:
+            msg = mlog.recv_match(type=['PARM'])
+            if msg is None:
+                break
+            parameters[msg.Name] = msg.Value
 
     mlog.rewind()
 
@@ -389,6 +454,7 @@ def magfit(mlog, timestamp_in_range, save_plot=None):
         old_corrections.offsets, old_corrections.diag, old_corrections.offdiag, old_corrections.cmot, old_corrections.scaling))
     if len(data) == 0:
         return
+    data = MagData(data)
 
     # do fit
     c = fit_WWW()
@@ -411,41 +477,28 @@ def magfit(mlog, timestamp_in_range, save_plot=None):
     print("New: %s diag: %s offdiag: %s cmot: %s scale: %.2f" % (
         c.offsets, c.diag, c.offdiag, c.cmot, c.scaling))
 
-    x = []
+    x = numpy.arange(len(data))
+
+    cf = correct(data, c)
+    yaw1 = get_yaw(data, cf)
+    ef1 = expected_field(data, yaw1)
+
+    uf = correct(data, old_corrections)
+    yaw2 = get_yaw(data, uf)
+    ef2 = expected_field(data, yaw2)
+
+    yaw_change1 = (yaw1 - yaw2 + 180) % 360 - 180
+    yaw_change2 = (yaw1 - data.att_yaw + 180) % 360 - 180
 
     corrected = {}
-    corrected['Yaw'] = []
+    uncorrected = {}
     expected1 = {}
     expected2 = {}
-    uncorrected = {}
-    uncorrected['Yaw'] = []
-    yaw_change1 = []
-    yaw_change2 = []
-    for i in range(len(data)):
-        (MAG,ATT,BAT) = data[i]
-        yaw1 = get_yaw(ATT,MAG,BAT,c)
-        corrected['Yaw'].append(yaw1)
-        ef1 = expected_field(ATT, yaw1)
-        cf = correct(MAG, BAT, c)
-
-        yaw2 = get_yaw(ATT,MAG,BAT,old_corrections)
-        ef2 = expected_field(ATT, yaw2)
-        uncorrected['Yaw'].append(yaw2)
-        uf = correct(MAG, BAT, old_corrections)
-
-        yaw_change1.append(mavextra.wrap_180(yaw1 - yaw2))
-        yaw_change2.append(mavextra.wrap_180(yaw1 - ATT.Yaw))
-        for axis in ['x','y','z']:
-            if not axis in corrected:
-                corrected[axis] = []
-                uncorrected[axis] = []
-                expected1[axis] = []
-                expected2[axis] = []
-            corrected[axis].append(getattr(cf, axis))
-            uncorrected[axis].append(getattr(uf, axis))
-            expected1[axis].append(getattr(ef1, axis))
-            expected2[axis].append(getattr(ef2, axis))
-        x.append(i)
+    for i, axis in enumerate(['x','y','z']):
+        corrected[axis] = cf[:,i]
+        uncorrected[axis] = uf[:,i]
+        expected1[axis] = ef1[:,i]
+        expected2[axis] = ef2[:,i]
 
     c.show_parms()
 
@@ -487,7 +540,8 @@ def main():
     from argparse import ArgumentParser
     parser = ArgumentParser(description='magnetometer fit (headless)')
     parser.add_argument('log', help='log file to process')
-    parser.add_argument('--mag', default='MAG[0]', help='magnetometer source, eg MAG[0]')
+    parser.add_argument('--mag', default='MAG[0]',
+                        help='magnetometer source, eg MAG[0]. A comma separated list fits each in parallel')
     parser.add_argument('--attitude', default='ATT', help='attitude source: ATT, XKF1, GYRO or XKY0')
     parser.add_argument('--orientation', default='ROTATION_NONE',
                         help='sensor orientation, eg ROTATION_YAW_180')
@@ -506,6 +560,8 @@ def main():
     parser.add_argument('--cmot', action='store_true', help='also fit motor-current interference')
     parser.add_argument('--cmot-nochange', action='store_true')
     parser.add_argument('--cmot-max', type=float, default=10.0)
+    parser.add_argument('--no-jacobian', action='store_true',
+                        help='estimate the gradient by finite differences instead of analytically')
     parser.add_argument('--save-plot', default='magfit.png',
                         help='save the result plot to this file instead of displaying it')
     args = parser.parse_args()
@@ -533,11 +589,38 @@ def main():
         'CMOT': args.cmot,
         'CMOT NoChange': args.cmot_nochange,
         'CMOT Max': args.cmot_max,
+        'Jacobian': not args.no_jacobian,
     }
 
-    mlog = mavutil.mavlink_connection(args.log)
+    mags = args.mag.split(',')
+    if len(mags) == 1:
+        magfit_log(args.log, margs, args.save_plot)
+        return
+
+    # fit each compass in its own process
+    procs = []
+    for mag in mags:
+        mag_margs = dict(margs)
+        mag_margs['Magnetometer'] = mag
+        save_plot = args.save_plot
+        if save_plot is not None:
+            (base, ext) = os.path.splitext(save_plot)
+            save_plot = "%s_%s%s" % (base, mag.replace('[', '').replace(']', ''), ext)
+        p = multiproc.Process(target=magfit_log, args=(args.log, mag_margs, save_plot))
+        p.start()
+        procs.append(p)
+    for p in procs:
+        p.join()
+
+
+def magfit_log(filename, fit_args, save_plot):
+    '''fit one compass over a whole log file'''
+    global margs
+    margs = fit_args
+    print("Fitting %s" % margs['Magnetometer'])
+    mlog = mavutil.mavlink_connection(filename)
     # process the whole log
-    magfit(mlog, lambda timestamp: 0, save_plot=args.save_plot)
+    magfit(mlog, lambda timestamp: 0, save_plot=save_plot)
 
 
 if __name__ == '__main__':
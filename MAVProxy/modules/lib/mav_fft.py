@@ -2,17 +2,38 @@
 
 '''
 extract ISBH and ISBD messages from AP_Logging files and produce FFT plots
+
+Samples are streamed per sensor into preallocated numpy buffers, either
+from the onboard batch sampler (ISBH/ISBD) or from raw IMU messages
+(ACC, GYR, IMU). Each sensor is then analysed to give a Welch averaged
+power spectral density and a spectrogram over the whole log. Results
+are cached per log so re-running with the same settings is immediate.
 '''
 
 import numpy
-import os
 import pylab
-import sys
 import time
 
 from pymavlink import mavutil
+from MAVProxy.modules.lib import log_columns
+from MAVProxy.modules.lib import log_scan
+from MAVProxy.modules.lib import multiproc
 from MAVProxy.modules.lib.multiproc_util import MPDataLogChildTask
 
+# bump when FFTResult changes to invalidate cached results
+CACHE_VERSION = 1
+
+# sample sources, giving the sensors found in each message type
+SOURCES = {
+    'batch': None,
+    'ACC': [('Accel', ['AccX', 'AccY', 'AccZ'])],
+    'GYR': [('Gyro', ['GyrX', 'GyrY', 'GyrZ'])],
+    'IMU': [('Accel', ['AccX', 'AccY', 'AccZ']), ('Gyro', ['GyrX', 'GyrY', 'GyrZ'])],
+}
+
+# number of FFT frames transformed at a time, bounding memory use
+FRAME_CHUNK = 256
+
 class MavFFT(MPDataLogChildTask):
     '''A class used to launch `mavfft_display` in a child process'''
 
@@ -24,136 +45,436 @@ class MavFFT(MPDataLogChildTask):
             A dataflash or telemetry log
         xlimits: MAVExplorer.XLimits
             An object capturing timestamp limits
+        source : str
+            sample source, one of SOURCES
+        window : int
+            FFT window size in samples, None for automatic
+        overlap : float
+            fraction of overlap between windows
+        spectrogram : bool
+            also show a spectrogram
+        jobs : int
+            number of processes used for analysis
         '''
 
         super(MavFFT, self).__init__(*args, **kwargs)
 
-        # all attributes are implicitly passed to the child process 
+        # all attributes are implicitly passed to the child process
         self.xlimits = kwargs['xlimits']
+        self.source = kwargs.get('source', 'batch')
+        self.window = kwargs.get('window', None)
+        self.overlap = kwargs.get('overlap', 0.5)
+        self.spectrogram = kwargs.get('spectrogram', False)
+        self.jobs = kwargs.get('jobs', 1)
 
     # @override
     def child_task(self):
         '''Launch `mavfft_display`'''
 
         # run the fft tool
-        mavfft_display(self.mlog, self.xlimits.timestamp_in_range)
+        mavfft_display(self.mlog, self.xlimits.timestamp_in_range,
+                       source=self.source,
+                       window=self.window,
+                       overlap=self.overlap,
+                       spectrogram=self.spectrogram,
+                       jobs=self.jobs,
+                       cache_key=(self.xlimits.xlim_low, self.xlimits.xlim_high))
 
-def mavfft_display(mlog, timestamp_in_range):
-    '''display fft for raw ACC data in logfile'''
+class SampleBuffer(object):
+    '''preallocated numpy buffer that values are streamed into, growing
+    by doubling when full'''
+    def __init__(self, shape=(), dtype=float, size=4096):
+        self.buf = numpy.empty((size,) + tuple(shape), dtype=dtype)
+        self.count = 0
 
-    '''object to store data about a single FFT plot'''
-    class PlotData(object):
-        def __init__(self, ffth):
-            self.seqno = -1
-            self.fftnum = ffth.N
-            self.sensor_type = ffth.type
-            self.instance = ffth.instance
-            self.sample_rate_hz = ffth.smp_rate
-            self.multiplier = ffth.mul
-            self.data = {}
-            self.data["X"] = []
-            self.data["Y"] = []
-            self.data["Z"] = []
-            self.holes = False
-            self.freq = None
-
-        def add_fftd(self, fftd):
-            if fftd.N != self.fftnum:
-                print("Skipping ISBD with wrong fftnum (%u vs %u)\n" % (fftd.fftnum, self.fftnum))
-                return
-            if self.holes:
-                print("Skipping ISBD(%u) for ISBH(%u) with holes in it" % (fftd.seqno, self.fftnum))
-                return
-            if fftd.seqno != self.seqno+1:
-                print("ISBH(%u) has holes in it" % fftd.N)
-                self.holes = True
-                return
-            self.seqno += 1
-            self.data["X"].extend(fftd.x)
-            self.data["Y"].extend(fftd.y)
-            self.data["Z"].extend(fftd.z)
-
-        def prefix(self):
-            if self.sensor_type == 0:
-                return "Accel"
-            elif self.sensor_type == 1:
-                return "Gyro"
-            else:
-                return "?Unknown Sensor Type?"
+    def reserve(self, n):
+        '''make room for n more values'''
+        if self.count + n <= self.buf.shape[0]:
+            return
+        size = max(2 * self.buf.shape[0], self.count + n)
+        buf = numpy.empty((size,) + self.buf.shape[1:], dtype=self.buf.dtype)
+        buf[:self.count] = self.buf[:self.count]
+        self.buf = buf
 
-        def tag(self):
-            return str(self)
+    def append(self, value):
+        '''add one value'''
+        self.reserve(1)
+        self.buf[self.count] = value
+        self.count += 1
 
-        def __str__(self):
-            return "%s[%u]" % (self.prefix(), self.instance)
+    def extend(self, values):
+        '''add an array of values'''
+        values = numpy.asarray(values)
+        n = values.shape[0]
+        self.reserve(n)
+        self.buf[self.count:self.count+n] = values
+        self.count += n
 
-    print("Processing log for ISBH and ISBD messages")
+    def __len__(self):
+        return self.count
 
-    things_to_plot = []
-    plotdata = None
-    start_time = time.time()
-    mlog.rewind()
+    def array(self):
+        '''return the values added so far'''
+        return self.buf[:self.count]
+
+class SensorData(object):
+    '''3 axis samples from one sensor, made up of contiguous segments'''
+    def __init__(self, tag, sample_rate_hz):
+        self.tag = tag
+        self.sample_rate_hz = sample_rate_hz
+        self.samples = SampleBuffer(shape=(3,))
+        # list of (start index, end index, start timestamp)
+        self.segments = []
+
+    def add_segment(self, samples, timestamp):
+        '''add a contiguous run of samples'''
+        start = len(self.samples)
+        self.samples.extend(samples)
+        self.segments.append((start, len(self.samples), timestamp))
+
+    def __getstate__(self):
+        # only send the used part of the buffer between processes
+        state = self.__dict__.copy()
+        samples = SampleBuffer(shape=(3,), size=len(self.samples))
+        samples.extend(self.samples.array())
+        state['samples'] = samples
+        return state
+
+class FFTResult(object):
+    '''analysis of one sensor'''
+    def __init__(self, tag, freq, psd, times, spec, nframes):
+        self.tag = tag
+        # frequency of each bin in Hz
+        self.freq = freq
+        # Welch averaged power spectral density, bins x 3 axes
+        self.psd = psd
+        # spectrogram column timestamps and PSDs, columns x bins x 3 axes
+        self.times = times
+        self.spec = spec
+        self.nframes = nframes
 
+def range_slice(timestamps, timestamp_in_range):
+    '''return (start,end) indexes of the time ordered timestamps that are
+    in range, found by bisection'''
+    def first(pred):
+        lo = 0
+        hi = len(timestamps)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if pred(timestamp_in_range(timestamps[mid])):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+    i0 = first(lambda r: r >= 0)
+    i1 = first(lambda r: r > 0)
+    return (i0, max(i0, i1))
+
+def read_columns(mlog, types):
+    '''read all fields of the given message types into dicts of numpy
+    arrays by type, in the same form as log_columns.get_columns, with
+    '_offset' giving message order. Uses columnar access when possible,
+    otherwise reads the log message by message'''
+    if log_columns.have_columns(mlog):
+        ret = {}
+        for mtype in types:
+            cols = log_columns.get_columns(mlog, mtype)
+            if cols is not None:
+                ret[mtype] = cols
+        return ret
+
+    buffers = {}
+    order = 0
+    mlog.rewind()
     while True:
-        m = mlog.recv_match(type=['ISBH','ISBD'])
+        m = mlog.recv_match(type=types)
         if m is None:
             break
-        in_range = timestamp_in_range(m._timestamp)
-        if in_range < 0:
+        mtype = m.get_type()
+        if mtype not in buffers:
+            buffers[mtype] = {}
+            for f in m.get_fieldnames():
+                v = getattr(m, f)
+                if isinstance(v, (str, bytes)):
+                    continue
+                buffers[mtype][f] = SampleBuffer(shape=numpy.shape(v))
+            buffers[mtype]['_timestamp'] = SampleBuffer()
+            buffers[mtype]['_offset'] = SampleBuffer(dtype=numpy.int64)
+        b = buffers[mtype]
+        for f in b:
+            if f == '_offset':
+                b[f].append(order)
+            else:
+                b[f].append(getattr(m, f))
+        order += 1
+    mlog.rewind()
+    ret = {}
+    for mtype in buffers:
+        ret[mtype] = {f: buffers[mtype][f].array() for f in buffers[mtype]}
+    return ret
+
+def sensor_prefix(sensor_type):
+    '''name of a batch sampler sensor type'''
+    if sensor_type == 0:
+        return "Accel"
+    elif sensor_type == 1:
+        return "Gyro"
+    return "?Unknown Sensor Type?"
+
+def batch_sensors(mlog, timestamp_in_range):
+    '''return list of SensorData from the batch sampler ISBH/ISBD messages'''
+    cols = read_columns(mlog, ['ISBH', 'ISBD'])
+    if 'ISBH' not in cols or 'ISBD' not in cols:
+        return []
+    hdr = cols['ISBH']
+    dat = cols['ISBD']
+    (h0, h1) = range_slice(hdr['_timestamp'], timestamp_in_range)
+    (d0, d1) = range_slice(dat['_timestamp'], timestamp_in_range)
+    hdr = {f: hdr[f][h0:h1] for f in hdr}
+    dat = {f: dat[f][d0:d1] for f in dat}
+    if len(hdr['N']) == 0 or len(dat['N']) == 0:
+        return []
+
+    # each ISBD belongs to the ISBH before it in the log, if the
+    # batch numbers match
+    hidx = numpy.searchsorted(hdr['_offset'], dat['_offset']) - 1
+    valid = hidx >= 0
+    valid[valid] = dat['N'][valid] == hdr['N'][hidx[valid]]
+    rows = numpy.nonzero(valid)[0]
+    hidx = hidx[rows]
+    if len(rows) == 0:
+        return []
+
+    # a batch is used up to its first missing or out of order ISBD
+    (_, group_start, group) = numpy.unique(hidx, return_index=True, return_inverse=True)
+    position = numpy.arange(len(rows)) - group_start[group]
+    bad = (dat['seqno'][rows] != position).astype(numpy.int64)
+    holes = numpy.cumsum(bad)
+    holes_before = holes[group_start] - bad[group_start]
+    keep = holes == holes_before[group]
+    for h in numpy.unique(hidx[~keep]):
+        print("ISBH(%u) has holes in it" % hdr['N'][h])
+    rows = rows[keep]
+    hidx = hidx[keep]
+
+    ret = []
+    sensor_key = hdr['type'].astype(numpy.int64) * 256 + hdr['instance']
+    for key in numpy.unique(sensor_key[hidx]):
+        sel = sensor_key[hidx] == key
+        srows = rows[sel]
+        shidx = hidx[sel]
+        first = shidx[0]
+        tag = "%s[%u]" % (sensor_prefix(hdr['type'][first]), hdr['instance'][first])
+        sensor = SensorData(tag, float(hdr['smp_rate'][first]))
+        mul = hdr['mul'][shidx].astype(float)[:, None]
+        samples = numpy.stack((dat['x'][srows] / mul,
+                               dat['y'][srows] / mul,
+                               dat['z'][srows] / mul), axis=2).reshape(-1, 3)
+        per_msg = dat['x'].shape[1]
+        (batches, start, count) = numpy.unique(shidx, return_index=True, return_counts=True)
+        sensor.samples.reserve(len(samples))
+        for i in range(len(batches)):
+            s = start[i] * per_msg
+            sensor.add_segment(samples[s:s + count[i] * per_msg], hdr['_timestamp'][batches[i]])
+        ret.append(sensor)
+    return ret
+
+def raw_sensors(mlog, source, timestamp_in_range):
+    '''return list of SensorData from raw IMU messages'''
+    cols = read_columns(mlog, [source]).get(source, None)
+    if cols is None or len(cols['_timestamp']) == 0:
+        return []
+    (i0, i1) = range_slice(cols['_timestamp'], timestamp_in_range)
+    cols = {f: cols[f][i0:i1] for f in cols}
+    if 'I' in cols:
+        instances = cols['I']
+    else:
+        instances = numpy.zeros(len(cols['_timestamp']), dtype=int)
+    ret = []
+    for inst in numpy.unique(instances):
+        sel = numpy.nonzero(instances == inst)[0]
+        if len(sel) < 2:
             continue
-        if in_range > 0:
-            break
-        msg_type = m.get_type()
-        if msg_type == "ISBH":
-            if plotdata is not None:
-                # close off previous data collection
-                things_to_plot.append(plotdata)
-            # initialise plot-data collection object
-            plotdata = PlotData(m)
+        timestamps = cols['_timestamp'][sel]
+        if 'SampleUS' in cols:
+            sample_times = cols['SampleUS'][sel] * 1.0e-6
+        else:
+            sample_times = timestamps
+        dt = numpy.diff(sample_times)
+        median_dt = numpy.median(dt)
+        if median_dt <= 0:
             continue
-
-        if msg_type == "ISBD":
-            if plotdata is None:
+        # split into segments at gaps in the samples
+        breaks = numpy.nonzero((dt > 3 * median_dt) | (dt <= 0))[0] + 1
+        bounds = numpy.concatenate(([0], breaks, [len(sel)]))
+        for (prefix, fields) in SOURCES[source]:
+            if not all(f in cols for f in fields):
                 continue
-            plotdata.add_fftd(m)
+            sensor = SensorData("%s[%u] (%s)" % (prefix, inst, source), 1.0 / median_dt)
+            samples = numpy.column_stack([cols[f][sel] for f in fields])
+            for i in range(len(bounds) - 1):
+                sensor.add_segment(samples[bounds[i]:bounds[i+1]], timestamps[bounds[i]])
+            ret.append(sensor)
+    return ret
+
+def get_sensors(mlog, timestamp_in_range, source='batch'):
+    '''return list of SensorData for a source'''
+    if source == 'batch':
+        return batch_sensors(mlog, timestamp_in_range)
+    return raw_sensors(mlog, source, timestamp_in_range)
+
+def analyse(sensor, window=None, overlap=0.5, max_columns=1000):
+    '''return FFTResult giving the Welch averaged PSD and spectrogram of
+    a sensor. Frames of window samples are taken from within each
+    segment with the given overlap, so frames never span a gap'''
+    lengths = [end - start for (start, end, ts) in sensor.segments]
+    if len(lengths) == 0 or max(lengths) < 2:
+        return None
+    if window is None:
+        window = 1024
+    if window > max(lengths):
+        window = max(lengths)
+    step = max(1, int(window * (1.0 - overlap)))
+    fs = sensor.sample_rate_hz
+
+    starts = []
+    times = []
+    for (start, end, ts) in sensor.segments:
+        s = numpy.arange(start, end - window + 1, step)
+        starts.append(s)
+        times.append(ts + (s - start + window * 0.5) / fs)
+    starts = numpy.concatenate(starts)
+    times = numpy.concatenate(times)
+    nframes = len(starts)
+
+    freq = numpy.fft.rfftfreq(window, 1.0 / fs)
+    nbins = len(freq)
+    hann = numpy.hanning(window)
+    scale = 1.0 / (fs * numpy.sum(hann * hann))
+    # one sided spectrum, DC and Nyquist bins are not doubled
+    scale = numpy.full(nbins, 2 * scale)
+    scale[0] *= 0.5
+    if window % 2 == 0:
+        scale[-1] *= 0.5
+
+    # frames are averaged into at most max_columns spectrogram columns
+    ncols = min(nframes, max_columns)
+    column = (numpy.arange(nframes) * ncols) // nframes
+    spec = numpy.zeros((ncols, nbins, 3))
+    col_count = numpy.bincount(column, minlength=ncols)
+    col_time = numpy.bincount(column, weights=times, minlength=ncols) / col_count
+
+    samples = sensor.samples.array()
+    offsets = numpy.arange(window)
+    psd = numpy.zeros((nbins, 3))
+    for i in range(0, nframes, FRAME_CHUNK):
+        frames = samples[starts[i:i+FRAME_CHUNK, None] + offsets]
+        frames = frames - frames.mean(axis=1, keepdims=True)
+        fft = numpy.fft.rfft(frames * hann[None, :, None], axis=1)
+        power = (fft.real**2 + fft.imag**2) * scale[None, :, None]
+        psd += power.sum(axis=0)
+        numpy.add.at(spec, column[i:i+FRAME_CHUNK], power)
+    psd /= nframes
+    spec /= col_count[:, None, None]
+    return FFTResult(sensor.tag, freq, psd, col_time, spec.astype(numpy.float32), nframes)
+
+def analyse_worker(sensor, window, overlap, queue):
+    '''analyse one sensor in a child process'''
+    queue.put((sensor.tag, analyse(sensor, window=window, overlap=overlap)))
+
+def analyse_all(sensors, window=None, overlap=0.5, jobs=1):
+    '''analyse a list of sensors, using up to jobs child processes'''
+    if jobs <= 1 or len(sensors) <= 1:
+        return [analyse(s, window=window, overlap=overlap) for s in sensors]
+    queue = multiproc.Queue()
+    pending = list(sensors)
+    running = {}
+    results = {}
+    while len(results) < len(sensors):
+        while len(pending) > 0 and len(running) < jobs:
+            sensor = pending.pop(0)
+            p = multiproc.Process(target=analyse_worker, args=(sensor, window, overlap, queue))
+            p.start()
+            running[sensor.tag] = p
+        (done, failed) = multiproc.wait_results(queue, running)
+        results.update(done)
+        for (tag, exitcode) in failed.items():
+            print("Analysis of %s failed, exit code %s" % (tag, exitcode))
+            results[tag] = None
+    return [results[s.tag] for s in sensors]
 
-    if len(things_to_plot) == 0:
-        print("No FFT data. Did you set INS_LOG_BAT_MASK?")
+def mavfft_analyse(mlog, timestamp_in_range, source='batch', window=None, overlap=0.5, jobs=1, cache_key=None):
+    '''return list of FFTResult for a log. If cache_key is given the
+    results are cached per log, keyed by it and the analysis settings'''
+    def compute():
+        start_time = time.time()
+        sensors = get_sensors(mlog, timestamp_in_range, source=source)
+        print("Extracted %u sensors in %.1fs" % (len(sensors), time.time() - start_time))
+        return [r for r in analyse_all(sensors, window=window, overlap=overlap, jobs=jobs) if r is not None]
+
+    filename = log_scan.log_filename(mlog)
+    if cache_key is None or filename is None:
+        return compute()
+    scan = log_scan.LogScan(mlog, filename)
+    name = "fft:%s" % repr((source, window, overlap, cache_key))
+    return scan.cached(name, CACHE_VERSION, compute)
+
+def mavfft_display(mlog, timestamp_in_range, source='batch', window=None, overlap=0.5,
+                   spectrogram=False, jobs=1, cache_key=None):
+    '''display fft for raw ACC data in logfile'''
+
+    if source == 'batch':
+        print("Processing log for ISBH and ISBD messages")
+    else:
+        print("Processing log for %s messages" % source)
+
+    results = mavfft_analyse(mlog, timestamp_in_range, source=source, window=window,
+                             overlap=overlap, jobs=jobs, cache_key=cache_key)
+    if len(results) == 0:
+        if source == 'batch':
+            print("No FFT data. Did you set INS_LOG_BAT_MASK?")
+        else:
+            print("No %s data" % source)
         return
-    time_delta = time.time() - start_time
-    print("Extracted %u fft data sets" % len(things_to_plot))
-
-    sum_fft = {}
-    freqmap = {}
-    count = 0
-
-    first_freq = None
-    for thing_to_plot in things_to_plot:
-        for axis in [ "X","Y","Z" ]:
-            d = numpy.array(thing_to_plot.data[axis])/float(thing_to_plot.multiplier)
-            if len(d) == 0:
-                print("No data?!?!?!")
-                continue
-            
-            avg = numpy.sum(d) / len(d)
-            d -= avg
-            d_fft = numpy.fft.rfft(d)
-            if thing_to_plot.tag() not in sum_fft:
-                sum_fft[thing_to_plot.tag()] = {
-                    "X": 0,
-                    "Y": 0,
-                    "Z": 0
-                }
-            sum_fft[thing_to_plot.tag()][axis] = numpy.add(sum_fft[thing_to_plot.tag()][axis], d_fft)
-            count += 1
-            freq = numpy.fft.rfftfreq(len(d), 1.0/thing_to_plot.sample_rate_hz)
-            freqmap[thing_to_plot.tag()] = freq
-
-    for sensor in sum_fft:
-        pylab.figure(str(sensor))
-        for axis in [ "X","Y","Z" ]:
-            pylab.plot(freqmap[sensor], numpy.abs(sum_fft[sensor][axis]/count), label=axis)
+
+    for r in results:
+        print("%s: %u frames, %.1f Hz resolution" % (r.tag, r.nframes, r.freq[1] - r.freq[0]))
+        pylab.figure(r.tag)
+        for (i, axis) in enumerate(["X", "Y", "Z"]):
+            pylab.semilogy(r.freq, r.psd[:, i], label=axis)
         pylab.legend(loc='upper right')
         pylab.xlabel('Hz')
+        pylab.ylabel('PSD')
+
+        if spectrogram:
+            pylab.figure(r.tag + " spectrogram")
+            power = numpy.sum(r.spec, axis=2).T
+            pylab.pcolormesh(r.times - r.times[0], r.freq, 10 * numpy.log10(numpy.maximum(power, 1.0e-20)),
+                             shading='auto')
+            pylab.colorbar(label='dB')
+            pylab.xlabel('Time (s)')
+            pylab.ylabel('Hz')
 
     pylab.show()
+
+def main():
+    '''show FFTs of a log from the command line'''
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('log', help='log file to process')
+    parser.add_argument('--source', default='batch', choices=sorted(SOURCES.keys()), help='sample source')
+    parser.add_argument('--window', type=int, default=None, help='FFT window size in samples')
+    parser.add_argument('--overlap', type=float, default=0.5, help='fraction of overlap between windows')
+    parser.add_argument('--spectrogram', action='store_true', help='also show spectrograms')
+    parser.add_argument('--jobs', type=int, default=1, help='number of processes for analysis')
+    parser.add_argument('--no-cache', action='store_true', help='do not use cached results')
+    args = parser.parse_args()
+
+    mlog = mavutil.mavlink_connection(args.log)
+    cache_key = None if args.no_cache else (None, None)
+    mavfft_display(mlog, lambda timestamp: 0, source=args.source, window=args.window,
+                   overlap=args.overlap, spectrogram=args.spectrogram, jobs=args.jobs,
+                   cache_key=cache_key)
+
+if __name__ == '__main__':
+    main()
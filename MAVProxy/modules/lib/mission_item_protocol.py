@@ -29,6 +29,172 @@ except ImportError:
     from io import BytesIO as SIO
 
 
+class ItemTransfer(object):
+    '''request window, timing and statistics for one transfer of items.
+
+    For downloads the number of outstanding requests grows while items
+    arrive and halves on loss, and the re-request timeout follows the
+    measured round trip time (as in TCP, RFC 6298). Uploads are driven
+    by the vehicle's requests so only their statistics are kept.
+    '''
+
+    MIN_WINDOW = 2
+    MIN_RTO = 0.2
+    MAX_RTO = 3.0
+
+    def __init__(self, direction, count, max_window=32, window=5):
+        self.direction = direction
+        self.count = count
+        self.max_window = max(self.MIN_WINDOW, max_window)
+        self.window = float(min(window, self.max_window))
+        self.ssthresh = float(self.max_window)
+        self.srtt = None
+        self.rttvar = None
+        self.rto = 2.0
+        self.last_backoff = 0
+        # outstanding requests, seq -> (time of last request, number of requests)
+        self.requested = {}
+        self.items = 0
+        self.requests = 0
+        self.rerequests = 0
+        self.duplicates = 0
+        self.start = time.time()
+        self.end = None
+
+    def request_sent(self, seq, tnow):
+        '''note a request for an item'''
+        (t, tries) = self.requested.get(seq, (None, 0))
+        self.requested[seq] = (tnow, tries + 1)
+        self.requests += 1
+        if tries > 0:
+            self.rerequests += 1
+
+    def item_received(self, seq, tnow):
+        '''note receipt of an item, updating round trip time and window'''
+        self.items += 1
+        r = self.requested.pop(seq, None)
+        if r is None:
+            return
+        (t, tries) = r
+        if tries == 1:
+            # only unambiguous round trips are used (Karn's algorithm)
+            rtt = tnow - t
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt * 0.5
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            self.rto = min(max(self.srtt + 4 * self.rttvar, self.MIN_RTO), self.MAX_RTO)
+        if self.window < self.ssthresh:
+            self.window += 1
+        else:
+            self.window += 1.0 / self.window
+        self.window = min(self.window, self.max_window)
+
+    def item_served(self, seq, tnow):
+        '''note an item sent in answer to a request from the vehicle. A
+        repeated request means the vehicle lost our reply'''
+        if seq in self.requested:
+            self.duplicates += 1
+        else:
+            self.items += 1
+        self.requested[seq] = (tnow, 1)
+
+    def to_request(self, next_seq, received, tnow):
+        '''return list of item numbers to request now, given the next
+        item needed and the items already received out of order'''
+        outstanding = 0
+        for (t, tries) in self.requested.values():
+            if tnow - t < self.rto:
+                outstanding += 1
+        ret = []
+        lost = False
+        seq = next_seq
+        while seq < self.count and len(ret) + outstanding < int(self.window):
+            if seq not in received:
+                r = self.requested.get(seq, None)
+                if r is None:
+                    ret.append(seq)
+                elif tnow - r[0] >= self.rto:
+                    ret.append(seq)
+                    lost = True
+            seq += 1
+        if lost and tnow - self.last_backoff >= self.rto:
+            # back off on loss, at most once per timeout period
+            self.last_backoff = tnow
+            self.ssthresh = max(self.window * 0.5, self.MIN_WINDOW)
+            self.window = self.ssthresh
+            self.rto = min(self.rto * 2, self.MAX_RTO)
+        return ret
+
+    def finished(self):
+        '''note the end of the transfer'''
+        self.end = time.time()
+        self.requested = {}
+
+    def elapsed(self):
+        if self.end is not None:
+            return self.end - self.start
+        return time.time() - self.start
+
+    def status(self):
+        '''return status string'''
+        dt = self.elapsed()
+        rate = self.items / dt if dt > 0 else 0
+        ret = "%s %u/%u items in %.2fs (%.1f items/s)" % (
+            self.direction, self.items, self.count, dt, rate)
+        if self.direction == 'download':
+            ret += " window %.1f rto %.0fms re-requests %u duplicates %u" % (
+                self.window, self.rto * 1000, self.rerequests, self.duplicates)
+            if self.srtt is not None:
+                ret += " rtt %.0fms" % (self.srtt * 1000)
+        else:
+            ret += " repeated requests %u" % self.duplicates
+        if self.end is None:
+            ret += " (in progress)"
+        return ret
+
+
+def float32(v):
+    '''round a value to single precision, as sent over MAVLink'''
+    return struct.unpack('<f', struct.pack('<f', v))[0]
+
+
+def items_match(k1, k2, file_precision=False):
+    '''compare two item keys. Keys hold the values as sent, so edits are
+    compared exactly. Mission files hold values to 6 decimal places, so
+    with file_precision items are compared to that precision'''
+    if not file_precision:
+        return k1 == k2
+    if k1[:3] != k2[:3]:
+        return False
+    for i in range(3, len(k1)):
+        tolerance = 1.0e-6 * max(1.0, abs(k1[i]))
+        if i in (7, 8):
+            # latitude and longitude in 1e-7 degrees
+            tolerance = 10
+        if abs(k1[i] - k2[i]) > tolerance:
+            return False
+    return True
+
+
+def changed_ranges(old, new, merge_gap=2, file_precision=False):
+    '''return list of (start, end) inclusive ranges of items in new that
+    differ from old, which must be the same length. Ranges separated by
+    merge_gap items or less are joined, as each partial upload costs a
+    round trip to start and finish'''
+    ranges = []
+    for i in range(len(new)):
+        if items_match(old[i], new[i], file_precision):
+            continue
+        if len(ranges) > 0 and i - ranges[-1][1] <= merge_gap + 1:
+            ranges[-1] = (ranges[-1][0], i)
+        else:
+            ranges.append((i, i))
+    return ranges
+
+
 class MissionItemProtocolModule(mp_module.MPModule):
     def __init__(self, mpstate, name, description, **args):
         super(MissionItemProtocolModule, self).__init__(mpstate, name, description, **args)
@@ -37,18 +203,23 @@ class MissionItemProtocolModule(mp_module.MPModule):
                          '%s management' % self.itemtype(),
                          self.completions())
         self.wp_op = None
-        self.wp_requested = {}
         self.wp_received = {}
+        self.transfer = None
         self.wp_save_filename = None
         self.wploader_by_sysid = {}
         self.loading_waypoints = False
         self.loading_waypoint_lasttime = time.time()
         self.last_waypoint = 0
-        self.wp_period = mavutil.periodic_event(0.5)
+        self.wp_period = mavutil.periodic_event(10)
         self.undo_wp = None
         self.undo_type = None
         self.undo_wp_idx = -1
         self.upload_start = None
+        # items as last confirmed by each vehicle, for incremental upload
+        self.confirmed_by_sysid = {}
+        self.upload_snapshot = None
+        self.partial_upload = None
+        self.pending_ranges = []
         self.last_get_home = time.time()
         self.ftp_count = None
 
@@ -190,18 +361,98 @@ on'''
             return item_num
         return item_num - 1
 
+    def item_key(self, wp):
+        '''return a tuple identifying the content of an item as the
+        vehicle will hold it'''
+        x = wp.x
+        y = wp.y
+        if wp.get_type() != 'MISSION_ITEM_INT' and self.has_location(wp.command):
+            x = int(round(x * 1.0e7))
+            y = int(round(y * 1.0e7))
+        return (wp.command, wp.frame, wp.autocontinue,
+                float32(wp.param1), float32(wp.param2), float32(wp.param3), float32(wp.param4),
+                int(x), int(y), float32(wp.z))
+
+    def item_keys(self):
+        '''return list of keys for the items we hold'''
+        return [self.item_key(self.wploader.item(i)) for i in range(self.wploader.count())]
+
+    def confirmed_items(self):
+        '''return keys of the items the vehicle is known to hold, or None'''
+        return self.confirmed_by_sysid.get(self.target_system, None)
+
+    def set_confirmed(self, keys):
+        self.confirmed_by_sysid[self.target_system] = keys
+
+    def dirty_ranges(self, file_precision=False):
+        '''return list of ranges of items changed since the vehicle last
+        confirmed the list, or None if a full upload is needed'''
+        confirmed = self.confirmed_items()
+        if confirmed is None or len(confirmed) != self.wploader.count() or len(confirmed) == 0:
+            return None
+        return changed_ranges(confirmed, self.item_keys(), file_precision=file_precision)
+
+    def send_changes(self, start=None, end=None, file_precision=False):
+        '''upload changed items. If we don't know what the vehicle holds
+        then the range start to end is sent, or all items if no range
+        is given'''
+        ranges = self.dirty_ranges(file_precision)
+        if ranges is None:
+            if start is None:
+                self.send_all_items()
+                return
+            ranges = [(start, end)]
+        if len(ranges) == 0:
+            print("No %s changes to send" % self.itemtype())
+            return
+        self.pending_ranges = ranges[1:]
+        self.send_partial(ranges[0][0], ranges[0][1])
+
+    def send_partial(self, start, end):
+        '''send items start to end inclusive with a partial list write'''
+        self.loading_waypoints = True
+        self.loading_waypoint_lasttime = time.time()
+        self.upload_start = time.time()
+        self.transfer = ItemTransfer('upload', end + 1 - start)
+        keys = [self.item_key(self.wploader.item(i)) for i in range(start, end+1)]
+        self.partial_upload = (start, end, keys)
+        self.upload_snapshot = None
+        self.master.mav.mission_write_partial_list_send(
+            self.target_system,
+            self.target_component,
+            start,
+            end,
+            mission_type=self.mav_mission_type())
+
+    def handle_mission_ack(self, m):
+        '''track what the vehicle holds from upload results'''
+        if self.partial_upload is None and self.upload_snapshot is None:
+            return
+        accepted = m.type == mavutil.mavlink.MAV_MISSION_ACCEPTED
+        if self.partial_upload is not None:
+            (start, end, keys) = self.partial_upload
+            self.partial_upload = None
+            if not accepted:
+                print("Partial %s upload rejected, sending all" % self.itemtype())
+                self.pending_ranges = []
+                self.send_all_items()
+                return
+            confirmed = self.confirmed_items()
+            if confirmed is not None and end < len(confirmed):
+                confirmed[start:end+1] = keys
+            if len(self.pending_ranges) > 0:
+                (start, end) = self.pending_ranges.pop(0)
+                self.send_partial(start, end)
+            return
+        if accepted:
+            self.set_confirmed(self.upload_snapshot)
+        self.upload_snapshot = None
+
     def missing_wps_to_request(self):
-        ret = []
-        tnow = time.time()
-        next_seq = self.wploader.count()
-        for i in range(5):
-            seq = next_seq+i
-            if seq+1 > self.wploader.expected_count:
-                continue
-            if seq in self.wp_requested and tnow - self.wp_requested[seq] < 2:
-                continue
-            ret.append(seq)
-        return ret
+        '''return list of items to request now'''
+        if self.transfer is None:
+            return []
+        return self.transfer.to_request(self.wploader.count(), self.wp_received, time.time())
 
     def append(self, item):
         '''append an item to the held item list'''
@@ -223,7 +474,8 @@ on'''
             wps = self.missing_wps_to_request()
         tnow = time.time()
         for seq in wps:
-            self.wp_requested[seq] = tnow
+            if self.transfer is not None:
+                self.transfer.request_sent(seq, tnow)
             if self.settings.wp_use_mission_int:
                 method = self.master.mav.mission_request_int_send
             else:
@@ -244,6 +496,12 @@ on'''
                 self.itemstype()))
         except Exception:
             print("Have %u %s" % (self.wploader.count()+len(self.wp_received), self.itemstype()))
+        if self.transfer is not None:
+            print(self.transfer.status())
+        ranges = self.dirty_ranges()
+        if ranges is not None and len(ranges) > 0:
+            print("%u %s changed in %u ranges since last sync with vehicle" % (
+                sum([end + 1 - start for (start, end) in ranges]), self.itemstype(), len(ranges)))
 
     def mavlink_packet(self, m):
         '''handle an incoming mavlink packet'''
@@ -262,6 +520,8 @@ on'''
                     time.asctime(time.localtime(m._timestamp)),
                     time.asctime()))
                 self.wploader.expected_count = m.count
+                self.wp_received = {}
+                self.transfer = ItemTransfer('download', m.count, max_window=self.settings.wp_max_window)
                 self.send_wp_requests()
 
         elif mtype in ['MISSION_ITEM', 'MISSION_ITEM_INT'] and self.wp_op is not None:
@@ -271,11 +531,15 @@ on'''
                     return
                 # our internal structure assumes MISSION_ITEM'''
                 m = self.wp_from_mission_item_int(m)
-            if m.seq < self.wploader.count():
+            if m.seq < self.wploader.count() or m.seq in self.wp_received:
                 # print("DUPLICATE %u" % m.seq)
+                if self.transfer is not None:
+                    self.transfer.duplicates += 1
                 return
             if m.seq+1 > self.wploader.expected_count:
                 self.console.writeln("Unexpected %s number %u - expected %u" % (self.itemtype(), m.seq, self.wploader.count()))
+            if self.transfer is not None:
+                self.transfer.item_received(m.seq, time.time())
             self.wp_received[m.seq] = m
             next_seq = self.wploader.count()
             while next_seq in self.wp_received:
@@ -292,22 +556,48 @@ on'''
             elif self.wp_op == "save":
                 self.save_waypoints(self.wp_save_filename)
             self.wp_op = None
-            self.wp_requested = {}
             self.wp_received = {}
+            if self.transfer is not None:
+                self.transfer.finished()
+            self.set_confirmed(self.item_keys())
 
         elif mtype in frozenset(["MISSION_REQUEST", "MISSION_REQUEST_INT"]):
             self.process_waypoint_request(m, self.master)
 
+        elif mtype == 'MISSION_ACK':
+            if getattr(m, 'mission_type', 0) != self.mav_mission_type():
+                return
+            if m.get_srcSystem() != self.target_system:
+                return
+            self.handle_mission_ack(m)
+
     def idle_task(self):
         '''handle missing waypoints'''
         if self.wp_period.trigger():
-            # cope with packet loss fetching mission
+            # cope with packet loss fetching mission, re-requesting
+            # items once their request times out
             if (self.master is not None and
-                    self.master.time_since('MISSION_ITEM') >= 2 and
+                    self.transfer is not None and
+                    self.transfer.direction == 'download' and
+                    self.transfer.end is None and
                     self.wploader.count() < getattr(self.wploader, 'expected_count', 0)):
                 wps = self.missing_wps_to_request()
-                print("re-requesting %s %s" % (self.itemstype(), str(wps)))
-                self.send_wp_requests(wps)
+                if len(wps) > 0:
+                    if any([seq in self.transfer.requested for seq in wps]):
+                        print("re-requesting %s %s" % (self.itemstype(), str(wps)))
+                    self.send_wp_requests(wps)
+
+            # autopilots which don't support partial list writes may
+            # never request an item
+            if (self.master is not None and
+                    self.partial_upload is not None and
+                    self.transfer is not None and
+                    self.transfer.items == 0 and
+                    time.time() - self.upload_start > 3):
+                self.partial_upload = None
+                self.pending_ranges = []
+                print("No response to partial %s upload, sending all" % self.itemtype())
+                self.send_all_items()
 
         self.idle_task_add_menu_items()
 
@@ -422,6 +712,8 @@ on'''
             self.console.error("Request for bad %s %u (max %u)" %
                                (self.itemtype, m.seq, self.wploader.count()))
             return
+        if self.transfer is not None and self.transfer.direction == 'upload':
+            self.transfer.item_served(m.seq, time.time())
         wp = self.wploader.wp(m.seq)
         wp.target_system = self.target_system
         wp.target_component = self.target_component
@@ -448,6 +740,8 @@ on'''
         # see if the transfer is complete:
         if m.seq == self.wploader.count() - 1:
             self.loading_waypoints = False
+            if self.transfer is not None and self.transfer.direction == 'upload':
+                self.transfer.finished()
             print("Loaded %u %s in %.2fs" % (
                 self.wploader.count(),
                 self.itemstype(),
@@ -464,6 +758,9 @@ on'''
         self.loading_waypoints = True
         self.loading_waypoint_lasttime = time.time()
         self.upload_start = time.time()
+        self.transfer = ItemTransfer('upload', self.wploader.count())
+        self.upload_snapshot = self.item_keys()
+        self.partial_upload = None
         self.master.mav.mission_count_send(
             self.target_system,
             self.target_component,
@@ -582,19 +879,10 @@ on'''
 
         print("Moving %s %u to %f, %f at %.1fm" % (self.itemtype(), idx, lat, lon, wp.z))
 
-        self.send_single_waypoint(offset)
+        self.send_changes(offset, offset)
 
     def send_single_waypoint(self, idx):
-        self.loading_waypoints = True
-        self.loading_waypoint_lasttime = time.time()
-        self.upload_start = time.time()
-        self.master.mav.mission_write_partial_list_send(
-            self.target_system,
-            self.target_component,
-            idx,
-            idx,
-            self.mav_mission_type()
-        )
+        self.send_partial(idx, idx)
 
     def is_location_command(self, cmd):
         '''see if cmd is a MAV_CMD with a latitude/longitude'''
@@ -678,13 +966,7 @@ on'''
             self.wploader.set(wp, wpnum)
 
         self.wploader.last_change = time.time()
-        self.loading_waypoints = True
-        self.loading_waypoint_lasttime = time.time()
-        self.master.mav.mission_write_partial_list_send(
-            self.target_system,
-            self.target_component,
-            wpstart_offset,
-            wpend_offset)
+        self.send_changes(wpstart_offset, wpend_offset)
         print("Moved %s %u:%u to %f, %f rotation=%.1f" % (self.itemstype(), wpstart, wpend, lat, lon, rotation))
 
     def change_mission_item_range(self, args, desc, changer, newvalstr):
@@ -715,15 +997,7 @@ on'''
             self.wploader.set(wp, offset)
 
         self.wploader.last_change = time.time()
-        self.upload_start = time.time()
-        self.loading_waypoints = True
-        self.loading_waypoint_lasttime = time.time()
-        self.master.mav.mission_write_partial_list_send(
-            self.target_system,
-            self.target_component,
-            self.item_num_to_offset(idx),
-            self.item_num_to_offset(idx+count),
-            mission_type=self.mav_mission_type())
+        self.send_changes(self.item_num_to_offset(idx), self.item_num_to_offset(idx+count-1))
         print("Changed %s for WPs %u:%u to %s" % (desc, idx, idx+(count-1), newvalstr))
 
     def cmd_changealt(self, args):
@@ -790,7 +1064,7 @@ on'''
             offset = self.item_num_to_offset(self.undo_wp_idx)
             self.wploader.set(wp, offset)
             self.wploader.last_change = time.time()
-            self.send_single_waypoint(offset)
+            self.send_changes(offset, offset)
             print("Undid %s move" % self.itemtype())
         elif self.undo_type == 'remove':
             offset = self.item_num_to_offset(self.undo_wp_idx)
@@ -836,13 +1110,15 @@ on'''
         wp.target_component = self.target_component
         self.wploader.set(wp, idx)
         self.wploader.last_change = time.time()
-        self.send_single_waypoint(idx)
+        self.send_changes(idx, idx)
 
     def cmd_clear(self, args):
         self.master.mav.mission_clear_all_send(
             self.target_system,
             self.target_component,
             mission_type=self.mav_mission_type())
+        self.upload_snapshot = []
+        self.partial_upload = None
         self.wploader.clear()
         if getattr(self.wploader, 'expected_count', None) is not None:
             self.wploader.expected_count = 0
@@ -885,6 +1161,37 @@ on'''
             return
         self.wploader.load(args[0])
 
+    def cmd_sync(self, args):
+        '''load items from a file, sending only those that differ from
+        what the vehicle holds'''
+        if len(args) != 1:
+            print("usage: %s sync <filename>" % self.command_name())
+            return
+        loader = self.create_loader()
+        try:
+            loader.load(args[0].strip('"'))
+        except Exception as msg:
+            print("Unable to load %s - %s" % (args[0], msg))
+            return
+        self.wploader.clear()
+        self.wploader.target_system = self.target_system
+        self.wploader.target_component = self.target_component
+        for i in range(loader.count()):
+            w = loader.item(i)
+            w.target_system = self.target_system
+            w.target_component = self.target_component
+            self.wploader.add(w)
+        self.wploader.expected_count = self.wploader.count()
+        self.wploader.last_change = time.time()
+        # the file only holds 6 decimal places, so items that match the vehicle to that precision are not sent
+        ranges = self.dirty_ranges(file_precision=True)
+        if ranges is None:
+            print("Sending all %u %s from %s" % (self.wploader.count(), self.itemstype(), args[0]))
+        elif len(ranges) > 0:
+            print("Sending %u changed %s in %u ranges from %s" % (
+                sum([end + 1 - start for (start, end) in ranges]), self.itemstype(), len(ranges), args[0]))
+        self.send_changes(file_precision=True)
+
     def cmd_update(self, args):
         if not self.check_have_list():
             return
@@ -913,6 +1220,7 @@ on'''
             "savelocal": self.cmd_savelocal,
             "show": (self.cmd_show, ["(FILENAME)"]),
             "status": self.cmd_status,
+            "sync": (self.cmd_sync, ["(FILENAME)"]),
         }
 
     def usage(self):
@@ -1069,6 +1377,7 @@ on'''
             w = mavmsg(*t)
             w = self.wp_from_mission_item_int(w)
             self.wploader.add(w)
+        self.set_confirmed(self.item_keys())
         self.show_and_save(self.target_system)
 
     def show_and_save(self, source_system):
@@ -1120,6 +1429,8 @@ on'''
         fh.seek(0)
 
         self.upload_start = time.time()
+        self.upload_snapshot = self.item_keys()
+        self.partial_upload = None
 
         ftp.cmd_put([self.mission_ftp_name(), self.mission_ftp_name()],
                     fh=fh, callback=self.ftp_upload_callback, progress_callback=self.ftp_upload_progress)
@@ -1141,3 +1452,6 @@ on'''
             item_size = mavmsg.unpacker.size
             print("Sent %s of length %u in %.2fs" %
                   (self.itemtype(), (dlen - 10) // item_size, time.time() - self.upload_start))
+            if self.upload_snapshot is not None:
+                self.set_confirmed(self.upload_snapshot)
+                self.upload_snapshot = None
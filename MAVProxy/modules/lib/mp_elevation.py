@@ -70,6 +70,30 @@ class ElevationModel():
             return None
         return alt
 
+    def GetElevationArray(self, latitudes, longitudes, timeout=0):
+        '''Returns a numpy array of altitudes (m ASL) for arrays of lat/long, NaN where unknown'''
+        lat = numpy.asarray(latitudes, dtype=numpy.float64)
+        lon = numpy.asarray(longitudes, dtype=numpy.float64)
+        ret = numpy.full(lat.shape, numpy.nan)
+        ok = numpy.isfinite(lat) & numpy.isfinite(lon)
+        if self.database not in ['SRTM1', 'SRTM3']:
+            for i in numpy.flatnonzero(ok.ravel()):
+                alt = self.GetElevation(lat.flat[i], lon.flat[i], timeout=timeout)
+                if alt is not None:
+                    ret.flat[i] = alt
+            return ret
+        tlat = numpy.floor(numpy.where(ok, lat, 0))
+        tlon = numpy.floor(numpy.where(ok, lon, 0))
+        # look up each tile once, using the scalar path to load it
+        for (tile_lat, tile_lon) in set(zip(tlat[ok].tolist(), tlon[ok].tolist())):
+            mask = ok & (tlat == tile_lat) & (tlon == tile_lon)
+            first = numpy.flatnonzero(mask.ravel())[0]
+            if self.GetElevation(lat.flat[first], lon.flat[first], timeout=timeout) is None:
+                continue
+            tile = self.tileDict[(tile_lat, tile_lon)]
+            ret[mask] = tile.getAltitudeArray(lat[mask], lon[mask])
+        return ret
+
 
 if __name__ == "__main__":
 
@@ -18,6 +18,7 @@ from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_widgets
 from MAVProxy.modules.lib import win_layout
 from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib import shm_frames
 from MAVProxy.modules.lib.mp_menu import *
 
 
@@ -198,7 +199,9 @@ class MPImage():
                  report_size_changes = False,
                  daemon = False,
                  auto_fit = False,
-                 fps = 10):
+                 fps = 10,
+                 shared_memory = True,
+                 frame_slots = 3):
 
         self.title = title
         self.width = int(width)
@@ -214,6 +217,10 @@ class MPImage():
         self.menu = None
         self.popup_menu = None
         self.fps = fps
+        # frames are passed in a shared memory ring when available
+        self.shared_memory = shared_memory and shm_frames.available()
+        self.frame_slots = frame_slots
+        self.frame_ring = None
 
         self.in_queue = multiproc.Queue()
         self.out_queue = multiproc.Queue()
@@ -248,10 +255,28 @@ class MPImage():
             return
         if not hasattr(img, 'shape'):
             img = np.asarray(img[:,:])
+        if self.shared_memory:
+            # the display process does any colour conversion
+            ring = self.frame_ring
+            if ring is None or ring.slot_bytes < img.nbytes:
+                if ring is not None:
+                    ring.close()
+                ring = shm_frames.FrameRing(self.frame_slots, img.nbytes)
+                self.frame_ring = ring
+            ref = ring.put(img, bgr)
+            if ref is not None:
+                self.in_queue.put(ref)
+            return
         if bgr:
             img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         self.in_queue.put(MPImageData(img))
 
+    def frame_stats(self):
+        '''return dict of shared memory frame counters, or None'''
+        if self.frame_ring is None:
+            return None
+        return self.frame_ring.stats()
+
     def set_fps_max(self, fps_max):
         '''set the maximum frame rate'''
         self.in_queue.put(MPImageFPSMax(fps_max))
@@ -352,10 +377,17 @@ class MPImage():
             ret.append(e)
         return ret
 
+    def close_frame_ring(self):
+        '''remove the shared memory frame ring'''
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+            self.frame_ring = None
+
     def terminate(self):
         '''terminate child process'''
         self.child.terminate()
         self.child.join()
+        self.close_frame_ring()
 
     def center(self, location):
         self.in_queue.put(MPImageRecenter(location))
@@ -416,6 +448,11 @@ class MPImagePanel(wx.Panel):
         self.seek_percentage = None
         self.seek_frame = None
         self.osd_elements = None
+        # shared memory frame rings we are attached to, the frame
+        # being shown and the buffer for colour conversion
+        self.frame_rings = {}
+        self.shown_frame = None
+        self.rgb_buffer = None
         state.brightness = 1.0
 
         # dragpos is the top left position in image coordinates
@@ -577,12 +614,18 @@ class MPImagePanel(wx.Panel):
         '''the redraw timer ensures we show new map tiles as they
         are downloaded'''
         state = self.state
+        shared_frame = None
         while not state.in_queue.empty():
             try:
                 obj = state.in_queue.get()
             except Exception:
                 time.sleep(0.05)
                 return
+            if isinstance(obj, shm_frames.FrameRef):
+                # only the latest frame is shown
+                if shared_frame is not None:
+                    self.release_shared_frame(shared_frame, False)
+                shared_frame = obj
             if isinstance(obj, MPImageOSD_Element):
                 self.handle_osd(obj)
             if isinstance(obj, MPImageData):
@@ -624,9 +667,49 @@ class MPImagePanel(wx.Panel):
             if isinstance(obj, MPImageEndTracker):
                 self.tracker = None
 
+        if shared_frame is not None:
+            self.show_shared_frame(shared_frame)
+
         if self.need_redraw:
             self.redraw()
 
+    def release_shared_frame(self, ref, displayed):
+        '''give a frame slot back to the sender'''
+        ring = self.frame_rings.get(ref.name, None)
+        if ring is not None:
+            ring.release(ref, displayed)
+
+    def show_shared_frame(self, ref):
+        '''show a frame from a shared memory ring'''
+        ring = self.frame_rings.get(ref.name, None)
+        if ring is None:
+            # the sender has made a new ring, detach from the old ones
+            self.shown_frame = None
+            self.raw_img = None
+            for old in self.frame_rings.values():
+                old.close()
+            self.frame_rings = {}
+            try:
+                ring = shm_frames.FrameRing.attach(ref)
+            except FileNotFoundError:
+                # ring was replaced before we saw it
+                return
+            self.frame_rings[ref.name] = ring
+        data = ring.get(ref)
+        previous = self.shown_frame
+        if ref.bgr:
+            # convert into a reused buffer, freeing the slot straight away
+            if self.rgb_buffer is None or self.rgb_buffer.shape != data.shape:
+                self.rgb_buffer = np.empty_like(data)
+            data = cv2.cvtColor(data, cv2.COLOR_BGR2RGB, dst=self.rgb_buffer)
+            ring.release(ref, True)
+            self.shown_frame = None
+        else:
+            self.shown_frame = ref
+        self.set_image_data(data, ref.shape[1], ref.shape[0])
+        if previous is not None:
+            self.release_shared_frame(previous, True)
+
     def start_tracker(self, obj):
         '''start a tracker on an object identified by a box'''
         if self.raw_img is None:
@@ -692,7 +775,7 @@ class MPImagePanel(wx.Panel):
             if frame_count % 5 == 0:
                 self.state.out_queue.put(MPImageFrameCounter(frame_count))
 
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
             (width, height) = (frame.shape[1], frame.shape[0])
             if self.tracker:
                 self.tracker.update(frame)
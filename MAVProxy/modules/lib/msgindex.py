@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+'''
+searchable index of text messages (MSG, EV, ERR, STATUSTEXT) in a log
+
+The index is built once while a log is loaded and then supports
+wildcard, substring and regex search with time range filtering and
+paging without going back to the log.
+
+AP_FLAKE8_CLEAN
+'''
+
+import bisect
+import fnmatch
+import re
+import time
+
+from MAVProxy.modules.lib.multiproc_util import MPChildTask
+
+
+def timestring(timestamp):
+    '''return string for a timestamp'''
+    ts_ms = int(timestamp * 1000.0) % 1000
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) + ".%.03u" % ts_ms
+
+
+class MessageIndex(object):
+    '''timestamped text messages held in log order'''
+
+    def __init__(self):
+        self.timestamps = []
+        self.texts = []
+        # upper case copy of texts for case-insensitive search
+        self.utexts = []
+
+    def add(self, timestamp, text):
+        '''add one message'''
+        self.timestamps.append(timestamp)
+        self.texts.append(text)
+        self.utexts.append(text.upper())
+
+    def finish(self):
+        '''sort by time once all messages are added. Reassembled
+        statustexts are added when complete so may be out of order'''
+        order = sorted(range(len(self.timestamps)), key=lambda i: self.timestamps[i])
+        self.timestamps = [self.timestamps[i] for i in order]
+        self.texts = [self.texts[i] for i in order]
+        self.utexts = [self.utexts[i] for i in order]
+
+    def __len__(self):
+        return len(self.texts)
+
+    def start_time(self):
+        '''timestamp of first message'''
+        if len(self.timestamps) == 0:
+            return None
+        return self.timestamps[0]
+
+    def index_range(self, t0=None, t1=None):
+        '''return (first,last+1) index for messages between two timestamps'''
+        i0 = 0
+        i1 = len(self.timestamps)
+        if t0 is not None:
+            i0 = bisect.bisect_left(self.timestamps, t0)
+        if t1 is not None:
+            i1 = bisect.bisect_right(self.timestamps, t1)
+        return (i0, max(i0, i1))
+
+    def matcher(self, pattern, regex=False):
+        '''return a function testing an upper case string against a pattern.
+        Wildcard patterns without * or ? are substring matches'''
+        if pattern is None or pattern in ['', '*']:
+            return None
+        if regex:
+            r = re.compile(pattern, re.IGNORECASE)
+            return lambda s: r.search(s) is not None
+        upattern = pattern.upper()
+        if upattern.find('*') == -1 and upattern.find('?') == -1:
+            return lambda s: upattern in s
+        r = re.compile(fnmatch.translate(upattern), re.DOTALL)
+        return lambda s: r.match(s) is not None
+
+    def search(self, pattern=None, regex=False, invert=False, t0=None, t1=None):
+        '''return list of indexes of matching messages'''
+        (i0, i1) = self.index_range(t0, t1)
+        match = self.matcher(pattern, regex=regex)
+        if match is None:
+            if invert:
+                return []
+            return list(range(i0, i1))
+        utexts = self.utexts
+        return [i for i in range(i0, i1) if match(utexts[i]) != invert]
+
+    def format(self, idx):
+        '''format one message for display'''
+        return "%s %s" % (timestring(self.timestamps[idx]), self.texts[idx])
+
+
+class MPMessageView(MPChildTask):
+    '''show a MessageIndex in a searchable GUI list in a child process'''
+
+    def __init__(self, *args, **kwargs):
+        '''
+        Parameters
+        ----------
+        index : MessageIndex
+            the messages to show
+        title : str
+            window title
+        '''
+        super(MPMessageView, self).__init__(*args, **kwargs)
+        self.index = kwargs['index']
+        self.title = kwargs.get('title', 'Messages')
+
+    # @override
+    def child_task(self):
+        '''child process - this holds all the GUI elements'''
+        from MAVProxy.modules.lib import mp_util
+        from MAVProxy.modules.lib.wx_loader import wx
+        from MAVProxy.modules.lib.msgindex_ui import MessageViewFrame
+        mp_util.child_close_fds()
+
+        app = wx.App(False)
+        app.frame = MessageViewFrame(index=self.index, title=self.title, close_event=self.close_event)
+        app.frame.Show()
+        app.MainLoop()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+'''
+GUI list for a MessageIndex, with search box
+
+AP_FLAKE8_CLEAN
+'''
+
+import re
+import time
+
+from MAVProxy.modules.lib.wx_loader import wx
+
+
+class MessageListCtrl(wx.ListCtrl):
+    '''virtual list showing a subset of a MessageIndex. Only the
+    visible rows are ever formatted'''
+
+    def __init__(self, parent, index):
+        super(MessageListCtrl, self).__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL)
+        self.index = index
+        self.rows = []
+        self.InsertColumn(0, 'Time', width=200)
+        self.InsertColumn(1, 'Message', width=600)
+
+    def set_rows(self, rows):
+        '''set list of message indexes to display'''
+        self.rows = rows
+        self.SetItemCount(len(rows))
+        self.Refresh()
+
+    def OnGetItemText(self, item, col):
+        idx = self.rows[item]
+        if col == 0:
+            ts = self.index.timestamps[idx]
+            ts_ms = int(ts * 1000.0) % 1000
+            return time.strftime("%H:%M:%S", time.localtime(ts)) + ".%.03u" % ts_ms
+        return self.index.texts[idx]
+
+
+class MessageViewFrame(wx.Frame):
+    '''searchable message list'''
+
+    def __init__(self, index, title, close_event):
+        super(MessageViewFrame, self).__init__(None, title=title, size=(850, 600))
+        self.index = index
+        self.close_event = close_event
+
+        panel = wx.Panel(self)
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        hbox = wx.BoxSizer(wx.HORIZONTAL)
+        self.search = wx.SearchCtrl(panel, style=wx.TE_PROCESS_ENTER)
+        self.search.ShowCancelButton(True)
+        self.regex = wx.CheckBox(panel, label='Regex')
+        self.invert = wx.CheckBox(panel, label='Invert')
+        self.status = wx.StaticText(panel, label='')
+        hbox.Add(self.search, 1, wx.EXPAND | wx.ALL, 2)
+        hbox.Add(self.regex, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 2)
+        hbox.Add(self.invert, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 2)
+        hbox.Add(self.status, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 4)
+        self.list = MessageListCtrl(panel, index)
+        vbox.Add(hbox, 0, wx.EXPAND)
+        vbox.Add(self.list, 1, wx.EXPAND)
+        panel.SetSizer(vbox)
+
+        self.search.Bind(wx.EVT_TEXT, self.on_search)
+        self.search.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.on_cancel)
+        self.regex.Bind(wx.EVT_CHECKBOX, self.on_search)
+        self.invert.Bind(wx.EVT_CHECKBOX, self.on_search)
+
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.timer.Start(100)
+
+        self.update_list()
+
+    def on_timer(self, event):
+        '''Periodically check if the close event has been received'''
+        if self.close_event.wait(0.001):
+            self.timer.Stop()
+            self.Destroy()
+
+    def on_cancel(self, event):
+        self.search.SetValue('')
+
+    def on_search(self, event):
+        self.update_list()
+
+    def update_list(self):
+        '''re-run the search and update the list'''
+        try:
+            rows = self.index.search(self.search.GetValue(),
+                                     regex=self.regex.GetValue(),
+                                     invert=self.invert.GetValue())
+        except re.error as ex:
+            self.status.SetLabel(str(ex))
+            return
+        self.list.set_rows(rows)
+        self.status.SetLabel("%u/%u" % (len(rows), len(self.index)))
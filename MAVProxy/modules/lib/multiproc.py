@@ -10,6 +10,9 @@ the script in the child. It is horrible, but it seems to be the only way to
 make things work on MacOS
 '''
 
+import queue
+
+
 class PipeQueue(object):
     '''simulate a queue using a pipe. This is used to avoid a problem with
     pipes on MacOS, while still keeping similar syntax'''
@@ -42,7 +45,20 @@ class PipeQueue(object):
             self.alive = False
             self.close()
 
-    def get(self):
+    def get(self, timeout=None):
+        '''get a message, returning None if none pending. With a timeout, wait
+        up to timeout seconds and raise queue.Empty if nothing arrives, as
+        multiprocessing.Queue does'''
+        if timeout is not None:
+            if self.alive and not self.pending:
+                try:
+                    self.receiver.poll(timeout)
+                except Exception:
+                    pass
+            m = self.get()
+            if m is None:
+                raise queue.Empty()
+            return m
         if not self.alive:
             return None
         self.fill()
@@ -70,3 +86,34 @@ if ((platform.system() == 'Darwin' or os.environ.get('USE_BILLIARD',None) is not
     Queue = PipeQueue
 else:
     from multiprocessing import Process, freeze_support, Pipe, Semaphore, Event, Lock, Queue
+
+
+def wait_results(result_queue, running, timeout=0.5):
+    '''wait up to timeout seconds for results from worker processes which each
+    put one (key, result) tuple on result_queue. running is a dict of key to
+    Process. Returns a dict of key to result for the workers that finished and a
+    dict of key to exit code for those that exited without sending a result.
+    Both are removed from running and joined'''
+    done = {}
+    failed = {}
+    try:
+        (key, result) = result_queue.get(timeout=timeout)
+        done[key] = result
+    except queue.Empty:
+        # a worker that has exited without sending a result has failed. Collect
+        # any results still in flight before deciding which ones those are
+        dead = [key for (key, p) in running.items() if not p.is_alive()]
+        if len(dead) == 0:
+            return (done, failed)
+        try:
+            while True:
+                (key, result) = result_queue.get(timeout=0.1)
+                done[key] = result
+        except queue.Empty:
+            pass
+        for key in dead:
+            if key not in done:
+                failed[key] = running[key].exitcode
+    for key in list(done.keys()) + list(failed.keys()):
+        running.pop(key).join()
+    return (done, failed)
@@ -63,6 +63,7 @@ class NtripClient(object):
         self.sent_header = False
         # RTCM3 parser
         self.rtcm3 = rtcm3.RTCM3()
+        self.pending = []
         self.last_id = None
         self.dt_last_gga_sent = 0
         self.last_connect_attempt = time.time()
@@ -116,6 +117,19 @@ class NtripClient(object):
         return self.last_id
 
     def read(self):
+        '''read one RTCM3 packet, or None'''
+        if len(self.pending) == 0:
+            packets = self.read_packets()
+            if packets is None:
+                return None
+            self.pending.extend(packets)
+        pkt = self.pending.pop(0)
+        self.last_id = rtcm3.packet_ID(pkt)
+        return pkt
+
+    def read_packets(self):
+        '''read all available data, returning a list of complete RTCM3
+        packets, or None if there are none'''
         if self.socket is None:
             if self.socket_pending is None:
                 now = time.time()
@@ -175,29 +189,32 @@ class NtripClient(object):
                 self.found_header = True
 
             return None
-        # normal data read
-        while True:
+        # normal data read, taking everything available from the socket
+        packets = []
+        while self.socket is not None:
             try:
-                data = self.socket.recv(1)
+                data = self.socket.recv(4096)
             except ssl.SSLWantReadError:
-                    return None
+                break
             except IOError as e:
                 if e.errno == errno.EWOULDBLOCK:
-                    return None
+                    break
                 self.socket.close()
                 self.socket = None
-                return None
+                break
             except Exception:
                 self.socket.close()
                 self.socket = None
-                return None
+                break
             if len(data) == 0:
                 self.socket.close()
                 self.socket = None
-                return None
-            if self.rtcm3.read(data):
-                self.last_id = self.rtcm3.get_packet_ID()
-                return self.rtcm3.get_packet()
+                break
+            packets.extend(self.rtcm3.add(data))
+        if len(packets) == 0:
+            return None
+        self.last_id = rtcm3.packet_ID(packets[-1])
+        return packets
 
     def connect(self):
         '''connect to NTRIP server'''
@@ -212,6 +229,7 @@ class NtripClient(object):
                     self.socket = self.socket_pending
                     self.socket_pending = None
                     self.rtcm3.reset()
+                    self.pending = []
                     return True
                 else:
                     self.socket_pending = None
@@ -243,10 +261,12 @@ class NtripClient(object):
 
     def readLoop(self):
         while True:
-            data = self.read()
-            if data is None:
+            packets = self.read_packets()
+            if packets is None:
+                time.sleep(0.01)
                 continue
-            print("got: ", len(data))
+            for data in packets:
+                print("got: ", len(data))
 
     def send_gga(self):
         gga = self.getGGAByteString()
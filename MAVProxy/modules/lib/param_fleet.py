@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+'''
+parameter tables across a fleet of vehicles
+
+Holds the parameters of several vehicles as one numpy matrix, with a
+row per vehicle and a column per parameter name, so that cross-vehicle
+comparisons are done as array operations. Parameters a vehicle does not
+have are NaN.
+
+AP_FLAKE8_CLEAN
+'''
+
+import fnmatch
+
+import numpy as np
+
+MINDELTA = 0.000001
+
+
+class ParamTable(object):
+    '''parameters of several vehicles as a matrix'''
+    def __init__(self, vehicles, names, values):
+        self.vehicles = vehicles
+        self.names = names
+        self.values = values
+
+    @staticmethod
+    def from_params(params):
+        '''build a table from a dict of vehicle to parameter dict'''
+        vehicles = sorted(params.keys())
+        names = set()
+        for v in vehicles:
+            names.update(params[v].keys())
+        names = sorted(names)
+        column = {n: i for (i, n) in enumerate(names)}
+        values = np.full((len(vehicles), len(names)), np.nan)
+        for (row, v) in enumerate(vehicles):
+            p = params[v]
+            if len(p) == 0:
+                continue
+            cols = np.fromiter((column[n] for n in p.keys()), dtype=np.int64, count=len(p))
+            values[row, cols] = np.fromiter(p.values(), dtype=np.float64, count=len(p))
+        return ParamTable(vehicles, names, values)
+
+    def select(self, wildcard):
+        '''return boolean mask of columns matching a wildcard'''
+        wildcard = wildcard.upper()
+        return np.fromiter((fnmatch.fnmatch(n, wildcard) for n in self.names), dtype=bool, count=len(self.names))
+
+    def diff_mask(self, mindelta=MINDELTA):
+        '''return boolean mask of columns which differ between vehicles,
+        including columns missing on some vehicles'''
+        if len(self.vehicles) == 0:
+            return np.zeros(len(self.names), dtype=bool)
+        missing = np.isnan(self.values)
+        some_missing = missing.any(axis=0)
+        all_missing = missing.all(axis=0)
+        filled = np.where(missing, 0.0, self.values)
+        vmax = np.where(missing, -np.inf, filled).max(axis=0)
+        vmin = np.where(missing, np.inf, filled).min(axis=0)
+        spread = np.where(all_missing, 0.0, vmax - vmin)
+        return (some_missing & ~all_missing) | (spread > mindelta)
+
+    def diff(self, wildcard='*', mindelta=MINDELTA):
+        '''return list of (name, values) for parameters which differ,
+        where values has one entry per vehicle, None if missing'''
+        mask = self.diff_mask(mindelta) & self.select(wildcard)
+        ret = []
+        for col in np.flatnonzero(mask).tolist():
+            column = self.values[:, col].tolist()
+            ret.append((self.names[col], [None if np.isnan(x) else x for x in column]))
+        return ret
+
+    def save_csv(self, filename, wildcard='*'):
+        '''save the table as CSV, one row per parameter'''
+        mask = self.select(wildcard)
+        with open(filename, 'w') as f:
+            f.write(",".join(["NAME"] + ["%u:%u" % v for v in self.vehicles]) + "\n")
+            for col in np.flatnonzero(mask).tolist():
+                column = self.values[:, col].tolist()
+                f.write(",".join([self.names[col]] + ["" if np.isnan(x) else "%.7g" % x for x in column]) + "\n")
+        return int(mask.sum())
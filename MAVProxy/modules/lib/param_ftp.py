@@ -5,102 +5,180 @@ decode ftp parameter protocol data
 
 import struct
 import sys
+from array import array
+
+import numpy as np
+
+MAGIC = 0x671b
+MAGIC_DEFAULTS = 0x671c
+
+HEADER = struct.Struct("<HHH")
+
+# mapping of data type to value format, and value plus default format
+DATA_TYPES = {
+    1: (struct.Struct("<b"), struct.Struct("<bb")),
+    2: (struct.Struct("<h"), struct.Struct("<hh")),
+    3: (struct.Struct("<i"), struct.Struct("<ii")),
+    4: (struct.Struct("<f"), struct.Struct("<ff")),
+}
+
+PTYPE_FLOAT = 4
+
 
 class ParamData(object):
+    '''decoded parameters, held as columns. names is a list of bytes,
+    values and types are numpy arrays. default_values is None unless the
+    data included defaults'''
+    def __init__(self, names, values, types, default_values=None):
+        self.names = names
+        self.values = values
+        self.types = types
+        self.default_values = default_values
+
+    def __len__(self):
+        return len(self.names)
+
+    def name_strings(self):
+        '''return names as a list of str'''
+        return [n.decode('utf-8') for n in self.names]
+
+    def value_list(self, values=None):
+        '''return values as a list, with integer parameters as int'''
+        if values is None:
+            values = self.values
+        ret = values.tolist()
+        for i in np.flatnonzero(self.types != PTYPE_FLOAT).tolist():
+            ret[i] = int(ret[i])
+        return ret
+
+    @property
+    def params(self):
+        '''params as list of (name, value, ptype)'''
+        return list(zip(self.names, self.value_list(), self.types.tolist()))
+
+    @property
+    def defaults(self):
+        '''defaults as list of (name, value, ptype), or None'''
+        if self.default_values is None:
+            return None
+        return list(zip(self.names, self.value_list(self.default_values), self.types.tolist()))
+
+
+class ParamDecoder(object):
+    '''incremental parameter data decoder. Data may be added in pieces as
+    it arrives, for example while a ftp transfer is in progress'''
     def __init__(self):
-        # params as (name, value, ptype)
-        self.params = []
-        # defaults as (name, value, ptype)
-        self.defaults = None
-
-    def add_param(self, name, value, ptype):
-        self.params.append((name,value,ptype))
-
-    def add_default(self, name, value, ptype):
-        if self.defaults is None:
-            self.defaults = []
-        self.defaults.append((name,value,ptype))
-        
+        self.buf = bytearray()
+        # number of bytes added so far
+        self.offset = 0
+        self.total_params = None
+        self.with_defaults = False
+        self.last_name = bytes()
+        self.names = []
+        self.values = array('d')
+        self.types = array('B')
+        self.default_values = array('d')
+        self.failed = False
+
+    def count(self):
+        '''number of parameters decoded so far'''
+        return len(self.names)
+
+    def add(self, data):
+        '''add some data, decoding all complete parameters. Returns False
+        on a decode error'''
+        if self.failed:
+            return False
+        self.offset += len(data)
+        self.buf.extend(data)
+        if self.total_params is None:
+            if len(self.buf) < HEADER.size:
+                return True
+            magic, num_params, total_params = HEADER.unpack_from(self.buf, 0)
+            if magic != MAGIC and magic != MAGIC_DEFAULTS:
+                print("paramftp: bad magic 0x%x expected 0x%x" % (magic, MAGIC))
+                self.failed = True
+                return False
+            self.with_defaults = magic == MAGIC_DEFAULTS
+            self.total_params = total_params
+            del self.buf[:HEADER.size]
+        with memoryview(self.buf) as mv:
+            used = self.decode(mv)
+        del self.buf[:used]
+        return not self.failed
+
+    def decode(self, mv):
+        '''decode complete parameters from mv, returning bytes used'''
+        n = len(mv)
+        ofs = 0
+        with_defaults = self.with_defaults
+        last_name = self.last_name
+        names = self.names
+        values = self.values
+        types = self.types
+        default_values = self.default_values
+        while ofs < n:
+            ptype = mv[ofs]
+            if ptype == 0:
+                # skip pad bytes
+                ofs += 1
+                continue
+            if ofs + 2 > n:
+                break
+            plen = mv[ofs+1]
+            has_default = with_defaults and (ptype & 0x10) != 0
+            ptype &= 0x0F
+            formats = DATA_TYPES.get(ptype, None)
+            if formats is None:
+                print("paramftp: bad type 0x%x" % ptype)
+                self.failed = True
+                break
+            fmt = formats[1] if has_default else formats[0]
+            name_len = ((plen >> 4) & 0x0F) + 1
+            common_len = plen & 0x0F
+            vofs = ofs + 2 + name_len
+            if vofs + fmt.size > n:
+                # wait for more data
+                break
+            name = last_name[0:common_len] + mv[ofs+2:vofs].tobytes()
+            last_name = name
+            v = fmt.unpack_from(mv, vofs)
+            names.append(name)
+            values.append(v[0])
+            types.append(ptype)
+            if with_defaults:
+                default_values.append(v[-1])
+            ofs = vofs + fmt.size
+        self.last_name = last_name
+        return ofs
+
+    def finish(self):
+        '''return ParamData for all parameters, or None on error'''
+        if self.failed or self.total_params is None:
+            return None
+        count = len(self.names)
+        if count != self.total_params:
+            print("paramftp: bad count %u should be %u" % (count, self.total_params))
+            return None
+        defaults = None
+        if self.with_defaults:
+            defaults = np.frombuffer(self.default_values, dtype=np.float64)
+        return ParamData(self.names,
+                         np.frombuffer(self.values, dtype=np.float64),
+                         np.frombuffer(self.types, dtype=np.uint8),
+                         defaults)
+
+
 def ftp_param_decode(data):
     '''decode parameter data, returning ParamData'''
-    pdata = ParamData()
-
-    magic = 0x671b
-    magic_defaults = 0x671c
-    if len(data) < 6:
+    if len(data) < HEADER.size:
         return None
-    magic2,num_params,total_params = struct.unpack("<HHH", data[0:6])
-    if magic != magic2 and magic_defaults != magic2:
-        print("paramftp: bad magic 0x%x expected 0x%x" % (magic2, magic))
+    decoder = ParamDecoder()
+    if not decoder.add(data):
         return None
-    with_defaults = magic2 == magic_defaults
-    data = data[6:]
-
-    # mapping of data type to type length and format
-    data_types = {
-        1: (1, 'b'),
-        2: (2, 'h'),
-        3: (4, 'i'),
-        4: (4, 'f'),
-    }
-
-    count = 0
-
-    if sys.version_info.major < 3:
-        pad_byte = chr(0)
-        last_name = ''
-    else:
-        pad_byte = 0
-        last_name = bytes()
-
-    while True:
-        while len(data) > 0 and data[0] == pad_byte:
-            # skip pad bytes
-            data = data[1:]
-
-        if len(data) == 0:
-            break
-
-        ptype, plen = struct.unpack("<BB", data[0:2])
-        flags = (ptype>>4) & 0x0F
-        has_default = with_defaults and (flags&1) != 0
-        ptype &= 0x0F
-
-        if not ptype in data_types:
-            print("paramftp: bad type 0x%x" % ptype)
-            return None
-
-        (type_len, type_format) = data_types[ptype]
-        default_len = type_len if has_default else 0
-
-        name_len = ((plen>>4) & 0x0F) + 1
-        common_len = (plen & 0x0F)
-        name = last_name[0:common_len] + data[2:2+name_len]
-        vdata = data[2+name_len:2+name_len+type_len+default_len]
-        last_name = name
-        data = data[2+name_len+type_len+default_len:]
-        if with_defaults:
-            if has_default:
-                v1,v2, = struct.unpack("<" + type_format + type_format, vdata)
-                pdata.add_param(name, v1, ptype)
-                pdata.add_default(name, v2, ptype)
-            else:
-                v, = struct.unpack("<" + type_format, vdata)
-                pdata.add_param(name, v, ptype)
-                pdata.add_default(name, v, ptype)
-        else:
-            v, = struct.unpack("<" + type_format, vdata)
-            pdata.add_param(name, v, ptype)
-        count += 1
-
-    if count != total_params:
-        print("paramftp: bad count %u should be %u" % (count, total_params))
-        return None
-
-    return pdata
+    return decoder.finish()
 
 if __name__ == "__main__":
-    import sys
     fname = sys.argv[1]
     data = open(fname,'rb').read()
     print("Decoding file of length %u" % len(data))
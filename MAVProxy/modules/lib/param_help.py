@@ -1,14 +1,169 @@
 import time, os
+import hashlib
+import pickle
+import threading
 from pymavlink import mavutil, mavparm
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import multiproc
 
+# bump when ParamInfo or the index layout changes
+INDEX_VERSION = 1
+
+class ParamInfo(object):
+    '''metadata for one parameter, pre-parsed from the XML'''
+    __slots__ = ('name', 'humanName', 'documentation', 'user',
+                 'fields', 'values', 'bitmask', 'range', 'increment', 'units')
+
+    def __init__(self, name):
+        self.name = name
+        self.humanName = None
+        self.documentation = None
+        self.user = None
+        # list of (name, text) for each field
+        self.fields = []
+        # list of (code, description) or empty
+        self.values = []
+        # dict of bit number to description, or None
+        self.bitmask = None
+        # (min, max) or None
+        self.range = None
+        self.increment = None
+        self.units = None
+
+    def get(self, key, default=None):
+        '''get an attribute, as for the XML element'''
+        return getattr(self, key, default)
+
+    def field(self, name):
+        '''return text of a field, or None'''
+        for (fname, text) in self.fields:
+            if fname == name:
+                return text
+        return None
+
+    def search_text(self):
+        '''return all text for keyword searches'''
+        ret = [self.name, self.humanName or '', self.documentation or '']
+        ret.extend([text for (fname, text) in self.fields])
+        ret.extend([text for (code, text) in self.values])
+        if self.bitmask is not None:
+            ret.extend(self.bitmask.values())
+        return '\n'.join(ret)
+
+def parse_code(code):
+    '''parse a value code, preferring int'''
+    try:
+        return int(code)
+    except ValueError:
+        return float(code)
+
+def compile_param(p, name):
+    '''make a ParamInfo from a param XML element'''
+    info = ParamInfo(name)
+    info.humanName = p.get('humanName')
+    info.documentation = p.get('documentation')
+    info.user = p.get('user')
+    for c in p:
+        if c.tag == 'field':
+            fname = c.get('name')
+            text = (c.text or '').strip()
+            info.fields.append((fname, text))
+            if fname == 'Range':
+                a = text.split()
+                try:
+                    info.range = (float(a[0]), float(a[1]))
+                except (IndexError, ValueError):
+                    pass
+            elif fname == 'Increment':
+                try:
+                    info.increment = float(text)
+                except ValueError:
+                    pass
+            elif fname == 'Units':
+                info.units = text
+            elif fname == 'Bitmask' and info.bitmask is None:
+                # traditional "Bitmask" field, used if there is no
+                # "bitmask" subtree
+                bitmask = {}
+                for v in text.split(','):
+                    a2 = v.split(':')
+                    if len(a2) == 2:
+                        try:
+                            bitmask[int(a2[0])] = a2[1]
+                        except ValueError:
+                            pass
+                info.bitmask = bitmask
+        elif c.tag == 'values':
+            for v in c:
+                try:
+                    info.values.append((parse_code(v.get('code')), v.text or ''))
+                except (TypeError, ValueError):
+                    pass
+        elif c.tag == 'bitmask':
+            info.bitmask = {}
+            for v in c:
+                try:
+                    info.bitmask[int(v.get('code'))] = v.text or ''
+                except (TypeError, ValueError):
+                    pass
+    return info
+
+def compile_xml(path):
+    '''compile a parameter XML file to a dict of ParamInfo'''
+    from xml.etree import ElementTree
+    tree = ElementTree.parse(path).getroot()
+    htree = {}
+    # library parameters take precedence, as in the XML order
+    for section in ['vehicles', 'libraries']:
+        for parameters in tree.findall(section + '/parameters'):
+            for p in parameters.findall('param'):
+                n = p.get('name')
+                if section == 'vehicles':
+                    n = n.split(':')[1]
+                htree[n] = compile_param(p, n)
+    return htree
+
+def index_path(path):
+    '''return path of the index for a XML file'''
+    path = os.path.abspath(path)
+    h = hashlib.md5(path.encode('utf-8')).hexdigest()[:8]
+    return mp_util.dot_mavproxy("%s-%s.pindex" % (os.path.basename(path), h))
+
+def load_index(path, verbose=False):
+    '''return parameter metadata for a XML file, using the index if it
+    is up to date and rebuilding it if not'''
+    st = os.stat(path)
+    key = (INDEX_VERSION, os.path.abspath(path), st.st_mtime, st.st_size)
+    ipath = index_path(path)
+    try:
+        with open(ipath, 'rb') as f:
+            (ikey, htree) = pickle.load(f)
+        if ikey == key:
+            return htree
+    except Exception:
+        pass
+    if verbose:
+        print("param: indexing %s" % path)
+    htree = compile_xml(path)
+    try:
+        tmp = ipath + ".tmp%u" % os.getpid()
+        with open(tmp, 'wb') as f:
+            pickle.dump((key, htree), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, ipath)
+    except Exception as e:
+        if verbose:
+            print("param: failed to save index: %s" % e)
+    return htree
+
 class ParamHelp:
     def __init__(self):
         self.xml_filepath = None
         self.vehicle_name = None
         self.last_pair = (None,None)
+        self.last_key = None
         self.last_htree = None
+        self.preload_pair = None
+        self.lock = threading.Lock()
 
     def param_help_download(self):
         '''download XML files for parameters'''
@@ -41,13 +196,9 @@ class ParamHelp:
         else:
             return self.vehicle_name
 
-    def param_help_tree(self, verbose=False):
-        '''return a "help tree", a map between a parameter and its metadata.  May return None if help is not available'''
-        if self.last_pair == (self.xml_filepath, self.vehicle_name):
-            return self.last_htree
+    def xml_path(self, verbose=False):
+        '''return path to the parameter XML, or None'''
         if self.xml_filepath is not None:
-            if verbose:
-                print("param: using xml_filepath=%s" % self.xml_filepath)
             path = self.xml_filepath
         else:
             if self.vehicle_name is None:
@@ -67,21 +218,41 @@ class ParamHelp:
             if verbose:
                 print("Param XML (%s) does not exist" % path)
             return None
-        xml = open(path,'rb').read()
-        from lxml import objectify
-        objectify.enable_recursive_str()
-        tree = objectify.fromstring(xml)
-        htree = {}
-        for p in tree.vehicles.parameters.param:
-            n = p.get('name').split(':')[1]
-            htree[n] = p
-        for lib in tree.libraries.parameters:
-            for p in lib.param:
-                n = p.get('name')
-                htree[n] = p
-        self.last_htree = htree
-        self.last_pair = (self.xml_filepath, self.vehicle_name)
-        return htree
+        return path
+
+    def param_help_tree(self, verbose=False):
+        '''return a "help tree", a map between a parameter name and its ParamInfo.  May return None if help is not available'''
+        with self.lock:
+            pair = (self.xml_filepath, self.vehicle_name)
+            path = self.xml_path(verbose)
+            if path is None:
+                return None
+            st = os.stat(path)
+            key = (path, st.st_mtime, st.st_size)
+            if self.last_pair == pair and self.last_key == key:
+                return self.last_htree
+            if verbose and self.xml_filepath is not None:
+                print("param: using xml_filepath=%s" % path)
+            try:
+                htree = load_index(path, verbose)
+            except Exception as e:
+                if verbose:
+                    print("Failed to load %s: %s" % (path, e))
+                return None
+            self.last_htree = htree
+            self.last_pair = pair
+            self.last_key = key
+            return htree
+
+    def preload(self):
+        '''load the help tree in the background, so it is ready when needed'''
+        pair = (self.xml_filepath, self.vehicle_name)
+        if pair == self.preload_pair or pair == self.last_pair:
+            return
+        self.preload_pair = pair
+        t = threading.Thread(target=self.param_help_tree, name='param_help')
+        t.daemon = True
+        t.start()
 
     def param_set_xml_filepath(self, args):
         self.xml_filepath = args[0]
@@ -100,44 +271,18 @@ class ParamHelp:
         for keyword in args:
             keyword = keyword.lower()
             for param in htree.keys():
-                if str(htree[param]).lower().find(keyword) != -1:
+                if htree[param].search_text().lower().find(keyword) != -1:
                     contains[param] = True
         for param in contains.keys():
             print("%s" % (param,))
 
     def get_Values_from_help(self, help):
-        children = help.getchildren()
-        for c in children:
-            if str(c).startswith("values"):
-                return c.getchildren()
-        return []
+        '''return list of (code, description) for a parameter'''
+        return help.values
 
     def get_bitmask_from_help(self, help):
-        # check for presence of "bitmask" subtree, use it by preference:
-        children = help.getchildren()
-        for c in children:
-            if str(c).startswith("bitmask"):
-                ret = {}
-                for entry in c.getchildren():
-                    ret[int(entry.get('code'))] = str(entry)
-                return ret
-
-        # "bitmask" subtree not present, split the traditional
-        # "Bitmask" field ourselves:
-        if not hasattr(help, 'field'):
-            return None
-        field = help.field
-        if not hasattr(field, 'attrib'):
-            return None
-        if field.attrib.get('name',None) != 'Bitmask':
-            return None
-        a = str(field).split(',')
-        ret = {}
-        for v in a:
-            a2 = v.split(':')
-            if len(a2) == 2:
-                ret[a2[0]] = a2[1]
-        return ret
+        '''return dict of bit number to description, or None if not a bitmask'''
+        return help.bitmask
 
     def param_info(self, param, value):
         '''return info string for a param value'''
@@ -166,8 +311,8 @@ class ParamHelp:
             pass
         try:
             values = self.get_Values_from_help(help)
-            for v in values:
-                if int(v.get('code')) == int(value):
+            for (code, v) in values:
+                if int(code) == int(value):
                     return v
         except Exception as e:
             pass
@@ -191,19 +336,19 @@ class ParamHelp:
                 print(help.get('documentation'))
                 try:
                     print("\n")
-                    for f in help.field:
-                        if f.get('name') == 'Bitmask':
+                    for (fname, text) in help.fields:
+                        if fname == 'Bitmask':
                             # handled specially below
                             continue
-                        print("%s : %s" % (f.get('name'), str(f)))
+                        print("%s : %s" % (fname, text))
                 except Exception as e:
                     pass
                 try:
                     values = self.get_Values_from_help(help)
                     if len(values):
                         print("\nValues: ")
-                        for v in values:
-                            print("\t%3u : %s" % (int(v.get('code')), str(v)))
+                        for (code, v) in values:
+                            print("\t%3u : %s" % (int(code), v))
                 except Exception as e:
                     print("Caught exception %s" % repr(e))
                     pass
@@ -241,17 +386,13 @@ class ParamHelp:
 
             # we'll ignore the Values field if there's a bitmask field
             # involved as they're usually just examples.
-            has_bitmask = False
-            for f in getattr(help, "field", []):
-                if f.get('name') == "Bitmask":
-                    has_bitmask = True
-                    break
+            has_bitmask = help.field('Bitmask') is not None
             if not has_bitmask:
                 values = self.get_Values_from_help(help)
                 if len(values) == 0:
                     # no prescribed values list
                     continue
-                value_values = [float(x.get("code")) for x in values]
+                value_values = [float(code) for (code, v) in values]
                 if value not in value_values:
                     print("%s: value %f not in Values (%s)" %
                           (param, value, str(value_values)))
@@ -6,10 +6,45 @@ POLYCRC24 = 0x1864CFB
 
 import struct
 
+# header is preamble and 10 bit length, followed by the body and a 24 bit CRC
+HEADER_LEN = 3
+CRC_LEN = 3
+
+def make_crc_table():
+    '''make table for byte-wise CRC24 calculation'''
+    table = [0] * 256
+    for i in range(256):
+        crc = i << 16
+        for j in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= POLYCRC24
+        table[i] = crc
+    return table
+
+CRC_TABLE = make_crc_table()
+
+def crc24(data, crc=0):
+    '''calculate 24 bit crc of a bytes-like object'''
+    table = CRC_TABLE
+    for b in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ table[(crc >> 16) ^ b]
+    return crc
+
+def packet_ID(pkt):
+    '''get message ID of a packet, or None'''
+    if pkt is None or len(pkt) < 8:
+        return None
+    id, = struct.unpack('>H', pkt[3:5])
+    return id >> 4
+
 class RTCM3:
+    '''frame RTCM3 packets from a byte stream. Data may be added in
+    chunks of any size, with all complete packets returned per call'''
     def __init__(self, debug=False):
-        self.crc_table = None
         self.debug = debug
+        self.crc_errors = 0
+        self.discarded = 0
         self.reset()
 
     def get_packet(self):
@@ -18,91 +53,94 @@ class RTCM3:
 
     def get_packet_ID(self):
         '''get get of packet, or None'''
-        if self.parsed_pkt is None or len(self.parsed_pkt) < 8:
-            return None
-        id, = struct.unpack('>H', self.parsed_pkt[3:5])
-        id >>= 4
-        return id
+        return packet_ID(self.parsed_pkt)
 
     def reset(self):
         '''reset state'''
-        self.pkt = bytearray()
-        self.pkt_len = 0
+        self.buf = bytearray()
         self.parsed_pkt = None
-
-    def parse(self):
-        '''parse packet'''
-        parity = self.pkt[-3:]
-        crc1 = parity[0] << 16 | parity[1] << 8 | parity[2]
-        crc2 = self.crc24(self.pkt[:-3])
-        if crc1 != crc2:
-            if self.debug:
-                print("crc fail len=%u" % len(self.pkt))
-            # look for preamble
-            idx = self.pkt[1:].find(bytearray([RTCMv3_PREAMBLE]))
-            if idx >= 0:
-                self.pkt = self.pkt[1+idx:]
-                if len(self.pkt) >= 3:
-                    self.pkt_len, = struct.unpack('>H', self.pkt[1:3])
-                    self.pkt_len &= 0x3ff
-                else:
-                    self.pkt_len = 0
-            else:
-                self.reset()
-            return False
-
-        # got a good packet
-        self.parsed_pkt = self.pkt
-        self.pkt = bytearray()
-        self.pkt_len = 0
-        return True
+        self.pending = []
+
+    def add(self, data):
+        '''add a chunk of bytes, returning a list of the complete packets
+        now available. The last one is also available with get_packet()'''
+        buf = self.buf
+        buf.extend(data)
+        packets = []
+        pos = 0
+        n = len(buf)
+        while True:
+            start = buf.find(RTCMv3_PREAMBLE, pos)
+            if start == -1:
+                self.discarded += n - pos
+                pos = n
+                break
+            self.discarded += start - pos
+            pos = start
+            if n - start < HEADER_LEN:
+                break
+            pkt_len = ((buf[start+1] & 0x3) << 8) | buf[start+2]
+            if pkt_len == 0:
+                pos = start + 1
+                continue
+            end = start + HEADER_LEN + pkt_len + CRC_LEN
+            if end > n:
+                # need more bytes
+                break
+            pkt = buf[start:end]
+            crc = (pkt[-3] << 16) | (pkt[-2] << 8) | pkt[-1]
+            with memoryview(pkt) as body:
+                ok = crc24(body[:-CRC_LEN]) == crc
+            if not ok:
+                if self.debug:
+                    print("crc fail len=%u" % len(pkt))
+                self.crc_errors += 1
+                # look for the next preamble
+                pos = start + 1
+                continue
+            packets.append(pkt)
+            pos = end
+        del buf[:pos]
+        if len(packets) > 0:
+            self.parsed_pkt = packets[-1]
+        return packets
 
     def read(self, byte):
         '''read in one byte, return true if a full packet is available'''
-
-        #import random
-        #if random.uniform(0,1000) < 1:
-        #    return False
-
-        byte = ord(byte)
-        if len(self.pkt) == 0 and byte != RTCMv3_PREAMBLE:
+        if len(self.buf) == 0 and len(self.pending) == 0 and ord(byte) != RTCMv3_PREAMBLE:
             # discard
+            self.discarded += 1
             return False
-
-        self.pkt.append(byte)
-        if self.pkt_len == 0 and len(self.pkt) >= 3:
-            self.pkt_len, = struct.unpack('>H', self.pkt[1:3])
-            self.pkt_len &= 0x3ff
-            if self.pkt_len == 0:
-                self.reset()
-                return False
-
-        if self.pkt_len > 0 and len(self.pkt) >= 3 + self.pkt_len + 3:
-            remainder = self.pkt[6+self.pkt_len:]
-            self.pkt = self.pkt[:6+self.pkt_len]
-            # got header, packet body and parity
-            ret = self.parse()
-            self.pkt.extend(remainder)
-            return ret
-
-        # need more bytes
-        return False
+        self.pending.extend(self.add(byte))
+        if len(self.pending) == 0:
+            return False
+        self.parsed_pkt = self.pending.pop(0)
+        return True
 
     def crc24(self, bytes):
         '''calculate 24 bit crc'''
-        if self.crc_table is None:
-            # initialise table
-            self.crc_table = [0] * 256
-            for i in range(256):
-                self.crc_table[i] = i<<16
-                for j in range(8):
-                    self.crc_table[i] <<= 1
-                    if (self.crc_table[i] & 0x1000000):
-                        self.crc_table[i] ^= POLYCRC24
-        crc = 0
-        for b in bytes:
-            crc = ((crc<<8)&0xFFFFFF) ^ self.crc_table[(crc>>16) ^ b]
-        return crc
+        return crc24(bytes)
+
+def benchmark(data, chunk_size):
+    '''compare byte at a time and chunked framing of data'''
+    import time
+    results = []
+    for (name, size) in [("bytewise", 1), ("chunked", chunk_size)]:
+        rtcm3 = RTCM3()
+        count = 0
+        t0 = time.time()
+        if size == 1:
+            for i in range(len(data)):
+                if rtcm3.read(data[i:i+1]):
+                    count += 1
+        else:
+            for i in range(0, len(data), size):
+                count += len(rtcm3.add(data[i:i+size]))
+        dt = max(time.time() - t0, 1.0e-6)
+        results.append((name, count, dt))
+        print("%-8s %u packets in %.3fs %.1f kbyte/s %.0f packets/s crc_errors=%u" % (
+            name, count, dt, len(data) / (1024.0 * dt), count / dt, rtcm3.crc_errors))
+    print("speedup %.1fx" % (results[0][2] / results[1][2]))
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
@@ -112,16 +150,22 @@ if __name__ == '__main__':
     parser.add_argument("filename", type=str, help="input file")
     parser.add_argument("--debug", action='store_true', help="show errors")
     parser.add_argument("--follow", action='store_true', help="continue reading on EOF")
+    parser.add_argument("--chunk", type=int, default=4096, help="read size")
+    parser.add_argument("--benchmark", action='store_true', help="replay the file, comparing byte at a time and chunked framing")
     args = parser.parse_args()
 
+    if args.benchmark:
+        benchmark(open(args.filename, 'rb').read(), args.chunk)
+        raise SystemExit(0)
+
     rtcm3 = RTCM3(args.debug)
     f = open(args.filename, 'rb')
     while True:
-        b = f.read(1)
+        b = f.read(args.chunk)
         if len(b) == 0:
             if args.follow:
                 time.sleep(0.1)
                 continue
             break
-        if rtcm3.read(b):
-            print("packet len %u ID %u" % (len(rtcm3.get_packet()), rtcm3.get_packet_ID()))
+        for pkt in rtcm3.add(b):
+            print("packet len %u ID %u" % (len(pkt), packet_ID(pkt)))
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+'''
+shared RTCM injection scheduler
+
+GPS correction sources (ntrip, DGPS) queue RTCM frames here. Each frame
+is split into GPS_RTCM_DATA fragments once, with a sequence number shared
+by all sources, then queued on each selected link. Links are serviced in
+priority order (observations before station data before ephemeris),
+paced by an optional byte rate and held back while the radio reports a
+nearly full transmit buffer in RADIO_STATUS. Stale frames are dropped,
+and optionally station frames and MSM observations are replaced by
+newer ones while waiting.
+
+AP_FLAKE8_CLEAN
+'''
+
+import random
+import time
+
+from pymavlink import mavutil
+from MAVProxy.modules.lib import mp_settings
+from MAVProxy.modules.lib import rtcm3
+from MAVProxy.modules.lib.mp_settings import MPSetting
+
+# payload size of GPS_RTCM_DATA
+FRAGMENT_LEN = 180
+
+# up to 4 fragments make a message. The autopilot only completes a
+# message on a short fragment, so a message must be less than 4 full
+# fragments
+MAX_MESSAGE_LEN = 4 * FRAGMENT_LEN - 1
+
+# approximate MAVLink2 framing overhead per message
+WIRE_OVERHEAD = 12
+
+# ignore RADIO_STATUS older than this
+RADIO_STATUS_TIMEOUT = 5.0
+
+# priorities, lower is sent first
+PRIORITY_OBSERVATION = 0
+PRIORITY_STATION = 1
+PRIORITY_EPHEMERIS = 2
+
+STATION_IDS = set([1005, 1006, 1007, 1008, 1033, 1230])
+EPHEMERIS_IDS = set([1019, 1020, 1041, 1042, 1044, 1045, 1046])
+
+
+def message_priority(msg_id):
+    '''return priority of a RTCM3 message ID'''
+    if msg_id is None:
+        return PRIORITY_STATION
+    if 1071 <= msg_id <= 1137 or 1001 <= msg_id <= 1004 or 1009 <= msg_id <= 1012:
+        return PRIORITY_OBSERVATION
+    if msg_id in STATION_IDS:
+        return PRIORITY_STATION
+    if msg_id in EPHEMERIS_IDS:
+        return PRIORITY_EPHEMERIS
+    return PRIORITY_STATION
+
+
+def get_bits(data, pos, length):
+    '''return unsigned bit field from a RTCM3 frame, pos counted from the start of the message body'''
+    value = 0
+    for i in range(pos, pos + length):
+        value = (value << 1) | ((data[rtcm3.HEADER_LEN + i // 8] >> (7 - i % 8)) & 1)
+    return value
+
+
+def supersede_key(data, msg_id):
+    '''return (key, epoch) for replacing queued frames with newer ones. Only station frames and
+    MSM observations can be replaced: a station frame by a newer one for the same station, and a MSM
+    frame by one for a later epoch, as a single epoch can span several MSM frames. Ephemeris and
+    other frames carry different data under the same ID, so key is None and they are never replaced'''
+    if msg_id is None or len(data) < rtcm3.HEADER_LEN + 7 + rtcm3.CRC_LEN:
+        return (None, None)
+    station = get_bits(data, 12, 12)
+    if msg_id in STATION_IDS:
+        return ((msg_id, station), None)
+    if 1071 <= msg_id <= 1137:
+        return ((msg_id, station), get_bits(data, 24, 30))
+    return (None, None)
+
+
+def fragment(data, seq):
+    '''return list of (flags, length, payload) GPS_RTCM_DATA fields for
+    one message of at most MAX_MESSAGE_LEN bytes'''
+    data = bytes(data)
+    if len(data) <= FRAGMENT_LEN:
+        flags = (seq & 0x1F) << 3
+        return [(flags, len(data), data.ljust(FRAGMENT_LEN, b'\0'))]
+    ret = []
+    # a full last fragment is followed by an empty one to end the message
+    for i in range(len(data) // FRAGMENT_LEN + 1):
+        chunk = data[i*FRAGMENT_LEN:(i+1)*FRAGMENT_LEN]
+        flags = 1 | (i << 1) | ((seq & 0x1F) << 3)
+        ret.append((flags, len(chunk), chunk.ljust(FRAGMENT_LEN, b'\0')))
+    return ret
+
+
+class Frame(object):
+    '''one queued RTCM frame, encoded ready to send on any link'''
+    def __init__(self, data, source, msg_id, priority, messages, repeat, drop_pct, now):
+        self.source = source
+        self.msg_id = msg_id
+        (self.key, self.epoch) = supersede_key(data, msg_id)
+        self.priority = priority
+        self.messages = messages
+        self.repeat = repeat
+        self.drop_pct = drop_pct
+        self.queued = now
+        self.length = len(data)
+        self.wire_bytes = len(messages) * (FRAGMENT_LEN + 2 + WIRE_OVERHEAD) * repeat
+
+
+class SourceStats(object):
+    '''counters for one source'''
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.bytes = 0
+        self.stale = 0
+        self.superseded = 0
+        self.overflow = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def latency_avg(self):
+        if self.sent == 0:
+            return 0.0
+        return self.latency_total / self.sent
+
+
+class LinkQueue(object):
+    '''frames waiting to be sent on one link'''
+    def __init__(self, link):
+        self.link = link
+        self.frames = []
+        self.tokens = 0.0
+        self.last_refill = None
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.held = 0
+        self.rate = 0.0
+        self.rate_bytes = 0
+        self.rate_time = None
+
+
+class RTCMInjector(object):
+    '''queue RTCM frames from any source and send them on selected links'''
+    def __init__(self, mpstate):
+        self.mpstate = mpstate
+        self.settings = mp_settings.MPSettings([
+            MPSetting('rate_limit', int, 0, 'link byte rate limit, 0 for none'),
+            MPSetting('txbuf_min', int, 20, 'hold frames while radio txbuf is below this percentage'),
+            MPSetting('max_age', float, 2.0, 'drop frames queued for longer than this'),
+            MPSetting('max_queue', int, 200, 'maximum frames queued per link'),
+            MPSetting('supersede', bool, False, 'replace queued station and MSM frames with newer ones'),
+        ])
+        self.seq = 0
+        self.queues = {}
+        self.stats = {}
+
+    def link_key(self, link):
+        return getattr(link, 'linknum', id(link))
+
+    def select_links(self, links):
+        '''return list of links for a queue request. None is the primary
+        link, 'all' is all links'''
+        if links is None:
+            master = self.mpstate.master()
+            return [] if master is None else [master]
+        if links == 'all':
+            return list(self.mpstate.mav_master)
+        return links
+
+    def encode(self, data):
+        '''return list of GPS_RTCM_DATA messages for a frame'''
+        messages = []
+        for ofs in range(0, len(data), MAX_MESSAGE_LEN):
+            for (flags, length, payload) in fragment(data[ofs:ofs+MAX_MESSAGE_LEN], self.seq):
+                messages.append(mavutil.mavlink.MAVLink_gps_rtcm_data_message(flags, length, payload))
+            self.seq += 1
+        return messages
+
+    def queue(self, data, source, links=None, priority=None, repeat=1, drop_pct=0):
+        '''queue a frame from a source. Non-RTCM3 data is queued as is'''
+        if len(data) == 0:
+            return
+        now = time.time()
+        msg_id = None
+        if data[0] == rtcm3.RTCMv3_PREAMBLE:
+            msg_id = rtcm3.packet_ID(data)
+        if priority is None:
+            priority = message_priority(msg_id)
+        stats = self.stats.setdefault(source, SourceStats())
+        stats.queued += 1
+        frame = Frame(data, source, msg_id, priority, self.encode(data), repeat, drop_pct, now)
+        for link in self.select_links(links):
+            key = self.link_key(link)
+            lq = self.queues.get(key, None)
+            if lq is None or lq.link is not link:
+                lq = LinkQueue(link)
+                self.queues[key] = lq
+            if self.settings.supersede and frame.key is not None:
+                old = [f for f in lq.frames if f.key == frame.key and f.source == source and
+                       (frame.epoch is None or f.epoch != frame.epoch)]
+                for f in old:
+                    lq.frames.remove(f)
+                    stats.superseded += 1
+            lq.frames.append(frame)
+            if len(lq.frames) > self.settings.max_queue:
+                # drop the least urgent, oldest frame
+                worst = max(lq.frames, key=lambda f: (f.priority, -f.queued))
+                lq.frames.remove(worst)
+                self.stats[worst.source].overflow += 1
+        self.update(now)
+
+    def radio_busy(self, link, now):
+        '''check if the radio on a link reports a nearly full tx buffer'''
+        messages = getattr(link, 'messages', None)
+        if messages is None:
+            return False
+        m = messages.get('RADIO_STATUS', None)
+        if m is None or now - getattr(m, '_timestamp', 0) > RADIO_STATUS_TIMEOUT:
+            return False
+        return m.txbuf < self.settings.txbuf_min
+
+    def update(self, now=None):
+        '''send what can be sent on each link'''
+        if now is None:
+            now = time.time()
+        for lq in self.queues.values():
+            self.service(lq, now)
+
+    def service(self, lq, now):
+        '''send queued frames on one link'''
+        max_age = self.settings.max_age
+        if max_age > 0:
+            for f in [f for f in lq.frames if now - f.queued > max_age]:
+                lq.frames.remove(f)
+                self.stats[f.source].stale += 1
+        if len(lq.frames) == 0:
+            return
+        if self.radio_busy(lq.link, now):
+            lq.held += 1
+            return
+
+        rate = self.settings.rate_limit
+        if rate > 0:
+            # token bucket, allowing up to half a second of burst
+            if lq.last_refill is not None:
+                lq.tokens = min(lq.tokens + rate * (now - lq.last_refill), rate * 0.5)
+            lq.last_refill = now
+
+        while len(lq.frames) > 0:
+            if rate > 0 and lq.tokens < 0:
+                break
+            f = min(lq.frames, key=lambda f: (f.priority, f.queued))
+            lq.frames.remove(f)
+            for m in f.messages:
+                for r in range(f.repeat):
+                    if f.drop_pct > 0 and random.random() * 100 < f.drop_pct:
+                        continue
+                    lq.link.mav.send(m)
+            if rate > 0:
+                lq.tokens -= f.wire_bytes
+            lq.bytes_sent += f.wire_bytes
+            lq.frames_sent += 1
+            lq.rate_bytes += f.wire_bytes
+            stats = self.stats[f.source]
+            stats.sent += 1
+            stats.bytes += f.length
+            latency = now - f.queued
+            stats.latency_total += latency
+            stats.latency_max = max(stats.latency_max, latency)
+
+        if lq.rate_time is None:
+            lq.rate_time = now
+        elif now - lq.rate_time > 1:
+            lq.rate = 0.9 * lq.rate + 0.1 * lq.rate_bytes / (now - lq.rate_time)
+            lq.rate_bytes = 0
+            lq.rate_time = now
+
+    def reset_stats(self):
+        '''reset all counters'''
+        self.stats = {}
+        for lq in self.queues.values():
+            lq.bytes_sent = 0
+            lq.frames_sent = 0
+            lq.held = 0
+
+    def status(self):
+        '''return status lines'''
+        lines = []
+        for source in sorted(self.stats.keys()):
+            s = self.stats[source]
+            lines.append("%s: queued %u sent %u (%u bytes) stale %u superseded %u overflow %u latency avg %.3fs max %.3fs" % (
+                source, s.queued, s.sent, s.bytes, s.stale, s.superseded, s.overflow,
+                s.latency_avg(), s.latency_max))
+        for key in sorted(self.queues.keys()):
+            lq = self.queues[key]
+            lines.append("link %s: pending %u sent %u frames %u bytes %.0f bytes/s held %u" % (
+                key, len(lq.frames), lq.frames_sent, lq.bytes_sent, lq.rate, lq.held))
+        if len(lines) == 0:
+            lines.append("No RTCM data")
+        return lines
+
+    def command(self, args):
+        '''handle inject commands'''
+        usage = "Usage: inject <status|reset|set>"
+        if len(args) == 0 or args[0] == "status":
+            for line in self.status():
+                print(line)
+        elif args[0] == "reset":
+            self.reset_stats()
+        elif args[0] == "set":
+            self.settings.command(args[1:])
+        else:
+            print(usage)
+
+
+def get_injector(mpstate):
+    '''return the injector shared by all modules'''
+    injector = getattr(mpstate, 'rtcm_injector', None)
+    if injector is None:
+        injector = RTCMInjector(mpstate)
+        mpstate.rtcm_injector = injector
+    return injector
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+'''
+shared memory frame ring for passing images between processes
+
+The sending process copies each frame into a free slot of a ring of
+preallocated slots in shared memory, and sends only a small FrameRef
+naming the slot over its queue. The receiver views the frame in place
+and frees the slot when done with it. If no slot is free the frame is
+dropped rather than queued, so a slow receiver can't build up a backlog.
+
+There is one writer and one reader per ring. Slot states and counters
+live in a header at the start of the shared memory.
+
+AP_FLAKE8_CLEAN
+'''
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+SLOT_FREE = 0
+SLOT_READY = 1
+
+# counters in the header
+COUNT_SENT = 0
+COUNT_DROPPED = 1
+COUNT_DISPLAYED = 2
+COUNT_SKIPPED = 3
+NUM_COUNTERS = 4
+
+HEADER_ALIGN = 64
+
+
+def available():
+    '''return True if shared memory frames can be used'''
+    return shared_memory is not None
+
+
+def header_size(nslots):
+    size = NUM_COUNTERS * 8 + nslots
+    return (size + HEADER_ALIGN - 1) // HEADER_ALIGN * HEADER_ALIGN
+
+
+class FrameRef(object):
+    '''reference to a frame in a ring, sent in place of the frame'''
+    def __init__(self, ring, slot, shape, dtype, bgr):
+        self.name = ring.name
+        self.nslots = ring.nslots
+        self.slot_bytes = ring.slot_bytes
+        self.slot = slot
+        self.shape = shape
+        self.dtype = dtype
+        self.bgr = bgr
+
+
+class FrameRing(object):
+    '''ring of frame slots in shared memory'''
+    def __init__(self, nslots=3, slot_bytes=0, name=None):
+        self.nslots = nslots
+        self.slot_bytes = slot_bytes
+        self.owner = name is None
+        size = header_size(nslots) + nslots * slot_bytes
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # track is only available from python 3.13. Before that
+                # attaching registers the ring with the resource tracker.
+                # A child process shares its parent's tracker, where the
+                # owner has already registered the ring, and unregistering
+                # would remove the owner's registration. Otherwise this
+                # process has its own tracker, which would remove the ring
+                # when this process exits, so unregister it
+                shared_tracker = getattr(resource_tracker._resource_tracker, '_fd', None) is not None
+                self.shm = shared_memory.SharedMemory(name=name)
+                if not shared_tracker:
+                    resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.name = self.shm.name
+        buf = self.shm.buf
+        self.counters = np.ndarray((NUM_COUNTERS,), dtype=np.uint64, buffer=buf)
+        self.states = np.ndarray((nslots,), dtype=np.uint8, buffer=buf, offset=NUM_COUNTERS * 8)
+        self.data_offset = header_size(nslots)
+        self.next_slot = 0
+
+    @staticmethod
+    def attach(ref):
+        '''attach to the ring a FrameRef refers to'''
+        return FrameRing(ref.nslots, ref.slot_bytes, name=ref.name)
+
+    def slot_view(self, slot, shape, dtype):
+        '''numpy view of the frame in a slot'''
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf,
+                          offset=self.data_offset + slot * self.slot_bytes)
+
+    def put(self, img, bgr=False):
+        '''copy a frame into a free slot, returning a FrameRef to send or
+        None if the frame was dropped as all slots are in use'''
+        for i in range(self.nslots):
+            slot = (self.next_slot + i) % self.nslots
+            if self.states[slot] == SLOT_FREE:
+                break
+        else:
+            self.counters[COUNT_DROPPED] += 1
+            return None
+        self.next_slot = (slot + 1) % self.nslots
+        view = self.slot_view(slot, img.shape, img.dtype)
+        np.copyto(view, img)
+        self.states[slot] = SLOT_READY
+        self.counters[COUNT_SENT] += 1
+        return FrameRef(self, slot, img.shape, img.dtype.str, bgr)
+
+    def get(self, ref):
+        '''return numpy view of a referenced frame'''
+        return self.slot_view(ref.slot, ref.shape, np.dtype(ref.dtype))
+
+    def release(self, ref, displayed=True):
+        '''free the slot of a frame'''
+        self.states[ref.slot] = SLOT_FREE
+        if displayed:
+            self.counters[COUNT_DISPLAYED] += 1
+        else:
+            self.counters[COUNT_SKIPPED] += 1
+
+    def stats(self):
+        '''return dict of frame counters'''
+        return {'sent': int(self.counters[COUNT_SENT]),
+                'dropped': int(self.counters[COUNT_DROPPED]),
+                'displayed': int(self.counters[COUNT_DISPLAYED]),
+                'skipped': int(self.counters[COUNT_SKIPPED])}
+
+    def close(self):
+        '''detach from the ring, removing it if we created it'''
+        self.counters = None
+        self.states = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a view of a frame is still held, the mapping goes when it does
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
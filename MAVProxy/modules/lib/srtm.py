@@ -21,6 +21,7 @@ import os
 import zipfile
 import array
 import math
+import numpy
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import multiproc
 
@@ -354,6 +355,8 @@ class SRTMTile:
             raise InvalidTileError(lat, lon)
         self.lat = lat
         self.lon = lon
+        # numpy copy of the data, made on first use
+        self.grid = None
 
     @staticmethod
     def _avg(value1, value2, weight):
@@ -430,6 +433,31 @@ class SRTMTile:
         #        value00, value10, value1, value01, value11, value2, value))
         return value
 
+    def getAltitudeArray(self, lat, lon):
+        """Get the altitudes of numpy arrays of lat lon pairs in this tile,
+            interpolating as for getAltitudeFromLatLon.
+        """
+        if self.grid is None:
+            # rows are in order of decreasing latitude
+            grid = numpy.frombuffer(self.data, dtype=numpy.int16).reshape(self.size, self.size)
+            self.grid = numpy.where(grid == -32768, -1, grid).astype(numpy.float32)
+        lat = numpy.asarray(lat, dtype=numpy.float64) - self.lat
+        lon = numpy.asarray(lon, dtype=numpy.float64) - self.lon
+        if numpy.any((lat < 0.0) | (lat >= 1.0) | (lon < 0.0) | (lon >= 1.0)):
+            raise WrongTileError(self.lat, self.lon, self.lat+lat.min(), self.lon+lon.min())
+        x = lon * (self.size - 1)
+        y = lat * (self.size - 1)
+        x_int = x.astype(numpy.int64)
+        y_int = y.astype(numpy.int64)
+        x_frac = x - x_int
+        y_frac = y - y_int
+        row0 = self.size - 1 - y_int
+        row1 = row0 - 1
+        grid = self.grid
+        value1 = grid[row0, x_int] * (1 - x_frac) + grid[row0, x_int+1] * x_frac
+        value2 = grid[row1, x_int] * (1 - x_frac) + grid[row1, x_int+1] * x_frac
+        return value1 * (1 - y_frac) + value2 * y_frac
+
 class SRTMOceanTile(SRTMTile):
     '''a tile for areas of zero altitude'''
     def __init__(self, lat, lon):
@@ -439,6 +467,9 @@ class SRTMOceanTile(SRTMTile):
     def getAltitudeFromLatLon(self, lat, lon):
         return 0
 
+    def getAltitudeArray(self, lat, lon):
+        return numpy.zeros(numpy.shape(lat))
+
 
 class parseHTMLDirectoryListing(HTMLParser):
 
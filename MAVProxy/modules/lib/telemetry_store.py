@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+'''
+store of the latest telemetry messages
+
+Holds the last message of each type, and of each instance of
+multi-instance messages as "TYPE[INSTANCE]", in numbered slots. Every
+update stamps its slot with a new store version, so consumers can ask
+for just the slots changed since the version they last saw. The store
+reads like a dict of key to message, so it can be used anywhere the
+old status.msgs dict was.
+
+Optionally a short history of recent messages is kept per key for rate
+and derivative calculations.
+
+AP_FLAKE8_CLEAN
+'''
+
+import sys
+from collections import deque
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class CountView(Mapping):
+    '''read-only dict-like view of the message counts of a store'''
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, key):
+        return self.store.counts[self.store.slot_of(key)]
+
+    def __iter__(self):
+        return iter(self.store.keys())
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, key):
+        return key in self.store
+
+
+class TelemetryStore(Mapping):
+    '''last message per type and instance, with change versions'''
+    def __init__(self, mtypes=None):
+        # interned key to slot number
+        self.index = {}
+        # mtype to (slot, instance field) for types we have received
+        self.types = {}
+        # (mtype, instance value) to slot number, avoiding formatting
+        # the instance key for each message
+        self.instance_index = {}
+        self.slot_keys = []
+        self.messages = []
+        self.counts = []
+        self.versions = []
+        self.history_len = {}
+        self.histories = {}
+        self.version = 0
+        self.msg_count = CountView(self)
+        if mtypes is not None:
+            for mtype in mtypes:
+                self.new_slot(mtype)
+
+    def new_slot(self, key):
+        '''allocate a slot for a key'''
+        key = sys.intern(key)
+        slot = len(self.slot_keys)
+        self.index[key] = slot
+        self.slot_keys.append(key)
+        self.messages.append(None)
+        self.counts.append(0)
+        self.versions.append(0)
+        return slot
+
+    def slot_of(self, key):
+        '''return slot of a key holding a message, raising KeyError if none'''
+        slot = self.index[key]
+        if self.messages[slot] is None:
+            raise KeyError(key)
+        return slot
+
+    def new_type(self, mtype, m):
+        '''setup a type on its first message'''
+        slot = self.index.get(mtype, None)
+        if slot is None:
+            slot = self.new_slot(mtype)
+        info = (slot, getattr(m, '_instance_field', None))
+        self.types[mtype] = info
+        return info
+
+    def new_instance(self, ikey):
+        '''setup an instance on its first message'''
+        key = "%s[%s]" % ikey
+        slot = self.index.get(key, None)
+        if slot is None:
+            slot = self.new_slot(key)
+        self.instance_index[ikey] = slot
+        length = self.history_len.get(ikey[0], None)
+        if length is not None:
+            self.histories[slot] = deque(maxlen=length)
+        return slot
+
+    def add(self, mtype, m):
+        '''add a received message'''
+        info = self.types.get(mtype, None)
+        if info is None:
+            info = self.new_type(mtype, m)
+        (slot, instance_field) = info
+        version = self.version + 1
+        self.version = version
+        self.messages[slot] = m
+        self.counts[slot] += 1
+        self.versions[slot] = version
+        histories = self.histories
+        if histories and slot in histories:
+            histories[slot].append(m)
+        if instance_field is None:
+            return
+        instance_value = getattr(m, instance_field, None)
+        if instance_value is None:
+            return
+        ikey = (mtype, instance_value)
+        slot = self.instance_index.get(ikey, None)
+        if slot is None:
+            slot = self.new_instance(ikey)
+        self.messages[slot] = m
+        self.counts[slot] += 1
+        self.versions[slot] = version
+        if histories and slot in histories:
+            histories[slot].append(m)
+
+    def changed_since(self, version):
+        '''return (version, changes) where changes is a list of (key,
+        message) for keys updated after the given version. Pass the
+        returned version in the next call'''
+        versions = self.versions
+        changes = [(self.slot_keys[i], self.messages[i]) for i in range(len(versions)) if versions[i] > version]
+        return (self.version, changes)
+
+    def version_of(self, key):
+        '''return version at which a key last changed, 0 if never'''
+        slot = self.index.get(key, None)
+        if slot is None:
+            return 0
+        return self.versions[slot]
+
+    def set_history(self, mtype, length):
+        '''keep the last length messages of a type, and of each of its
+        instances. A length of 0 stops keeping history'''
+        slots = [s for (k, s) in self.index.items() if k == mtype or k.startswith(mtype + '[')]
+        if mtype not in self.index:
+            slots.append(self.new_slot(mtype))
+        if length <= 0:
+            self.history_len.pop(mtype, None)
+            for slot in slots:
+                self.histories.pop(slot, None)
+            return
+        self.history_len[mtype] = length
+        for slot in slots:
+            old = self.histories.get(slot, [])
+            self.histories[slot] = deque(old, maxlen=length)
+
+    def history(self, key):
+        '''return list of recent messages for a key, oldest first'''
+        slot = self.index.get(key, None)
+        if slot is None or slot not in self.histories:
+            return []
+        return list(self.histories[slot])
+
+    def rate(self, key):
+        '''return message rate in Hz over the history of a key, or None'''
+        hist = self.history(key)
+        if len(hist) < 2:
+            return None
+        dt = hist[-1]._timestamp - hist[0]._timestamp
+        if dt <= 0:
+            return None
+        return (len(hist) - 1) / dt
+
+    def derivative(self, key, field):
+        '''return rate of change per second of a field over the last two
+        messages in the history of a key, or None'''
+        hist = self.history(key)
+        if len(hist) < 2:
+            return None
+        (m0, m1) = (hist[-2], hist[-1])
+        dt = m1._timestamp - m0._timestamp
+        if dt <= 0:
+            return None
+        return (getattr(m1, field) - getattr(m0, field)) / dt
+
+    def __getitem__(self, key):
+        return self.messages[self.slot_of(key)]
+
+    def get(self, key, default=None):
+        slot = self.index.get(key, None)
+        if slot is None:
+            return default
+        m = self.messages[slot]
+        if m is None:
+            return default
+        return m
+
+    def __contains__(self, key):
+        slot = self.index.get(key, None)
+        return slot is not None and self.messages[slot] is not None
+
+    def __iter__(self):
+        messages = self.messages
+        return iter([self.slot_keys[i] for i in range(len(messages)) if messages[i] is not None])
+
+    def __len__(self):
+        return sum(1 for m in self.messages if m is not None)
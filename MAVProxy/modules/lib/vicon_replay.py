@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+'''
+stand-in for the pyvicon frame API, for testing the vicon module without
+the Vicon DataStream SDK or hardware
+
+Frames come either from a CSV recording made with "vicon record" or from
+simulated subjects flying circles. get_frame() blocks until the next frame
+is due, as the SDK does in server push mode.
+
+AP_FLAKE8_CLEAN
+'''
+
+import csv
+import math
+import time
+
+import numpy as np
+
+
+class ViconRecorder(object):
+    '''record subject poses to a CSV file that ViconReplay can play back'''
+
+    def __init__(self, filename, frame_rate):
+        self.filename = filename
+        self.fh = open(filename, 'w', newline='')
+        self.fh.write("# frame_rate %f\n" % frame_rate)
+        self.writer = csv.writer(self.fh)
+        self.writer.writerow(['frame', 'subject', 'segment', 'x', 'y', 'z', 'q0', 'q1', 'q2', 'q3'])
+
+    def add(self, frame_num, subject, segment, pos_mm, quat):
+        '''add one subject pose, position in mm, quaternion as returned by pyvicon'''
+        self.writer.writerow([frame_num, subject, segment] +
+                             ["%.3f" % v for v in pos_mm] + ["%.7f" % v for v in quat])
+
+    def close(self):
+        self.fh.close()
+
+
+class ViconReplay(object):
+    '''replay frames through the subset of the pyvicon API used by the vicon module'''
+
+    def __init__(self, frames, frame_rate, speed=1.0, latency=0.0):
+        # frames is a list of (frame_num, {subject: (segment, pos_mm, quat)})
+        self.frames = frames
+        self.frame_rate = frame_rate
+        self.speed = speed
+        self.latency = latency
+        self.subjects = []
+        for (frame_num, poses) in frames:
+            for name in poses:
+                if name not in self.subjects:
+                    self.subjects.append(name)
+        self.index = -1
+        self.loops = 0
+        self.span = frames[-1][0] - frames[0][0] + 1 if frames else 0
+        self.next_time = None
+
+    @staticmethod
+    def from_file(filename, speed=1.0, latency=0.0):
+        '''load a recording made by ViconRecorder'''
+        frame_rate = 100.0
+        frames = []
+        with open(filename, newline='') as fh:
+            line = fh.readline()
+            if line.startswith("# frame_rate"):
+                frame_rate = float(line.split()[2])
+            else:
+                fh.seek(0)
+            for row in csv.DictReader(fh):
+                frame_num = int(row['frame'])
+                if not frames or frames[-1][0] != frame_num:
+                    frames.append((frame_num, {}))
+                pos = np.array([float(row[k]) for k in 'xyz'])
+                quat = [float(row['q%u' % i]) for i in range(4)]
+                frames[-1][1][row['subject']] = (row['segment'], pos, quat)
+        return ViconReplay(frames, frame_rate, speed=speed, latency=latency)
+
+    @staticmethod
+    def simulated(nsubjects=1, frame_rate=100.0, period=10.0, radius=1.0, speed=1.0, latency=0.0):
+        '''subjects flying circles around the origin, evenly spaced in phase'''
+        nframes = int(round(period * frame_rate))
+        frames = []
+        for f in range(nframes):
+            poses = {}
+            for s in range(nsubjects):
+                angle = 2 * math.pi * (f / float(nframes) + s / float(nsubjects))
+                pos = np.array([math.cos(angle), math.sin(angle), -1.0]) * radius * 1000.0
+                # yaw along the direction of travel
+                yaw = angle + math.pi / 2
+                quat = [math.cos(yaw / 2), 0.0, 0.0, math.sin(yaw / 2)]
+                poses["sim%u" % s] = ("root", pos, quat)
+            frames.append((f, poses))
+        return ViconReplay(frames, frame_rate, speed=speed, latency=latency)
+
+    def get_frame(self):
+        '''wait for and move to the next frame'''
+        if not self.frames:
+            time.sleep(0.1)
+            return False
+        now = time.time()
+        if self.next_time is None or now - self.next_time > 0.1:
+            # starting, or too far behind, so drop frames as server push would
+            self.next_time = now
+        elif self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time += 1.0 / (self.frame_rate * self.speed)
+        self.index += 1
+        if self.index >= len(self.frames):
+            self.index = 0
+            self.loops += 1
+        return True
+
+    def get_frame_number(self):
+        if self.index < 0:
+            return 0
+        return self.frames[self.index][0] + self.loops * self.span
+
+    def get_frame_rate(self):
+        return self.frame_rate
+
+    def get_latency_total(self):
+        return self.latency
+
+    def get_subject_count(self):
+        return len(self.subjects)
+
+    def get_subject_name(self, index):
+        if index >= len(self.subjects):
+            return None
+        return self.subjects[index]
+
+    def get_subject_root_segment_name(self, name):
+        for (frame_num, poses) in self.frames:
+            if name in poses:
+                return poses[name][0]
+        return None
+
+    def current_pose(self, name, segment):
+        if self.index < 0:
+            return None
+        pose = self.frames[self.index][1].get(name)
+        if pose is None or pose[0] != segment:
+            return None
+        return pose
+
+    def get_segment_global_translation(self, name, segment):
+        pose = self.current_pose(name, segment)
+        if pose is None:
+            return None
+        return pose[1]
+
+    def get_segment_global_quaternion(self, name, segment):
+        pose = self.current_pose(name, segment)
+        if pose is None:
+            return None
+        return pose[2]
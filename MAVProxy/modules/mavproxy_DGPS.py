@@ -7,6 +7,8 @@ import socket, errno
 from pymavlink import mavutil
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_settings
+from MAVProxy.modules.lib import rtcm3
+from MAVProxy.modules.lib import rtcm_inject
 from MAVProxy.modules.lib.mp_settings import MPSetting
 
 class DGPSModule(mp_module.MPModule):
@@ -16,12 +18,14 @@ class DGPSModule(mp_module.MPModule):
         return mp_settings.MPSettings([
                 MPSetting("portnum", int, 13320),
                 MPSetting("ip", str, "127.0.0.1"),
+                MPSetting("frame_rtcm", bool, True),
             ])
 
     def __init__(self, mpstate):
         super(DGPSModule, self).__init__(mpstate, "DGPS", "DGPS injection support for SBP/RTCP/UBC")
         self.dgps_settings = DGPSModule.default_settings()
-        self.inject_seq_nr = 0
+        self.rtcm3 = rtcm3.RTCM3()
+        self.injector = rtcm_inject.get_injector(mpstate)
         self.cmdname = "dgps"
         
         self.create_port()
@@ -31,11 +35,16 @@ class DGPSModule(mp_module.MPModule):
             f"{self.cmdname} control",
             [
                 "set (DGPS_SETTING)",
+                "inject <status|reset>",
+                "inject set (RTCMINJECTSETTING)",
             ],
         )
         self.add_completion_function(
             "(DGPS_SETTING)", self.dgps_settings.completion
         )
+        self.add_completion_function(
+            "(RTCMINJECTSETTING)", self.injector.settings.completion
+        )
         self.dgps_settings.set_callback(self.on_setting_set)
 
     def create_port(self):
@@ -50,11 +59,13 @@ class DGPSModule(mp_module.MPModule):
         """
         dgps commands
         """
-        usage = f"usage: {self.cmdname} <set>"
+        usage = f"usage: {self.cmdname} <set|inject>"
         if len(args) < 1:
             print(usage)
         elif args[0] == "set":
             self.cmd_set(args[1:])
+        elif args[0] == "inject":
+            self.injector.command(args[1:])
         else:
             print(usage)
 
@@ -65,55 +76,8 @@ class DGPSModule(mp_module.MPModule):
         self.dgps_settings.command(args)
     
     def send_rtcm_msg(self, data):
-
-        if self.master is None:
-            return
-
-        msglen = 180
-        
-        if (len(data) > msglen * 4):
-            print("DGPS: Message too large", len(data))
-            return
-        
-        # How many messages will we send?
-        msgs = 0
-        if (len(data) % msglen == 0):
-            msgs = len(data) // msglen
-        else:
-            msgs = (len(data) // msglen) + 1
-
-        for a in range(0, msgs):
-            
-            flags = 0
-            
-            # Set the fragment flag if we're sending more than 1 packet.
-            if (msgs) > 1:
-                flags = 1
-            
-            # Set the ID of this fragment
-            flags |= (a & 0x3) << 1
-            
-            # Set an overall sequence number
-            flags |= (self.inject_seq_nr & 0x1f) << 3
-            
-            
-            amount = min(len(data) - a * msglen, msglen)
-            datachunk = data[a*msglen : a*msglen + amount]
-
-            self.master.mav.gps_rtcm_data_send(
-                flags,
-                len(datachunk),
-                bytearray(datachunk.ljust(180, b'\0')))
-        
-        # Send a terminal 0-length message if we sent 2 or 3 exactly-full messages.     
-        if (msgs < 4) and (len(data) % msglen == 0) and (len(data) > msglen):
-            flags = 1 | (msgs & 0x3)  << 1 | (self.inject_seq_nr & 0x1f) << 3
-            self.master.mav.gps_rtcm_data_send(
-                flags,
-                0,
-                bytearray("".ljust(180, '\0')))
-            
-        self.inject_seq_nr += 1
+        '''queue data for injection'''
+        self.injector.queue(data, 'DGPS')
 
     def on_setting_set(self, setting):
         print("Settings changed:", setting.name)
@@ -122,19 +86,33 @@ class DGPSModule(mp_module.MPModule):
                 self.port.close()
             self.create_port()
 
+    def handle_data(self, data):
+        '''send received data, split into whole RTCM3 packets if it is RTCM3.
+        Other data (eg. SBP or UBX) is passed through as received'''
+        if (not self.dgps_settings.frame_rtcm or
+            (len(self.rtcm3.buf) == 0 and data[0] != rtcm3.RTCMv3_PREAMBLE)):
+            self.send_rtcm_msg(data)
+            return
+        for pkt in self.rtcm3.add(data):
+            self.send_rtcm_msg(bytes(pkt))
+
     def idle_task(self):
         '''called in idle time'''
-        try:
-            data = self.port.recv(1024) # Attempt to read up to 1024 bytes.
-        except socket.error as e:
-            if e.errno in [ errno.EAGAIN, errno.EWOULDBLOCK ]:
+        self.injector.update()
+        while True:
+            try:
+                data = self.port.recv(4096) # whole datagram, RTCM3 frames can be over 1024 bytes
+            except socket.error as e:
+                if e.errno in [ errno.EAGAIN, errno.EWOULDBLOCK ]:
+                    return
+                raise
+            if len(data) == 0:
                 return
-            raise
-        try:
-            self.send_rtcm_msg(data)
+            try:
+                self.handle_data(data)
 
-        except Exception as e:
-            print("DGPS: GPS Inject Failed:", e)
+            except Exception as e:
+                print("DGPS: GPS Inject Failed:", e)
 
 def init(mpstate):
     '''initialise module'''
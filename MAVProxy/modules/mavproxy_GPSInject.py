@@ -3,12 +3,14 @@ inject data to GPS modules from a file or URL
 primarily used to inject uBlox AssistNow data
 """
 
+import bisect
 import random
 import time
 import os
 
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_settings
+from MAVProxy.modules.lib import rtcm3
 import urllib.request
 
 OFFLINE_MBX = "https://firmware.ardupilot.org/AssistNow/OFFLINE.UBX"
@@ -28,6 +30,7 @@ class GPSInjectModule(mp_module.MPModule):
         self.add_completion_function('(GPSINJECTSETTING)',
                                      self.gpsinject_settings.completion)
         self.buf = None
+        self.frame_ends = None
         self.sent_bytes = 0
         self.sent_count = 0
         self.started = False
@@ -52,6 +55,7 @@ class GPSInjectModule(mp_module.MPModule):
                 self.start_pending = False
                 return
             print("GPSInject: retrieved %u bytes" % len(self.buf))
+            self.find_frames()
 
         if self.start_pending:
             GPS_RAW_INT = self.master.messages.get("GPS_RAW_INT", None)
@@ -75,7 +79,10 @@ class GPSInjectModule(mp_module.MPModule):
             cansend = max_send
         else:
             cansend = int((now - self.last_send) / sec_per_byte)
-        self.last_send = now
+        allowed = cansend
+        cansend = self.frame_limit(cansend)
+        # carry unused allowance over to the next send
+        self.last_send = now - (allowed - cansend) * sec_per_byte
 
         while cansend > 0:
             n = min(max_send, len(self.buf) - self.sent_bytes)
@@ -97,6 +104,31 @@ class GPSInjectModule(mp_module.MPModule):
                     break
             cansend -= n
 
+    def find_frames(self):
+        '''if the source is a RTCM3 stream note where each frame ends, so
+        sends can stop on frame boundaries'''
+        self.frame_ends = None
+        framer = rtcm3.RTCM3()
+        frames = framer.add(self.buf)
+        if len(frames) == 0 or sum([len(f) for f in frames]) != len(self.buf):
+            return
+        self.frame_ends = []
+        total = 0
+        for f in frames:
+            total += len(f)
+            self.frame_ends.append(total)
+        print("GPSInject: source has %u RTCM3 frames" % len(frames))
+
+    def frame_limit(self, cansend):
+        '''limit bytes to send to end on a RTCM3 frame boundary, unless no
+        frame ends within the limit'''
+        if self.frame_ends is None:
+            return cansend
+        i = bisect.bisect_right(self.frame_ends, self.sent_bytes + cansend) - 1
+        if i < 0 or self.frame_ends[i] <= self.sent_bytes:
+            return cansend
+        return self.frame_ends[i] - self.sent_bytes
+
     def cmd_gpsinject(self, args):
         '''GPSInject command handling'''
         if len(args) <= 0:
@@ -104,6 +136,7 @@ class GPSInjectModule(mp_module.MPModule):
             return
         if args[0] == "start":
             self.buf = None
+            self.frame_ends = None
             self.sent_bytes = 0
             self.sent_count = 0
             self.started = False
@@ -20,6 +20,7 @@ import math
 from math import radians, degrees
 from threading import Thread
 import cv2
+import numpy as np
 import traceback
 import copy
 import datetime
@@ -1257,6 +1258,27 @@ class SIYIModule(mp_module.MPModule):
         myalt = GPS_RAW_INT.alt*1.0e-3 + self.siyi_settings.mount_alt
         return cproj.get_latlonalt_for_pixel(px, py, gpi.lat*1.0e-7,gpi.lon*1.0e-7,myalt,fov_att[0],fov_att[1],fov_att[2]+math.degrees(att.yaw))
 
+    def get_latlonalt_list(self, xs, ys, FOV, aspect_ratio):
+        '''
+        get ground lat/lon for a list of points, using one vehicle and camera pose
+        xs and ys are from -1 to 1, relative to center of camera view
+        return is a list with a (lat,lon,alt) tuple or None per point
+        '''
+        att = self.master.messages.get('ATTITUDE',None)
+        gpi = self.master.messages.get('GLOBAL_POSITION_INT',None)
+        GPS_RAW_INT = self.master.messages.get('GPS_RAW_INT',None)
+        if gpi is None or att is None or GPS_RAW_INT is None:
+            return [None] * len(xs)
+        C = camera_projection.CameraParams(xresolution=1024, yresolution=int(1024/aspect_ratio), FOV=FOV)
+        cproj = camera_projection.CameraProjection(C, elevation_model=self.module('terrain').ElevationModel)
+        fov_att = self.get_fov_attitude()
+        myalt = GPS_RAW_INT.alt*1.0e-3 + self.siyi_settings.mount_alt
+        px = C.xresolution * 0.5*(1+np.asarray(xs))
+        py = C.yresolution * 0.5*(1+np.asarray(ys))
+        (lat, lon, alt) = cproj.get_latlonalt_for_pixels(px, py, gpi.lat*1.0e-7,gpi.lon*1.0e-7,myalt,
+                                                         fov_att[0],fov_att[1],fov_att[2]+math.degrees(att.yaw))
+        return [None if np.isnan(lat[i]) else (float(lat[i]), float(lon[i]), float(alt[i])) for i in range(len(lat))]
+
     def get_target_yaw_pitch(self, lat, lon, alt, mylat, mylon, myalt, vehicle_yaw_rad):
         '''get target yaw/pitch in vehicle frame for a target lat/lon'''
         GPS_vector_x = (lon-mylon)*1.0e7*math.cos(math.radians((mylat + lat) * 0.5)) * 0.01113195
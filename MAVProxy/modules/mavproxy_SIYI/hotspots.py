@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+'''
+hotspot detection for raw thermal frames
+
+The frame is split into slices x slices blocks and the hottest pixel of
+each block found with one reshape and reduction over the whole frame.
+Blocks whose hottest pixel is over the threshold become candidate
+hotspots, located at that pixel rather than the block centre.
+
+Flagged locations are remembered in a MarkerHistory, which buckets them
+in a grid of cells the size of the minimum flag separation so a
+candidate is only compared with flags in nearby cells.
+'''
+
+import math
+from collections import deque
+
+import numpy as np
+
+from MAVProxy.modules.lib import mp_util
+
+# meters per degree of latitude
+LATITUDE_SCALE = mp_util.radius_of_earth * math.pi / 180.0
+
+
+def find_hotspots(data, threshold, slices):
+    '''find the hottest pixel of each of slices x slices blocks of a 2D
+    array, returning (xs, ys, values) arrays for the blocks with a value
+    of at least threshold, hottest first'''
+    (height, width) = data.shape
+    slices = max(1, min(slices, width, height))
+    bw = width // slices
+    bh = height // slices
+    # trailing pixels that don't fill a block are ignored
+    blocks = data[:bh*slices, :bw*slices].reshape(slices, bh, slices, bw)
+    blocks = blocks.transpose(0, 2, 1, 3).reshape(slices, slices, bh*bw)
+    idx = blocks.argmax(axis=2)
+    values = np.take_along_axis(blocks, idx[:, :, np.newaxis], axis=2)[:, :, 0]
+    (by, bx) = np.nonzero(values >= threshold)
+    if len(by) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return (empty, empty, values[by, bx])
+    idx = idx[by, bx]
+    ys = by * bh + idx // bw
+    xs = bx * bw + idx % bw
+    values = values[by, bx]
+    order = np.argsort(-values, kind='stable')
+    return (xs[order], ys[order], values[order])
+
+
+class MarkerHistory(object):
+    '''recently flagged locations, bucketed in a grid for nearby lookups'''
+    def __init__(self, min_dist, max_len):
+        self.markers = deque()
+        self.cells = {}
+        # cell size in degrees. The longitude size is set for the
+        # latitude of the first marker
+        self.lat_cell = None
+        self.lon_cell = None
+        self.min_dist = None
+        self.max_len = 0
+        self.set_limits(min_dist, max_len)
+
+    def set_limits(self, min_dist, max_len):
+        '''change separation and length limits, rebuilding if needed'''
+        max_len = int(max_len)
+        min_dist = max(float(min_dist), 1.0)
+        if min_dist == self.min_dist and max_len == self.max_len:
+            return
+        self.min_dist = min_dist
+        self.max_len = max_len
+        markers = list(self.markers)
+        self.clear()
+        for latlon in markers[-max_len:] if max_len > 0 else []:
+            self.add(latlon)
+
+    def clear(self):
+        '''forget all markers'''
+        self.markers.clear()
+        self.cells.clear()
+        self.lon_cell = None
+
+    def __len__(self):
+        return len(self.markers)
+
+    @staticmethod
+    def lon_scale(lat):
+        '''meters per degree of longitude at a latitude'''
+        return LATITUDE_SCALE * max(math.cos(math.radians(min(abs(lat), 90.0))), 1.0e-6)
+
+    def cell(self, latlon):
+        '''grid cell of a location'''
+        return (int(math.floor(latlon[0] / self.lat_cell)), int(math.floor(latlon[1] / self.lon_cell)))
+
+    def near(self, latlon):
+        '''return True if a marker is within min_dist of latlon'''
+        if self.lon_cell is None:
+            return False
+        (cn, ce) = self.cell(latlon)
+        # away from the latitude the cells were sized for a longitude
+        # cell may span less than min_dist, so search more columns
+        lon_dist = self.min_dist / self.lon_scale(abs(latlon[0]) + self.lat_cell)
+        span = int(math.ceil(lon_dist / self.lon_cell))
+        cells = self.cells
+        for dn in (-1, 0, 1):
+            for de in range(-span, span+1):
+                for (lat, lon) in cells.get((cn+dn, ce+de), ()):
+                    if mp_util.gps_distance(lat, lon, latlon[0], latlon[1]) < self.min_dist:
+                        return True
+        return False
+
+    def add(self, latlon):
+        '''add a marker, dropping the oldest if over the length limit'''
+        if self.max_len <= 0:
+            return
+        if self.lon_cell is None:
+            self.lat_cell = self.min_dist / LATITUDE_SCALE
+            self.lon_cell = self.min_dist / self.lon_scale(latlon[0])
+        self.markers.append(latlon)
+        self.cells.setdefault(self.cell(latlon), []).append(latlon)
+        while len(self.markers) > self.max_len:
+            old = self.markers.popleft()
+            key = self.cell(old)
+            bucket = self.cells[key]
+            bucket.remove(old)
+            if not bucket:
+                del self.cells[key]
+
+    def check_add(self, latlon):
+        '''return True if latlon is near a marker, otherwise add it'''
+        if self.near(latlon):
+            return True
+        self.add(latlon)
+        return False
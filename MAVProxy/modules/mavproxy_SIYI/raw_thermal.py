@@ -3,11 +3,8 @@
 from threading import Thread
 import cv2
 import os
-import socket
-import struct
 import datetime
 import math
-import zlib
 
 import time, sys
 
@@ -17,6 +14,8 @@ from MAVProxy.modules.lib.mp_image import MPImageTrackPos
 from MAVProxy.modules.lib.mp_image import MPImageFrameCounter
 from MAVProxy.modules.mavproxy_map import mp_slipmap
 from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.mavproxy_SIYI.thermal_stream import ThermalStream
+from MAVProxy.modules.mavproxy_SIYI.hotspots import find_hotspots, MarkerHistory
 import numpy as np
 
 EXPECTED_DATA_SIZE = 640 * 512 * 2
@@ -41,7 +40,7 @@ class RawThermal:
         self.tmax = -1
         self.mouse_temp = -1
         self.image_count = 0
-        self.marker_history = []
+        self.marker_history = MarkerHistory(30, 50)
         self.last_tstamp = None
 
 
@@ -80,34 +79,28 @@ class RawThermal:
 
     def fetch_loop(self):
         '''main thread'''
-        while True:
-            if self.im is None:
-                break
-            time.sleep(0.1)
-            ret = self.fetch_latest_compressed()
-            if ret is None:
+        timeout = 2.0
+        if self.siyi is not None:
+            timeout = self.siyi.siyi_settings.fetch_timeout
+        self.stream = ThermalStream(self.uri, timeout=timeout)
+        self.stream.start_threads()
+        seq = 0
+        while self.im is not None:
+            (seq, frame) = self.stream.get(seq)
+            if frame is None:
                 continue
-            (fname, tstamp, data) = ret
-            if self.last_tstamp is not None and tstamp == self.last_tstamp:
+            if self.last_tstamp is not None and frame.tstamp == self.last_tstamp:
                 continue
-            self.last_tstamp = tstamp
-            self.display_image(fname, data)
-            self.save_image(fname, tstamp, data)
+            self.last_tstamp = frame.tstamp
+            self.display_image(frame.fname, frame.data)
+            self.save_image(frame.fname, frame.tstamp, frame.raw)
+        self.stream.stop()
 
     def in_history(self, latlon):
-        '''check if latlon in the history'''
-        autoflag_dist = self.siyi.siyi_settings.autoflag_dist
-        for (lat1,lon1) in self.marker_history:
-            dist = mp_util.gps_distance(lat1,lon1,latlon[0],latlon[1])
-            if dist < autoflag_dist:
-                return True
-
-        # add to history
-        self.marker_history.append(latlon)
-        if len(self.marker_history) > self.siyi.siyi_settings.autoflag_history:
-            self.marker_history.pop(0)
-        return False
-
+        '''check if latlon in the history, adding it if not'''
+        settings = self.siyi.siyi_settings
+        self.marker_history.set_limits(settings.autoflag_dist, settings.autoflag_history)
+        return self.marker_history.check_add(latlon)
 
     def handle_auto_flag(self):
         if not self.siyi.siyi_settings.autoflag_enable or self.siyi.have_DATA96:
@@ -121,33 +114,26 @@ class RawThermal:
 
         width = self.res[0]
         height = self.res[1]
-        latlonalt = self.xy_to_latlon(width//2, height//2)
-        if latlonalt is None:
-            return
-        slices = self.siyi.siyi_settings.autoflag_slices
-        slice_width = width // slices
-        slice_height = height // slices
-
         data = self.last_data.reshape(height, width)
+        threshold = self.siyi.siyi_settings.autoflag_temp + C_TO_KELVIN
+        (xs, ys, values) = find_hotspots(data, threshold, self.siyi.siyi_settings.autoflag_slices)
+        if len(xs) == 0:
+            return
 
-        for sx in range(slices):
-            for sy in range(slices):
-                sub = data[sx*slice_width:(sx+1)*slice_width, sy*slice_height:(sy+1)*slice_height]
-                maxv = sub.max() - C_TO_KELVIN
-                if maxv < self.siyi.siyi_settings.autoflag_temp:
-                    continue
-                X = (sx*slice_width) + slice_width//2
-                Y = (sy*slice_height) + slice_height//2
-                latlonalt = self.xy_to_latlon(X, Y)
-                if latlonalt is None:
-                    continue
-                latlon = (latlonalt[0], latlonalt[1])
-                if self.in_history(latlon):
-                    continue
-                map.cmd_map_marker(["flame"], latlon=latlon)
+        # project all hotspots with one camera pose
+        aspect_ratio = float(width) / height
+        xs = (2 * (xs + 0.5) / float(width)) - 1.0
+        ys = (2 * (ys + 0.5) / float(height)) - 1.0
+        for latlonalt in self.siyi.get_latlonalt_list(xs.tolist(), ys.tolist(), self.FOV, aspect_ratio):
+            if latlonalt is None:
+                continue
+            latlon = (latlonalt[0], latlonalt[1])
+            if self.in_history(latlon):
+                continue
+            map.cmd_map_marker(["flame"], latlon=latlon)
 
     def display_image(self, fname, data):
-        '''display an image'''
+        '''display an image, from bytes or an array of big-endian uint16'''
         a = np.frombuffer(data, dtype='>u2')
         if len(a) != 640 * 512:
             print("Bad size %u" % len(a))
@@ -181,84 +167,6 @@ class RawThermal:
         self.image_count += 1
         self.update_title()
             
-    def decompress_zlib_buffer(self, compressed_buffer):
-        try:
-            # Decompress the buffer using zlib
-            uncompressed_buffer = zlib.decompress(compressed_buffer)
-            return uncompressed_buffer
-        except zlib.error as e:
-            # Handle any errors during decompression
-            return None
-
-    def fetch_latest_compressed(self):
-        '''fetch a compressed thermal image'''
-        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        timeout = self.siyi.siyi_settings.fetch_timeout
-        if timeout >= 0:
-            tcp.settimeout(2)
-        try:
-            tcp.connect(self.uri)
-        except Exception:
-            return None
-        buf = bytearray()
-
-        while True:
-            try:
-                b = tcp.recv(1024)
-            except Exception:
-                break
-            if not b:
-                break
-            buf += b
-
-        header_len = 128 + 12
-        if len(buf) < header_len:
-            return None
-
-        fname = buf[:128].decode("utf-8").strip('\x00')
-        compressed_size,tstamp = struct.unpack("<Id", buf[128:128+12])
-
-        compressed_data = buf[header_len:]
-
-        if compressed_size != len(compressed_data):
-            return None
-
-        uncompressed_data = self.decompress_zlib_buffer(compressed_data)
-
-        if len(uncompressed_data) != EXPECTED_DATA_SIZE:
-            return None
-
-        return fname, tstamp, uncompressed_data
-
-    def fetch_latest(self):
-        '''fetch a thermal image'''
-        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        timeout = self.siyi.siyi_settings.fetch_timeout
-        if timeout >= 0:
-            tcp.settimeout(2)
-        try:
-            tcp.connect(self.uri)
-        except Exception:
-            return None
-        buf = bytearray()
-
-        while True:
-            try:
-                b = tcp.recv(1024)
-            except Exception:
-                break
-            if not b:
-                break
-            buf += b
-
-        if len(buf) != 128 + 8 + EXPECTED_DATA_SIZE:
-            return None
-
-        fname = buf[:128].decode("utf-8").strip('\x00')
-        tstamp, = struct.unpack("<d", buf[128:128+8])
-        data = buf[128+8:]
-        return fname, tstamp, data
-
     def save_image(self, fname, tstamp, data):
         '''same thermal image in thermal/ directory'''
         fname = os.path.basename(fname)[:-4]
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+'''
+streaming client for SIYI raw thermal frames
+
+Each frame is a 128 byte NUL padded filename, then for compressed frames
+a uint32 compressed size and a double timestamp followed by zlib data,
+or for uncompressed frames a double timestamp followed by 640x512
+big-endian uint16 pixels.
+
+The connection is kept open for as long as the server keeps sending
+frames, and re-opened if the server closes it after each frame. Data is
+received into a preallocated buffer and frames are parsed from it as
+they complete. Decompression is done on a worker thread, which only
+ever works on the newest frame, dropping frames it can't keep up with.
+'''
+
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+EXPECTED_DATA_SIZE = 640 * 512 * 2
+NAME_LEN = 128
+COMPRESSED_HEADER = struct.Struct("<Id")
+RAW_HEADER = struct.Struct("<d")
+# refuse frames claiming to be larger than this
+MAX_FRAME_SIZE = 4 * EXPECTED_DATA_SIZE
+
+
+class ThermalFrame(object):
+    '''a received frame. data is a numpy view of the pixels as
+    big-endian uint16, raw the bytes it views'''
+    def __init__(self, fname, tstamp, raw):
+        self.fname = fname
+        self.tstamp = tstamp
+        self.raw = raw
+        self.data = np.frombuffer(raw, dtype='>u2')
+
+
+class ThermalStream(object):
+    '''long-lived client for a thermal frame server'''
+    def __init__(self, uri, compressed=True, timeout=2.0, reconnect_interval=0.1, buffer_size=2*EXPECTED_DATA_SIZE):
+        self.uri = uri
+        self.compressed = compressed
+        self.timeout = timeout
+        # servers which send one frame per connection are polled at
+        # most this often
+        self.reconnect_interval = reconnect_interval
+        self.last_connect = 0
+        if compressed:
+            self.header_len = NAME_LEN + COMPRESSED_HEADER.size
+        else:
+            self.header_len = NAME_LEN + RAW_HEADER.size
+        self.buf = bytearray(buffer_size)
+        self.start = 0
+        self.end = 0
+        self.sock = None
+        self.running = False
+        self.cond = threading.Condition()
+        self.pending = None
+        self.latest = None
+        self.latest_seq = 0
+        self.connections = 0
+        self.frames = 0
+        self.decoded = 0
+        self.dropped = 0
+        self.repeated = 0
+        self.last_tstamp = None
+        self.errors = 0
+        self.bytes = 0
+        self.reader = None
+        self.worker = None
+
+    def start_threads(self):
+        '''start receiving frames'''
+        if self.running:
+            return
+        self.running = True
+        self.reader = threading.Thread(target=self.read_loop, name='thermal_read')
+        self.reader.daemon = True
+        self.reader.start()
+        self.worker = threading.Thread(target=self.decode_loop, name='thermal_decode')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def stop(self):
+        '''stop receiving frames'''
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def connect(self):
+        '''open a connection, returning False on failure'''
+        dt = time.time() - self.last_connect
+        if dt < self.reconnect_interval:
+            time.sleep(self.reconnect_interval - dt)
+        self.last_connect = time.time()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.timeout >= 0:
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.uri)
+        except Exception:
+            sock.close()
+            return False
+        self.sock = sock
+        self.start = 0
+        self.end = 0
+        self.connections += 1
+        return True
+
+    def make_room(self, need):
+        '''make room for need bytes from the start of unparsed data'''
+        if self.start > 0 and self.start == self.end:
+            self.start = 0
+            self.end = 0
+        if self.start + need <= len(self.buf) and self.end < len(self.buf):
+            return
+        # move unparsed data to the front of the buffer
+        n = self.end - self.start
+        self.buf[0:n] = self.buf[self.start:self.end]
+        self.start = 0
+        self.end = n
+        if need > len(self.buf):
+            self.buf.extend(bytes(need - len(self.buf)))
+
+    def read_loop(self):
+        '''receive and parse frames'''
+        while self.running:
+            if self.sock is None and not self.connect():
+                time.sleep(0.5)
+                continue
+            if not self.running:
+                break
+            need = self.header_len
+            try:
+                with memoryview(self.buf) as mv:
+                    n = self.sock.recv_into(mv[self.end:])
+            except socket.timeout:
+                n = -1
+            except OSError:
+                n = 0
+            if n > 0:
+                self.end += n
+                self.bytes += n
+                need = self.parse()
+            if n <= 0 or need is None:
+                # server finished with this connection, or sent bad data
+                if self.end != self.start:
+                    self.errors += 1
+                self.sock.close()
+                self.sock = None
+                continue
+            self.make_room(need)
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def parse(self):
+        '''parse complete frames, returning the number of bytes needed for
+        the next frame, or None on bad data'''
+        buf = self.buf
+        while True:
+            avail = self.end - self.start
+            if avail < self.header_len:
+                return self.header_len
+            ofs = self.start
+            if self.compressed:
+                (size, tstamp) = COMPRESSED_HEADER.unpack_from(buf, ofs + NAME_LEN)
+                if size > MAX_FRAME_SIZE:
+                    return None
+            else:
+                (tstamp,) = RAW_HEADER.unpack_from(buf, ofs + NAME_LEN)
+                size = EXPECTED_DATA_SIZE
+            total = self.header_len + size
+            if avail < total:
+                return total
+            with memoryview(buf) as mv:
+                fname = bytes(mv[ofs:ofs+NAME_LEN]).split(b'\x00')[0].decode("utf-8", errors="replace")
+                payload = bytes(mv[ofs+self.header_len:ofs+total])
+            self.start += total
+            self.frames += 1
+            if tstamp == self.last_tstamp:
+                # servers sending one frame per connection send the
+                # latest frame again if there is no new one
+                self.repeated += 1
+                continue
+            self.last_tstamp = tstamp
+            with self.cond:
+                if self.pending is not None:
+                    self.dropped += 1
+                self.pending = (fname, tstamp, payload)
+                self.cond.notify_all()
+
+    def decode_loop(self):
+        '''decompress the newest frame'''
+        while self.running:
+            with self.cond:
+                while self.pending is None and self.running:
+                    self.cond.wait(0.5)
+                if not self.running:
+                    break
+                (fname, tstamp, payload) = self.pending
+                self.pending = None
+            if self.compressed:
+                try:
+                    payload = zlib.decompress(payload)
+                except zlib.error:
+                    self.errors += 1
+                    continue
+            if len(payload) != EXPECTED_DATA_SIZE:
+                self.errors += 1
+                continue
+            frame = ThermalFrame(fname, tstamp, payload)
+            with self.cond:
+                self.latest = frame
+                self.latest_seq += 1
+                self.decoded += 1
+                self.cond.notify_all()
+
+    def get(self, last_seq=0, timeout=0.5):
+        '''wait for a frame newer than last_seq, returning (seq, frame) or
+        (last_seq, None) on timeout'''
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.latest_seq == last_seq and self.running:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return (last_seq, None)
+                self.cond.wait(remaining)
+            if self.latest_seq == last_seq:
+                return (last_seq, None)
+            return (self.latest_seq, self.latest)
+
+    def status(self):
+        '''return status string'''
+        return "connections:%u frames:%u repeated:%u decoded:%u dropped:%u errors:%u %.1fMB" % (
+            self.connections, self.frames, self.repeated, self.decoded, self.dropped, self.errors, self.bytes / 1.0e6)
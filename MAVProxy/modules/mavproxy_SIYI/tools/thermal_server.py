@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+'''
+stand-in SIYI raw thermal frame server, for testing the raw thermal
+view without a camera. Serves synthetic frames with a moving hot spot,
+or replays .bin frames saved by the raw thermal view
+'''
+
+import glob
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from argparse import ArgumentParser
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("--port", default=7345, type=int, help="TCP port")
+parser.add_argument("--rate", default=10.0, type=float, help="frame rate")
+parser.add_argument("--raw", action='store_true', help="send uncompressed frames")
+parser.add_argument("--oneshot", action='store_true', help="send one frame per connection, as the camera does")
+parser.add_argument("--dir", default=None, type=str, help="directory of .bin frames to replay")
+args = parser.parse_args()
+
+WIDTH = 640
+HEIGHT = 512
+C_TO_KELVIN = 273.15
+
+
+def synthetic_frame(n):
+    '''make a frame with a hot spot moving across a 20C background'''
+    a = np.full((HEIGHT, WIDTH), (20 + C_TO_KELVIN) * 64, dtype=np.float64)
+    x = (n * 7) % WIDTH
+    y = (n * 3) % HEIGHT
+    a[max(y-8, 0):y+8, max(x-8, 0):x+8] = (150 + C_TO_KELVIN) * 64
+    a += np.random.randint(0, 64, a.shape)
+    return a.astype('>u2').tobytes()
+
+
+if args.dir is not None:
+    frames = [open(f, 'rb').read() for f in sorted(glob.glob(os.path.join(args.dir, '*.bin')))]
+    print("Loaded %u frames" % len(frames))
+else:
+    # precompute frames so high frame rates can be served
+    frames = [synthetic_frame(n) for n in range(64)]
+if not args.raw:
+    frames = [zlib.compress(data, 1) for data in frames]
+
+
+def encode_frame(n):
+    '''encode frame number n for sending'''
+    data = frames[n % len(frames)]
+    fname = ("frame%06u.bin" % n).encode("utf-8").ljust(128, b'\0')
+    tstamp = time.time()
+    if args.raw:
+        return fname + struct.pack("<d", tstamp) + data
+    return fname + struct.pack("<Id", len(data), tstamp) + data
+
+
+class FrameSource(object):
+    '''produce frames at the frame rate, shared by all clients'''
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        while True:
+            frame = encode_frame(self.seq)
+            with self.cond:
+                self.frame = frame
+                self.seq += 1
+                self.cond.notify_all()
+            time.sleep(1.0 / args.rate)
+
+    def wait(self, seq):
+        '''wait for a frame after seq'''
+        with self.cond:
+            while self.seq == seq:
+                self.cond.wait()
+            return (self.seq, self.frame)
+
+
+def serve_client(conn, source):
+    '''send frames to one client'''
+    seq = 0
+    try:
+        while True:
+            (seq, frame) = source.wait(seq)
+            conn.sendall(frame)
+            if args.oneshot:
+                break
+    except OSError:
+        pass
+    conn.close()
+
+
+source = FrameSource()
+listen = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+listen.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+listen.bind(('', args.port))
+listen.listen(4)
+print("Serving %s frames on port %u at %.1f Hz" % ("raw" if args.raw else "compressed", args.port, args.rate))
+while True:
+    (conn, addr) = listen.accept()
+    thread = threading.Thread(target=serve_client, args=(conn, source))
+    thread.daemon = True
+    thread.start()
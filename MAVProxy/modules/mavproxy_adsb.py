@@ -6,9 +6,11 @@ Dec 2015
 
 from math import *
 
+import numpy as np
+
+from MAVProxy.modules.lib import adsb_tracks
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_settings
-from MAVProxy.modules.lib import mp_util
 from pymavlink import mavutil
 from PIL import ImageColor
 
@@ -82,7 +84,7 @@ def get_internal_emitter(trkn):
         return 99        # dummy it for now
 
 class ADSBVehicle(object):
-    '''a generic ADS-B threat'''
+    '''a generic ADS-B threat. Position and threat state are held in the ADSBModule track table'''
 
     def __init__(self, id, state):
         self.id = id
@@ -90,16 +92,15 @@ class ADSBVehicle(object):
         self.vehicle_colour = 'green'  # use plane icon for now
         self.vehicle_type = 'plane'
         self.icon = self.vehicle_colour + self.vehicle_type + '.png'
-        self.update_time = 0
-        self.is_evading_threat = False
-        self.v_distance = None
-        self.h_distance = None
-        self.distance = None
+        self.emitter_type = 0
+        self.on_map = False
+        self.displayed = None
+        self.changed = True
 
-    def update(self, state, tnow):
+    def update(self, state):
         '''update the threat state'''
         self.state = state
-        self.update_time = tnow
+        self.changed = True
 
 
 class ADSBModule(mp_module.MPModule):
@@ -107,6 +108,7 @@ class ADSBModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(ADSBModule, self).__init__(mpstate, "adsb", "ADS-B data support", public = True)
         self.threat_vehicles = {}
+        self.tracks = adsb_tracks.TrackTable()
         self.active_threat_ids = []  # holds all threat ids the vehicle is evading
 
         self.add_command('adsb', self.cmd_ADSB, "adsb control",
@@ -123,201 +125,240 @@ class ADSBModule(mp_module.MPModule):
                                                      ("alt_color1", str, "blue"),
                                                      ("alt_color2", str, "red"),
                                                      ("alt_color_alt_thresh", int, 300),
-                                                     ("alt_color_dist_thresh", int, 3000)])
+                                                     ("alt_color_dist_thresh", int, 3000),
+                                                     # seconds ahead to look for a closest approach within threat_radius, 0 to disable
+                                                     ("cpa_horizon", int, 0)])
         self.add_completion_function('(ADSBSETTING)',
                                      self.ADSB_settings.completion)
-        
+
         self.threat_detection_timer = mavutil.periodic_event(2)
         self.threat_timeout_timer = mavutil.periodic_event(2)
+        self.map_update_timer = mavutil.periodic_event(5)
         self.tnow = self.get_time()
         self.last_traffic = self.tnow
 
+        # distances to the nearest of our vehicles, and closest approach, per track row
+        self.distance = np.zeros(0)
+        self.h_distance = np.zeros(0)
+        self.v_distance = np.zeros(0)
+        self.cpa_time = np.zeros(0)
+        self.cpa_distance = np.zeros(0)
+
     def cmd_ADSB(self, args):
         '''adsb command parser'''
-        usage = "usage: adsb <set>"
+        usage = "usage: adsb <status|set>"
         if len(args) == 0:
             print(usage)
             return
         if args[0] == "status":
+            self.update_threat_distances()
             print("total threat count: %u  active threat count: %u" %
                   (len(self.threat_vehicles), len(self.active_threat_ids)))
 
-            for id in self.threat_vehicles.keys():
-                print("id: %s  distance: %.2f m callsign: %s  alt: %.2f" % (id,
-                                                                            self.threat_vehicles[id].distance,
-                                                                            self.threat_vehicles[id].state['callsign'],
-                                                                            self.threat_vehicles[id].state['altitude']))
+            for (row, id) in enumerate(self.tracks.ids):
+                print("id: %s  distance: %.2f m callsign: %s  alt: %.2f  cpa: %.1f m in %.1f s" % (
+                    id, self.distance[row], self.threat_vehicles[id].state.callsign,
+                    self.tracks.alt[row], self.cpa_distance[row], self.cpa_time[row]))
         elif args[0] == "set":
             self.ADSB_settings.command(args[1:])
         else:
             print(usage)
 
+    def our_vehicles(self):
+        '''return arrays of lat, lon, alt and NED velocity for all of our vehicles with a position'''
+        positions = {}
+        for master in self.mpstate.mav_master:
+            for (sysid, state) in master.sysid_state.items():
+                GPI = state.messages.get("GLOBAL_POSITION_INT", None)
+                if GPI is None or (GPI.lat == 0 and GPI.lon == 0):
+                    continue
+                if sysid not in positions or GPI._timestamp > positions[sysid]._timestamp:
+                    positions[sysid] = GPI
+        a = np.array([(m.lat * 1.0e-7, m.lon * 1.0e-7, m.alt * 0.001, m.vx * 0.01, m.vy * 0.01, m.vz * 0.01)
+                      for m in positions.values()]).reshape(-1, 6)
+        return a.T
+
+    def update_threat_distances(self):
+        '''update the distance and closest approach between all threats and the nearest of our vehicles'''
+        t = self.tracks
+        n = len(t)
+        (lat, lon, alt, vn, ve, vd) = self.our_vehicles()
+        self.distance = np.full(n, np.nan)
+        self.h_distance = np.full(n, np.nan)
+        self.v_distance = np.full(n, np.nan)
+        self.cpa_time = np.full(n, np.nan)
+        self.cpa_distance = np.full(n, np.nan)
+        if n == 0 or len(lat) == 0:
+            return
+
+        # tracks down the rows, our vehicles across the columns
+        h_distance = adsb_tracks.haversine_distance(t.lat[:, None], t.lon[:, None], lat[None, :], lon[None, :])
+        v_distance = t.alt[:, None] - alt[None, :]
+        distance = np.hypot(h_distance, v_distance)
+        nearest = np.argmin(distance, axis=1)
+        rows = np.arange(n)
+        self.h_distance = h_distance[rows, nearest]
+        self.v_distance = v_distance[rows, nearest]
+        self.distance = distance[rows, nearest]
+
+        north = (t.lat[:, None] - lat[None, :]) * adsb_tracks.DEG_TO_M
+        east = (t.lon[:, None] - lon[None, :]) * adsb_tracks.DEG_TO_M * np.cos(np.radians(lat))[None, :]
+        (cpa_time, cpa_distance) = adsb_tracks.closest_approach(north, east, -v_distance,
+                                                                t.vn[:, None] - vn[None, :],
+                                                                t.ve[:, None] - ve[None, :],
+                                                                t.vd[:, None] - vd[None, :],
+                                                                max(self.ADSB_settings.cpa_horizon, 0))
+        nearest = np.argmin(cpa_distance, axis=1)
+        self.cpa_time = cpa_time[rows, nearest]
+        self.cpa_distance = cpa_distance[rows, nearest]
+
     def perform_threat_detection(self):
         '''determine threats'''
-        # TODO: perform more advanced threat detection
-        threat_radius_clear = self.ADSB_settings.threat_radius * \
-            self.ADSB_settings.threat_radius_clear_multiplier
-
-        for id in self.threat_vehicles.keys():
-            if self.threat_vehicles[id].distance is not None:
-                if self.threat_vehicles[id].distance <= self.ADSB_settings.threat_radius and not self.threat_vehicles[id].is_evading_threat:
-                    # if the threat is in the threat radius and not currently
-                    # known to the module...
-                    # set flag to action threat
-                    self.threat_vehicles[id].is_evading_threat = True
-
-                if self.threat_vehicles[id].distance > threat_radius_clear and self.threat_vehicles[id].is_evading_threat:
-                    # if the threat is known to the module and outside the
-                    # threat clear radius...
-                    # clear flag to action threat
-                    self.threat_vehicles[id].is_evading_threat = False
-
-        self.active_threat_ids = [id for id in self.threat_vehicles.keys(
-        ) if self.threat_vehicles[id].is_evading_threat]
-
-    def update_threat_distances(self, latlonalt):
-        '''update the distance between threats and vehicle'''
-        for id in self.threat_vehicles.keys():
-            threat_latlonalt = (self.threat_vehicles[id].state['lat'] * 1e-7,
-                                self.threat_vehicles[id].state['lon'] * 1e-7,
-                                self.threat_vehicles[id].state['altitude'])
-
-            self.threat_vehicles[id].h_distance = self.get_h_distance(latlonalt, threat_latlonalt)
-            self.threat_vehicles[id].v_distance = self.get_v_distance(latlonalt, threat_latlonalt)
-
-            # calculate and set the total distance between threat and vehicle
-            self.threat_vehicles[id].distance = sqrt(
-                self.threat_vehicles[id].h_distance**2 + (self.threat_vehicles[id].v_distance)**2)
-
-    def get_h_distance(self, latlonalt1, latlonalt2):
-        '''get the horizontal distance between threat and vehicle'''
-        (lat1, lon1, alt1) = latlonalt1
-        (lat2, lon2, alt2) = latlonalt2
-
-        lat1 = radians(lat1)
-        lon1 = radians(lon1)
-        lat2 = radians(lat2)
-        lon2 = radians(lon2)
-
-        dLat = lat2 - lat1
-        dLon = lon2 - lon1
-
-        # math as per mavextra.distance_two()
-        a = sin(0.5 * dLat)**2 + sin(0.5 * dLon)**2 * cos(lat1) * cos(lat2)
-        c = 2.0 * atan2(sqrt(a), sqrt(1.0 - a))
-        return 6371 * 1000 * c
-
-    def get_v_distance(self, latlonalt1, latlonalt2):
-        '''get the horizontal distance between threat and vehicle'''
-        (lat1, lon1, alt1) = latlonalt1
-        (lat2, lon2, alt2) = latlonalt2
-        return alt2 - alt1
+        self.update_threat_distances()
+        threat_radius = self.ADSB_settings.threat_radius
+        threat_radius_clear = threat_radius * self.ADSB_settings.threat_radius_clear_multiplier
+
+        evading = self.tracks.evading
+        known = ~np.isnan(self.distance)
+        inside = known & (self.distance <= threat_radius)
+        if self.ADSB_settings.cpa_horizon > 0:
+            # also treat as a threat anything that will come within the threat radius
+            inside |= known & (self.cpa_distance <= threat_radius)
+        # set flag to action threats inside the threat radius, and clear it once outside the clear radius
+        evading |= inside
+        evading &= ~(known & (self.distance > threat_radius_clear) & ~inside)
+
+        self.active_threat_ids = [self.tracks.ids[i] for i in np.flatnonzero(evading)]
+
+    def tracks_in_range(self, lat, lon, radius):
+        '''return ids of threats within radius metres of a position'''
+        return self.tracks.in_range(lat, lon, radius)
 
     def check_threat_timeout(self):
         '''check and handle threat time out'''
-        for id in self.threat_vehicles.keys():
-            if self.threat_vehicles[id].update_time == 0:
-                self.threat_vehicles[id].update_time = self.get_time()
-            dt = self.get_time() - self.threat_vehicles[id].update_time
-            if dt > self.ADSB_settings.timeout:
-                # if the threat has timed out...
-                del self.threat_vehicles[id]  # remove the threat from the dict
-                for mp in self.module_matching('map*'):
-                    # remove the threat from the map
-                    mp.map.remove_object(id)
-                    mp.map.remove_object(id+":circle")
-                # we've modified the dict we're iterating over, so
-                # we'll get any more timed-out threats next time we're
-                # called:
-                return
-
-    def add_vehicle(self, state):
-        '''handle an incoming vehicle packet'''
-        id = 'ADSB-' + str(state['ICAO_address'])
-        lat = state['lat']
-        lon = state['lon']
-        altitude_km = state['altitude']
-        callsign = state['callsign']
-        heading = state['heading']
+        expired = self.get_time() - self.tracks.update_time > self.ADSB_settings.timeout
+        for id in self.tracks.remove(expired):
+            del self.threat_vehicles[id]  # remove the threat from the dict
+            for mp in self.module_matching('map*'):
+                # remove the threat from the map
+                mp.map.remove_object(id)
+                mp.map.remove_object(id+":circle")
+
+    def add_vehicle(self, m):
+        '''handle an incoming ADSB_VEHICLE packet'''
+        id = 'ADSB-' + str(m.ICAO_address)
         # OBC test framework reserves specific ICAO bands for synthetic
         # obstacles (drones/aircraft/birds/clouds) and maps them to
         # internal emitter types via get_internal_emitter(); for real
         # ADSB addresses (0x004000..0x9FFFFF) trust the supplied
         # emitter_type so we don't render every live aircraft as the
         # placeholder "flag" icon.
-        icao = state['ICAO_address']
+        icao = m.ICAO_address
         if icao <= 0x003FFF or icao >= 0xA00000:
             emitter_type = get_internal_emitter(icao)
         else:
-            emitter_type = state.get('emitter_type', 0) or 0
-        squawk = state['squawk']
+            emitter_type = getattr(m, 'emitter_type', 0) or 0
 
-        if id not in self.threat_vehicles.keys():  # check to see if the vehicle is in the dict
-            #print("NEW: ", state)
+        vehicle = self.threat_vehicles.get(id, None)
+        if vehicle is None:  # check to see if the vehicle is in the dict
             # if not then add it
-            self.threat_vehicles[id] = ADSBVehicle(id=id, state=state)
-            #print("NEW: ", state)
-            for mp in self.module_matching('map*'):
-                from MAVProxy.modules.lib import mp_menu
-                from MAVProxy.modules.mavproxy_map import mp_slipmap
-                self.threat_vehicles[id].menu_item = mp_menu.MPMenuItem(name=id, returnkey=None)
-
-                threat_radius = get_threat_radius(emitter_type, squawk)
-                selected_icon = get_threat_icon(emitter_type, self.threat_vehicles[id].icon)
-                    
-                if selected_icon is not None:
-                    #print("map add ", state)
-                    # draw the vehicle on the map
-                    popup = mp_menu.MPMenuSubMenu('ADSB', items=[self.threat_vehicles[id].menu_item])
-                    icon = mp.map.icon(selected_icon)
-                    mp.map.add_object(mp_slipmap.SlipIcon(id, (lat * 1e-7, lon * 1e-7),
-                                                        icon, layer=3, rotation=heading*0.01, follow=False,
-                                                        trail=mp_slipmap.SlipTrail(colour=(0, 255, 255)),
-                                                        popup_menu=popup))
-                if threat_radius > 0:
-                    mp.map.add_object(mp_slipmap.SlipCircle(id+":circle", 3,
-                                                        (lat * 1e-7, lon * 1e-7),
-                                                        threat_radius, (0, 255, 255), linewidth=1))
+            vehicle = ADSBVehicle(id=id, state=m)
+            self.threat_vehicles[id] = vehicle
         else:  # the vehicle is in the dict
             # update the dict entry
-            self.threat_vehicles[id].update(state, self.get_time())
-
-        for mp in self.module_matching('map*'):
-            # update the map, labelling alt above/below our alt
-            GPI = self.master.messages.get("GLOBAL_POSITION_INT", None)
-            if GPI is None:
-                return
-            ref_alt = GPI.alt*0.001
-            lat_deg = lat * 1.0e-7
-            lon_deg = lon * 1.0e-7
-            our_lat_deg = GPI.lat*1.0e-7
-            our_lon_deg = GPI.lon*1.0e-7
-
-            dist = mp_util.gps_distance(our_lat_deg, our_lon_deg, lat_deg, lon_deg)
-            alt_amsl = altitude_km * 0.001
-            color = ImageColor.getrgb(self.ADSB_settings.alt_color1)
+            vehicle.update(m)
+        vehicle.emitter_type = emitter_type
+
+        heading = radians(m.heading * 0.01)
+        speed = m.hor_velocity * 0.01
+        height = get_threat_height(emitter_type)
+        self.tracks.update(id,
+                           lat=m.lat * 1.0e-7,
+                           lon=m.lon * 1.0e-7,
+                           alt=m.altitude * 0.001,
+                           vn=speed * cos(heading),
+                           ve=speed * sin(heading),
+                           vd=-m.ver_velocity * 0.01,
+                           update_time=self.get_time(),
+                           radius=get_threat_radius(emitter_type, m.squawk),
+                           height=height if height is not None else inf)
+
+    def add_to_map(self, mp, vehicle, row):
+        '''draw a new threat on the map'''
+        from MAVProxy.modules.lib import mp_menu
+        from MAVProxy.modules.mavproxy_map import mp_slipmap
+        id = vehicle.id
+        latlon = (self.tracks.lat[row], self.tracks.lon[row])
+        vehicle.menu_item = mp_menu.MPMenuItem(name=id, returnkey=None)
+
+        threat_radius = self.tracks.radius[row]
+        selected_icon = get_threat_icon(vehicle.emitter_type, vehicle.icon)
+
+        if selected_icon is not None:
+            # draw the vehicle on the map
+            popup = mp_menu.MPMenuSubMenu('ADSB', items=[vehicle.menu_item])
+            icon = mp.map.icon(selected_icon)
+            mp.map.add_object(mp_slipmap.SlipIcon(id, latlon,
+                                                  icon, layer=3, rotation=vehicle.state.heading*0.01, follow=False,
+                                                  trail=mp_slipmap.SlipTrail(colour=(0, 255, 255)),
+                                                  popup_menu=popup))
+        if threat_radius > 0:
+            mp.map.add_object(mp_slipmap.SlipCircle(id+":circle", 3,
+                                                    latlon,
+                                                    threat_radius, (0, 255, 255), linewidth=1))
+
+    def update_map(self):
+        '''update the map for threats whose displayed position, label or colour has changed'''
+        maps = self.module_matching('map*')
+        if not maps or len(self.tracks) == 0:
+            return
+        t = self.tracks
+        # label alt above/below our alt, and colour threats near us
+        GPI = self.master.messages.get("GLOBAL_POSITION_INT", None)
+        alt_amsl = t.alt
+        if GPI is not None:
+            rel_alt = (alt_amsl - GPI.alt*0.001).astype(int)
+            dist = adsb_tracks.haversine_distance(GPI.lat*1.0e-7, GPI.lon*1.0e-7, t.lat, t.lon)
+            near = (alt_amsl > 0) & (dist < t.radius) & (np.abs(rel_alt) < t.height)
+            if near.any():
+                tnow = self.get_time()
+                if self.ADSB_settings.traffic_warning and tnow - self.last_traffic > 5:
+                    self.last_traffic = tnow
+                    self.say("traffic")
+        color1 = ImageColor.getrgb(self.ADSB_settings.alt_color1)
+        color2 = ImageColor.getrgb(self.ADSB_settings.alt_color2)
+
+        for (row, id) in enumerate(t.ids):
+            vehicle = self.threat_vehicles[id]
+            if not vehicle.changed and GPI is None:
+                continue
+            emitter_type = vehicle.emitter_type
+            color = color1
             label = ""
             if self.ADSB_settings.show_callsign and (emitter_type < 14 or emitter_type == 100 or emitter_type == 101):
-                label = "[%s] " % callsign.rstrip()
-            if alt_amsl > 0:
-                alt = int(alt_amsl - ref_alt)
-                label += self.height_string(alt)
-                label += " (AMSL: %s) " % self.height_string(alt_amsl)
-                if abs(dist) < get_threat_radius(emitter_type, squawk) and abs(alt) < get_threat_height(emitter_type):
-                    tnow = self.get_time()
-                    if self.ADSB_settings.traffic_warning and tnow - self.last_traffic > 5:
-                        self.last_traffic = tnow
-                        self.say("traffic")
-                    color = ImageColor.getrgb(self.ADSB_settings.alt_color2)
-
-            mp.map.set_position(id, (lat_deg, lon_deg), rotation=heading*0.01, label=label, colour=color)
-            mp.map.set_position(id+":circle", (lat_deg, lon_deg))
+                label = "[%s] " % vehicle.state.callsign.rstrip()
+            if GPI is not None and alt_amsl[row] > 0:
+                label += self.height_string(rel_alt[row])
+                label += " (AMSL: %s) " % self.height_string(alt_amsl[row])
+                if near[row]:
+                    color = color2
+            displayed = (t.lat[row], t.lon[row], vehicle.state.heading, label, color)
+            vehicle.changed = False
+            if displayed == vehicle.displayed:
+                continue
+            vehicle.displayed = displayed
+            for mp in maps:
+                if not vehicle.on_map:
+                    self.add_to_map(mp, vehicle, row)
+                mp.map.set_position(id, (t.lat[row], t.lon[row]), rotation=vehicle.state.heading*0.01,
+                                    label=label, colour=color)
+                mp.map.set_position(id+":circle", (t.lat[row], t.lon[row]))
+            vehicle.on_map = True
 
     def mavlink_packet(self, m):
         '''handle an incoming mavlink packet'''
         if m.get_type() == "ADSB_VEHICLE":
-            state = m.to_dict()
-            self.add_vehicle(state)
+            self.add_vehicle(m)
 
     def idle_task(self):
         '''called on idle'''
@@ -329,6 +370,9 @@ class ADSBModule(mp_module.MPModule):
             # TODO: possibly evade detected threats with ids in
             # self.active_threat_ids
 
+        if self.map_update_timer.trigger():
+            self.update_map()
+
 
 def init(mpstate):
     '''initialise module'''
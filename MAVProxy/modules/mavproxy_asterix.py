@@ -5,8 +5,12 @@ This listens for SDPS on UDP and translates to ADSB_VEHICLE messages
 '''
 
 import pickle
+from collections import OrderedDict, deque
 from math import *
 
+import numpy as np
+
+from MAVProxy.modules.lib import adsb_tracks
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_settings
 from MAVProxy.modules.lib import mp_util
@@ -48,6 +52,68 @@ class VehiclePos(object):
         self.alt = GPI.alt * 1.0e-3
         self.vx = GPI.vx * 1.0e-2
         self.vy = GPI.vy * 1.0e-2
+        self.time = time.time()
+
+class LinkPacer(object):
+    '''paces ADSB_VEHICLE messages to one link, holding only the newest pending message per target'''
+    def __init__(self):
+        self.pending = {}
+        # time each target was last sent on this link, or first queued if not yet sent
+        self.last_sent = {}
+        self.tokens = 0.0
+        self.last_time = None
+        self.replaced = 0
+        self.expired = 0
+
+    def add(self, icao_address, priority, recv_time, pkt):
+        if icao_address in self.pending:
+            self.replaced += 1
+        self.pending[icao_address] = (priority, recv_time, pkt)
+        if icao_address not in self.last_sent:
+            self.last_sent[icao_address] = recv_time
+
+    def due(self, rate, tnow, max_age):
+        '''return list of (recv_time, pkt) to send now, favouring close targets and those not sent
+        for a while, so every target is sent eventually. Messages received more than max_age
+        seconds ago are dropped'''
+        for k in [k for (k, v) in self.pending.items() if tnow - v[1] > max_age]:
+            del self.pending[k]
+            self.expired += 1
+        for k in [k for (k, t) in self.last_sent.items() if k not in self.pending and tnow - t > max_age]:
+            del self.last_sent[k]
+        if not self.pending:
+            self.last_time = tnow
+            self.tokens = 0.0
+            return []
+        if rate <= 0:
+            count = len(self.pending)
+        else:
+            if self.last_time is not None:
+                self.tokens += (tnow - self.last_time) * rate
+            count = int(self.tokens)
+            self.tokens -= count
+        self.last_time = tnow
+        if count <= 0:
+            return []
+        if count >= len(self.pending):
+            chosen = list(self.pending.keys())
+            # don't save up unused allowance for a later burst
+            self.tokens = 0.0
+        else:
+            # closest first, weighted by time waiting. Targets not sent for twice the time to send
+            # every pending target once go first, oldest first, so far targets are not starved
+            overdue = 2.0 * len(self.pending) / rate
+            last_sent = self.last_sent
+
+            def order(k):
+                wait = tnow - last_sent[k]
+                if wait > overdue:
+                    return (0, -wait)
+                return (1, (self.pending[k][0] + 1.0) / max(wait, 0.001))
+            chosen = sorted(self.pending.keys(), key=order)[:count]
+        for k in chosen:
+            self.last_sent[k] = tnow
+        return [self.pending.pop(k)[1:] for k in chosen]
 
 class AsterixModule(mp_module.MPModule):
 
@@ -67,6 +133,8 @@ class AsterixModule(mp_module.MPModule):
                                                         ('filter_time', int, 20),
                                                         ('wgs84_to_AMSL', float, -41.2),
                                                         ('filter_use_vehicle2', bool, True),
+                                                        # max ADSB_VEHICLE messages per second on each link, 0 for no limit
+                                                        ('link_rate', int, 0),
         ])
         self.add_completion_function('(ASTERIXSETTING)',
                                      self.asterix_settings.completion)
@@ -77,6 +145,22 @@ class AsterixModule(mp_module.MPModule):
         # storage for vehicle positions, used for filtering
         self.vehicle_pos = None
         self.vehicle2_pos = None
+        self.vehicle_positions = {}
+        # vehicle positions older than this many seconds are not used for filtering
+        self.vehicle_pos_timeout = 10
+
+        # recently parsed datagrams, so repeated datagrams are not parsed again
+        self.parse_cache = OrderedDict()
+        self.parse_cache_size = 256
+        self.pacers = {}
+
+        # reception and latency counters
+        self.datagram_count = 0
+        self.cache_hits = 0
+        self.backlog = 0
+        self.backlog_max = 0
+        self.targets_superseded = 0
+        self.latency = deque(maxlen=1000)
 
         self.adsb_packets_sent = 0
         self.adsb_packets_not_sent = 0
@@ -95,6 +179,16 @@ class AsterixModule(mp_module.MPModule):
         print("ADSB packets sent: %u" % self.adsb_packets_sent)
         print("ADSB packets not sent: %u" % self.adsb_packets_not_sent)
         print("ADSB bitrate: %u bytes/s" % int(self.adsb_byterate))
+        print("Datagrams: %u  cache hits: %u  backlog: %u  max backlog: %u  superseded targets: %u" % (
+            self.datagram_count, self.cache_hits, self.backlog, self.backlog_max, self.targets_superseded))
+        print("Link queues: %s  replaced before send: %u  expired before send: %u" % (
+            " ".join([str(len(p.pending)) for p in self.pacers.values()]),
+            sum([p.replaced for p in self.pacers.values()]),
+            sum([p.expired for p in self.pacers.values()])))
+        if len(self.latency) > 0:
+            latency = np.array(self.latency) * 1000.0
+            print("Receive to send latency: mean %.1fms p95 %.1fms max %.1fms" % (
+                latency.mean(), np.percentile(latency, 95), latency.max()))
 
     def cmd_asterix(self, args):
         '''asterix command parser'''
@@ -122,6 +216,11 @@ class AsterixModule(mp_module.MPModule):
             self.sock.close()
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            # room for bursts between main loop ticks
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        except socket.error:
+            pass
         self.sock.bind(('', self.asterix_settings.port))
         self.sock.setblocking(False)
         print("Started on port %u" % self.asterix_settings.port)
@@ -132,6 +231,7 @@ class AsterixModule(mp_module.MPModule):
             self.sock.close()
             self.sock = None
         self.tracks = {}
+        self.pacers = {}
 
     def set_secondary_vehicle_position(self, m):
         '''store second vehicle position for filtering purposes'''
@@ -142,166 +242,209 @@ class AsterixModule(mp_module.MPModule):
             return
         self.vehicle2_pos = VehiclePos(m)
 
-    def could_collide_hor(self, vpos, adsb_pkt):
-        '''return true if vehicle could come within filter_dist_xy meters of adsb vehicle in timeout seconds'''
-        margin = self.asterix_settings.filter_dist_xy
+    def filter_positions(self):
+        '''return the vehicle positions used for filtering, forgetting vehicles we no longer hear from'''
+        oldest = time.time() - self.vehicle_pos_timeout
+        for sysid in [s for (s, v) in self.vehicle_positions.items() if v.time < oldest]:
+            del self.vehicle_positions[sysid]
+        positions = list(self.vehicle_positions.values())
+        if (self.vehicle2_pos is not None and self.asterix_settings.filter_use_vehicle2 and
+                self.vehicle2_pos.time >= oldest):
+            positions.append(self.vehicle2_pos)
+        return positions
+
+    def should_send_adsb_pkts(self, adsb_pkts):
+        '''return mask of packets for vehicles that could come within the filter distances of one of
+        our vehicles in filter_time seconds, and the distance to the nearest of our vehicles'''
+        n = len(adsb_pkts)
+        positions = self.filter_positions()
+        if len(positions) == 0:
+            return np.zeros(n, dtype=bool), np.full(n, np.inf)
         timeout = self.asterix_settings.filter_time
-        alat = adsb_pkt.lat * 1.0e-7
-        alon = adsb_pkt.lon * 1.0e-7
-        avel = adsb_pkt.hor_velocity * 0.01
-        vvel = sqrt(vpos.vx**2 + vpos.vy**2)
-        dist = mp_util.gps_distance(vpos.lat, vpos.lon, alat, alon)
-        dist -= avel * timeout
-        dist -= vvel * timeout
-        if dist <= margin:
-            return True
-        return False
-
-    def could_collide_ver(self, vpos, adsb_pkt):
-        '''return true if vehicle could come within filter_dist_z meters of adsb vehicle in timeout seconds'''
-        if adsb_pkt.emitter_type < 100 or adsb_pkt.emitter_type > 104:
-            return True
-        margin = self.asterix_settings.filter_dist_z
-        vtype = adsb_pkt.emitter_type - 100
-        valt = vpos.alt
-        aalt1 = adsb_pkt.altitude * 0.001
-        if vtype == 2:
-            # weather, always yes
-            return True
-        if vtype == 4:
-            # bird of prey, always true
-            return True
-        # planes and migrating birds have 150m margin
-        aalt2 = aalt1 + adsb_pkt.ver_velocity * 0.01 * self.asterix_settings.filter_time
-        altsep1 = abs(valt - aalt1)
-        altsep2 = abs(valt - aalt2)
-        if altsep1 > 150 + margin and altsep2 > 150 + margin:
-            return False
-        return True
-
-    def should_send_adsb_pkt(self, adsb_pkt):
-        if self.vehicle_pos is not None:
-            if self.could_collide_hor(self.vehicle_pos, adsb_pkt) and self.could_collide_ver(self.vehicle_pos, adsb_pkt):
-                return True
-
-        if self.vehicle2_pos is not None:
-            if self.could_collide_hor(self.vehicle2_pos, adsb_pkt) and self.could_collide_ver(self.vehicle2_pos, adsb_pkt):
-                return True
-
-        return False
-
-    def idle_task(self):
-        '''called on idle'''
-        if self.sock is None:
-            return
-        try:
-            pkt = self.sock.recv(10240)
-        except Exception:
-            return
-        try:
-            if pkt.startswith(b'PICKLED:'):
-                pkt = pkt[8:]
-                # pickled packet
+        vlat = np.array([v.lat for v in positions])
+        vlon = np.array([v.lon for v in positions])
+        valt = np.array([v.alt for v in positions])[None, :]
+        vvel = np.array([sqrt(v.vx**2 + v.vy**2) for v in positions])[None, :]
+        a = np.array([(p.lat, p.lon, p.altitude, p.hor_velocity, p.ver_velocity, p.emitter_type) for p in adsb_pkts],
+                     dtype=float).reshape(-1, 6)
+        alat = a[:, 0:1] * 1.0e-7
+        alon = a[:, 1:2] * 1.0e-7
+        aalt1 = a[:, 2:3] * 0.001
+        avel = a[:, 3:4] * 0.01
+        emitter_type = a[:, 5:6]
+
+        # horizontal: could we come within filter_dist_xy
+        dist = adsb_tracks.haversine_distance(alat, alon, vlat[None, :], vlon[None, :])
+        hor = dist - avel * timeout - vvel * timeout <= self.asterix_settings.filter_dist_xy
+
+        # vertical: weather, birds of prey and non-OBC types always pass, planes and
+        # migrating birds have a 150m margin
+        always = (emitter_type < 100) | (emitter_type > 104) | (emitter_type == 102) | (emitter_type == 104)
+        aalt2 = aalt1 + a[:, 4:5] * 0.01 * timeout
+        margin = 150 + self.asterix_settings.filter_dist_z
+        ver = always | (np.abs(valt - aalt1) <= margin) | (np.abs(valt - aalt2) <= margin)
+
+        return (hor & ver).any(axis=1), dist.min(axis=1)
+
+    def receive_datagrams(self):
+        '''read all pending datagrams from the socket'''
+        datagrams = []
+        # bound the work per tick so a flood can't stall the main loop
+        while len(datagrams) < 1000:
+            try:
+                datagrams.append(self.sock.recv(10240))
+            except Exception:
+                break
+        self.backlog = len(datagrams)
+        self.backlog_max = max(self.backlog_max, self.backlog)
+        self.datagram_count += len(datagrams)
+        if datagrams:
+            try:
+                header = struct.pack('<d', time.time())
+                self.logfile.write(b''.join([b'AST:' + header + struct.pack('<I', len(pkt)) + pkt for pkt in datagrams]))
+            except Exception:
+                pass
+        return datagrams
+
+    def decode(self, pkt):
+        '''parse a datagram, reusing the result for recently seen identical datagrams'''
+        amsg = self.parse_cache.get(pkt, None)
+        if amsg is not None:
+            self.parse_cache.move_to_end(pkt)
+            self.cache_hits += 1
+            return amsg
+        if pkt.startswith(b'PICKLED:'):
+            # pickled packet
+            try:
+                amsg = [pickle.loads(pkt[8:])]
+            except pickle.UnpicklingError:
+                amsg = asterix.parse(pkt[8:])
+        else:
+            amsg = asterix.parse(pkt)
+        self.parse_cache[pkt] = amsg
+        if len(self.parse_cache) > self.parse_cache_size:
+            self.parse_cache.popitem(last=False)
+        return amsg
+
+    def make_adsb_pkt(self, m):
+        '''make an ADSB_VEHICLE packet from an asterix record'''
+        lat = m['I105']['Lat']['val']
+        lon = m['I105']['Lon']['val']
+        alt_f = m['I130']['Alt']['val']
+        climb_rate_fps = m['I220']['RoC']['val']
+        sac = m['I010']['SAC']['val']
+        sic = m['I010']['SIC']['val']
+        trkn = m['I040']['TrkN']['val']
+        # fake ICAO_address
+        icao_address = trkn & 0xFFFFFF
+        # object types based on real world ICAO ranges
+        # 000000 - 0003FFF - unallocated    - use for MAVLINK SYSID (up to 16838)
+        # A00000 - AFFFFFF - USA            - use for generated aircraft
+        # B00000 - BFFFFFF - reserved       - use for dummy obstacles
+        # C00000 - C3FFFFF - Canada
+        # 780000 - 7BFFFFF - China
+        # 7C0000 - 7FFFFFF - Australia
+        # from genobstacles:
+        # 'Aircraft'        : 0xA00000,
+        # 'Weather'         : 0xB00000,
+        # 'BirdMigrating'   : 0xB10000,
+        # 'BirdOfPrey'      : 0xB20000
+        # 'Drone'           : 0x000000 - 0x003FFF (16383)
+        if trkn >= 0xB00000 and  trkn < 0xB10000:
+            emitter_type = 102	# weather
+        elif trkn >= 0xB10000 and  trkn < 0xB20000:
+            emitter_type = 103	# Migratory Bird
+        elif trkn >= 0xB20000 and  trkn < 0xB30000:
+            emitter_type = 104	# Predatory Bird
+        elif trkn < 0x003FFF:
+            emitter_type = 14	# drone
+        elif trkn >= 0xA00000:
+            emitter_type = 1	# aircraft
+        else:
+            emitter_type = 99	# dummy it for now
+
+        # use squawk for time in 0.1 second increments. This allows for old msgs to be discarded on vehicle
+        # when using more than one link to vehicle
+        squawk = (int(self.mpstate.attitude_time_s * 10) & 0xFFFF)
+
+        alt_m = alt_f * 0.3048
+
+        # asterix is WGS84, ArduPilot uses AMSL, which is EGM96
+        alt_m += self.asterix_settings.wgs84_to_AMSL
+
+        return self.master.mav.adsb_vehicle_encode(icao_address,
+                                                   int(lat*1e7),
+                                                   int(lon*1e7),
+                                                   mavutil.mavlink.ADSB_ALTITUDE_TYPE_GEOMETRIC,
+                                                   int(alt_m*1000), # mm
+                                                   0, # heading
+                                                   0, # hor vel
+                                                   int(climb_rate_fps * 0.3048 * 100), # cm/s
+                                                   ("%06X" % icao_address).encode("ascii"),
+                                                   emitter_type, # 100 + (trkn // 10000),
+                                                   1,
+                                                   (mavutil.mavlink.ADSB_FLAGS_VALID_COORDS |
+                                                    mavutil.mavlink.ADSB_FLAGS_VALID_ALTITUDE |
+                                                    mavutil.mavlink.ADSB_FLAGS_VALID_VELOCITY |
+                                                    mavutil.mavlink.ADSB_FLAGS_VALID_HEADING),
+                                                   squawk)
+
+    def process_datagrams(self, datagrams, recv_time):
+        '''parse, filter and queue all targets from a batch of datagrams'''
+        # keep only the newest record for each target in the batch
+        records = {}
+        for pkt in datagrams:
+            try:
+                amsg = self.decode(pkt)
+                self.pkt_count += 1
+            except Exception:
+                print("bad packet")
+                continue
+            for m in amsg:
+                if self.asterix_settings.debug > 1:
+                    print(m)
                 try:
-                    amsg = [pickle.loads(pkt)]
-                except pickle.UnpicklingError:
-                    amsg = asterix.parse(pkt)
-            else:
-                amsg = asterix.parse(pkt)
-            self.pkt_count += 1
-            self.console.set_status('ASTX', 'ASTX %u/%u' % (self.pkt_count, self.adsb_packets_sent), row=6)
-        except Exception:
-            print("bad packet")
+                    trkn = m['I040']['TrkN']['val']
+                except (KeyError, TypeError):
+                    continue
+                if trkn in records:
+                    self.targets_superseded += 1
+                records[trkn] = m
+        self.console.set_status('ASTX', 'ASTX %u/%u' % (self.pkt_count, self.adsb_packets_sent), row=6)
+        if not records:
             return
-        try:
-            logpkt = b'AST:' + struct.pack('<dI', time.time(), len(pkt)) + pkt
-            self.logfile.write(logpkt)
-        except Exception:
-            pass
-        
-        for m in amsg:
-            if self.asterix_settings.debug > 1:
-                print(m)
-            lat = m['I105']['Lat']['val']
-            lon = m['I105']['Lon']['val']
-            alt_f = m['I130']['Alt']['val']
-            climb_rate_fps = m['I220']['RoC']['val']
-            sac = m['I010']['SAC']['val']
-            sic = m['I010']['SIC']['val']
-            trkn = m['I040']['TrkN']['val']
-            # fake ICAO_address
-            icao_address = trkn & 0xFFFFFF
-            # object types based on real world ICAO ranges
-            # 000000 - 0003FFF - unallocated    - use for MAVLINK SYSID (up to 16838)
-            # A00000 - AFFFFFF - USA            - use for generated aircraft
-            # B00000 - BFFFFFF - reserved       - use for dummy obstacles
-            # C00000 - C3FFFFF - Canada
-            # 780000 - 7BFFFFF - China
-            # 7C0000 - 7FFFFFF - Australia
-            # from genobstacles:
-            # 'Aircraft'        : 0xA00000,
-            # 'Weather'         : 0xB00000,
-            # 'BirdMigrating'   : 0xB10000,
-            # 'BirdOfPrey'      : 0xB20000
-            # 'Drone'           : 0x000000 - 0x003FFF (16383)
-            if trkn >= 0xB00000 and  trkn < 0xB10000:
-                emitter_type = 102	# weather
-            elif trkn >= 0xB10000 and  trkn < 0xB20000:
-                emitter_type = 103	# Migratory Bird
-            elif trkn >= 0xB20000 and  trkn < 0xB30000:
-                emitter_type = 104	# Predatory Bird
-            elif trkn < 0x003FFF:
-                emitter_type = 14	# drone
-            elif trkn >= 0xA00000:
-                emitter_type = 1	# aircraft
-            else:
-                emitter_type = 99	# dummy it for now
-
-            # use squawk for time in 0.1 second increments. This allows for old msgs to be discarded on vehicle
-            # when using more than one link to vehicle
-            squawk = (int(self.mpstate.attitude_time_s * 10) & 0xFFFF)
-
-            alt_m = alt_f * 0.3048
-
-            # asterix is WGS84, ArduPilot uses AMSL, which is EGM96
-            alt_m += self.asterix_settings.wgs84_to_AMSL
-
-            # consider filtering this packet out; if it's not close to
-            # either home or the vehicle position don't send it
-            adsb_pkt = self.master.mav.adsb_vehicle_encode(icao_address,
-                                                           int(lat*1e7),
-                                                           int(lon*1e7),
-                                                           mavutil.mavlink.ADSB_ALTITUDE_TYPE_GEOMETRIC,
-                                                           int(alt_m*1000), # mm
-                                                           0, # heading
-                                                           0, # hor vel
-                                                           int(climb_rate_fps * 0.3048 * 100), # cm/s
-                                                           ("%06X" % icao_address).encode("ascii"),
-                                                           emitter_type, # 100 + (trkn // 10000),
-                                                           1,
-                                                           (mavutil.mavlink.ADSB_FLAGS_VALID_COORDS |
-                                                            mavutil.mavlink.ADSB_FLAGS_VALID_ALTITUDE |
-                                                            mavutil.mavlink.ADSB_FLAGS_VALID_VELOCITY |
-                                                            mavutil.mavlink.ADSB_FLAGS_VALID_HEADING),
-                                                           squawk)
+
+        adsb_pkts = []
+        for m in records.values():
+            try:
+                adsb_pkt = self.make_adsb_pkt(m)
+            except (KeyError, TypeError):
+                continue
+            icao_address = adsb_pkt.ICAO_address
             if icao_address in self.tracks:
                 self.tracks[icao_address].update(adsb_pkt, self.get_time())
             else:
                 self.tracks[icao_address] = Track(adsb_pkt)
             if self.asterix_settings.debug > 0:
                 print(adsb_pkt)
-            # send on all links
-            if self.should_send_adsb_pkt(adsb_pkt):
-                self.adsb_packets_sent += 1
-                for i in range(len(self.mpstate.mav_master)):
-                    conn = self.mpstate.mav_master[i]
-                    #if adsb_pkt.hor_velocity < 1:
-                    #    print(adsb_pkt)
-                    conn.mav.send(adsb_pkt)
+            adsb_pkts.append(adsb_pkt)
+        if not adsb_pkts:
+            return
+
+        # consider filtering these packets out; if they're not close to
+        # any of our vehicles don't send them
+        (send, nearest) = self.should_send_adsb_pkts(adsb_pkts)
+        links = list(self.mpstate.mav_master)
+        adsb_mod = self.module('adsb')
+        for i in range(len(adsb_pkts)):
+            adsb_pkt = adsb_pkts[i]
+            # queue on all links
+            if send[i]:
+                for conn in links:
+                    self.link_pacer(conn).add(adsb_pkt.ICAO_address, nearest[i], recv_time, adsb_pkt)
             else:
                 self.adsb_packets_not_sent += 1
 
-            adsb_mod = self.module('adsb')
             if adsb_mod:
                 # the adsb module is loaded, display on the map
                 adsb_mod.mavlink_packet(adsb_pkt)
@@ -313,7 +456,41 @@ class AsterixModule(mp_module.MPModule):
                     self.mpstate.sysid_outputs[sysid].write(adsb_pkt.get_msgbuf())
             except Exception:
                 pass
-                
+
+    def link_pacer(self, conn):
+        '''get the pacer for a link'''
+        pacer = self.pacers.get(conn, None)
+        if pacer is None:
+            pacer = LinkPacer()
+            self.pacers[conn] = pacer
+        return pacer
+
+    def send_pending(self):
+        '''send queued packets on each link at the allowed rate'''
+        if not self.pacers:
+            return
+        links = self.mpstate.mav_master
+        for conn in list(self.pacers.keys()):
+            if conn not in links:
+                # link has been removed
+                del self.pacers[conn]
+        tnow = time.time()
+        for (conn, pacer) in self.pacers.items():
+            for (recv_time, adsb_pkt) in pacer.due(self.asterix_settings.link_rate, tnow,
+                                                   self.asterix_settings.filter_time):
+                conn.mav.send(adsb_pkt)
+                self.adsb_packets_sent += 1
+                self.latency.append(time.time() - recv_time)
+
+    def idle_task(self):
+        '''called on idle'''
+        if self.sock is None:
+            return
+        datagrams = self.receive_datagrams()
+        if datagrams:
+            self.process_datagrams(datagrams, time.time())
+        self.send_pending()
+
         now = time.time()
         delta = now - self.adsb_byterate_update_timestamp
         if delta > 5:
@@ -328,6 +505,7 @@ class AsterixModule(mp_module.MPModule):
             if abs(m.lat) < 1000 and abs(m.lon) < 1000:
                 return
             self.vehicle_pos = VehiclePos(m)
+            self.vehicle_positions[m.get_srcSystem()] = self.vehicle_pos
 
 def init(mpstate):
     '''initialise module'''
@@ -344,7 +522,7 @@ if __name__ == '__main__':
     tstart = time.time()
     while True:
         header = logf.read(16)
-        if header[0:4] != 'AST:':
+        if header[0:4] != b'AST:':
             print("Bad header", header[0:4])
             break
         (t,len) = struct.unpack('<dI', header[4:16])
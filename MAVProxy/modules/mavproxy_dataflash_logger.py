@@ -11,6 +11,11 @@ in a local directory.
 
 The relevant code in the ArduPilot code base can be found in
 libraries/DataFlash/DataFlash_MAVLink.*
+
+Received blocks are coalesced into contiguous runs and written by a
+background thread, so a high rate log does not cost a seek and write
+per block in the main thread. Blocks are written at their offset in
+the log, leaving holes for missing blocks until they arrive.
 '''
 
 import os
@@ -18,12 +23,164 @@ import os.path
 from pymavlink import mavutil
 import errno
 import sys
+import threading
+
+if sys.version_info[0] >= 3:
+    import queue as Queue
+else:
+    import Queue
 
 from MAVProxy.modules.lib import mp_module
 import time
 from MAVProxy.modules.lib import mp_settings
 
 
+class BlockBitmap(object):
+    '''set of block numbers held as a bitmap'''
+    def __init__(self):
+        self.bits = bytearray()
+        self.count = 0
+
+    def grow(self, n):
+        '''make room for block n'''
+        need = (n >> 3) + 1
+        if need > len(self.bits):
+            self.bits.extend(bytes(max(need - len(self.bits), len(self.bits))))
+
+    def test(self, n):
+        i = n >> 3
+        return i < len(self.bits) and (self.bits[i] >> (n & 7)) & 1 == 1
+
+    def add(self, n):
+        if self.test(n):
+            return
+        self.grow(n)
+        self.bits[n >> 3] |= 1 << (n & 7)
+        self.count += 1
+
+    def discard(self, n):
+        '''remove block n, returning True if it was present'''
+        if not self.test(n):
+            return False
+        self.bits[n >> 3] &= ~(1 << (n & 7))
+        self.count -= 1
+        return True
+
+    def add_range(self, start, end):
+        '''add blocks start to end-1, none of which are present'''
+        if end <= start:
+            return
+        self.grow(end - 1)
+        n = start
+        while n < end and n & 7 != 0:
+            self.bits[n >> 3] |= 1 << (n & 7)
+            n += 1
+        full = (end - n) >> 3
+        if full > 0:
+            self.bits[n >> 3:(n >> 3) + full] = b'\xff' * full
+            n += full << 3
+        while n < end:
+            self.bits[n >> 3] |= 1 << (n & 7)
+            n += 1
+        self.count += end - start
+
+    def members(self, start, end):
+        '''yield blocks present between start and end-1'''
+        start = max(start, 0)
+        end = min(end, len(self.bits) << 3)
+        if start >= end:
+            return
+        bits = self.bits
+        for i in range(start >> 3, ((end - 1) >> 3) + 1):
+            b = bits[i]
+            if b == 0:
+                continue
+            for j in range(8):
+                n = (i << 3) + j
+                if (b >> j) & 1 and start <= n < end:
+                    yield n
+
+
+class LogWriter(object):
+    '''write-behind log file. Blocks are coalesced into contiguous runs
+    which a background thread writes at their offset in the file'''
+
+    # write out runs when this much data is buffered, or this many
+    # seconds after the oldest buffered data arrived
+    FLUSH_SIZE = 65536
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.logfile = open(filename, 'w+b')
+        self.runs = []
+        self.run_offset = None
+        self.run_data = None
+        self.buffered = 0
+        self.first_buffered = None
+        self.writes = 0
+        self.bytes_written = 0
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.write_thread, name='dataflash_logger')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, ofs, data):
+        '''add a block of data at offset ofs'''
+        if self.run_data is not None and ofs == self.run_offset + len(self.run_data):
+            self.run_data.extend(data)
+        else:
+            if self.run_data is not None:
+                self.runs.append((self.run_offset, self.run_data))
+            self.run_offset = ofs
+            self.run_data = bytearray(data)
+        if self.first_buffered is None:
+            self.first_buffered = time.time()
+        self.buffered += len(data)
+        if self.buffered >= LogWriter.FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        '''pass buffered runs to the write thread'''
+        if self.run_data is not None:
+            self.runs.append((self.run_offset, self.run_data))
+            self.run_offset = None
+            self.run_data = None
+        if len(self.runs) > 0:
+            self.queue.put(self.runs)
+            self.runs = []
+        self.buffered = 0
+        self.first_buffered = None
+
+    def idle_flush(self):
+        '''flush if the buffered data is getting old'''
+        if self.first_buffered is not None and time.time() - self.first_buffered >= LogWriter.FLUSH_INTERVAL:
+            self.flush()
+
+    def write_thread(self):
+        '''write runs in the background'''
+        while True:
+            runs = self.queue.get()
+            if runs is None:
+                break
+            for (ofs, data) in runs:
+                self.logfile.seek(ofs)
+                self.logfile.write(data)
+                self.writes += 1
+                self.bytes_written += len(data)
+        self.logfile.close()
+
+    def pending(self):
+        '''number of batches waiting to be written'''
+        return self.queue.qsize()
+
+    def close(self):
+        '''write everything out and close the file'''
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+
 class dataflash_logger(mp_module.MPModule):
     def __init__(self, mpstate):
         """Initialise module.  We start poking the UAV for messages after this
@@ -42,12 +199,8 @@ class dataflash_logger(mp_module.MPModule):
         self.prev_download = 0
         self.last_status_time = time.time()
         self.last_seqno = 0
-        self.missing_blocks = {}
-        self.acking_blocks = {}
-        self.blocks_to_ack_and_nack = []
-        self.missing_found = 0
-        self.abandoned = 0
-        self.dropped = 0
+        self.writer = None
+        self.reset_counters()
         self.armed = False
 
         self.log_settings = mp_settings.MPSettings(
@@ -63,6 +216,30 @@ class dataflash_logger(mp_module.MPModule):
         self.add_completion_function('(LOGSETTING)',
                                      self.log_settings.completion)
 
+    # give up on a missing block once we have seen one this much newer
+    MAX_MISSING_AGE = 200
+    # seconds between NACKs of a missing block
+    NACK_INTERVAL = 0.1
+    MAX_NACKS = 20
+
+    def reset_counters(self):
+        '''reset block tracking for a new log'''
+        self.missing_blocks = BlockBitmap()
+        # no blocks below this are missing
+        self.missing_low = 0
+        self.acks_pending = []
+        self.last_nack_time = 0
+        self.missing_found = 0
+        self.missing_total = 0
+        self.abandoned = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.blocks = 0
+        self.acks_sent = 0
+        self.nacks_sent = 0
+        self.start_time = time.time()
+        self.last_block_time = self.start_time
+
     def usage(self):
         '''show help on a command line options'''
         return "Usage: dataflash_logger <status|start|stop|set>"
@@ -76,6 +253,8 @@ class dataflash_logger(mp_module.MPModule):
         elif args[0] == "stop":
             self.sender = None
             self.stopped = True
+            if self.writer is not None:
+                self.writer.flush()
         elif args[0] == "start":
             self.stopped = False
         elif args[0] == "set":
@@ -114,19 +293,16 @@ class dataflash_logger(mp_module.MPModule):
         filename = self.new_log_filepath()
 
         self.last_seqno = 0
-        self.logfile = open(filename, 'w+b')
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = LogWriter(filename)
         print("DFLogger: logging started (%s)" % (filename))
         self.prev_cnt = 0
         self.download = 0
         self.prev_download = 0
         self.last_idle_status_printed_time = time.time()
         self.last_status_time = time.time()
-        self.missing_blocks = {}
-        self.acking_blocks = {}
-        self.blocks_to_ack_and_nack = []
-        self.missing_found = 0
-        self.abandoned = 0
-        self.dropped = 0
+        self.reset_counters()
 
     def status(self):
         '''returns information about module'''
@@ -138,15 +314,33 @@ class dataflash_logger(mp_module.MPModule):
         now = time.time()
         interval = now - self.last_status_time
         self.last_status_time = now
+        expected = self.last_seqno + 1
+        writes = 0
+        written = 0
+        pending = 0
+        if self.writer is not None:
+            writes = self.writer.writes
+            written = self.writer.bytes_written
+            pending = self.writer.pending()
         return("DFLogger: %(state)s Rate(%(interval)ds):%(rate).3fkB/s "
                "Block:%(block_cnt)d Missing:%(missing)d Fixed:%(fixed)d "
-               "Abandoned:%(abandoned)d" %
+               "Abandoned:%(abandoned)d Loss:%(loss).1f%% Dup:%(dup)d "
+               "Avg:%(avg).3fkB/s Acks:%(acks)d Nacks:%(nacks)d "
+               "Writes:%(writes)d (%(written)dkB, %(pending)d pending)" %
                {"interval": interval,
                 "rate": transferred/(interval*1000),
                 "block_cnt": self.last_seqno,
-                "missing": len(self.missing_blocks),
+                "missing": self.missing_blocks.count,
                 "fixed": self.missing_found,
                 "abandoned": self.abandoned,
+                "loss": 100.0 * self.missing_total / expected,
+                "dup": self.duplicates,
+                "avg": self.download / (max(now - self.start_time, 0.001) * 1000),
+                "acks": self.acks_sent,
+                "nacks": self.nacks_sent,
+                "writes": writes,
+                "written": written // 1024,
+                "pending": pending,
                 "state": "Inactive" if self.stopped else "Active"})
 
     def idle_print_status(self):
@@ -157,62 +351,43 @@ class dataflash_logger(mp_module.MPModule):
             self.last_idle_status_printed_time = now
 
     def idle_send_acks_and_nacks(self):
-        '''Send packets to UAV in idle loop'''
-        max_blocks_to_send = 10
-        blocks_sent = 0
-        i = 0
-        now = time.time()
-        while (i < len(self.blocks_to_ack_and_nack) and
-               blocks_sent < max_blocks_to_send):
-            # print("ACKLIST: %s" %
-            # ([x[1] for x in self.blocks_to_ack_and_nack],))
-            stuff = self.blocks_to_ack_and_nack[i]
-
-            [master, block, status, first_sent, last_sent] = stuff
-            if status == 1:
-                # print("DFLogger: ACKing block (%d)" % (block,))
-                mavstatus = mavutil.mavlink.MAV_REMOTE_LOG_DATA_BLOCK_ACK
-                (target_sys, target_comp) = self.sender
-                self.master.mav.remote_log_block_status_send(target_sys,
-                                                             target_comp,
-                                                             block,
-                                                             mavstatus)
-                blocks_sent += 1
-                del self.acking_blocks[block]
-                del self.blocks_to_ack_and_nack[i]
-                continue
-
-            if block not in self.missing_blocks:
-                # we've received this block now
-                del self.blocks_to_ack_and_nack[i]
-                continue
-
-            # give up on packet if we have seen one with a much higher
-            # number (or after 60 seconds):
-            if (self.last_seqno - block > 200) or (now - first_sent > 60):
-                if self.log_settings.verbose:
-                    print("DFLogger: Abandoning block (%d)" % (block,))
-                del self.blocks_to_ack_and_nack[i]
-                del self.missing_blocks[block]
-                self.abandoned += 1
-                continue
-
-            i += 1
-            # only send each nack every-so-often:
-            if last_sent is not None:
-                if now - last_sent < 0.1:
-                    continue
+        '''Send packets to UAV in idle loop. All blocks received since the
+        last call are ACKed, and missing blocks are NACKed periodically'''
+        (target_sys, target_comp) = self.sender
+        send = self.master.mav.remote_log_block_status_send
+        acks = self.acks_pending
+        if len(acks) > 0:
+            self.acks_pending = []
+            mavstatus = mavutil.mavlink.MAV_REMOTE_LOG_DATA_BLOCK_ACK
+            for block in acks:
+                send(target_sys, target_comp, block, mavstatus)
+            self.acks_sent += len(acks)
 
+        now = time.time()
+        if self.missing_blocks.count == 0 or now - self.last_nack_time < self.NACK_INTERVAL:
+            return
+        self.last_nack_time = now
+        # give up on blocks we have seen a much higher number than, or
+        # when nothing has arrived for a long time
+        oldest = self.last_seqno - self.MAX_MISSING_AGE
+        if now - self.last_block_time > 60:
+            oldest = self.last_seqno + 1
+        for block in list(self.missing_blocks.members(self.missing_low, oldest)):
+            if self.log_settings.verbose:
+                print("DFLogger: Abandoning block (%d)" % (block,))
+            self.missing_blocks.discard(block)
+            self.abandoned += 1
+        self.missing_low = max(self.missing_low, oldest)
+        mavstatus = mavutil.mavlink.MAV_REMOTE_LOG_DATA_BLOCK_NACK
+        nacks = 0
+        for block in self.missing_blocks.members(oldest, self.last_seqno):
             if self.log_settings.verbose:
                 print("DFLogger: Asking for block (%d)" % (block,))
-            mavstatus = mavutil.mavlink.MAV_REMOTE_LOG_DATA_BLOCK_NACK
-            (target_sys, target_comp) = self.sender
-            self.master.mav.remote_log_block_status_send(target_sys,
-                                                         target_comp,
-                                                         block,
-                                                         mavstatus)
-            blocks_sent += 1
-            stuff[4] = now
+            send(target_sys, target_comp, block, mavstatus)
+            nacks += 1
+            if nacks >= self.MAX_NACKS:
+                break
+        self.nacks_sent += nacks
 
     def idle_task_started(self):
         '''called in idle task only when logging is started'''
@@ -237,6 +412,8 @@ class dataflash_logger(mp_module.MPModule):
             self.idle_task_started()
         else:
             self.idle_task_not_started()
+        if self.writer is not None:
+            self.writer.idle_flush()
 
     def tell_sender_to_stop(self, m):
         '''send a stop packet (if we haven't sent one in the last second)'''
@@ -309,30 +486,15 @@ class dataflash_logger(mp_module.MPModule):
         return True
 
     def do_ack_block(self, seqno):
-        if seqno in self.acking_blocks:
-            # already acking this one; we probably sent
-            # multiple nacks and received this one
-            # multiple times
-            return
-
-        now = time.time()
-
-        # ACK the block we just got:
-        self.blocks_to_ack_and_nack.append([self.master, seqno, 1, now, None])
-        self.acking_blocks[seqno] = 1
-
-        # NACK any blocks we haven't seen and should have:
-        if(seqno - self.last_seqno > 1):
-            for block in range(self.last_seqno+1, seqno):
-                if block not in self.missing_blocks and \
-                   block not in self.acking_blocks:
-                    self.missing_blocks[block] = 1
-                    if self.log_settings.verbose:
-                        print("DFLogger: setting %d for nacking" % (block,))
-                    self.blocks_to_ack_and_nack.append(
-                        [self.master, block, 0, now, None]
-                    )
-        # print("\nmissed blocks: ",self.missing_blocks)
+        '''queue an ACK for a block, and note any blocks we haven't seen
+        and should have'''
+        self.acks_pending.append(seqno)
+        if seqno - self.last_seqno > 1:
+            start = self.last_seqno + 1
+            if self.log_settings.verbose:
+                print("DFLogger: setting %d to %d for nacking" % (start, seqno-1))
+            self.missing_blocks.add_range(start, seqno)
+            self.missing_total += seqno - start
 
     def mavlink_packet(self, m):
         '''handle mavlink packets'''
@@ -358,28 +520,31 @@ class dataflash_logger(mp_module.MPModule):
 
             if self.sender is not None:
                 size = len(m.data)
-                data = bytearray(m.data[:size])
-                ofs = size*(m.seqno)
-                self.logfile.seek(ofs)
-                self.logfile.write(data)
+                self.writer.add(size*m.seqno, m.data)
+                self.blocks += 1
+                self.last_block_time = time.time()
 
-                if m.seqno in self.missing_blocks:
+                if self.missing_blocks.discard(m.seqno):
                     if self.log_settings.verbose:
                         print("DFLogger: Got missing block: %d" % (m.seqno,))
-                    del self.missing_blocks[m.seqno]
                     self.missing_found += 1
-                    self.blocks_to_ack_and_nack.append(
-                        [self.master, m.seqno, 1, time.time(), None]
-                    )
-                    self.acking_blocks[m.seqno] = 1
-                    # print("DFLogger: missing: %s" %
-                    # (str(self.missing_blocks),))
+                    self.acks_pending.append(m.seqno)
+                elif m.seqno <= self.last_seqno and m.seqno != 0:
+                    # repeat of a block we have, the ACK was probably lost
+                    self.duplicates += 1
+                    self.acks_pending.append(m.seqno)
                 else:
                     self.do_ack_block(m.seqno)
                     if self.last_seqno < m.seqno:
                         self.last_seqno = m.seqno
                 self.download += size
 
+    def unload(self):
+        '''close the log on unload'''
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
 
 def init(mpstate):
     '''initialise module'''
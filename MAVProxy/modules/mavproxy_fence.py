@@ -573,7 +573,7 @@ class FenceModule(mission_item_protocol.MissionItemProtocolModule):
         self.wploader.set(moving_item, moving_item.seq)
         self.wploader.last_change = time.time()
 
-        self.send_single_waypoint(moving_item.seq)
+        self.send_changes(moving_item.seq, moving_item.seq)
 
     def setcircleradius(self, seq, radius=None):
         '''change radius of circle at seq to radius
@@ -612,7 +612,7 @@ class FenceModule(mission_item_protocol.MissionItemProtocolModule):
         self.wploader.set(changing_item, changing_item.seq)
         self.wploader.last_change = time.time()
 
-        self.send_single_waypoint(changing_item.seq)
+        self.send_changes(changing_item.seq, changing_item.seq)
 
     def is_circle_item(self, item):
         return item.command in [
@@ -804,7 +804,7 @@ class FenceModule(mission_item_protocol.MissionItemProtocolModule):
         self.wploader.set(moving_item, moving_item.seq)
         self.wploader.last_change = time.time()
 
-        self.send_single_waypoint(moving_item.seq)
+        self.send_changes(moving_item.seq, moving_item.seq)
 
     def set_fence_enabled(self, do_enable):
         '''Enable or disable fence'''
@@ -1062,21 +1062,8 @@ class LinkModule(mp_module.MPModule):
             usec = (usec & ~3) | master.linknum
             self.mpstate.logqueue.put(bytearray(struct.pack('>Q', usec) + m.get_msgbuf()))
 
-        # keep the last message of each type around
-        self.status.msgs[mtype] = m
-        instance_field = getattr(m, '_instance_field', None)
-        if mtype not in self.status.msg_count:
-            self.status.msg_count[mtype] = 0
-        self.status.msg_count[mtype] += 1
-
-        if instance_field is not None:
-            instance_value = getattr(m, instance_field, None)
-            if instance_value is not None:
-                mtype_instance = "%s[%s]" % (mtype, instance_value)
-                self.status.msgs[mtype_instance] = m
-                if mtype_instance not in self.status.msg_count:
-                    self.status.msg_count[mtype_instance] = 0
-                self.status.msg_count[mtype_instance] += 1
+        # keep the last message of each type and instance around
+        self.status.msgs.add(mtype, m)
 
         if getattr(m, 'time_boot_ms', None) is not None and self.message_is_from_primary_vehicle(m):
             # update link_delayed attribute
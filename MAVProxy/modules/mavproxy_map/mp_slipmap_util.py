@@ -342,6 +342,129 @@ class UnclosedSlipPolygon(SlipPolygon):
                 self.linewidth)
 
 
+def polyline_significance(points, keep=None, min_tolerance=0.01):
+    '''run Douglas-Peucker over a list of (lat,lon,...) points once for all
+    tolerances. Returns an array giving, for each point, the largest
+    tolerance in metres at which Douglas-Peucker would keep it, so the
+    simplified line for any tolerance is just the points whose
+    significance is at least that tolerance. Points listed in keep are
+    always retained. Segments are split breadth first across the whole
+    line at once so the work is vectorised'''
+    n = len(points)
+    sig = np.zeros(n)
+    if n == 0:
+        return sig
+    # project to local flat coordinates in metres
+    lat = np.array([p[0] for p in points], dtype=float)
+    lon = np.array([p[1] for p in points], dtype=float)
+    lat0 = math.radians(np.mean(lat))
+    x = np.radians(lon - lon[0]) * math.cos(lat0) * mp_util.radius_of_earth
+    y = np.radians(lat - lat[0]) * mp_util.radius_of_earth
+
+    kept = [0, n-1]
+    if keep is not None:
+        kept.extend(keep)
+    kept = np.unique(np.array(kept, dtype=np.int64))
+    sig[kept] = np.inf
+    pts = np.setdiff1d(np.arange(n), kept)
+    while len(pts) > 0:
+        seg = np.searchsorted(kept, pts, side='right') - 1
+        a = kept[seg]
+        b = kept[seg+1]
+        dx = x[b] - x[a]
+        dy = y[b] - y[a]
+        px = x[pts] - x[a]
+        py = y[pts] - y[a]
+        seglen = np.hypot(dx, dy)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dist = np.where(seglen > 0, np.abs(px*dy - py*dx) / seglen, np.hypot(px, py))
+
+        # find the furthest point in each segment
+        starts = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+        segmax = np.maximum.reduceat(dist, starts)
+        counts = np.diff(np.r_[starts, len(pts)])
+        segmax_pp = np.repeat(segmax, counts)
+        is_max = np.flatnonzero(dist == segmax_pp)
+        first = np.r_[True, seg[is_max][1:] != seg[is_max][:-1]]
+        chosen = is_max[first]
+
+        # a point can be no more significant than the segment it splits
+        parent = np.minimum(sig[a[chosen]], sig[b[chosen]])
+        sig[pts[chosen]] = np.minimum(dist[chosen], parent)
+
+        # drop segments whose points are all within the minimum tolerance
+        active = np.repeat(segmax >= min_tolerance, counts)
+        active[chosen] = False
+        kept = np.union1d(kept, pts[chosen[segmax >= min_tolerance]])
+        pts = pts[active]
+    return sig
+
+
+class SlipTrack(SlipPolygon):
+    '''a long vehicle track. The line is simplified with Douglas-Peucker
+    for the current zoom level so drawing cost depends on the detail
+    visible, not on the number of points'''
+    def __init__(self, key, points, layer, colour, linewidth, arrow=False, popup_menu=None, showlines=True,
+                 showcircles=True, tolerance_pixels=0.5):
+        SlipPolygon.__init__(self, key, points, layer, colour, linewidth, arrow=arrow, popup_menu=popup_menu,
+                             showlines=showlines, showcircles=showcircles)
+        self.tolerance_pixels = tolerance_pixels
+        # always keep points where the colour changes
+        keep = []
+        for i in range(1, len(points)):
+            if len(points[i]) > 2 and points[i][2] != points[i-1][2]:
+                keep.append(i-1)
+                keep.append(i)
+        self._significance = polyline_significance(points, keep=keep)
+        self._pix_index = []
+
+    def metres_per_pixel(self, pixmapper):
+        '''work out the current map scale around the track'''
+        (lat, lon) = (self._bounds[0], self._bounds[1])
+        (lat2, lon2) = mp_util.gps_newpos(lat, lon, 90, 1000)
+        (x1, y1) = pixmapper((lat, lon))
+        (x2, y2) = pixmapper((lat2, lon2))
+        pixels = math.hypot(x2-x1, y2-y1)
+        if pixels <= 0:
+            return None
+        return 1000.0 / pixels
+
+    def draw(self, img, pixmapper, bounds):
+        '''draw the track on the image'''
+        if self.hidden:
+            return
+        self._has_timestamps = len(self.points) > 0 and len(self.points[0]) > 3
+        self._pix_points = []
+        self._pix_index = []
+        mpp = self.metres_per_pixel(pixmapper)
+        if mpp is None:
+            indexes = range(len(self.points))
+        else:
+            indexes = np.flatnonzero(self._significance >= mpp * self.tolerance_pixels).tolist()
+        for k in range(len(indexes)-1):
+            i = indexes[k]
+            if len(self.points[i]) > 2:
+                colour = self.points[i][2]
+            else:
+                colour = self.colour
+            if len(self.points[i]) > 3:
+                timestamp = self.points[i][3]
+                if self._timestamp_range is not None:
+                    if timestamp < self._timestamp_range[0] or timestamp > self._timestamp_range[1]:
+                        continue
+            if len(self._pix_points) == 0:
+                self._pix_index.append(i)
+            self.draw_line(img, pixmapper, self.points[i], self.points[indexes[k+1]],
+                           colour, self.linewidth)
+            self._pix_index.append(indexes[k+1])
+
+    def selection_info(self):
+        '''return the index of the selected point in the full track'''
+        if self._selected_vertex is None or self._selected_vertex >= len(self._pix_index):
+            return self._selected_vertex
+        return self._pix_index[self._selected_vertex]
+
+
 class SlipGrid(SlipObject):
     '''a map grid'''
     def __init__(self, key, layer, colour, linewidth):
@@ -2,11 +2,12 @@
 send NTRIP data to flight controller
 """
 
-import random
 import time
 
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import ntrip
+from MAVProxy.modules.lib import rtcm3
+from MAVProxy.modules.lib import rtcm_inject
 from MAVProxy.modules.lib import mp_settings
 
 
@@ -28,9 +29,14 @@ class NtripModule(mp_module.MPModule):
                          ["<status>",
                           "<start>",
                           "<stop>",
-                          "set (NTRIPSETTING)"])
+                          "set (NTRIPSETTING)",
+                          "inject <status|reset>",
+                          "inject set (RTCMINJECTSETTING)"])
         self.add_completion_function('(NTRIPSETTING)',
                                      self.ntrip_settings.completion)
+        self.injector = rtcm_inject.get_injector(mpstate)
+        self.add_completion_function('(RTCMINJECTSETTING)',
+                                     self.injector.settings.completion)
         self.pos = None
         self.pkt_count = 0
         self.last_pkt = None
@@ -63,10 +69,11 @@ class NtripModule(mp_module.MPModule):
         '''called on idle'''
         if self.start_pending and self.ntrip is None and self.pos is not None:
             self.cmd_start()
+        self.injector.update()
         if self.ntrip is None:
             return
-        data = self.ntrip.read()
-        if data is None:
+        packets = self.ntrip.read_packets()
+        if packets is None:
             now = time.time()
             if (self.last_pkt is not None and
                 now - self.last_pkt > 15 and
@@ -79,46 +86,28 @@ class NtripModule(mp_module.MPModule):
         if time.time() - self.ntrip.dt_last_gga_sent > 2:
             self.ntrip.setPosition(self.pos[0], self.pos[1])
             self.ntrip.send_gga()
+        for data in packets:
+            self.send_rtcm(data)
+
+    def send_rtcm(self, data):
+        '''send one RTCM3 packet to the vehicle'''
         self.log_rtcm(data)
 
-        rtcm_id = self.ntrip.get_ID()
+        rtcm_id = rtcm3.packet_ID(data)
         if not rtcm_id in self.id_counts:
             self.id_counts[rtcm_id] = 0
             self.last_by_id[rtcm_id] = data[:]
         self.id_counts[rtcm_id] += 1
 
-        blen = len(data)
-        if blen > 4*180:
-            # can't send this with GPS_RTCM_DATA
-            return
-        total_len = blen
-        self.rate_total += blen * self.ntrip_settings.sendmul
-
-        if blen > 180:
-            flags = 1 # fragmented
+        self.rate_total += len(data) * self.ntrip_settings.sendmul
+        if self.ntrip_settings.sendalllinks:
+            links = 'all'
         else:
-            flags = 0
-        # add in the sequence number
-        flags |= (self.pkt_count & 0x1F) << 3
-
-        fragment = 0
-        while blen > 0:
-            send_data = bytearray(data[:180])
-            frag_len = len(send_data)
-            data = data[frag_len:]
-            if frag_len < 180:
-                send_data.extend(bytearray([0]*(180-frag_len)))
-            if self.ntrip_settings.sendalllinks:
-                links = self.mpstate.mav_master
-            else:
-                links = [self.master]
-            for link in links:
-                for d in range(self.ntrip_settings.sendmul):
-                    if random.random() * 100 < self.ntrip_settings.frag_drop_pct:
-                        continue
-                    link.mav.gps_rtcm_data_send(flags | (fragment<<1), frag_len, send_data)
-            fragment += 1
-            blen -= frag_len
+            links = None
+        self.injector.queue(data, 'ntrip',
+                            links=links,
+                            repeat=self.ntrip_settings.sendmul,
+                            drop_pct=self.ntrip_settings.frag_drop_pct)
         self.pkt_count += 1
 
         now = time.time()
@@ -133,7 +122,7 @@ class NtripModule(mp_module.MPModule):
     def cmd_ntrip(self, args):
         '''ntrip command handling'''
         if len(args) <= 0:
-            print("Usage: ntrip <start|stop|status|set>")
+            print("Usage: ntrip <start|stop|status|set|inject>")
             return
         if args[0] == "start":
             self.cmd_start()
@@ -144,6 +133,8 @@ class NtripModule(mp_module.MPModule):
             self.ntrip_status()
         elif args[0] == "set":
             self.ntrip_settings.command(args[1:])
+        elif args[0] == "inject":
+            self.injector.command(args[1:])
 
     def ntrip_status(self):
         '''show ntrip status'''
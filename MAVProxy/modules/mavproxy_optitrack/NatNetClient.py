@@ -54,6 +54,9 @@ DoubleValue = struct.Struct( '<d' )
 NNIntValue = struct.Struct( '<I')
 FPCalMatrixRow = struct.Struct( '<ffffffffffff' )
 FPCorners      = struct.Struct( '<ffffffffffff')
+Int16Value = struct.Struct( '<h' )
+Int32Value = struct.Struct( '<i' )
+RigidBodyPose = struct.Struct( '<i3f4f' )
 
 class NatNetClient:
     # print_level = 0 off
@@ -83,6 +86,10 @@ class NatNetClient:
         self.rigid_body_listener = None
         self.new_frame_listener  = None
 
+        # Set this to a callback method to receive a list of (id, pos, rot, tracking_valid) for all
+        # rigid bodies in each frame. Frames are then decoded on a fast path that skips all other data.
+        self.rigid_body_frame_listener = None
+
         # Set Application Name
         self.__application_name = "Not Set"
 
@@ -839,6 +846,65 @@ class NatNetClient:
         return offset, frame_suffix_data
 
 
+    # Unpack only the rigid bodies from a motion capture frame message
+    def __unpack_rigid_bodies_fast( self, data, offset, major, minor):
+        """return list of (id, pos, rot, tracking_valid) without decoding other frame data"""
+        view = memoryview( data )
+        # skip frame number
+        offset += 4
+        # NatNet 4.1 and later give the byte size of each data block, allowing it to be skipped
+        has_sizes = ( (major == 4) and (minor > 0) ) or (major > 4)
+
+        # Markerset data
+        count, = Int32Value.unpack_from( view, offset )
+        offset += 4
+        if has_sizes:
+            size_in_bytes, = Int32Value.unpack_from( view, offset )
+            offset += 4 + size_in_bytes
+        else:
+            for i in range( count ):
+                offset = data.index( b'\0', offset ) + 1
+                marker_count, = Int32Value.unpack_from( view, offset )
+                offset += 4 + 12 * marker_count
+
+        # Legacy other markers
+        count, = Int32Value.unpack_from( view, offset )
+        offset += 4
+        if has_sizes:
+            size_in_bytes, = Int32Value.unpack_from( view, offset )
+            offset += 4 + size_in_bytes
+        else:
+            offset += 12 * count
+
+        # Rigid bodies
+        rigid_body_count, = Int32Value.unpack_from( view, offset )
+        offset += 4
+        if has_sizes:
+            offset += 4
+
+        has_markers = major < 3 and major != 0
+        has_error = major >= 2
+        has_param = ( ( major == 2 ) and ( minor >= 6 ) ) or major > 2
+        rigid_bodies = []
+        for i in range( rigid_body_count ):
+            new_id, px, py, pz, qx, qy, qz, qw = RigidBodyPose.unpack_from( view, offset )
+            offset += RigidBodyPose.size
+            if has_markers:
+                # positions, then IDs and sizes from version 2.0
+                marker_count, = Int32Value.unpack_from( view, offset )
+                offset += 4 + 12 * marker_count
+                if major >= 2:
+                    offset += 8 * marker_count
+            if has_error:
+                offset += 4
+            tracking_valid = True
+            if has_param:
+                param, = Int16Value.unpack_from( view, offset )
+                offset += 2
+                tracking_valid = ( param & 0x01 ) != 0
+            rigid_bodies.append( (new_id, (px, py, pz), (qx, qy, qz, qw), tracking_valid) )
+        return rigid_bodies
+
     # Unpack data from a motion capture frame message
     def __unpack_mocap_data( self, data : bytes, packet_size, major, minor):
         mocap_data = MoCapData.MoCapData()
@@ -1628,12 +1694,26 @@ class NatNetClient:
             trace( "Message ID  : %3.1d NAT_FRAMEOFDATA"% message_id )
             trace( "Packet Size : ", packet_size )
 
+            if self.rigid_body_frame_listener is not None and print_level == 0:
+                try:
+                    rigid_bodies = self.__unpack_rigid_bodies_fast( data, offset, major, minor )
+                except (struct.error, ValueError):
+                    trace( "ERROR: Truncated frame of data" )
+                    return message_id
+                self.rigid_body_frame_listener( rigid_bodies )
+                return message_id
+
             offset_tmp, mocap_data = self.__unpack_mocap_data( data[offset:], packet_size, major, minor )
             offset += offset_tmp
+            if self.rigid_body_frame_listener is not None:
+                # tracking valid flag is only sent from version 2.6
+                has_param = ( ( major == 2 ) and ( minor >= 6 ) ) or major > 2
+                self.rigid_body_frame_listener( [ (rb.id_num, tuple(rb.pos), tuple(rb.rot), rb.tracking_valid or not has_param)
+                                                  for rb in mocap_data.rigid_body_data.rigid_body_list ] )
             #print("MoCap Frame: %d\n"%(mocap_data.prefix_data.frame_number))
-            # get a string version of the data for output
-            mocap_data_str=mocap_data.get_as_string()
             if print_level >= 1:
+                # get a string version of the data for output
+                mocap_data_str=mocap_data.get_as_string()
                 print("%s\n"%mocap_data_str)
 
         elif message_id == self.NAT_MODELDEF :
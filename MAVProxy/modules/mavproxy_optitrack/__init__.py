@@ -3,6 +3,7 @@
 # yuan-chu tai
 
 import time
+import threading
 from pymavlink import mavutil
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_util
@@ -21,25 +22,108 @@ class optitrack(mp_module.MPModule):
             ('print_lv', int, 0),
             ('multicast', bool, True)]
         )
-        self.add_command('optitrack', self.cmd_optitrack, "optitrack control", ['<start>', '<stop>', 'set (OPTITRACKSETTING)'])
+        self.add_command('optitrack', self.cmd_optitrack, "optitrack control",
+                         ['<start>', '<stop>', 'map', 'unmap', 'set (OPTITRACKSETTING)'])
         self.streaming_client = NatNetClient.NatNetClient()
-        # Configure the streaming client to call our rigid body handler on the emulator to send data out.
-        self.streaming_client.rigid_body_listener = self.receive_rigid_body_frame
-        self.last_msg_time = 0
+        # Configure the streaming client to call our rigid body handler with all rigid bodies in each frame
+        self.streaming_client.rigid_body_frame_listener = self.receive_rigid_body_frame
+        # map of rigid body ID to vehicle sysid. When empty obj_id is sent to the current vehicle
+        self.body_map = {}
+        # time each rigid body was last queued, only used by the data thread
+        self.last_msg_time = {}
+        # latest sample per rigid body, handed from the data thread to idle_task
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # links already warned about carrying more than one mapped vehicle
+        self.shared_links_warned = set()
         self.started = False
 
-    # This is a callback function that gets connected to the NatNet client. It is called once per rigid body per frame
-    def receive_rigid_body_frame(self, new_id, position, rotation):
-        if (new_id == self.optitrack_settings.obj_id):
-            now = time.time()
-            if (now - self.last_msg_time) > (self.optitrack_settings.msg_intvl_ms * 0.001):
-                time_us = int(now * 1.0e6)
-                self.master.mav.att_pos_mocap_send(time_us, (rotation[3], rotation[0], rotation[2], -rotation[1]), position[0], position[2], -position[1])
-                self.last_msg_time = now
+    # This is a callback function that gets connected to the NatNet client. It is called once per frame
+    # from the NatNet data thread, so only queues samples for idle_task to send
+    def receive_rigid_body_frame(self, rigid_bodies):
+        body_map = self.body_map
+        if not body_map:
+            body_map = {self.optitrack_settings.obj_id: None}
+        now = time.time()
+        intvl = self.optitrack_settings.msg_intvl_ms * 0.001
+        queued = []
+        for (new_id, position, rotation, tracking_valid) in rigid_bodies:
+            if new_id not in body_map or not tracking_valid:
+                continue
+            if (now - self.last_msg_time.get(new_id, 0)) <= intvl:
+                continue
+            self.last_msg_time[new_id] = now
+            queued.append((new_id, (int(now * 1.0e6), position, rotation)))
+        if queued:
+            with self.pending_lock:
+                self.pending.update(queued)
+
+    def idle_task(self):
+        '''send queued mocap samples'''
+        if not self.pending:
+            return
+        with self.pending_lock:
+            pending = self.pending
+            self.pending = {}
+        links = self.mapped_links()
+        for (new_id, (time_us, position, rotation)) in pending.items():
+            if not self.body_map:
+                masters = [self.master]
+            else:
+                masters = links.get(self.body_map.get(new_id), [])
+            for master in masters:
+                master.mav.att_pos_mocap_send(time_us, (rotation[3], rotation[0], rotation[2], -rotation[1]),
+                                              position[0], position[2], -position[1])
+
+    def mapped_links(self):
+        '''return dict of mapped sysid to the links to send its rigid body on. ATT_POS_MOCAP has no
+        target system, so every vehicle on a link uses every body sent on it. Links carrying more than
+        one mapped vehicle are not used, and sysids not seen on any link get no links'''
+        links = {}
+        for sysid in set(self.body_map.values()):
+            links[sysid] = self.mpstate.sysid_links(sysid)
+        for master in self.mpstate.mav_master:
+            sharing = sorted([sysid for sysid in links if master in links[sysid]])
+            if len(sharing) < 2:
+                continue
+            if master.linknum not in self.shared_links_warned:
+                self.shared_links_warned.add(master.linknum)
+                print("optitrack: not sending on link %u, it carries mapped sysids %s" % (
+                    master.linknum, " ".join([str(s) for s in sharing])))
+            for sysid in sharing:
+                links[sysid].remove(master)
+        return links
 
     def usage(self):
         '''show help on command line options'''
-        return "Usage: optitrack <start|stop|set>"
+        return "Usage: optitrack <start|stop|map|unmap|set>"
+
+    def cmd_map(self, args):
+        '''map rigid body IDs to vehicle sysids'''
+        if len(args) == 0:
+            if not self.body_map:
+                print("Sending rigid body %u to current vehicle" % self.optitrack_settings.obj_id)
+            for new_id in sorted(self.body_map.keys()):
+                print("Rigid body %u -> sysid %u" % (new_id, self.body_map[new_id]))
+            return
+        if len(args) != 2:
+            print("Usage: optitrack map <BODY_ID> <SYSID>")
+            print("Each mapped vehicle needs its own link, as ATT_POS_MOCAP goes to all vehicles on a link")
+            return
+        self.body_map[int(args[0])] = int(args[1])
+        self.shared_links_warned = set()
+        if len(self.mpstate.sysid_links(int(args[1]))) == 0:
+            print("sysid %u not seen on any link, not sending until it is" % int(args[1]))
+
+    def cmd_unmap(self, args):
+        '''remove rigid body ID mappings'''
+        if len(args) != 1:
+            print("Usage: optitrack unmap <BODY_ID|all>")
+            return
+        if args[0] == "all":
+            self.body_map = {}
+        else:
+            self.body_map.pop(int(args[0]), None)
 
     def cmd_start(self):
         self.streaming_client.set_client_address(self.optitrack_settings.client)
@@ -59,6 +143,10 @@ class optitrack(mp_module.MPModule):
             if self.started:
                 self.started = False
                 self.streaming_client.shutdown()
+        elif args[0] == "map":
+            self.cmd_map(args[1:])
+        elif args[0] == "unmap":
+            self.cmd_unmap(args[1:])
         elif args[0] == "set":
             self.optitrack_settings.command(args[1:])
         else:
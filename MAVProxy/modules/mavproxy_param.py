@@ -15,6 +15,7 @@ from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import param_help
 from MAVProxy.modules.lib import param_ftp
+from MAVProxy.modules.lib import param_fleet
 
 if mp_util.has_wxpython:
     from MAVProxy.modules.lib.mp_menu import MPMenuItem
@@ -55,6 +56,7 @@ class ParamState:
         self.ftp_failed = False
         self.ftp_started = False
         self.ftp_count = None
+        self.ftp_decoder = None
         self.ftp_send_param = None
         self.mpstate = mpstate
         self.sysid = sysid
@@ -65,13 +67,65 @@ class ParamState:
 
         # dictionary of ParamSet objects we are processing:
         self.parameters_to_set = {}
+        # number of parameter sets allowed in flight, adapted to the link
+        self.set_window = ParamState.SET_WINDOW_INITIAL
+        self.batches = []
+        self.ftp_load_fallback = None
+        self.last_param_value = 0
         # a Queue which onto which ParamSet objects can be pushed in a
         # thread-safe manner:
         self.parameters_to_set_input_queue = Queue.Queue()
 
+    SET_WINDOW_INITIAL = 8
+    SET_WINDOW_MIN = 2
+    SET_WINDOW_MAX = 64
+    # hold parameter sets while the radio transmit buffer is below this percentage
+    SET_TXBUF_MIN = 30
+    SET_RETRY_MAX = 8
+
+    class ParamBatch():
+        '''progress of a group of parameter sets, such as a param load'''
+        def __init__(self, description, count):
+            self.description = description
+            self.count = count
+            self.done = 0
+            self.failed = 0
+            # sets replaced by a later set of the same parameter
+            self.superseded = 0
+            self.start = time.time()
+
+        def completed(self):
+            return self.done + self.failed + self.superseded
+
+        def finished(self):
+            return self.completed() >= self.count
+
+        def eta(self):
+            '''estimated seconds to completion, or None'''
+            completed = self.completed()
+            if completed == 0:
+                return None
+            dt = time.time() - self.start
+            return dt * (self.count - completed) / completed
+
+        def status(self):
+            ret = "Param set %u/%u" % (self.completed(), self.count)
+            eta = self.eta()
+            if eta is not None and not self.finished():
+                ret += " ETA %.0fs" % eta
+            return ret
+
+        def summary(self):
+            ret = "Set %u parameters from %s in %.1fs" % (self.done, self.description, time.time() - self.start)
+            if self.failed > 0:
+                ret += " (%u failed)" % self.failed
+            if self.superseded > 0:
+                ret += " (%u replaced by a later set)" % self.superseded
+            return ret
+
     class ParamSet():
         '''class to hold information about a parameter set being attempted'''
-        def __init__(self, master, name, value, param_type=None, attempts=None):
+        def __init__(self, master, name, value, param_type=None, attempts=None, batch=None, old_value=None):
             self.master = master
             self.name = name
             self.value = value
@@ -79,6 +133,8 @@ class ParamState:
             self.attempts_remaining = attempts
             self.retry_interval = 1  # seconds
             self.last_value_received = None
+            self.batch = batch
+            self.old_value = old_value
 
             if self.attempts_remaining is None:
                 self.attempts_remaining = 3
@@ -128,6 +184,9 @@ class ParamState:
                 self.attempts_remaining = 0
                 return
             # print(f"Sending set attempts-remaining={self.attempts_remaining}")
+            if self.request_sent != 0:
+                # back off exponentially on retries
+                self.retry_interval = min(self.retry_interval * 2, ParamState.SET_RETRY_MAX)
             self.master.param_set_send(
                 self.name.upper(),
                 numeric_value,
@@ -136,15 +195,23 @@ class ParamState:
             self.request_sent = time.time()
             self.attempts_remaining -= 1
 
-        def expired(self):
+        def in_flight(self, now):
+            '''true if we are waiting for a reply to a set'''
+            return self.request_sent != 0 and now - self.request_sent <= self.retry_interval
+
+        def expired(self, now=None):
             if self.attempts_remaining > 0:
                 return False
-            return time.time() - self.request_sent > self.retry_interval
+            if now is None:
+                now = time.time()
+            return now - self.request_sent > self.retry_interval
 
-        def due_for_retry(self):
+        def due_for_retry(self, now=None):
             if self.attempts_remaining <= 0:
                 return False
-            return time.time() - self.request_sent > self.retry_interval
+            if now is None:
+                now = time.time()
+            return now - self.request_sent > self.retry_interval
 
         def handle_PARAM_VALUE(self, m, value):
             '''handle PARAM_VALUE packet m which has already been checked for a
@@ -172,32 +239,87 @@ class ParamState:
         try:
             while True:
                 new_parameter_to_set = self.parameters_to_set_input_queue.get(block=False)
+                old = self.parameters_to_set.get(new_parameter_to_set.name, None)
+                if old is not None and old.batch is not None:
+                    # the old set will never complete, so don't leave its batch waiting for it
+                    old.batch.superseded += 1
                 self.parameters_to_set[new_parameter_to_set.name] = new_parameter_to_set
         except Empty:
             pass
 
-        # now send any parameter-sets which are due to be sent out,
-        # either because they are new or because we need to retry:
-        count = 0
+        if len(self.parameters_to_set) == 0:
+            self.update_batches()
+            return
+
+        # purge expired parameter-sets and count those awaiting a reply
+        now = time.time()
+        in_flight = 0
         keys_to_remove = []  # remove entries after iterating the dict
         for (key, parameter_to_set) in self.parameters_to_set.items():
-            if parameter_to_set.expired():
+            if parameter_to_set.expired(now):
                 parameter_to_set.print_expired_message()
                 keys_to_remove.append(key)
+                if parameter_to_set.batch is not None:
+                    parameter_to_set.batch.failed += 1
                 continue
-            if not parameter_to_set.due_for_retry():
-                continue
-            # send parameter set:
-            parameter_to_set.send_set()
-            # rate-limit to 10 items per call:
-            count += 1
-            if count > 10:
-                break
-
-        # complete purging of expired parameter-sets:
+            if parameter_to_set.in_flight(now):
+                in_flight += 1
         for key in keys_to_remove:
             del self.parameters_to_set[key]
 
+        # now send any parameter-sets which are due to be sent out,
+        # either because they are new or because we need to retry,
+        # keeping the number awaiting a reply within the window
+        if not self.link_busy(now):
+            lost = False
+            for parameter_to_set in self.parameters_to_set.values():
+                if in_flight >= int(self.set_window):
+                    break
+                if not parameter_to_set.due_for_retry(now):
+                    continue
+                if parameter_to_set.request_sent != 0:
+                    lost = True
+                parameter_to_set.send_set()
+                in_flight += 1
+            if lost:
+                # shrink window on loss
+                self.set_window = max(self.set_window * 0.5, ParamState.SET_WINDOW_MIN)
+
+        self.update_batches()
+
+    def link_busy(self, now):
+        '''check if the radio on a link to this vehicle reports a nearly full transmit buffer'''
+        links = []
+        for (linknum, vehicles) in self.mpstate.vehicle_link_map.items():
+            if linknum < len(self.mpstate.mav_master) and any(v[0] == self.sysid[0] for v in vehicles):
+                links.append(self.mpstate.mav_master[linknum])
+        if len(links) == 0:
+            # not heard from the vehicle yet, sets go out on the selected link
+            master = self.mpstate.master()
+            if master is None:
+                return False
+            links = [master]
+        for master in links:
+            m = master.messages.get('RADIO_STATUS', None)
+            if m is None or now - getattr(m, '_timestamp', 0) > 5:
+                continue
+            if m.txbuf < ParamState.SET_TXBUF_MIN:
+                return True
+        return False
+
+    def update_batches(self):
+        '''report progress of parameter set batches'''
+        if len(self.batches) == 0:
+            return
+        for batch in self.batches[:]:
+            if batch.finished():
+                print(batch.summary())
+                self.batches.remove(batch)
+        if len(self.batches) > 0:
+            self.mpstate.console.set_status('Params', self.batches[0].status())
+        else:
+            self.mpstate.console.set_status('Params', 'Param %u/%u' % (len(self.mav_param_set), self.mav_param_count))
+
     def use_ftp(self):
         '''return true if we should try ftp for download'''
         if self.ftp_failed:
@@ -251,6 +373,7 @@ class ParamState:
             # Note: the xml specifies param_index is a uint16, so -1 in that field will show as 65535
             # We accept both -1 and 65535 as 'unknown index' to future proof us against someday having that
             # xml fixed.
+            self.last_param_value = time.time()
             if self.fetch_set is not None:
                 self.fetch_set.discard(m.param_index)
             if m.param_index != -1 and m.param_index != 65535 and m.param_index not in self.mav_param_set:
@@ -278,9 +401,15 @@ class ParamState:
             # if we were setting this parameter then check it's the
             # value we want and, if so, stop setting the parameter
             try:
-                if self.parameters_to_set[param_id].handle_PARAM_VALUE(m, value):
+                parameter_to_set = self.parameters_to_set[param_id]
+                if parameter_to_set.handle_PARAM_VALUE(m, value):
                     # print(f"removing set of param_id ({self.parameters_to_set[param_id].value} vs {value})")
                     del self.parameters_to_set[param_id]
+                    self.set_window = min(self.set_window + 1, ParamState.SET_WINDOW_MAX)
+                    if parameter_to_set.batch is not None:
+                        parameter_to_set.batch.done += 1
+                        if parameter_to_set.old_value is not None:
+                            print("changed %s from %f to %f" % (param_id, parameter_to_set.old_value, value))
             except KeyError:
                 pass
 
@@ -311,6 +440,17 @@ class ParamState:
                         self.fetch_set.add(idx)
                         count += 1
 
+    def fetch_missing(self, master, max_count):
+        '''request up to max_count missing parameters by index, addressed
+        to this sysid rather than the current target'''
+        missing = set(range(self.mav_param_count)).difference(self.mav_param_set)
+        for idx in sorted(missing)[:max_count]:
+            master.mav.param_request_read_send(self.sysid[0], self.sysid[1], b"", idx)
+
+    def complete(self):
+        '''true if we have all parameters'''
+        return self.mav_param_count != 0 and len(self.mav_param_set) == self.mav_param_count
+
     def param_use_xml_filepath(self, filepath):
         self.param_help.xml_filepath = filepath
 
@@ -329,6 +469,7 @@ class ParamState:
             return
         self.ftp_started = True
         self.ftp_count = None
+        self.ftp_decoder = param_ftp.ParamDecoder()
         ftp.cmd_get([
             "@PARAM/param.pck?withdefaults=1",
         ],
@@ -367,20 +508,24 @@ class ParamState:
             (mav.srcSystem, mav.srcComponent) = id_saved
 
     def ftp_callback_progress(self, fh, total_size):
-        '''callback as read progresses'''
-        if self.ftp_count is None and total_size >= 6:
-            ofs = fh.tell()
-            fh.seek(0)
-            buf = fh.read(6)
+        '''callback as read progresses, decoding the parameters received so far'''
+        decoder = self.ftp_decoder
+        if decoder is None or decoder.failed:
+            return
+        # only decode up to the first gap in the file
+        ofs = fh.tell()
+        limit = ofs
+        ftp = self.mpstate.module('ftp')
+        if ftp is not None:
+            for (gap_ofs, gap_len) in ftp.read_gaps:
+                limit = min(limit, gap_ofs)
+        if limit > decoder.offset:
+            fh.seek(decoder.offset)
+            decoder.add(fh.read(limit - decoder.offset))
             fh.seek(ofs)
-            magic2, num_params, total_params = struct.unpack("<HHH", buf)
-            if magic2 == 0x671b or magic2 == 0x671c:
-                self.ftp_count = total_params
-        # approximate count
-        if self.ftp_count is not None:
-            # each entry takes 11 bytes on average
-            per_entry_size = 11
-            done = min(int(total_size / per_entry_size), self.ftp_count-1)
+        if decoder.total_params is not None:
+            self.ftp_count = decoder.total_params
+            done = min(decoder.count(), self.ftp_count-1)
             self.mpstate.console.set_status('Params', 'Param %u/%u' % (done, self.ftp_count))
 
     def ftp_callback(self, fh):
@@ -393,28 +538,37 @@ class ParamState:
 
         # magic = 0x671b
         # magic_defaults = 0x671c
-        data = fh.read()
-        pdata = param_ftp.ftp_param_decode(data)
-        if pdata is None or len(pdata.params) == 0:
+        decoder = self.ftp_decoder
+        self.ftp_decoder = None
+        pdata = None
+        if decoder is not None and not decoder.failed:
+            # decode whatever arrived after the last progress callback
+            fh.seek(decoder.offset)
+            decoder.add(fh.read())
+            pdata = decoder.finish()
+        if pdata is None:
+            fh.seek(0)
+            pdata = param_ftp.ftp_param_decode(fh.read())
+        if pdata is None or len(pdata) == 0:
             return
-        with_defaults = pdata.defaults is not None
+        with_defaults = pdata.default_values is not None
 
         self.param_types = {}
         self.mav_param_set = set()
         self.fetch_one = dict()
         self.fetch_set = None
         self.mav_param.clear()
-        total_params = len(pdata.params)
+        total_params = len(pdata)
         self.mav_param_count = total_params
 
-        idx = 0
-        for (name, v, ptype) in pdata.params:
+        names = pdata.name_strings()
+        values = pdata.value_list()
+        for idx in range(total_params):
             # we need to set it to REAL32 to ensure we use write value for param_set
-            name = str(name.decode('utf-8'))
+            name = names[idx]
             self.param_types[name] = mavutil.mavlink.MAV_PARAM_TYPE_REAL32
             self.mav_param_set.add(idx)
-            self.mav_param[name] = v
-            idx += 1
+            self.mav_param[name] = values[idx]
 
         self.ftp_failed = False
         self.mpstate.console.set_status('Params', 'Param %u/%u' % (total_params, total_params))
@@ -425,13 +579,13 @@ class ParamState:
 
         if with_defaults:
             self.default_params = mavparm.MAVParmDict()
-            for (name, v, ptype) in pdata.defaults:
-                name = str(name.decode('utf-8'))
-                self.default_params[name] = v
+            defaults = pdata.value_list(pdata.default_values)
+            for idx in range(total_params):
+                self.default_params[names[idx]] = defaults[idx]
             if self.logdir:
                 defaults_path = os.path.join(self.logdir, "defaults.parm")
                 self.default_params.save(defaults_path, '*', verbose=False)
-                print("Saved %u defaults to %s" % (len(pdata.defaults), defaults_path))
+                print("Saved %u defaults to %s" % (total_params, defaults_path))
 
     def fetch_all(self, master):
         '''force refetch of parameters'''
@@ -646,7 +800,7 @@ class ParamState:
         # Update the parameter
         self.set_parameter(master, uname, value, attempts=3, param_type=ptype)
 
-    def set_parameter(self, master, name, value, attempts=None, param_type=None):
+    def set_parameter(self, master, name, value, attempts=None, param_type=None, batch=None, old_value=None):
         '''convenient intermediate method which determines parameter type for
         lazy callers'''
         if param_type is None:
@@ -658,8 +812,46 @@ class ParamState:
             value,
             attempts=attempts,
             param_type=param_type,
+            batch=batch,
+            old_value=old_value,
         ))
 
+    def set_parameters(self, master, newparm, description, show_changes=True):
+        '''set a dictionary of parameters as one batch, with progress reporting'''
+        batch = ParamState.ParamBatch(description, len(newparm))
+        if batch.count == 0:
+            return None
+        self.batches.append(batch)
+        for name in mp_util.sorted_natural(newparm.keys()):
+            old_value = self.mav_param.get(name, None) if show_changes else None
+            self.set_parameter(master, name, newparm[name], attempts=3, batch=batch, old_value=old_value)
+        return batch
+
+    def param_load(self, master, filename, param_wildcard, check=True):
+        '''load parameters from a file, setting those that differ from the
+        vehicle. Large change sets use ftp when available'''
+        newparm = mavparm.MAVParmDict()
+        if not newparm.load(filename, param_wildcard, check=False):
+            return
+        if check:
+            for k in list(newparm.keys()):
+                if k not in self.mav_param:
+                    print("Unknown parameter %s" % k)
+                    newparm.pop(k)
+                elif abs(self.mav_param[k] - newparm[k]) <= newparm.mindelta:
+                    newparm.pop(k)
+        changed = len(newparm.keys())
+        print("Changing %u parameters" % changed)
+        if changed == 0:
+            return
+        threshold = self.mpstate.settings.param_ftp_load
+        if (threshold > 0 and changed >= threshold and
+                self.use_ftp() and self.mpstate.module('ftp') is not None):
+            self.ftp_load_fallback = (filename, newparm)
+            self.ftp_send(newparm)
+            return
+        self.set_parameters(master, newparm, filename)
+
     def param_revert(self, master, args):
         '''handle param revert'''
         defaults = self.default_params
@@ -671,6 +863,7 @@ class ParamState:
             return
         wildcard = args[0].upper()
         count = 0
+        revert = {}
         for p in self.mav_param:
             p = str(p).upper()
             if not fnmatch.fnmatch(p, wildcard):
@@ -684,8 +877,9 @@ class ParamState:
             if s1 == s2:
                 continue
             print("Reverting %-16.16s  %s -> %s" % (p, s1, s2))
-            self.set_parameter(master, p, defaults[p], attempts=3)
+            revert[p] = defaults[p]
             count += 1
+        self.set_parameters(master, revert, "defaults", show_changes=False)
         print("Reverted %u parameters" % count)
 
     def handle_command(self, master, mpstate, args):
@@ -775,7 +969,7 @@ class ParamState:
                 param_wildcard = args[2]
             else:
                 param_wildcard = "*"
-            self.mav_param.load(args[1].strip('"'), param_wildcard, master)
+            self.param_load(master, args[1].strip('"'), param_wildcard)
         elif args[0] == "preload":
             if len(args) < 2:
                 print("Usage: param preload <filename>")
@@ -789,7 +983,7 @@ class ParamState:
                 param_wildcard = args[2]
             else:
                 param_wildcard = "*"
-            self.mav_param.load(args[1].strip('"'), param_wildcard, master, check=False)
+            self.param_load(master, args[1].strip('"'), param_wildcard, check=False)
         elif args[0] == "ftpload":
             if len(args) < 2:
                 print("Usage: param ftpload <filename> [wildcard]")
@@ -823,6 +1017,10 @@ class ParamState:
             self.param_show(pattern, verbose)
         elif args[0] == "status":
             print("Have %u/%u params" % (len(self.mav_param_set), self.mav_param_count))
+            for batch in self.batches:
+                print(batch.status())
+            if len(self.parameters_to_set) > 0:
+                print("%u parameter sets pending, window %u" % (len(self.parameters_to_set), int(self.set_window)))
         else:
             print(usage)
 
@@ -842,8 +1040,15 @@ class ParamState:
 
     def ftp_upload_callback(self, dlen):
         '''callback on ftp put completion'''
+        fallback = self.ftp_load_fallback
+        self.ftp_load_fallback = None
         if dlen is None:
             print("Failed to send parameters")
+            self.ftp_send_param = None
+            if fallback is not None:
+                (filename, newparm) = fallback
+                print("Setting parameters with PARAM_SET")
+                self.set_parameters(self.mpstate.master(), newparm, filename)
         else:
             if self.ftp_send_param is not None:
                 for k in mp_util.sorted_natural(self.ftp_send_param.keys()):
@@ -886,18 +1091,22 @@ class ParamState:
             return
         newparm = mavparm.MAVParmDict()
         newparm.load(filename, param_wildcard, check=False)
-        fh = SIO()
         for k in mp_util.sorted_natural(newparm.keys()):
             v = newparm.get(k)
             oldv = self.mav_param.get(k, None)
             if oldv is not None and abs(oldv - v) <= newparm.mindelta:
                 # not changed
                 newparm.pop(k)
-        count = len(newparm.keys())
-        if count == 0:
+        if len(newparm.keys()) == 0:
             print("No parameter changes")
             return
+        self.ftp_send(newparm)
 
+    def ftp_send(self, newparm):
+        '''send a dictionary of parameters with ftp'''
+        ftp = self.mpstate.module('ftp')
+        count = len(newparm.keys())
+        fh = SIO()
         fh.write(struct.pack("<HHH", 0x671b, count, count))
         last_param = ""
         for k in mp_util.sorted_natural(newparm.keys()):
@@ -936,6 +1145,9 @@ class ParamModule(mp_module.MPModule):
         self.pstate = {}
         self.check_new_target_system()
         self.menu_added_console = False
+        # fleet fetches in progress, by sysid
+        self.fleet_fetch = {}
+        self.fleet_period = mavutil.periodic_event(4)
         bitmask_indexes = "|".join(str(x) for x in range(32))
         self.add_command(
             'param', self.cmd_param, "parameter handling", [
@@ -943,6 +1155,7 @@ class ParamModule(mp_module.MPModule):
                 "<set|show|fetch|ftp|help|apropos|revert> (PARAMETER)",
                 "<load|save|savechanged|diff|forceload|ftpload> (FILENAME)",
                 "<set_xml_filepath> (FILEPATH)",
+                "<fleet> <fetch|diff|save|status>",
                 f"<bitmask> <toggle|set|clear> (PARAMETER) <{bitmask_indexes}>"
             ],
         )
@@ -1032,6 +1245,8 @@ class ParamModule(mp_module.MPModule):
         sysid = self.get_sysid()
         self.pstate[sysid].vehicle_name = self.vehicle_name
         self.pstate[sysid].param_help.vehicle_name = self.vehicle_name
+        if self.vehicle_name is not None:
+            self.pstate[sysid].param_help.preload()
         self.pstate[sysid].fetch_check(self.master)
         if self.module('console') is not None:
             if not self.menu_added_console:
@@ -1041,13 +1256,182 @@ class ParamModule(mp_module.MPModule):
             self.menu_added_console = False
 
         self.run_parameter_set_queues()
+        if len(self.fleet_fetch) > 0 and self.fleet_period.trigger():
+            self.fleet_update()
 
     def run_parameter_set_queues(self):
         for pstate in self.pstate.values():
             pstate.run_parameter_set_queue()
 
+    class FleetFetch():
+        '''progress of the parameter fetch from one vehicle of a fleet'''
+        def __init__(self, use_ftp):
+            self.start = time.time()
+            self.last_request = 0
+            self.use_ftp = use_ftp
+
+    FLEET_LIST_RETRY = 2.0
+    FLEET_FETCH_TIMEOUT = 120.0
+    FLEET_FETCH_MISSING = 20
+
+    def fleet_vehicles(self):
+        '''return sorted list of autopilot sysids we have seen'''
+        ret = []
+        for (sysid, pstate) in self.pstate.items():
+            autopilot = pstate.autopilot_type_by_sysid.get(sysid[0], None)
+            if autopilot is None or autopilot == mavutil.mavlink.MAV_AUTOPILOT_INVALID:
+                continue
+            ret.append(sysid)
+        return sorted(ret)
+
+    def fleet_table(self):
+        '''return a ParamTable of all vehicles with parameters'''
+        params = {}
+        for sysid in self.fleet_vehicles():
+            pstate = self.pstate[sysid]
+            if len(pstate.mav_param) > 0:
+                params[sysid] = pstate.mav_param
+        return param_fleet.ParamTable.from_params(params)
+
+    def fleet_start(self, sysids):
+        '''start fetching parameters from a list of vehicles at once. The
+        current target uses ftp if enabled, as the ftp module can only
+        talk to one vehicle, the others use PARAM_REQUEST_LIST'''
+        for sysid in sysids:
+            self.add_new_target_system(sysid)
+            pstate = self.pstate[sysid]
+            use_ftp = (sysid == self.get_sysid() and pstate.use_ftp() and
+                       self.module('ftp') is not None and not pstate.ftp_started)
+            pstate.mav_param_set = set()
+            pstate.mav_param_count = 0
+            pstate.fetch_set = None
+            self.fleet_fetch[sysid] = ParamModule.FleetFetch(use_ftp)
+            if use_ftp:
+                pstate.ftp_start()
+        print("Fetching parameters from %u vehicles" % len(sysids))
+        self.fleet_update()
+
+    def fleet_update(self):
+        '''progress parameter fetches from the fleet'''
+        if self.master is None:
+            return
+        now = time.time()
+        for (sysid, fetch) in list(self.fleet_fetch.items()):
+            pstate = self.pstate[sysid]
+            if pstate.complete():
+                print("Fleet: %u:%u received %u parameters in %.1fs" % (
+                    sysid[0], sysid[1], pstate.mav_param_count, now - fetch.start))
+                del self.fleet_fetch[sysid]
+                continue
+            if now - fetch.start > ParamModule.FLEET_FETCH_TIMEOUT:
+                print("Fleet: %u:%u fetch timed out with %u/%u parameters" % (
+                    sysid[0], sysid[1], len(pstate.mav_param_set), pstate.mav_param_count))
+                del self.fleet_fetch[sysid]
+                continue
+            if fetch.use_ftp:
+                if pstate.ftp_started:
+                    continue
+                if pstate.ftp_failed:
+                    # fall back to PARAM_REQUEST_LIST
+                    fetch.use_ftp = False
+            if fetch.use_ftp:
+                continue
+            # request on the links the vehicle is on, or the current link if not seen yet
+            links = self.mpstate.sysid_links(sysid[0])
+            if len(links) == 0:
+                links = [self.master]
+            if pstate.mav_param_count == 0:
+                if now - fetch.last_request > ParamModule.FLEET_LIST_RETRY:
+                    for master in links:
+                        master.mav.param_request_list_send(sysid[0], sysid[1])
+                    fetch.last_request = now
+            elif now - pstate.last_param_value > 1:
+                for master in links:
+                    pstate.fetch_missing(master, ParamModule.FLEET_FETCH_MISSING)
+        if len(self.fleet_fetch) == 0:
+            print("Fleet fetch complete")
+
+    def fleet_diff(self, args):
+        '''show parameters that differ between vehicles'''
+        wildcard = args[0] if len(args) > 0 else '*'
+        table = self.fleet_table()
+        if len(table.vehicles) < 2:
+            print("Need parameters from at least two vehicles")
+            return
+        diffs = table.diff(wildcard)
+        print("%-16.16s %s" % ("", " ".join(["%12s" % ("%u:%u" % v) for v in table.vehicles])))
+        for (name, values) in diffs:
+            vstr = []
+            for v in values:
+                if v is None:
+                    vstr.append("%12s" % "-")
+                else:
+                    vstr.append("%12.7g" % v)
+            print("%-16.16s %s" % (name, " ".join(vstr)))
+        print("%u of %u parameters differ across %u vehicles" % (len(diffs), len(table.names), len(table.vehicles)))
+
+    def fleet_save(self, args):
+        '''save parameters of all vehicles as CSV'''
+        if len(args) < 1:
+            print("Usage: param fleet save FILENAME (WILDCARD)")
+            return
+        wildcard = args[1] if len(args) > 1 else '*'
+        table = self.fleet_table()
+        count = table.save_csv(args[0], wildcard)
+        print("Saved %u parameters from %u vehicles to %s" % (count, len(table.vehicles), args[0]))
+
+    def parse_fleet_sysids(self, args):
+        '''parse SYSID or SYSID:COMPID arguments, using the target component when
+        no component is given. Returns None on bad input'''
+        sysids = []
+        for a in args:
+            try:
+                if ':' in a:
+                    (sysid, compid) = a.split(':', 1)
+                    sysids.append((int(sysid), int(compid)))
+                else:
+                    sysids.append((int(a), self.get_sysid()[1]))
+            except ValueError:
+                print("Bad vehicle %s" % a)
+                return None
+        return sysids
+
+    def cmd_fleet(self, args):
+        '''handle param fleet commands'''
+        usage = "Usage: param fleet <fetch|diff|save|status>"
+        if len(args) < 1:
+            print(usage)
+            return
+        if args[0] == "fetch":
+            if len(args) > 1:
+                sysids = self.parse_fleet_sysids(args[1:])
+                if sysids is None:
+                    print("Usage: param fleet fetch (SYSID[:COMPID]...)")
+                    return
+            else:
+                sysids = self.fleet_vehicles()
+            if len(sysids) == 0:
+                print("No vehicles found")
+                return
+            self.fleet_start(sysids)
+        elif args[0] == "diff":
+            self.fleet_diff(args[1:])
+        elif args[0] == "save":
+            self.fleet_save(args[1:])
+        elif args[0] == "status":
+            for sysid in self.fleet_vehicles():
+                pstate = self.pstate[sysid]
+                fetching = " (fetching)" if sysid in self.fleet_fetch else ""
+                print("%u:%u %u/%u params%s" % (
+                    sysid[0], sysid[1], len(pstate.mav_param_set), pstate.mav_param_count, fetching))
+        else:
+            print(usage)
+
     def cmd_param(self, args):
         '''control parameters'''
+        if len(args) > 0 and args[0] == "fleet":
+            self.cmd_fleet(args[1:])
+            return
         self.check_new_target_system()
         sysid = self.get_sysid()
         self.pstate[sysid].handle_command(self.master, self.mpstate, args)
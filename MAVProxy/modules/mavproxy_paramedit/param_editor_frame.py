@@ -13,6 +13,7 @@ import math
 from MAVProxy.modules.lib import multiproc
 from MAVProxy.modules.mavproxy_paramedit import checklisteditor as cle
 from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.lib import param_help
 from MAVProxy.modules.mavproxy_paramedit import ph_event
 ParamEditorEvent = ph_event.ParamEditorEvent
 
@@ -338,49 +339,46 @@ class ParamEditorFrame(wx.Frame):
                                                       wx.Colour(152, 251, 152))
         self.set_row_size(row)
         try:
-            for f in self.htree[name].field:
-                if f.get('name') == "Bitmask":
-                    bits = str(f).split(',')
-                    self.display_list.SetCellEditor(row, PE_OPTION, cle.GridCheckListEditor(bits, PE_VALUE, pvalue))
-                    val = ""
-                    binary = bin(int(pvalue))[2:]
-                    for b in bits:
-                        bopt = b.split(":")
-                        if len(bopt) != 2:
-                            continue
-                        bvalue = int(bopt[0])
-                        bstr = bopt[1].strip()
-                        if (int(pvalue) & (1 << bvalue)) != 0:
-                            val = val + "%u: %s\n" % (bvalue, bstr)
-                    val = val.strip()
-                    self.display_list.SetCellValue(row, PE_OPTION, str(val))
-                    self.set_row_size(row, 25*len(bits))
-                    return
+            bitmask = self.htree[name].field("Bitmask")
+            if bitmask is not None:
+                bits = bitmask.split(',')
+                self.display_list.SetCellEditor(row, PE_OPTION, cle.GridCheckListEditor(bits, PE_VALUE, pvalue))
+                val = ""
+                binary = bin(int(pvalue))[2:]
+                for b in bits:
+                    bopt = b.split(":")
+                    if len(bopt) != 2:
+                        continue
+                    bvalue = int(bopt[0])
+                    bstr = bopt[1].strip()
+                    if (int(pvalue) & (1 << bvalue)) != 0:
+                        val = val + "%u: %s\n" % (bvalue, bstr)
+                val = val.strip()
+                self.display_list.SetCellValue(row, PE_OPTION, str(val))
+                self.set_row_size(row, 25*len(bits))
+                return
         except Exception as e:
             pass
         try:
-            if self.htree[name].values is not None:
-                v = self.htree[name].findall('values')[0].getchildren()
-                for i in range(len(v)):
-                    if float(v[i].get('code')) == pvalue:
-                        selected = str(v[i].get('code'))+":"+str(v[i])
-                        sel_ind = i
-                    v[i] = str(v[i].get('code'))+":"+str(v[i])
+            values = self.htree[name].values
+            v = [str(code)+":"+text for (code, text) in values]
+            sel_ind = None
+            for i in range(len(values)):
+                if float(values[i][0]) == pvalue:
+                    sel_ind = i
+            if sel_ind is not None:
                 self.display_list.SetCellEditor(row, PE_OPTION, cle.GridDropListEditor(v, PE_VALUE, sel_ind))
-                self.display_list.SetCellValue(row, PE_OPTION, str(selected))
+                self.display_list.SetCellValue(row, PE_OPTION, v[sel_ind])
                 return
         except Exception as e:
             pass
         Range = {}
-        try:
-            for f in self.htree[name].field:
-                if f.get('name') == "Increment":
-                    Range['Increment'] = float(f)
-                if f.get('name') == "Range":
-                    Range['Min'] = float(str(f).split(' ')[0])
-                    Range['Max'] = float(str(f).split(' ')[1])
-        except Exception as e:
-            pass
+        info = self.htree.get(name, None)
+        if info is not None:
+            if info.increment is not None:
+                Range['Increment'] = info.increment
+            if info.range is not None:
+                (Range['Min'], Range['Max']) = info.range
         if len(Range) > 1:
             if len(Range) == 2:
                 Range['Increment'] = (float(Range['Max'])-float(Range['Min']))/10
@@ -401,18 +399,12 @@ class ParamEditorFrame(wx.Frame):
             desc = str(self.htree[name].get('humanName')) + "\n\n" + str(self.htree[name].get('documentation'))
         except Exception as e:
             desc = str(e)
-        try:
-            for f in self.htree[name].field:
-                if f.get('name') == "Units":
-                    unit = str(f)
-        except Exception as e:
-            unit = ""
-        try:
-            for f in self.htree[name].field:
-                if f.get('name') == "Range":
-                    option = "Range:"+str(f)
-        except Exception as e:
-            option = ""
+        info = self.htree.get(name, None)
+        if info is not None:
+            if info.units is not None:
+                unit = info.units
+            if info.field("Range") is not None:
+                option = "Range:"+info.field("Range")
         return(unit, option, desc)
 
     def Read_File(self, event):  # wxGlade: ParamEditor.<event_handler>
@@ -570,17 +562,7 @@ class ParamEditorFrame(wx.Frame):
         else:
             return
         try:
-            xml = open(path, 'rb').read()
-            from lxml import objectify
-            objectify.enable_recursive_str()
-            tree = objectify.fromstring(xml)
-            for p in tree.vehicles.parameters.param:
-                n = p.get('name').split(':')[1]
-                self.htree[n] = p
-            for lib in tree.libraries.parameters:
-                for p in lib.param:
-                    n = p.get('name')
-                    self.htree[n] = p
+            self.htree.update(param_help.load_index(path))
         except Exception as e:
             print (e)
 
@@ -9,7 +9,7 @@ April 2018
 import time
 import json
 import socket
-from threading import Thread
+from threading import Thread, Lock
 
 from flask import Flask
 from werkzeug.serving import make_server
@@ -24,15 +24,28 @@ def mavlink_to_json(msg):
     ret = ret[0:-2] + '}'
     return ret
 
-def mpstatus_to_json(status):
-    '''Translate MPStatus in json string'''
-    msg_keys = list(status.msgs.keys())
-    data = '{'
-    for key in msg_keys[:-1]:
-        data += mavlink_to_json(status.msgs[key]) + ','
-    data += mavlink_to_json(status.msgs[msg_keys[-1]])
-    data += '}'
-    return data
+def mpstatus_to_json(status, cache=None):
+    '''Translate MPStatus in json string. If a JSONCache is given only
+    messages changed since the last call are translated'''
+    if cache is None:
+        cache = JSONCache()
+    return cache.update(status.msgs)
+
+class JSONCache(object):
+    '''JSON of the last message of each type, updated from the changes
+    in a telemetry store'''
+    def __init__(self):
+        self.version = 0
+        self.json = {}
+        self.lock = Lock()
+
+    def update(self, msgs):
+        '''return JSON of all messages'''
+        with self.lock:
+            (self.version, changes) = msgs.changed_since(self.version)
+            for (key, m) in changes:
+                self.json[key] = mavlink_to_json(m)
+            return '{' + ','.join(self.json.values()) + '}'
 
 class RestServer():
     '''Rest Server'''
@@ -51,6 +64,7 @@ class RestServer():
         # Save status
         self.status = None
         self.server = None
+        self.json_cache = JSONCache()
 
     def update_dict(self, mpstate):
         '''We don't have time to waste'''
@@ -96,7 +110,7 @@ class RestServer():
             return '{"result": "No message"}'
 
         try:
-            status_dict = json.loads(mpstatus_to_json(self.status))
+            status_dict = json.loads(mpstatus_to_json(self.status, self.json_cache))
         except Exception as e:
             print(e)
             return
@@ -5,17 +5,124 @@ use vicon data to provide VISION_POSITION_ESTIMATE and GPS_INPUT data
 import math
 import threading
 import time
+from collections import deque
+
+import numpy as np
 
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_settings
 from MAVProxy.modules.lib import LowPassFilter2p
 from MAVProxy.modules.lib import mp_util
-from pymavlink.rotmat import Vector3
-from pymavlink.quaternion import Quaternion
+from MAVProxy.modules.lib import vicon_replay
 from pymavlink import mavutil
 from pymavlink import mavextra
 
-from pyvicon import pyvicon
+try:
+    from pyvicon import pyvicon
+except ImportError:
+    pyvicon = None
+
+
+def quat_to_euler(quat):
+    '''roll, pitch, yaw arrays from an (n,4) array of w,x,y,z quaternions'''
+    w, x, y, z = quat[:, 0], quat[:, 1], quat[:, 2], quat[:, 3]
+    roll = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+    pitch = np.arcsin(np.clip(2 * (w * y - z * x), -1.0, 1.0))
+    yaw = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+    return roll, pitch, yaw
+
+
+class ViconClock(object):
+    '''map Vicon frame numbers onto the local clock'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.offset = None
+        self.frame_rate = None
+
+    def frame_time(self, frame_num, frame_rate, recv_time, latency):
+        '''return local time of capture of a frame'''
+        vicon_t = frame_num / frame_rate
+        offset = recv_time - latency - vicon_t
+        if self.offset is None or frame_rate != self.frame_rate or abs(offset - self.offset) > 0.1:
+            self.offset = offset
+            self.frame_rate = frame_rate
+        else:
+            # follow the lowest delay seen, creeping up slowly to track clock drift
+            self.offset = min(offset, self.offset + 1.0e-6)
+        return vicon_t + self.offset
+
+
+class LatencyStats(object):
+    '''rolling latency statistics, in seconds'''
+
+    def __init__(self, window=1000):
+        self.total = deque(maxlen=window)
+        self.sdk = deque(maxlen=window)
+        self.processing = deque(maxlen=window)
+
+    def reset(self):
+        self.total.clear()
+        self.sdk.clear()
+        self.processing.clear()
+
+    def add(self, total, sdk, processing):
+        self.total.append(total)
+        self.sdk.append(sdk)
+        self.processing.append(processing)
+
+    def summary(self, name, samples):
+        if len(samples) == 0:
+            return "%s: no data" % name
+        a = np.array(samples) * 1000.0
+        p50, p95 = np.percentile(a, [50, 95])
+        return "%s: mean %.2fms p50 %.2fms p95 %.2fms max %.2fms" % (name, a.mean(), p50, p95, a.max())
+
+    def report(self):
+        return "\n".join([self.summary("total", self.total),
+                          self.summary("sdk", self.sdk),
+                          self.summary("processing", self.processing)])
+
+
+class ViconSubjects(object):
+    '''tracked subjects, with their position and velocity filter state held as arrays'''
+
+    def __init__(self, names, segments, sysids, frame_rate, vel_filter_hz):
+        self.names = names
+        self.segments = segments
+        self.sysids = sysids
+        n = len(names)
+        self.last_pos = np.zeros((n, 3))
+        self.last_vel = np.zeros((n, 3))
+        self.last_frame = np.full(n, -1, dtype=np.int64)
+        self.have_vel = np.zeros(n, dtype=bool)
+        self.vel_filter = LowPassFilter2p.LowPassFilter2p(frame_rate, vel_filter_hz)
+        self.vel_filter_hz = vel_filter_hz
+
+    def update(self, frame_num, pos, valid, frame_dt):
+        '''add positions for a frame, returning mask of subjects with a velocity, and filtered velocities'''
+        gap = frame_num - self.last_frame
+        ok = valid & (self.last_frame >= 0) & (gap > 0) & (gap <= 100)
+        dt = np.where(ok, gap, 1) * frame_dt
+        # subjects without a new velocity hold their last one through the filter
+        vel = np.where(ok[:, None], (pos - self.last_pos) / dt[:, None], self.last_vel)
+        self.last_vel = vel
+        self.last_pos = np.where(valid[:, None], pos, self.last_pos)
+        self.last_frame = np.where(valid, frame_num, self.last_frame)
+        first = ok & ~self.have_vel
+        self.have_vel |= ok
+        f = self.vel_filter
+        if f.delay_element_1 is None:
+            f.delay_element_1 = np.zeros_like(vel)
+            f.delay_element_2 = np.zeros_like(vel)
+        if first.any():
+            # start each subject's filter settled at its first real velocity, not the zeros held until then
+            settled = vel / (1.0 + f.a1 + f.a2)
+            f.delay_element_1 = np.where(first[:, None], settled, f.delay_element_1)
+            f.delay_element_2 = np.where(first[:, None], settled, f.delay_element_2)
+        return ok, f.apply(vel)
 
 
 class ViconModule(mp_module.MPModule):
@@ -38,166 +145,261 @@ class ViconModule(mp_module.MPModule):
         self.add_command('vicon', self.cmd_vicon, 'VICON control',
                          ["<start>",
                           "<stop>",
+                          "<replay> (FILENAME)",
+                          "<sim>",
+                          "<map>",
+                          "<unmap>",
+                          "<record> (FILENAME)",
+                          "<latency>",
                           "set (VICONSETTING)"])
         self.add_completion_function('(VICONSETTING)',
                                      self.vicon_settings.completion)
         self.vicon = None
-        self.thread = threading.Thread(target=self.thread_loop)
-        self.thread.start()
+        # map of subject name to vehicle sysid. When empty object_name is sent to the current vehicle
+        self.subject_map = {}
+        self.subjects_changed = False
+        self.record_filename = None
+        self.latency = LatencyStats()
+        self.stopping = False
         self.pos = None
         self.att = None
+        self.nsubjects = 0
         self.frame_count = 0
         self.gps_count = 0
         self.vision_count = 0
         self.last_frame_count = 0
-        self.vel_filter = LowPassFilter2p.LowPassFilter2p(200.0, 30.0)
         self.actual_frame_rate = 0.0
+        self.thread = threading.Thread(target=self.thread_loop)
+        self.thread.daemon = True
+        self.thread.start()
 
-    def detect_vicon_object(self):
-        self.vicon.get_frame()
-        object_name = self.vicon_settings.object_name
-        if object_name is None:
-            # We haven't specified which object we are looking for, so just find the first one
-            object_name = self.vicon.get_subject_name(0)
-        if object_name is None:
-            # No objects found
-            return None, None
-        segment_name = self.vicon.get_subject_root_segment_name(object_name)
-        if segment_name is None:
-            # Object we're looking for can't be found
-            return None, None
-        print("Connected to subject '%s' segment '%s'" % (object_name, segment_name))
-        return object_name, segment_name
-
-    def get_vicon_pose(self, object_name, segment_name):
-
-        # get position in mm. Coordinates are in NED
-        vicon_pos = self.vicon.get_segment_global_translation(object_name, segment_name)
-
-        if vicon_pos is None:
-            # Object is not in view
-            return None, None, None, None
-
-        vicon_quat = Quaternion(self.vicon.get_segment_global_quaternion(object_name, segment_name))
-
-        pos_ned = Vector3(vicon_pos * 0.001)
-        euler = vicon_quat.euler
-        roll, pitch, yaw = euler[0], euler[1], euler[2]
-        yaw = math.radians(mavextra.wrap_360(math.degrees(yaw)))
-
-        return pos_ned, roll, pitch, yaw
+    def detect_vicon_subjects(self, vicon):
+        '''find the subjects to track, returning a ViconSubjects or None'''
+        vicon.get_frame()
+        if self.subject_map:
+            wanted = sorted(self.subject_map.items())
+        else:
+            object_name = self.vicon_settings.object_name
+            if object_name is None:
+                # We haven't specified which object we are looking for, so just find the first one
+                object_name = vicon.get_subject_name(0)
+            if object_name is None:
+                # No objects found
+                return None
+            wanted = [(object_name, None)]
+        names = []
+        segments = []
+        sysids = []
+        for (object_name, sysid) in wanted:
+            segment_name = vicon.get_subject_root_segment_name(object_name)
+            if segment_name is None:
+                # Object we're looking for can't be found
+                continue
+            print("Connected to subject '%s' segment '%s'" % (object_name, segment_name))
+            names.append(object_name)
+            segments.append(segment_name)
+            sysids.append(sysid)
+        if not names:
+            return None
+        return ViconSubjects(names, segments, sysids, vicon.get_frame_rate(), self.vicon_settings.vel_filter_hz)
+
+    def get_vicon_poses(self, vicon, subjects, frame_num, recorder):
+        '''get positions in metres NED and w,x,y,z quaternions for all subjects'''
+        n = len(subjects.names)
+        pos = np.zeros((n, 3))
+        quat = np.zeros((n, 4))
+        quat[:, 0] = 1.0
+        valid = np.zeros(n, dtype=bool)
+        for i in range(n):
+            name = subjects.names[i]
+            segment = subjects.segments[i]
+            # get position in mm. Coordinates are in NED
+            vicon_pos = vicon.get_segment_global_translation(name, segment)
+            if vicon_pos is None:
+                # Object is not in view
+                continue
+            vicon_quat = vicon.get_segment_global_quaternion(name, segment)
+            pos[i] = vicon_pos
+            quat[i] = vicon_quat
+            valid[i] = True
+            if recorder is not None:
+                recorder.add(frame_num, name, segment, vicon_pos, vicon_quat)
+        return pos * 0.001, quat, valid
+
+    def update_recorder(self, recorder, frame_rate):
+        '''open or close the recording file on request from the main thread'''
+        filename = self.record_filename
+        if recorder is not None and recorder.filename != filename:
+            recorder.close()
+            print("Vicon recording closed")
+            recorder = None
+        if recorder is None and filename is not None:
+            try:
+                recorder = vicon_replay.ViconRecorder(filename, frame_rate)
+                print("Vicon recording to %s" % filename)
+            except IOError as ex:
+                print("Vicon recording failed: %s" % ex)
+                self.record_filename = None
+        return recorder
 
     def thread_loop(self):
         """background processing"""
-        object_name = None
-        segment_name = None
-        last_pos = None
+        vicon = None
+        subjects = None
+        recorder = None
+        clock = ViconClock()
         last_frame_num = None
         frame_count = 0
 
-        while True:
-            if self.vicon is None:
+        while not self.stopping:
+            if self.vicon is not vicon:
+                # started, stopped or switched source
+                vicon = self.vicon
+                subjects = None
+            if vicon is None:
+                recorder = self.update_recorder(recorder, 0)
                 time.sleep(0.1)
-                object_name = None
                 continue
 
-            if not object_name:
-                object_name, segment_name = self.detect_vicon_object()
-                if object_name is None:
+            if subjects is None or self.subjects_changed:
+                self.subjects_changed = False
+                subjects = self.detect_vicon_subjects(vicon)
+                if subjects is None:
                     continue
-                last_msg_time = time.time()
+                self.nsubjects = len(subjects.names)
                 now = time.time()
+                last_vision_send = now
                 last_origin_send = now
-                now_ms = int(now * 1000)
-                last_gps_send_ms = now_ms
-                frame_rate = self.vicon.get_frame_rate()
+                last_gps_send_ms = int(now * 1000)
+                frame_rate = vicon.get_frame_rate()
                 frame_dt = 1.0/frame_rate
-                last_rate = time.time()
+                last_rate = now
+                last_frame_num = None
                 frame_count = 0
+                clock.reset()
                 print("Vicon frame rate %.1f" % frame_rate)
 
-            if self.vicon_settings.gps_rate > 0:
-                gps_period_ms = 1000 // self.vicon_settings.gps_rate
-            time.sleep(0.01)
-            self.vicon.get_frame()
-            mav = self.master
-            now = time.time()
-            now_ms = int(now * 1000)
-            frame_num = self.vicon.get_frame_number()
+            if subjects.vel_filter_hz != self.vicon_settings.vel_filter_hz:
+                subjects.vel_filter_hz = self.vicon_settings.vel_filter_hz
+                subjects.vel_filter.set_cutoff_frequency(frame_rate, subjects.vel_filter_hz)
+            recorder = self.update_recorder(recorder, frame_rate)
+
+            # in server push mode this blocks until the next frame arrives
+            vicon.get_frame()
+            recv_time = time.time()
+            frame_num = vicon.get_frame_number()
+            if frame_num == last_frame_num:
+                # no new frame yet
+                continue
+            last_frame_num = frame_num
+            get_latency = getattr(vicon, 'get_latency_total', None)
+            sdk_latency = get_latency() if get_latency is not None else 0.0
+            frame_time = clock.frame_time(frame_num, frame_rate, recv_time, sdk_latency)
 
             frame_count += 1
-            if now - last_rate > 0.1:
-                rate = frame_count / (now - last_rate)
+            if recv_time - last_rate > 0.1:
+                rate = frame_count / (recv_time - last_rate)
                 self.actual_frame_rate = 0.9 * self.actual_frame_rate + 0.1 * rate
-                last_rate = now
+                last_rate = recv_time
                 frame_count = 0
-                self.vel_filter.set_cutoff_frequency(self.actual_frame_rate, self.vicon_settings.vel_filter_hz)
-
-            pos_ned, roll, pitch, yaw = self.get_vicon_pose(object_name, segment_name)
-            if pos_ned is None:
-                continue
-            
-            # print(f"XYZ: {pos_ned.x}, {pos_ned.y}, {pos_ned.z}, ")
 
-            if last_frame_num is None or frame_num - last_frame_num > 100 or frame_num <= last_frame_num:
-                last_frame_num = frame_num
-                last_pos = pos_ned
+            pos_ned, quat, valid = self.get_vicon_poses(vicon, subjects, frame_num, recorder)
+            ok, filtered_vel = subjects.update(frame_num, pos_ned, valid, frame_dt)
+            if not ok.any():
                 continue
 
-            dt = (frame_num - last_frame_num) * frame_dt
-            vel = (pos_ned - last_pos) * (1.0/dt)
-            last_pos = pos_ned
-            last_frame_num = frame_num
-
-            filtered_vel = self.vel_filter.apply(vel)
-
+            now = time.time()
+            now_ms = int(now * 1000)
+            send_vision = False
             if self.vicon_settings.vision_rate > 0:
-                dt = now - last_msg_time
-                if dt < 1.0 / self.vicon_settings.vision_rate:
-                    continue
+                send_vision = now - last_vision_send >= 1.0 / self.vicon_settings.vision_rate
+            send_gps = False
+            if self.vicon_settings.gps_rate > 0:
+                gps_period_ms = 1000 // self.vicon_settings.gps_rate
+                send_gps = now_ms - last_gps_send_ms > gps_period_ms
+            if not send_vision and not send_gps:
+                continue
 
-            last_msg_time = now
+            roll, pitch, yaw = quat_to_euler(quat)
+            yaw = np.mod(yaw, 2 * math.pi)
 
-            self.pos = pos_ned
-            self.att = [math.degrees(roll), math.degrees(pitch), math.degrees(yaw)]
+            first = np.flatnonzero(ok)[0]
+            self.pos = pos_ned[first]
+            self.att = [math.degrees(roll[first]), math.degrees(pitch[first]), math.degrees(yaw[first])]
             self.frame_count += 1
 
-            time_us = int(now * 1.0e6)
-
-            if now - last_origin_send > 1 and self.vicon_settings.vision_rate > 0:
-                # send a heartbeat msg
-                mav.mav.heartbeat_send(mavutil.mavlink.MAV_TYPE_GCS, mavutil.mavlink.MAV_AUTOPILOT_GENERIC, 0, 0, 0)
-
-                # send origin at 1Hz
-                mav.mav.set_gps_global_origin_send(self.target_system,
-                                                   int(self.vicon_settings.origin_lat*1.0e7),
-                                                   int(self.vicon_settings.origin_lon*1.0e7),
-                                                   int(self.vicon_settings.origin_alt*1.0e3),
-                                                   time_us)
+            # timestamp from the Vicon clock so jitter in receiving frames does not reach the EKF
+            time_us = int(frame_time * 1.0e6)
+
+            # send to all subjects for this frame together
+            links = [self.subject_link(subjects.sysids[i]) for i in range(len(subjects.names))]
+            if send_vision and now - last_origin_send > 1:
+                sent = set()
+                for i in np.flatnonzero(ok):
+                    (mav, target_system) = links[i]
+                    if mav is None or (id(mav), target_system) in sent:
+                        continue
+                    sent.add((id(mav), target_system))
+                    # send a heartbeat msg
+                    mav.mav.heartbeat_send(mavutil.mavlink.MAV_TYPE_GCS, mavutil.mavlink.MAV_AUTOPILOT_GENERIC, 0, 0, 0)
+
+                    # send origin at 1Hz
+                    mav.mav.set_gps_global_origin_send(target_system,
+                                                       int(self.vicon_settings.origin_lat*1.0e7),
+                                                       int(self.vicon_settings.origin_lon*1.0e7),
+                                                       int(self.vicon_settings.origin_alt*1.0e3),
+                                                       time_us)
                 last_origin_send = now
 
-            if self.vicon_settings.gps_rate > 0 and now_ms - last_gps_send_ms > gps_period_ms:
-                '''send GPS data at the specified rate, trying to align on the given period'''
-                self.gps_input_send(now, pos_ned, yaw, filtered_vel)
+            for i in np.flatnonzero(ok):
+                mav = links[i][0]
+                if mav is None:
+                    continue
+                if send_gps:
+                    '''send GPS data at the specified rate, trying to align on the given period'''
+                    self.gps_input_send(mav, frame_time, pos_ned[i], yaw[i], filtered_vel[i])
+                    self.gps_count += 1
+
+                if send_vision:
+                    # send VISION_POSITION_ESTIMATE
+                    # we force mavlink1 to avoid the covariances which seem to make the packets too large
+                    # for the mavesp8266 wifi bridge
+                    mav.mav.global_vision_position_estimate_send(time_us,
+                                                                 pos_ned[i][0], pos_ned[i][1], pos_ned[i][2],
+                                                                 roll[i], pitch[i], yaw[i], force_mavlink1=True)
+                    self.vision_count += 1
+            if send_gps:
                 last_gps_send_ms = (now_ms//gps_period_ms) * gps_period_ms
-                self.gps_count += 1
-
-            if self.vicon_settings.vision_rate > 0:
-                # send VISION_POSITION_ESTIMATE
-                # we force mavlink1 to avoid the covariances which seem to make the packets too large
-                # for the mavesp8266 wifi bridge
-                mav.mav.global_vision_position_estimate_send(time_us,
-                                                             pos_ned.x, pos_ned.y, pos_ned.z,
-                                                             roll, pitch, yaw, force_mavlink1=True)
-                self.vision_count += 1
-
-    def gps_input_send(self, time, pos_ned, yaw, gps_vel):
+            if send_vision:
+                last_vision_send = now
+
+            sent_time = time.time()
+            self.latency.add(sent_time - frame_time, sdk_latency, sent_time - recv_time)
+
+        if recorder is not None:
+            recorder.close()
+
+    def subject_link(self, sysid):
+        '''return link and target system to send a subject's data to. The link is None
+        if the sysid has not been seen on any link'''
+        if sysid is None:
+            return (self.master, self.target_system)
+        links = self.mpstate.sysid_links(sysid)
+        if len(links) == 0:
+            return (None, sysid)
+        # prefer the link with the most recent heartbeat from the vehicle
+        best = self.mpstate.master(sysid)
+        if best not in links:
+            best = links[0]
+        return (best, sysid)
+
+    def gps_input_send(self, mav, time, pos_ned, yaw, gps_vel):
         time_us = int(time * 1.0e6)
 
         gps_lat, gps_lon = mavextra.gps_offset(self.vicon_settings.origin_lat,
                                                self.vicon_settings.origin_lon,
-                                               pos_ned.y, pos_ned.x)
-        gps_alt = self.vicon_settings.origin_alt - pos_ned.z
+                                               pos_ned[1], pos_ned[0])
+        gps_alt = self.vicon_settings.origin_alt - pos_ned[2]
         gps_week, gps_week_ms = mp_util.get_gps_time(time)
         if self.vicon_settings.gps_nsats >= 6:
             fix_type = 3
@@ -207,21 +409,25 @@ class ViconModule(mp_module.MPModule):
         if yaw_cd == 0:
             # the yaw extension to GPS_INPUT uses 0 as no yaw support
             yaw_cd = 36000
-        self.master.mav.gps_input_send(time_us, 0, 0, gps_week_ms, gps_week, fix_type,
+        mav.mav.gps_input_send(time_us, 0, 0, gps_week_ms, gps_week, fix_type,
                                int(gps_lat * 1.0e7), int(gps_lon * 1.0e7), gps_alt,
                                1.0, 1.0,
-                               gps_vel.x, gps_vel.y, gps_vel.z,
+                               gps_vel[0], gps_vel[1], gps_vel[2],
                                0.2, 1.0, 1.0,
                                self.vicon_settings.gps_nsats,
                                yaw_cd)
 
     def cmd_start(self):
         """start vicon"""
+        if pyvicon is None:
+            print("pyvicon not installed")
+            return
         vicon = pyvicon.PyVicon()
         print("Opening Vicon connection to %s" % self.vicon_settings.host)
         vicon.connect(self.vicon_settings.host)
         print("Configuring vicon")
-        vicon.set_stream_mode(pyvicon.StreamMode.ClientPull)
+        # server push makes get_frame() wait for each new frame rather than polling
+        vicon.set_stream_mode(pyvicon.StreamMode.ServerPush)
         vicon.enable_marker_data()
         vicon.enable_segment_data()
         vicon.enable_unlabeled_marker_data()
@@ -231,29 +437,101 @@ class ViconModule(mp_module.MPModule):
         vicon.set_axis_mapping(pyvicon.Direction.Forward, pyvicon.Direction.Right, pyvicon.Direction.Down)
         print(vicon.get_axis_mapping())
         print("vicon ready")
+        self.latency.reset()
+        self.vicon = vicon
+
+    def cmd_replay(self, args):
+        """replay a recording, or simulated subjects, in place of the Vicon SDK"""
+        if args[0] == "sim":
+            nsubjects = int(args[1]) if len(args) > 1 else 1
+            vicon = vicon_replay.ViconReplay.simulated(nsubjects)
+        else:
+            speed = float(args[1]) if len(args) > 1 else 1.0
+            try:
+                vicon = vicon_replay.ViconReplay.from_file(args[0], speed=speed)
+            except (IOError, ValueError, KeyError) as ex:
+                print("Failed to load %s: %s" % (args[0], ex))
+                return
+        print("Vicon replaying %u subjects at %.1fHz" % (vicon.get_subject_count(), vicon.get_frame_rate()))
+        self.latency.reset()
         self.vicon = vicon
 
+    def cmd_map(self, args):
+        """map subjects to vehicle sysids"""
+        if len(args) == 0:
+            if not self.subject_map:
+                print("Sending %s to current vehicle" % (self.vicon_settings.object_name or "first subject"))
+            for name in sorted(self.subject_map.keys()):
+                print("%s -> sysid %u" % (name, self.subject_map[name]))
+            return
+        if len(args) != 2:
+            print("Usage: vicon map <SUBJECT> <SYSID>")
+            return
+        self.subject_map[args[0]] = int(args[1])
+        self.subjects_changed = True
+        if len(self.mpstate.sysid_links(int(args[1]))) == 0:
+            print("sysid %u not seen on any link, not sending until it is" % int(args[1]))
+
+    def cmd_unmap(self, args):
+        """remove subject mappings"""
+        if len(args) != 1:
+            print("Usage: vicon unmap <SUBJECT|all>")
+            return
+        if args[0] == "all":
+            self.subject_map = {}
+        else:
+            self.subject_map.pop(args[0], None)
+        self.subjects_changed = True
+
     def cmd_vicon(self, args):
         """command processing"""
         if len(args) == 0:
-            print("Usage: vicon <set|start|stop>")
+            print("Usage: vicon <set|start|stop|replay|sim|map|unmap|record|latency>")
             return
         if args[0] == "start":
             self.cmd_start()
-        if args[0] == "stop":
+        elif args[0] == "stop":
             self.vicon = None
+        elif args[0] == "replay":
+            if len(args) < 2:
+                print("Usage: vicon replay <FILENAME> [SPEED]")
+                return
+            self.cmd_replay(args[1:])
+        elif args[0] == "sim":
+            self.cmd_replay(["sim"] + args[1:])
+        elif args[0] == "map":
+            self.cmd_map(args[1:])
+        elif args[0] == "unmap":
+            self.cmd_unmap(args[1:])
+        elif args[0] == "record":
+            if len(args) < 2:
+                print("Usage: vicon record <FILENAME|stop>")
+            elif args[1] == "stop":
+                self.record_filename = None
+            else:
+                self.record_filename = args[1]
+        elif args[0] == "latency":
+            if len(args) > 1 and args[1] == "reset":
+                self.latency.reset()
+            else:
+                print(self.latency.report())
         elif args[0] == "set":
             self.vicon_settings.command(args[1:])
 
+    def unload(self):
+        """unload module"""
+        self.stopping = True
+
     def idle_task(self):
         """run on idle"""
-        if not self.pos or not self.att or self.frame_count == self.last_frame_count:
+        if self.pos is None or not self.att or self.frame_count == self.last_frame_count:
             return
         self.last_frame_count = self.frame_count
-        self.console.set_status('VPos', 'Vicon: Pos: %.2fN %.2fE %.2fD' % (self.pos.x, self.pos.y, self.pos.z), row=5)
-        self.console.set_status('VAtt', ' Att R:%.2f P:%.2f Y:%.2f GPS %u VIS %u RATE %.1f' % (self.att[0], self.att[1], self.att[2],
-                                                                                         self.gps_count, self.vision_count,
-                                                                                         self.actual_frame_rate), row=5)
+        self.console.set_status('VPos', 'Vicon: Pos: %.2fN %.2fE %.2fD' % (self.pos[0], self.pos[1], self.pos[2]), row=5)
+        self.console.set_status('VAtt', ' Att R:%.2f P:%.2f Y:%.2f GPS %u VIS %u RATE %.1f SUBJ %u' % (
+            self.att[0], self.att[1], self.att[2],
+            self.gps_count, self.vision_count,
+            self.actual_frame_rate, self.nsubjects), row=5)
 
 
 def init(mpstate):
@@ -150,12 +150,8 @@ class WPModule(mission_item_protocol.MissionItemProtocolModule):
         wp.target_system    = self.target_system
         wp.target_component = self.target_component
         self.wploader.set(wp, idx)
-
-        self.loading_waypoints = True
-        self.loading_waypoint_lasttime = time.time()
-        self.master.mav.mission_write_partial_list_send(self.target_system,
-                                                        self.target_component,
-                                                        idx, idx+1)
+        self.wploader.last_change = time.time()
+        self.send_changes(idx, idx)
         print("Moved WP %u %.1fm bearing %.1f from home" % (idx, dist, bearing))
 
     def commands(self):
@@ -497,13 +493,8 @@ class WPModule(mission_item_protocol.MissionItemProtocolModule):
         w.x = lat
         w.y = lon
         self.wploader.set(w, 0)
-        self.loading_waypoints = True
-        self.loading_waypoint_lasttime = time.time()
-        self.master.mav.mission_write_partial_list_send(
-            self.target_system,
-            self.target_component,
-            0, 0
-        )
+        self.wploader.last_change = time.time()
+        self.send_changes(0, 0)
 
     def fix_jumps(self, idx, delta):
         '''fix up jumps when we add/remove rows'''
@@ -10,6 +10,7 @@ import sys
 import time
 import os
 import fnmatch
+import re
 import threading
 import shlex
 import traceback
@@ -22,6 +23,8 @@ from MAVProxy.modules.lib import rline
 from MAVProxy.modules.lib import wxconsole
 from MAVProxy.modules.lib import param_help
 from MAVProxy.modules.lib import param_ftp
+from MAVProxy.modules.lib import log_scan
+from MAVProxy.modules.lib import msgindex
 from MAVProxy.modules.lib.graph_ui import Graph_UI
 from pymavlink.mavextra import *
 from MAVProxy.modules.lib.mp_menu import *
@@ -48,9 +51,6 @@ flightmodes = None
 # Global var to hold the GUI menu element
 TopMenu = None
 
-# have we decoded MAVFtp params?
-done_ftp_decode = False
-
 def xml_unescape(e):
     '''unescape < amd >'''
     e = e.replace('&gt;', '>')
@@ -119,10 +119,12 @@ class MEState(object):
               MPSetting('paramdocs', bool, True, 'show param docs'),
               MPSetting('max_rate', float, 0, 'maximum display rate of graphs in Hz'),
               MPSetting('vehicle_type', str, 'Auto', 'force vehicle type for mode handling'),
+              MPSetting('messages_page_size', int, 50, 'number of messages per page', range=(1,100000)),
               ]
             )
 
         self.mlog = None
+        self.log_scan = None
         self.mav_param = None
         self.filename = None
         self.command_map = command_map
@@ -135,6 +137,8 @@ class MEState(object):
             "map"       : ['(VARIABLE) (VARIABLE) (VARIABLE) (VARIABLE) (VARIABLE)'],
             "param"     : ['download', 'check', 'help (PARAMETER)', 'save', 'savechanged', 'diff', 'show', 'check'],
             "logmessage": ['download', 'help (MESSAGETYPE)'],
+            "messages"  : ['--regex', '--from', '--to', '--zoom', '--page', '--gui'],
+            "fft"       : ['--source', '--window', '--overlap', '--spectrogram', '--jobs'],
             "locationAnalysis"  : [],
             }
         self.aliases = {}
@@ -681,13 +685,42 @@ def cmd_fft(args):
     '''display fft from log'''
 
     from MAVProxy.modules.lib import mav_fft
-    if len(args) > 0:
-        condition = args[0]
-    else:
-        condition = None
+    usage = "Usage: fft [--source batch|ACC|GYR|IMU] [--window N] [--overlap F] [--spectrogram] [--jobs N]"
+    source = 'batch'
+    window = None
+    overlap = 0.5
+    spectrogram = False
+    jobs = 1
+    try:
+        while len(args) > 0:
+            a = args.pop(0)
+            if a == '--source':
+                source = args.pop(0)
+            elif a == '--window':
+                window = int(args.pop(0))
+            elif a == '--overlap':
+                overlap = float(args.pop(0))
+            elif a == '--spectrogram':
+                spectrogram = True
+            elif a == '--jobs':
+                jobs = int(args.pop(0))
+            else:
+                print(usage)
+                return
+    except (IndexError, ValueError):
+        print(usage)
+        return
+    if source not in mav_fft.SOURCES:
+        print(usage)
+        return
     global fft_tool, xlimits
     fft_tool = mav_fft.MavFFT(mlog=mestate.mlog,
-                              xlimits=xlimits)
+                              xlimits=xlimits,
+                              source=source,
+                              window=window,
+                              overlap=overlap,
+                              spectrogram=spectrogram,
+                              jobs=jobs)
     fft_tool.start()
 
 msgstats_tool = None
@@ -1052,104 +1085,314 @@ error_codes = {
     }
 }
     
+def get_error_code(subsys, ecode):
+    '''return string for an ERR message error code'''
+    for e in error_codes:
+        if e.endswith('*'):
+            subsys_match = subsys.startswith(e[:-1])
+        else:
+            subsys_match = subsys == e
+        if subsys_match:
+            if ecode in error_codes[e]:
+                return error_codes[e][ecode]
+            elif "*" in error_codes[e]:
+                return error_codes[e]['*'].replace("#",str(ecode))
+    return str(ecode)
+
+def message_string(m):
+    '''return display string for a MSG, EV, ERR or STATUSTEXT message'''
+    mtype = m.get_type()
+    if mtype == 'MSG':
+        return m.Message
+    if mtype == 'EV':
+        return "Event: %s" % events.get(m.Id, str(m.Id))
+    if mtype == 'ERR':
+        subsys = subsystems.get(m.Subsys, str(m.Subsys))
+        ecode = get_error_code(subsys, m.ECode)
+        return "Error: Subsys %s ECode %s " % (subsys, ecode)
+    return m.text
+
+class MessageScan(log_scan.LogScanConsumer):
+    '''build a searchable index of text messages, reassembling
+    chunked statustexts'''
+    name = 'messages'
+    types = set(['MSG', 'EV', 'ERR', 'STATUSTEXT'])
+
+    def start(self, mlog):
+        self.index = msgindex.MessageIndex()
+        self.statustext_current_id = None
+        self.statustext_next_seq = 0
+        self.statustext_accumulation = None
+        self.statustext_timestamp = None
+
+    def handle(self, mlog, m):
+        chunking_id = getattr(m, "id", getattr(m, "ID", None))
+        chunking_seq = getattr(m, "chunk_seq", getattr(m, "Seq", None))
+
+        if chunking_id is not None and chunking_seq is not None and chunking_id != 0:
+            if chunking_id != self.statustext_current_id:
+                if self.statustext_accumulation is not None:
+                    self.index.add(self.statustext_timestamp, self.statustext_accumulation)
+                self.statustext_accumulation = ""
+                self.statustext_current_id = chunking_id
+                self.statustext_next_seq = 0
+                self.statustext_timestamp = m._timestamp
+            if chunking_seq != self.statustext_next_seq:
+                self.statustext_accumulation += "..."
+            self.statustext_next_seq = chunking_seq + 1
+            t_str = getattr(m, "text", None)
+            if t_str is None:
+                t_str = getattr(m, 'Message')
+            self.statustext_accumulation += t_str
+            return
+
+        self.index.add(m._timestamp, message_string(m))
+
+    def finish(self, mlog):
+        # add any remaining statustext
+        if self.statustext_accumulation is not None:
+            self.index.add(self.statustext_timestamp, self.statustext_accumulation)
+        self.index.finish()
+        return self.index
+
+def message_index():
+    '''return the message index for the current log and condition'''
+    if mestate.settings.condition is None and mestate.log_scan is not None:
+        index = mestate.log_scan.result('messages')
+        if index is not None:
+            return index
+    # conditions depend on the other messages in the log, so need a new pass
+    scan = MessageScan()
+    mlog = mestate.mlog
+    mlog.rewind()
+    scan.start(mlog)
+    while True:
+        m = mlog.recv_match(type=scan.types, condition=mestate.settings.condition)
+        if m is None:
+            break
+        scan.handle(mlog, m)
+    mlog.rewind()
+    return scan.finish(mlog)
+
+msgview_tool = None
+
 def cmd_messages(args):
     '''show messages'''
+    usage = "Usage: messages [--regex] [--from SECONDS] [--to SECONDS] [--zoom] [--page N] [--gui] [!]<PATTERN>"
     invert = False
-    if len(args) > 0:
-        wildcard = args[0]
-        if wildcard.startswith("!"):
-            invert = True
-            wildcard = wildcard[1:]
-        if wildcard.find('*') == -1 and wildcard.find('?') == -1:
-            wildcard = "*" + wildcard + "*"
-    else:
-        wildcard = '*'
+    regex = False
+    gui = False
+    page = None
+    t0 = None
+    t1 = None
+    zoom = False
+    wildcard = None
+    try:
+        while len(args) > 0:
+            a = args.pop(0)
+            if a == '--regex':
+                regex = True
+            elif a == '--gui':
+                gui = True
+            elif a == '--zoom':
+                zoom = True
+            elif a == '--from':
+                t0 = float(args.pop(0))
+            elif a == '--to':
+                t1 = float(args.pop(0))
+            elif a == '--page':
+                page = int(args.pop(0))
+            elif wildcard is None:
+                wildcard = a
+            else:
+                print(usage)
+                return
+    except (IndexError, ValueError):
+        print(usage)
+        return
+    if wildcard is not None and wildcard.startswith("!"):
+        invert = True
+        wildcard = wildcard[1:]
 
-    # statustext reassembly:
-    statustext_current_id = None
-    statustext_next_seq = 0
-    statustext_accumulation = None
-    # statustext_timestring = None
+    index = message_index()
 
+    if gui:
+        global msgview_tool
+        msgview_tool = msgindex.MPMessageView(index=index, title="Messages: %s" % mestate.filename)
+        msgview_tool.start()
+        return
 
-    def print_if_match(m_timestring, mstr):
-        matches = fnmatch.fnmatch(mstr.upper(), wildcard.upper())
-        if invert:
-            matches = not matches
-        if matches:
-            print("%s %s" % (m_timestring, mstr))
+    # --from and --to are in seconds since the first message
+    tbase = index.start_time()
+    if tbase is not None:
+        if t0 is not None:
+            t0 += tbase
+        if t1 is not None:
+            t1 += tbase
+    if zoom:
+        if xlimits.xlim_low is not None:
+            t0 = xlimits.xlim_low
+        if xlimits.xlim_high is not None:
+            t1 = xlimits.xlim_high
 
-    def get_error_code(subsys, ecode):
-        for e in error_codes:
-            if e.endswith('*'):
-                subsys_match = subsys.startswith(e[:-1])
+    try:
+        rows = index.search(wildcard, regex=regex, invert=invert, t0=t0, t1=t1)
+    except re.error as ex:
+        print("Bad regex: %s" % ex)
+        return
+    if page is not None:
+        page_size = mestate.settings.messages_page_size
+        npages = max(1, (len(rows) + page_size - 1) // page_size)
+        if page < 1 or page > npages:
+            print("Page must be between 1 and %u" % npages)
+            return
+        print("Page %u/%u (%u messages)" % (page, npages, len(rows)))
+        rows = rows[(page-1)*page_size:page*page_size]
+    for i in rows:
+        print(index.format(i))
+
+class FlightModeScan(log_scan.LogScanConsumer):
+    '''build the flightmode list, as mlog.flightmode_list() does'''
+    name = 'flightmodes'
+    types = set(['MODE', 'HEARTBEAT'])
+
+    def start(self, mlog):
+        self.flightmodes = []
+        self.fmode = None
+        self.tstamp = None
+
+    def handle(self, mlog, m):
+        self.tstamp = m._timestamp
+        if mlog.flightmode == self.fmode:
+            return
+        if len(self.flightmodes) > 0:
+            (mode, t0, t1) = self.flightmodes[-1]
+            self.flightmodes[-1] = (mode, t0, self.tstamp)
+        self.flightmodes.append((mlog.flightmode, self.tstamp, None))
+        self.fmode = mlog.flightmode
+
+    def finish(self, mlog):
+        if self.tstamp is not None:
+            (mode, t0, t1) = self.flightmodes[-1]
+            if hasattr(mlog, 'last_timestamp'):
+                t1 = mlog.last_timestamp()
             else:
-                subsys_match = subsys == e
-            if subsys_match:
-                if ecode in error_codes[e]:
-                    return error_codes[e][ecode]
-                elif "*" in error_codes[e]:
-                    return error_codes[e]['*'].replace("#",str(ecode))
-        return str(ecode)
+                t1 = self.tstamp
+            self.flightmodes[-1] = (mode, t0, t1)
+        self.restore(mlog, self.flightmodes)
+        return self.flightmodes
 
-    mestate.mlog.rewind()
-    types = set(['MSG','EV','ERR', 'STATUSTEXT'])
-    while True:
-        m = mestate.mlog.recv_match(type=types, condition=mestate.settings.condition)
-        if m is None:
-            break
-        if m.get_type() == 'MSG':
-            mstr = m.Message
-        elif m.get_type() == 'EV':
-            mstr = "Event: %s" % events.get(m.Id, str(m.Id))
-        elif m.get_type() == 'ERR':
-            subsys = subsystems.get(m.Subsys, str(m.Subsys))
-            ecode = get_error_code(subsys, m.ECode)
-            mstr = "Error: Subsys %s ECode %s " % (subsys, ecode)
-        else:
-            mstr = m.text
+    def restore(self, mlog, result):
+        # avoid another pass when mlog.flightmode_list() is called
+        mlog._flightmodes = result
 
-        # special handling for statustext:
-        chunking_id = getattr(m, "id", getattr(m, "ID", None))
-        chunking_seq = getattr(m, "chunk_seq", getattr(m, "Seq", None))
 
-        if chunking_id is not None and chunking_seq is not None and chunking_id != 0:
-            if chunking_id != statustext_current_id:
-                if statustext_accumulation is not None:
-                    print_if_match(statustext_timestring, statustext_accumulation)
-                statustext_accumulation = ""
-                statustext_current_id = chunking_id
-                statustext_next_seq = 0
-                statustext_timestring = timestring(m)
-            if chunking_seq != statustext_next_seq:
-                statustext_accumulation += "..."
-            statustext_next_seq = chunking_seq + 1
-            t_str = getattr(m, "text", None)
-            if t_str is None:
-                t_str = getattr(m, 'Message')
-            statustext_accumulation += t_str
+class ParamScan(log_scan.LogScanConsumer):
+    '''collect parameters; the log reader fills in mlog.params itself'''
+    name = 'params'
+    types = set(['PARM', 'PARAM_VALUE'])
 
-            continue
+    def finish(self, mlog):
+        return (dict(mlog.params), getattr(mlog, 'param_defaults', None))
 
-        print_if_match(timestring(m), mstr)
+    def restore(self, mlog, result):
+        (params, defaults) = result
+        mlog.params.update(params)
+        if defaults is not None:
+            mlog.param_defaults = dict(defaults)
 
-    # emit any remaining statustext if it matches:
-    if statustext_accumulation is not None:
-        print_if_match(statustext_timestring, statustext_accumulation)
 
-    mestate.mlog.rewind()
+class FTPParamScan(log_scan.LogScanConsumer):
+    '''decode FILE_TRANSFER_PROTOCOL for parameters'''
+    name = 'ftp_params'
+    types = set(['FILE_TRANSFER_PROTOCOL'])
 
-def extract_files():
-    '''extract all FILE messages as a dictionary of files'''
-    sequences = {}
-    mestate.mlog.rewind()
-    while True:
-        m = mestate.mlog.recv_match(type=['FILE'], condition=mestate.settings.condition)
-        if m is None:
-            break
-        if not m.FileName in sequences:
-            sequences[m.FileName] = set()
-        sequences[m.FileName].add((m.Offset, m.Data[:m.Length]))
+    FTP_OpenFileRO = 4
+    FTP_ReadFile = 5
+    FTP_BurstReadFile = 15
+    FTP_Ack = 128
+
+    def start(self, mlog):
+        # map of session to (filename, list of (offset, data))
+        self.transfers = {}
+
+    def handle(self, mlog, m):
+        session = m.payload[2]
+        opcode = m.payload[3]
+        size = m.payload[4]
+        req_opcode = m.payload[5]
+        data = m.payload[12:12+size]
+        if opcode == self.FTP_OpenFileRO:
+            self.transfers[session] = (bytearray(data), [])
+        if req_opcode in [self.FTP_ReadFile, self.FTP_BurstReadFile] and opcode == self.FTP_Ack:
+            if session not in self.transfers:
+                print("No session %u" % session)
+                return
+            offset, = struct.unpack("<I", bytearray(m.payload[8:12]))
+            self.transfers[session][1].append((offset, bytearray(data)))
+
+    def extract(self, blocks):
+        '''join blocks into a file, returning None on a gap'''
+        blocks.sort(key=lambda x: x[0])
+        data = bytearray()
+        for (offset, bdata) in blocks:
+            if offset < len(data):
+                continue
+            if offset > len(data):
+                print("gap at %u" % len(data))
+                return None
+            data += bdata
+        return bytes(data)
+
+    def finish(self, mlog):
+        pdata = None
+        for session in self.transfers:
+            (filename, blocks) = self.transfers[session]
+            if filename.decode(errors='ignore').startswith('@PARAM/param.pck'):
+                ex = self.extract(blocks)
+                if ex is not None:
+                    pdata = param_ftp.ftp_param_decode(ex)
+        if pdata is None:
+            return None
+        names = pdata.name_strings()
+        params = list(zip(names, pdata.value_list()))
+        defaults = None
+        if pdata.default_values is not None and len(pdata) > 0:
+            defaults = list(zip(names, pdata.value_list(pdata.default_values)))
+        result = (params, defaults)
+        self.restore(mlog, result)
+        return result
+
+    def restore(self, mlog, result):
+        if result is None:
+            return
+        (params, defaults) = result
+        for (name, value) in params:
+            if name not in mlog.params:
+                mlog.params[name] = value
+        if defaults is not None:
+            mlog.param_defaults = dict(defaults)
+
+
+class FileScan(log_scan.LogScanConsumer):
+    '''collect FILE messages as a dictionary of files'''
+    name = 'files'
+    types = set(['FILE'])
+
+    def start(self, mlog):
+        self.sequences = {}
+
+    def handle(self, mlog, m):
+        if not m.FileName in self.sequences:
+            self.sequences[m.FileName] = set()
+        self.sequences[m.FileName].add((m.Offset, m.Data[:m.Length]))
+
+    def finish(self, mlog):
+        return join_file_sequences(self.sequences)
+
+
+def join_file_sequences(sequences):
+    '''join sets of (offset,data) into a dictionary of files'''
     ret = {}
     for f in sequences:
         ofs = 0
@@ -1164,9 +1407,25 @@ def extract_files():
                 print("Gap in %s at %u" % (f, ofs))
             ret[f] += t[1]
             ofs = t[0]+len(t[1])
+    return ret
 
+def extract_files():
+    '''extract all FILE messages as a dictionary of files'''
+    if mestate.settings.condition is None and mestate.log_scan is not None:
+        files = mestate.log_scan.result('files')
+        if files is not None:
+            return files
+    sequences = {}
     mestate.mlog.rewind()
-    return ret
+    while True:
+        m = mestate.mlog.recv_match(type=['FILE'], condition=mestate.settings.condition)
+        if m is None:
+            break
+        if not m.FileName in sequences:
+            sequences[m.FileName] = set()
+        sequences[m.FileName].add((m.Offset, m.Data[:m.Length]))
+    mestate.mlog.rewind()
+    return join_file_sequences(sequences)
 
 def cmd_file(args):
     '''show files'''
@@ -1209,6 +1468,8 @@ def set_vehicle_name():
                 mavutil.mavlink.MAV_TYPE_SUBMARINE : "ArduSub",
                 }
     mestate.param_help.vehicle_name = mapping.get(mestate.mlog.mav_type, None)
+    if mestate.param_help.vehicle_name is not None:
+        mestate.param_help.preload()
 
 def cmd_param_diff(args):
     '''show parameter changed using 4.3.x defaults'''
@@ -1275,89 +1536,11 @@ def cmd_param_save(args, changed_only=False):
     f.close()
     print("Saved %u parameters to %s" % (count, filename))
             
-def ftp_decode(mlog):
-    '''decode FILE_TRANSFER_PROTOCOL for parameters'''
-    mlog.rewind()
-    ftp_transfers = {}
-    ftp_block_size = 0
-
-    FTP_OpenFileRO = 4
-    FTP_ReadFile = 5
-    FTP_BurstReadFile = 15
-    FTP_Ack = 128
-    FTP_NAck = 129
-
-    class Block(object):
-        def __init__(self, offset, size, data):
-            self.offset = offset
-            self.size = size
-            self.data = data
-
-    class Transfer(object):
-        def __init__(self, filename):
-            self.filename = filename
-            self.blocks = []
-
-        def extract(self):
-            self.blocks.sort(key = lambda x: x.offset)
-            data = bytes()
-            for b in self.blocks:
-                if b.offset < len(data):
-                    continue
-                if b.offset > len(data):
-                    print("gap at %u" % len(data))
-                    return None
-                data += bytes(b.data)
-            return data
-    
-    while True:
-        m = mestate.mlog.recv_match(type=['FILE_TRANSFER_PROTOCOL'])
-        if m is None:
-            break
-        session = m.payload[2]
-        opcode = m.payload[3]
-        size = m.payload[4]
-        req_opcode = m.payload[5]
-        burst_complete = m.payload[6]
-        data = m.payload[12:12+size]
-        if opcode == FTP_OpenFileRO:
-            filename = data
-            ftp_transfers[session] = Transfer(bytearray(filename))
-        if req_opcode in [FTP_ReadFile, FTP_BurstReadFile] and opcode == FTP_Ack:
-            if not session in ftp_transfers:
-                print("No session %u" % session)
-                continue
-            offset, = struct.unpack("<I", bytearray(m.payload[8:12]))
-            ftp_transfers[session].blocks.append(Block(offset,size,bytearray(data)))
-
-    pdata = None
-    for session in ftp_transfers:
-        f = ftp_transfers[session]
-        if f.filename.decode().startswith('@PARAM/param.pck'):
-            ex = f.extract()
-            if ex is not None:
-                pdata = param_ftp.ftp_param_decode(ex)
-    if pdata is not None:
-        for (name,value,ptype) in pdata.params:
-            name = name.decode('utf-8')
-            if name not in mlog.params:
-                mlog.params[name] = value
-        if pdata.defaults is not None and len(pdata.defaults) > 0:
-            mlog.param_defaults = {}
-            for (name,value,ptype) in pdata.defaults:
-                name = name.decode('utf-8')
-                mlog.param_defaults[name] = value
-
-
 def cmd_param(args):
     '''show parameters'''
     verbose = mestate.settings.paramdocs
     mlog = mestate.mlog
     usage = "Usage: param <help|download|check|show|diff|save|savechanged>"
-    global done_ftp_decode
-    if isinstance(mlog, mavutil.mavfile) and not done_ftp_decode:
-        done_ftp_decode = True
-        ftp_decode(mlog)
     if len(args) > 0:
         if args[0] == 'help':
             if len(args) < 2:
@@ -1603,6 +1786,18 @@ def loadfile(args):
     # evaluation requires that to function.
     load_graphs()
 
+    # gather everything else we need from the log in a single pass
+    t0 = time.time()
+    mestate.log_scan = log_scan.LogScan(mlog, args)
+    mestate.log_scan.add_consumer(FlightModeScan())
+    mestate.log_scan.add_consumer(ParamScan())
+    mestate.log_scan.add_consumer(FTPParamScan())
+    mestate.log_scan.add_consumer(FileScan())
+    mestate.log_scan.add_consumer(MessageScan())
+    mestate.log_scan.run()
+    if mestate.log_scan.scanned:
+        mestate.console.write("scanned log in %.1fs\n" % (time.time()-t0))
+
     global flightmodes
     flightmodes = mlog.flightmode_list()
 
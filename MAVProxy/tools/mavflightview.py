@@ -9,6 +9,7 @@ AP_FLAKE8_CLEAN
 import cv2
 import functools
 import math
+import numpy as np
 import os
 import random
 import re
@@ -24,6 +25,7 @@ from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import multiproc
 from MAVProxy.modules.lib import grapher
 from MAVProxy.modules.lib import kmlread
+from MAVProxy.modules.lib import log_columns
 
 
 def create_map(title):
@@ -382,6 +384,194 @@ def pos_expressions(type_list):
     return ret
 
 
+mission_types = set(['MISSION_ITEM', 'MISSION_ITEM_INT', 'CMD'])
+
+
+def add_mission_item(wp, m, options):
+    '''add a logged mission item to a waypoint loader'''
+    type = m.get_type()
+    if type in ['MISSION_ITEM', 'MISSION_ITEM_INT']:
+        try:
+            new_m = m
+            if type == 'MISSION_ITEM_INT':
+                # create a MISSION_ITEM from MISSION_ITEM_INT
+                new_m = mavutil.mavlink.MAVLink_mission_item_message(
+                    0,
+                    0,
+                    m.seq,
+                    m.frame,
+                    m.command,
+                    m.current,
+                    m.autocontinue,
+                    m.param1,
+                    m.param2,
+                    m.param3,
+                    m.param4,
+                    m.x / 1.0e7,
+                    m.y / 1.0e7,
+                    m.z
+                )
+            while new_m.seq > wp.count():
+                print("Adding dummy WP %u" % wp.count())
+                wp.set(new_m, wp.count())
+            wp.set(new_m, m.seq)
+        except Exception as e:
+            print("Exception: %s" % str(e))
+            pass
+    elif type == 'CMD':
+        if options.mission is None:
+            m = mavutil.mavlink.MAVLink_mission_item_message(
+                0,
+                0,
+                m.CNum,
+                mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
+                m.CId,
+                0,       # current
+                1,       # autocontinue
+                m.Prm1,
+                m.Prm2,
+                m.Prm3,
+                m.Prm4,
+                m.Lat,
+                m.Lng,
+                m.Alt
+            )
+            try:
+                while m.seq > wp.count():
+                    print("Adding dummy WP %u" % wp.count())
+                    wp.set(m, wp.count())
+                wp.set(m, m.seq)
+            except Exception:
+                pass
+
+
+def rate_limit(timestamps, rate):
+    '''return indexes of timestamps kept when limiting to a maximum rate'''
+    if rate == 0:
+        return np.arange(len(timestamps))
+    ret = []
+    last = None
+    period = 1.0/rate
+    for i, t in enumerate(timestamps.tolist()):
+        if last is None or t - last > period:
+            last = t
+            ret.append(i)
+    return np.array(ret, dtype=np.int64)
+
+
+def track_columns(mlog, expressions, options, flightmode_selections=[]):
+    '''extract track points for simple position message types directly
+    from the columnar log data, with flightmode filtering and colouring
+    done as interval lookups over all points at once. Returns
+    (path, used_flightmodes), or None if this log or these options need
+    the message by message path'''
+    if not log_columns.have_columns(mlog):
+        return None
+    if options.condition is not None:
+        return None
+    colour_source = getattr(options, "colour_source", "flightmode")
+    if colour_source not in ["flightmode", "type"]:
+        return None
+
+    # gather the columns for each expression first, so we can give up
+    # before doing any work if one isn't a plain position message
+    columns = []
+    for e in expressions:
+        type = e.expression
+        if type in mission_types or log_columns.message_count(mlog, type) == 0:
+            columns.append(None)
+            continue
+        if e.recv_match_types != set([type]):
+            return None
+        fmt = mlog.formats[mlog.name_to_id[type]]
+        fields = ['Lat']
+        for lon in ['Lng', 'Lon']:
+            if lon in fmt.colhash:
+                fields.append(lon)
+                break
+        if len(fields) != 2:
+            return None
+        if type in ['GPS', 'GPS2']:
+            for f in ['Status', 'FixType']:
+                if f in fmt.colhash:
+                    fields.append(f)
+                    break
+            else:
+                # message_to_latlon() won't give a position
+                columns.append(None)
+                continue
+            if 'NSats' in fmt.colhash:
+                fields.append('NSats')
+        cols = log_columns.get_columns(mlog, type, fields)
+        if cols is None:
+            return None
+        columns.append((fields, cols))
+
+    # flightmode in effect for a timestamp is a lookup on mode start times
+    fmodes = mlog.flightmode_list()
+    mode_names = [f[0] for f in fmodes] + ['UNKNOWN']
+    mode_starts = np.array([f[1] for f in fmodes], dtype=float)
+
+    selecting = False
+    for sel in flightmode_selections:
+        if sel:
+            selecting = True
+    if selecting:
+        sel_ends = np.array([f[2] for f in options._flightmodes], dtype=float)
+        selected = np.zeros(len(sel_ends)+1, dtype=bool)
+        for i in range(min(len(sel_ends), len(flightmode_selections))):
+            selected[i] = flightmode_selections[i]
+
+    mav_type = getattr(mlog, 'mav_type', None)
+    path = []
+    used_flightmodes = {}
+    for instance in range(len(expressions)):
+        path.append([])
+        if columns[instance] is None:
+            continue
+        (fields, cols) = columns[instance]
+        t = cols['_timestamp']
+        lat = cols[fields[0]]
+        lng = cols[fields[1]]
+
+        # only plot thing we have a valid-looking location for:
+        mask = (np.abs(lat) > 0.01) | (np.abs(lng) > 0.01)
+        if len(fields) > 2:
+            # prevent mapping when no fix
+            status = cols[fields[2]]
+            nsats = cols['NSats'] if 'NSats' in cols else np.zeros(len(t))
+            mask &= (status >= 2) | (nsats >= 5)
+
+        midx = np.searchsorted(mode_starts, t, side='right') - 1
+        midx[midx < 0] = len(fmodes)
+        if options.mode is not None:
+            allowed = [i for i in range(len(mode_names)) if mode_names[i].lower() == options.mode.lower()]
+            mask &= np.isin(midx, allowed)
+        if selecting:
+            k = np.searchsorted(sel_ends, t, side='right')
+            mask &= selected[np.minimum(k, len(sel_ends))]
+
+        idx = np.flatnonzero(mask)
+        idx = idx[rate_limit(t[idx], options.rate)]
+        if len(idx) == 0:
+            continue
+
+        midx = midx[idx]
+        for m in np.unique(midx).tolist():
+            used_flightmodes[mode_names[m]] = 1
+        if colour_source == "flightmode":
+            mode_colours = [colour_for_flightmode(mav_type, mode_names[m], instance) for m in range(len(mode_names))]
+            colours = [mode_colours[m] for m in midx.tolist()]
+        else:
+            colours = [map_colours[instance]] * len(idx)
+
+        t = t[idx]
+        tdays = grapher.timestamp_to_days(t[0]) + (t - t[0]) * (1.0 / (60*60*24))
+        path[instance] = list(zip(lat[idx].tolist(), lng[idx].tolist(), colours, tdays.tolist()))
+
+    return (path, used_flightmodes)
+
+
 def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
     '''create a map for a log file'''
     wp = mavwp.MAVWPLoader()
@@ -435,9 +625,15 @@ def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
     last_timestamps = {}
     used_flightmodes = {}
 
+    fast = track_columns(mlog, expressions, options, flightmode_selections)
+    if fast is not None:
+        (path, used_flightmodes) = fast
+        # only the mission needs to come from the message stream
+        recv_match_types = recv_match_types.intersection(mission_types)
+
     mlog.rewind()
 
-    while True:
+    while fast is None or len(recv_match_types) > 0:
         try:
             m = mlog.recv_match(type=recv_match_types)
             if m is None:
@@ -447,60 +643,11 @@ def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
 
         type = m.get_type()
 
-        if type in ['MISSION_ITEM', 'MISSION_ITEM_INT']:
-            try:
-                new_m = m
-                if type == 'MISSION_ITEM_INT':
-                    # create a MISSION_ITEM from MISSION_ITEM_INT
-                    new_m = mavutil.mavlink.MAVLink_mission_item_message(
-                        0,
-                        0,
-                        m.seq,
-                        m.frame,
-                        m.command,
-                        m.current,
-                        m.autocontinue,
-                        m.param1,
-                        m.param2,
-                        m.param3,
-                        m.param4,
-                        m.x / 1.0e7,
-                        m.y / 1.0e7,
-                        m.z
-                    )
-                while new_m.seq > wp.count():
-                    print("Adding dummy WP %u" % wp.count())
-                    wp.set(new_m, wp.count())
-                wp.set(new_m, m.seq)
-            except Exception as e:
-                print("Exception: %s" % str(e))
-                pass
+        if type in mission_types:
+            add_mission_item(wp, m, options)
             continue
-        elif type == 'CMD':
-            if options.mission is None:
-                m = mavutil.mavlink.MAVLink_mission_item_message(
-                    0,
-                    0,
-                    m.CNum,
-                    mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
-                    m.CId,
-                    0,       # current
-                    1,       # autocontinue
-                    m.Prm1,
-                    m.Prm2,
-                    m.Prm3,
-                    m.Prm4,
-                    m.Lat,
-                    m.Lng,
-                    m.Alt
-                )
-                try:
-                    while m.seq > wp.count():
-                        print("Adding dummy WP %u" % wp.count())
-                        wp.set(m, wp.count())
-                    wp.set(m, m.seq)
-                except Exception:
-                    pass
+
+        if fast is not None:
             continue
 
         if not mlog.check_condition(options.condition):
@@ -621,7 +768,7 @@ def mavflightview_show(path,
     path_objs = []
     for i in range(len(path)):
         if len(path[i]) != 0:
-            path_objs.append(mp_slipmap.SlipPolygon(
+            path_objs.append(mp_slipmap.SlipTrack(
                 'FlightPath[%u]-%s' % (i, title),
                 path[i],
                 layer='FlightPath',
@@ -771,16 +918,55 @@ def load_kml(kml):
     return ret
 
 
-def mavflightview(filename, options):
+def mavflightview_load(filename, options):
+    '''load a log, returning the track etc for mavflightview_show'''
     print("Loading %s ..." % filename)
     mlog = mavutil.mavlink_connection(filename)
-    stuff = mavflightview_mav(mlog, options)
+    return mavflightview_mav(mlog, options)
+
+
+def mavflightview(filename, options, stuff=None):
+    if stuff is None:
+        stuff = mavflightview_load(filename, options)
     if stuff is None:
         return
     [path, wp, fen, used_flightmodes, mav_type, instances] = stuff
     mavflightview_show(path, wp, fen, used_flightmodes, mav_type, options, instances, title=filename)
 
 
+def load_worker(filename, options, queue):
+    '''load one log in a child process'''
+    try:
+        stuff = mavflightview_load(filename, options)
+    except Exception as ex:
+        print("Failed to load %s: %s" % (filename, ex))
+        stuff = None
+    queue.put((filename, stuff))
+
+
+def load_parallel(filenames, options, jobs):
+    '''load several logs using up to jobs child processes, returning a
+    dictionary of results by filename'''
+    queue = multiproc.Queue()
+    # results are by filename, so load each file once
+    pending = list(dict.fromkeys(filenames))
+    count = len(pending)
+    running = {}
+    results = {}
+    while len(results) < count:
+        while len(pending) > 0 and len(running) < jobs:
+            filename = pending.pop(0)
+            p = multiproc.Process(target=load_worker, args=(filename, options, queue))
+            p.start()
+            running[filename] = p
+        (done, failed) = multiproc.wait_results(queue, running)
+        results.update(done)
+        for (filename, exitcode) in failed.items():
+            print("Failed to load %s: exit code %s" % (filename, exitcode))
+            results[filename] = None
+    return results
+
+
 class mavflightview_options(object):
     def __init__(self):
         self.service = "MicrosoftHyb"
@@ -847,6 +1033,7 @@ if __name__ == "__main__":
     parser.add_option("--height", type='int', default=600, help="output image height in pixels")
     parser.add_option("--zoom-sweep", default=None, help="comma separated list of ground widths (m) to capture as separate images")  # noqa:E501
     parser.add_option("--grid", action='store_true', default=False, help="draw lat/lon grid on captured image")
+    parser.add_option("--jobs", type='int', default=1, help="number of logs to load in parallel")
 
     (opts, args) = parser.parse_args()
 
@@ -869,5 +1056,10 @@ if __name__ == "__main__":
 
     random.seed(1)
 
-    for f in args:
-        mavflightview(f, opts)
+    if opts.jobs > 1 and len(args) > 1:
+        loaded = load_parallel(args, opts, opts.jobs)
+        for f in args:
+            mavflightview(f, opts, stuff=loaded[f])
+    else:
+        for f in args:
+            mavflightview(f, opts)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+'''
+MAV Picture Viewer Grid
+
+Virtual grid of thumbnails for the mosaic window. Rather than one widget
+per image, only the rows in view are drawn, so the cost of the grid does
+not grow with the number of images. Thumbnail bitmaps are held in a
+bounded LRU, and only for images in or near the view.
+
+AP_FLAKE8_CLEAN
+'''
+
+from collections import OrderedDict
+from math import ceil
+from MAVProxy.modules.lib.wx_loader import wx
+
+
+class MosaicGrid(wx.VScrolledWindow):
+    """scrolled grid of image thumbnails"""
+
+    def __init__(self, parent, size, thumb_size, columns,
+                 select_cb=None, colour_cb=None, request_cb=None,
+                 prefetch_rows=4, max_bitmaps=1000):
+        super(MosaicGrid, self).__init__(parent, -1, size=size, style=wx.TAB_TRAVERSAL)
+        self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
+
+        # layout of each cell (thumbnail plus highlight border) and gap between cells
+        self.thumb_size = thumb_size
+        self.columns = columns
+        self.border = 2
+        self.gap = 5
+        self.cell_size = thumb_size + 2 * self.border
+
+        # callbacks for clicks, highlight colours and loading thumbnails
+        self.select_cb = select_cb
+        self.colour_cb = colour_cb
+        self.request_cb = request_cb
+
+        # filenumbers in display order and their position in it
+        self.display_list = []
+        self.display_index = {}
+
+        # LRU of thumbnail bitmaps indexed by filenumber
+        self.bitmaps = OrderedDict()
+        self.max_bitmaps = max(max_bitmaps, 2 * prefetch_rows * columns)
+        self.prefetch_rows = prefetch_rows
+        self.requested_rows = None
+
+        self.placeholder_brush = wx.Brush(wx.Colour(200, 200, 200))
+
+        self.SetRowCount(0)
+        self.Bind(wx.EVT_PAINT, self.on_paint)
+        self.Bind(wx.EVT_LEFT_DOWN, self.on_left_down)
+        self.Bind(wx.EVT_SIZE, self.on_size)
+
+    # row height callback used by VScrolledWindow
+    def OnGetRowHeight(self, row):
+        return self.cell_size + self.gap
+
+    # set the filenumbers to display, in order
+    def set_display_list(self, filenumbers):
+        """set filenumbers to display"""
+        self.display_list = list(filenumbers)
+        self.display_index = {f: i for (i, f) in enumerate(self.display_list)}
+        self.SetRowCount(int(ceil(len(self.display_list) / float(self.columns))))
+        self.requested_rows = None
+        self.Refresh()
+
+    # forget all thumbnails, e.g. when a new folder is opened
+    def clear_thumbnails(self):
+        """clear thumbnail LRU"""
+        self.bitmaps.clear()
+        self.requested_rows = None
+
+    # return range of rows to keep thumbnails for
+    def wanted_rows(self):
+        first = self.GetVisibleRowsBegin()
+        last = self.GetVisibleRowsEnd()
+        return (max(0, first - self.prefetch_rows), min(self.GetRowCount(), last + self.prefetch_rows))
+
+    # return True if a filenumber is displayed in or near the view
+    def is_wanted(self, filenumber):
+        idx = self.display_index.get(filenumber)
+        if idx is None:
+            return False
+        (first, last) = self.wanted_rows()
+        return first <= idx // self.columns < last
+
+    # add a loaded thumbnail
+    def add_thumbnail(self, thumb):
+        """add a thumbnail, ignoring it if it is not in or near the view"""
+        if not self.is_wanted(thumb.filenumber):
+            return
+        rgb = thumb.get_rgb()
+        if rgb is None:
+            return
+        self.bitmaps[thumb.filenumber] = wx.Bitmap.FromBuffer(thumb.width, thumb.height, rgb)
+        self.bitmaps.move_to_end(thumb.filenumber)
+        while len(self.bitmaps) > self.max_bitmaps:
+            self.bitmaps.popitem(last=False)
+        self.refresh_item(thumb.filenumber)
+
+    # request thumbnails missing from the visible rows and prefetch margin
+    def request_missing(self):
+        rows = self.wanted_rows()
+        if rows == self.requested_rows:
+            return
+        self.requested_rows = rows
+        (first, last) = rows
+        # visible rows first, then the margin below and above
+        vis_first = self.GetVisibleRowsBegin()
+        order = list(range(vis_first, last)) + list(range(vis_first - 1, first - 1, -1))
+        missing = []
+        for row in order:
+            for f in self.display_list[row * self.columns:(row + 1) * self.columns]:
+                if f not in self.bitmaps:
+                    missing.append(f)
+        if missing and self.request_cb is not None:
+            self.request_cb(missing)
+
+    # return rectangle of a cell relative to the first visible row
+    def cell_rect(self, idx):
+        row = idx // self.columns
+        col = idx % self.columns
+        y = (row - self.GetVisibleRowsBegin()) * (self.cell_size + self.gap) + self.gap
+        x = col * (self.cell_size + self.gap) + self.gap
+        return wx.Rect(x, y, self.cell_size, self.cell_size)
+
+    # draw the visible rows
+    def on_paint(self, event):
+        dc = wx.AutoBufferedPaintDC(self)
+        dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+        dc.Clear()
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        first = self.GetVisibleRowsBegin() * self.columns
+        last = min(len(self.display_list), self.GetVisibleRowsEnd() * self.columns)
+        for idx in range(first, last):
+            filenumber = self.display_list[idx]
+            rect = self.cell_rect(idx)
+
+            # highlight colour shows as a border around the thumbnail
+            colour = wx.WHITE
+            if self.colour_cb is not None:
+                colour = self.colour_cb(filenumber)
+            dc.SetBrush(wx.Brush(colour))
+            dc.DrawRectangle(rect)
+
+            bitmap = self.bitmaps.get(filenumber)
+            if bitmap is not None:
+                self.bitmaps.move_to_end(filenumber)
+                dc.DrawBitmap(bitmap, rect.x + self.border, rect.y + self.border)
+            else:
+                dc.SetBrush(self.placeholder_brush)
+                dc.DrawRectangle(rect.x + self.border, rect.y + self.border, self.thumb_size, self.thumb_size)
+        self.request_missing()
+
+    # redraw a single image
+    def refresh_item(self, filenumber):
+        """redraw an image's cell if visible"""
+        idx = self.display_index.get(filenumber)
+        if idx is None or not self.IsRowVisible(idx // self.columns):
+            return
+        self.RefreshRect(self.cell_rect(idx), eraseBackground=False)
+
+    # scroll so an image is visible
+    def show(self, filenumber):
+        """scroll image into view"""
+        idx = self.display_index.get(filenumber)
+        if idx is None:
+            return
+        row = idx // self.columns
+        if not self.IsRowVisible(row):
+            self.ScrollToRow(row)
+
+    # find the image at a window position
+    def filenumber_at(self, pos):
+        """return filenumber at a position, or None"""
+        pitch = self.cell_size + self.gap
+        col = (pos.x - self.gap) // pitch
+        row = self.GetVisibleRowsBegin() + (pos.y - self.gap) // pitch
+        if col < 0 or col >= self.columns or pos.x - self.gap - col * pitch >= self.cell_size:
+            return None
+        idx = row * self.columns + col
+        if idx < 0 or idx >= len(self.display_list):
+            return None
+        return self.display_list[idx]
+
+    # handle mouse clicks
+    def on_left_down(self, event):
+        filenumber = self.filenumber_at(event.GetPosition())
+        if filenumber is not None and self.select_cb is not None:
+            self.select_cb(filenumber)
+        event.Skip()
+
+    # handle window resize
+    def on_size(self, event):
+        self.requested_rows = None
+        self.Refresh()
+        event.Skip()
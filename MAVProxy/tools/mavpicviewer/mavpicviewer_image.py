@@ -12,9 +12,8 @@ from threading import Thread
 import cv2
 import time
 import os
-import piexif
-import re
 import mavpicviewer_shared as mpv
+import mavpicviewer_thumbs
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_elevation
 
@@ -143,8 +142,6 @@ class mavpicviewer_image:
             self.set_yaw(obj.yaw)
         elif isinstance(obj, mpv.ClearAllPOI):
             self.poi_clear_all()
-        elif isinstance(obj, mpv.GetTempForAllImages):
-            self.send_all_temperatures()
         elif isinstance(obj, mpv.Close):
             self.close(False)
 
@@ -457,20 +454,11 @@ class mavpicviewer_image:
     def get_exif_loc_and_temp(self, filename):
         """get latitude, longitude, altitude and terrain_alt from exif tags"""
 
-        exif_dict = piexif.load(filename)
-
-        if piexif.GPSIFD.GPSLatitudeRef in exif_dict["GPS"]:
-            lat_ns = exif_dict["GPS"][piexif.GPSIFD.GPSLatitudeRef]
-            lat = self.dms_to_decimal(exif_dict["GPS"][piexif.GPSIFD.GPSLatitude][0],
-                                      exif_dict["GPS"][piexif.GPSIFD.GPSLatitude][1],
-                                      exif_dict["GPS"][piexif.GPSIFD.GPSLatitude][2],
-                                      lat_ns)
-            lon_ew = exif_dict["GPS"][piexif.GPSIFD.GPSLongitudeRef]
-            lon = self.dms_to_decimal(exif_dict["GPS"][piexif.GPSIFD.GPSLongitude][0],
-                                      exif_dict["GPS"][piexif.GPSIFD.GPSLongitude][1],
-                                      exif_dict["GPS"][piexif.GPSIFD.GPSLongitude][2],
-                                      lon_ew)
-            alt = float(exif_dict["GPS"][piexif.GPSIFD.GPSAltitude][0])/float(exif_dict["GPS"][piexif.GPSIFD.GPSAltitude][1])
+        exif = mavpicviewer_thumbs.read_exif(filename)
+        if exif.lat is not None:
+            lat = exif.lat
+            lon = exif.lon
+            alt = exif.alt
             terr_alt = self.elevation_model.GetElevation(lat, lon)
             if terr_alt is None:
                 print("WARNING: failed terrain lookup for %f %f" % (lat, lon))
@@ -481,45 +469,8 @@ class mavpicviewer_image:
             alt = 0
             terr_alt = 0
 
-        # get comment
-        temp_max = None
-        temp_max_x = None
-        temp_max_y = None
-        temp_min = None
-        temp_min_x = None
-        temp_min_y = None
-        if piexif.ExifIFD.UserComment in exif_dict["Exif"]:
-            comment_bytes = exif_dict["Exif"][piexif.ExifIFD.UserComment]
-            comment_str = comment_bytes.decode("utf-8")
-            temp_max, temp_max_x, temp_max_y, temp_min, temp_min_x, temp_min_y = self.get_temp_from_comment(comment_str)
-
-        return lat, lon, alt, terr_alt, temp_max, temp_max_x, temp_max_y, temp_min, temp_min_x, temp_min_y
-
-    # collect and send all temperatures to mosaic
-    def send_all_temperatures(self):
-        for filenumber in range(len(self.filelist)):
-            filename = self.filelist[filenumber]
-            if filename is not None:
-                # load exif data
-                lat, lon, alt_amsl, terr_alt, \
-                    temp_max, temp_max_pos_X, temp_max_pos_Y, \
-                    temp_min, temp_min_pos_X, temp_min_pos_Y = self.get_exif_loc_and_temp(filename)
-                # send exif data to mosaic
-                self.send_comm_object(mpv.SetTempAndPos(filenumber, temp_max, temp_max_pos_X, temp_max_pos_Y))
-
-    def dms_to_decimal(self, degrees, minutes, seconds, sign=b' '):
-        """Convert degrees, minutes, seconds into decimal degrees.
-
-        >>> dms_to_decimal((10, 1), (10, 1), (10, 1))
-        10.169444444444444
-        >>> dms_to_decimal((8, 1), (9, 1), (10, 1), 'S')
-        -8.152777777777779
-        """
-        return (-1 if sign in b'SWsw' else 1) * (
-            float(degrees[0])/float(degrees[1])        +
-            float(minutes[0])/float(minutes[1]) / 60.0   +
-            float(seconds[0])/float(seconds[1]) / 3600.0
-        )
+        return lat, lon, alt, terr_alt, \
+            exif.temp_max, exif.temp_max_x, exif.temp_max_y, exif.temp_min, exif.temp_min_x, exif.temp_min_y
 
     def get_latlonalt(self, pixel_x, pixel_y):
         '''
@@ -534,48 +485,6 @@ class mavpicviewer_image:
                                                             self.lat, self.lon, self.alt_amsl,
                                                             self.roll, self.pitch, self.yaw)
 
-    # get temperature from a comment string
-    # on success returns three values, temp max, X and Y pixel coordinates
-    # on failure all values are None
-    def get_temp_from_comment(self, comment_str):
-        """
-        Extracts the maximum temperature and the corresponding pixel from the given comment string.
-
-        Parameters:
-        comment (str): A string containing temperature and pixel data like "max:26.85(76,304);min:21.85(422,187)"
-
-        Returns:
-        tuple: A tuple containing the max temperature (float) and the pixel coordinates (tuple of integers).
-        """
-
-        # initialise values
-        temp_max = None
-        temp_max_x = None
-        temp_max_y = None
-        temp_min = None
-        temp_min_x = None
-        temp_min_y = None
-
-        # Use regular expression to extract max temperature and the pixel coordinates
-        max_temp_pattern = r"max:([\d\.]+)\((\d+),(\d+)\)"
-        match = re.search(max_temp_pattern, comment_str)
-        if match:
-            # Extract the max temperature and pixel coordinates
-            temp_max = float(match.group(1))
-            temp_max_x = int(match.group(2))
-            temp_max_y = int(match.group(3))
-
-        # extract min temperature and pixel coordinates
-        min_temp_pattern = r"min:([\d\.]+)\((\d+),(\d+)\)?"
-        match = re.search(min_temp_pattern, comment_str)
-        if match:
-            # Extract the max temperature and pixel coordinates
-            temp_min = float(match.group(1))
-            temp_min_x = int(match.group(2))
-            temp_min_y = int(match.group(3))
-
-        return temp_max, temp_max_x, temp_max_y, temp_min, temp_min_x, temp_min_y
-
     # get temperature from an image's pixel darkness (assume black is hot)
     # on success returns three values, temp max, X and Y pixel coordinates
     # on failure all values are None
@@ -11,14 +11,15 @@ AP_FLAKE8_CLEAN
 import os
 from argparse import ArgumentParser
 from math import ceil
-import wx.lib.scrolledpanel as scrolled
 from MAVProxy.modules.lib import multiproc
 from MAVProxy.modules.lib import mp_util
 import mavpicviewer_shared as mpv
 from mavpicviewer_settings import mavpicviewer_settings
 import mavpicviewer_image
+import mavpicviewer_thumbs
 if mp_util.has_wxpython:
     from MAVProxy.modules.lib.wx_loader import wx
+    from mavpicviewer_grid import MosaicGrid
 
 prefix_str = "mavpicviewer_mosaic: "
 
@@ -36,7 +37,7 @@ class mavpicviewer_mosaic:
         self.filelist = {}
         self.update_file_list(folderpath)
 
-        # init dictionary of POI and panels for all images
+        # init dictionary of POI for all images
         self.poi_dict = {}
 
         # init dictionary of image locations
@@ -97,16 +98,15 @@ class mavpicviewer_mosaic:
         # add a read-only status text box
         self.text_status = wx.TextCtrl(self.frame, id=-1, size=(600, 60), style=wx.TE_READONLY | wx.TE_MULTILINE | wx.TE_RICH)
 
-        # add a scrolled panel
-        self.scrolled_panel = scrolled.ScrolledPanel(self.frame, -1, size=(600, 600), style=wx.TAB_TRAVERSAL)
-        self.scrolled_panel_sizer = wx.GridSizer(cols=5, hgap=5, vgap=5)
+        # add a grid of thumbnails. Only the visible rows are drawn
+        self.grid = MosaicGrid(self.frame, (600, 600), self.thumb_size, self.thumb_columns,
+                               select_cb=self.on_image_click,
+                               colour_cb=self.get_highlight_colour,
+                               request_cb=self.request_thumbnails)
 
-        # dictionary of panels for all images (used to turn on/off highlighting)
-        self.panel_dict = {}
-        self.update_panel_dict()
-
-        self.scrolled_panel.SetSizer(self.scrolled_panel_sizer)
-        self.scrolled_panel.SetupScrolling(scroll_x=True, scroll_y=True)
+        # thumbnails are loaded in the background and shown as they arrive
+        self.thumb_loader = None
+        self.start_thumbnail_loader()
 
         # add a vertical and horizontal sizers
         self.vert_sizer = wx.BoxSizer(wx.VERTICAL)
@@ -114,7 +114,7 @@ class mavpicviewer_mosaic:
 
         # set size hints and add sizer to frame
         self.vert_sizer.Add(self.text_status, proportion=0, flag=wx.EXPAND, border=5)
-        self.vert_sizer.Add(self.scrolled_panel, proportion=0, flag=wx.EXPAND | wx.ALL, border=5)
+        self.vert_sizer.Add(self.grid, proportion=0, flag=wx.EXPAND | wx.ALL, border=5)
         self.vert_sizer.Add(self.horiz_sizer, proportion=0, flag=wx.EXPAND)
         self.frame.SetSizer(self.vert_sizer)
 
@@ -133,31 +133,18 @@ class mavpicviewer_mosaic:
         # this does not return until the window is Closed
         self.app.MainLoop()
 
-    # update panel dictionary
-    def update_panel_dict(self):
-        # clear entries from panel dictionary
-        self.panel_dict.clear()
-
-        # create panel for each image
-        for i in range(len(self.filelist)):
-            # create a panel for each image (this allows us to set a background colour)
-            panel = wx.Panel(self.scrolled_panel, -1, size=(104, 104))
-
-            # create an image for each panel
-            img_path = self.filelist[i]
-            wx_image = wx.Image(img_path, wx.BITMAP_TYPE_ANY).Scale(100, 100)
-            image = wx.StaticBitmap(panel, i, wx.Bitmap(wx_image))
-
-            # bind event for left mouse button click
-            image.Bind(wx.EVT_LEFT_DOWN, self.on_image_click)
+    # start loading thumbnails for the file list
+    def start_thumbnail_loader(self):
+        if self.thumb_loader is not None:
+            self.thumb_loader.close()
+        self.grid.clear_thumbnails()
+        self.thumb_loader = mavpicviewer_thumbs.ThumbnailLoader(self.filelist, self.thumb_size)
+        self.thumb_load_reported = False
 
-            # create a box sizer to center the image within the panel
-            sizer = wx.BoxSizer(wx.VERTICAL)
-            sizer.Add(image, 0, wx.ALIGN_CENTER | wx.ALL, 2)
-            panel.SetSizer(sizer)
-
-            # add panel to dictionary
-            self.panel_dict[i] = panel
+    # request thumbnails be loaded next, called by the grid for visible images
+    def request_thumbnails(self, filenumbers):
+        if self.thumb_loader is not None:
+            self.thumb_loader.request(filenumbers)
 
     # process menu events
     def menu_open_folder(self, event):
@@ -199,12 +186,18 @@ class mavpicviewer_mosaic:
             # send Close command to image viewer
             self.send_comm_object(mpv.Close())
 
+        # stop thumbnail loading
+        if self.thumb_loader is not None:
+            self.thumb_loader.close()
+            self.thumb_loader = None
+
         # Close frame and exit main loop
         self.app.ExitMainLoop()
 
-    # handle timer event.  used to consume messages from the comm pipe
+    # handle timer event.  used to consume messages from the comm pipe and show loaded thumbnails
     def handle_timer_event(self, event):
         """handle timer event"""
+        self.update_thumbnails()
         if self.image_comm_pipe is not None:
             while self.image_comm_pipe.poll():
                 wx.CallAfter(self.handle_comm_object, self.image_comm_pipe.recv())
@@ -229,6 +222,22 @@ class mavpicviewer_mosaic:
                 self.image_temp_dict[obj.filenumber] = mpv.TempAndPos(obj.temp_max, obj.temp_pos_x, obj.temp_pos_y)
                 self.update_status_text()
 
+    # show thumbnails loaded since the last call
+    def update_thumbnails(self):
+        """show loaded thumbnails"""
+        if self.thumb_loader is None or self.thumb_loader.idle():
+            return
+        for thumb in self.thumb_loader.poll():
+            # the grid keeps thumbnails only for images in or near the view
+            self.grid.add_thumbnail(thumb)
+            # record exif temperatures for sorting, unless the image viewer has sent them
+            exif = thumb.exif
+            if exif is not None and exif.temp_max is not None and thumb.filenumber not in self.image_temp_dict:
+                self.image_temp_dict[thumb.filenumber] = mpv.TempAndPos(exif.temp_max, exif.temp_max_x, exif.temp_max_y)
+        if self.thumb_loader.finished() and not self.thumb_load_reported:
+            self.thumb_load_reported = True
+            print(prefix_str + self.thumb_loader.status())
+
     # send a communication object to the image viewer
     def send_comm_object(self, obj):
         """send a communication object to the image viewer"""
@@ -291,8 +300,8 @@ class mavpicviewer_mosaic:
         # clear image location dictionary
         self.image_loc_dict.clear()
 
-        # update panel dictionary
-        self.update_panel_dict()
+        # restart thumbnail loading
+        self.start_thumbnail_loader()
 
         # display all images
         self.display_all_images()
@@ -329,10 +338,10 @@ class mavpicviewer_mosaic:
         elif keycode == wx.WXK_DOWN:
             wx.CallAfter(self.set_filenunmber, self.filenumber+5)
 
-    # process window events
-    def on_image_click(self, event):
+    # process image click, called by the grid with the clicked image's filenumber
+    def on_image_click(self, filenumber):
         """process image click event"""
-        wx.CallAfter(self.set_filenunmber, event.GetId())
+        wx.CallAfter(self.set_filenunmber, filenumber)
 
     # set filenumber and update display
     def set_filenunmber(self, filenumber, notify_image_viewer=True):
@@ -369,64 +378,45 @@ class mavpicviewer_mosaic:
         if filenumber < 0 or filenumber >= len(self.filelist):
             return
 
-        # get panel for filenumber
-        panel = self.panel_dict[filenumber]
-        if panel is None:
-            return
+        # redraw the image's cell
+        self.grid.refresh_item(filenumber)
 
-        # get highlight colour
-        background_colour = wx.WHITE
+    # get highlight colour for an image
+    def get_highlight_colour(self, filenumber):
+        """get highlight colour for an image"""
         if filenumber == self.filenumber:
             # green for current image
-            background_colour = wx.GREEN
-        elif filenumber in self.poi_dict:
+            return wx.GREEN
+        if filenumber in self.poi_dict:
             # red for images with POI
-            background_colour = wx.RED
-
-        # set background colour
-        panel.SetBackgroundColour(background_colour)
-
-        # refresh panel
-        panel.Refresh()
-        panel.Update()
-        panel.Layout()
+            return wx.RED
+        return wx.WHITE
 
     # scroll to be visible
     def scroll_to_be_visible(self, filenumber):
         """scroll image to be visible"""
-        panel = self.panel_dict[self.filenumber]
-        if panel is not None:
-            self.scrolled_panel.ScrollChildIntoView(panel)
+        self.grid.show(filenumber)
 
     # display all images
     def display_all_images(self, poi_only=False, sort_by_temp=False):
         """display all images"""
-        # detach and hide all panels
-        for p in self.scrolled_panel_sizer.GetChildren():
-            panel = p.GetWindow()
-            self.scrolled_panel_sizer.Detach(panel)
-            panel.Hide()
-
         # create list of filenumbers (either the full list or the sorted by temperature list)
         if sort_by_temp:
             filenumber_list = list(self.image_temp_dict_sorted.keys())
         else:
             filenumber_list = list(range(len(self.filelist)))
 
-        # add panels to scrolled panel sizer
-        for i in filenumber_list:
-            # check if we should only display POI images
-            if poi_only is True and i not in self.poi_dict:
-                continue
-            panel = self.panel_dict[i]
-            if panel is not None:
-                self.scrolled_panel_sizer.Add(panel, proportion=0, flag=wx.ALL, border=2, userData=i)
-                panel.Show()
+        # check if we should only display POI images
+        if poi_only is True:
+            filenumber_list = [i for i in filenumber_list if i in self.poi_dict]
+
+        # the grid requests thumbnails for the rows it shows
+        self.grid.set_display_list(filenumber_list)
 
         # update frame layout
         self.frame.Layout()
 
-    # set filenumber and update display
+    # hide an image from the display
     def hide_image(self, filenumber):
         # sanity check filenumber
         num_files = len(self.filelist)
@@ -435,9 +425,7 @@ class mavpicviewer_mosaic:
             return
 
         # hide image
-        panel = self.scrolled_panel_sizer.GetItem(self.filenumber).GetWindow()
-        self.scrolled_panel_sizer.Detach(panel)
-        self.scrolled_panel_sizer.Layout()
+        self.grid.set_display_list([i for i in self.grid.display_list if i != filenumber])
 
     # handle settings changes callback
     # this is called by the settings window when a setting is changed
@@ -452,10 +440,11 @@ class mavpicviewer_mosaic:
     def sort_images_by_temperature(self):
         """sort images by temperature (max temp first)"""
         # print warning if not all images have temperature data
+        # temperatures are read from exif tags as thumbnails are loaded
         if len(self.image_temp_dict) != len(self.filelist):
             print(prefix_str + "only %d (of %d) images have temp" % (len(self.image_temp_dict), len(self.filelist)))
-            # request temperatures from image viewer
-            self.send_comm_object(mpv.GetTempForAllImages())
+            if self.thumb_loader is not None and not self.thumb_loader.finished():
+                print(prefix_str + "still loading " + self.thumb_loader.status())
 
         # update dictionary of images sorted by temperature
         self.image_temp_dict_sorted = dict(sorted(self.image_temp_dict.items(),
@@ -120,12 +120,6 @@ class ClearAllPOI:
         pass
 
 
-# request temperatures from all images
-class GetTempForAllImages:
-    def __init__(self):
-        pass
-
-
 # set Temp data for the given filenumber
 class SetTempAndPos:
     def __init__(self, filenumber, temp_max, temp_pos_x, temp_pos_y):
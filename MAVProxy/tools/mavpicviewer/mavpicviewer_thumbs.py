@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+
+'''
+MAV Picture Viewer Thumbnails
+
+Generates thumbnails and reads exif location and temperature for a
+folder of images in background worker processes. Images are decoded at
+reduced resolution, which for JPEGs skips most of the decode work.
+Results are kept in an on-disk cache keyed by path, modification time
+and size so re-opening a folder only processes new or changed images.
+
+AP_FLAKE8_CLEAN
+'''
+
+import os
+import queue
+import re
+import sqlite3
+import time
+
+import cv2
+import numpy as np
+import piexif
+
+from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib import mp_util
+
+prefix_str = "mavpicviewer_thumbs: "
+
+# reduced resolution decode flags, most reduced first
+REDUCED_DECODES = [(8, cv2.IMREAD_REDUCED_COLOR_8),
+                   (4, cv2.IMREAD_REDUCED_COLOR_4),
+                   (2, cv2.IMREAD_REDUCED_COLOR_2),
+                   (1, cv2.IMREAD_COLOR)]
+
+# quality of JPEG thumbnails held in the cache
+CACHE_JPEG_QUALITY = 90
+
+# times a file may be the one a worker died on before it is treated as failed
+WORKER_DEATH_LIMIT = 2
+
+
+# ExifInfo holds location and temperatures from an image's exif tags
+# values are None if not present in the image
+class ExifInfo:
+    def __init__(self, lat=None, lon=None, alt=None,
+                 temp_max=None, temp_max_x=None, temp_max_y=None,
+                 temp_min=None, temp_min_x=None, temp_min_y=None):
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt
+        self.temp_max = temp_max
+        self.temp_max_x = temp_max_x
+        self.temp_max_y = temp_max_y
+        self.temp_min = temp_min
+        self.temp_min_x = temp_min_x
+        self.temp_min_y = temp_min_y
+
+
+# Thumbnail holds an image's thumbnail plus its exif info, which is None if it could not be read
+# cached thumbnails hold JPEG bytes which are only decoded when get_rgb() is called
+class Thumbnail:
+    def __init__(self, filenumber, path, width, height, exif, rgb=None, jpeg=None):
+        self.filenumber = filenumber
+        self.path = path
+        self.width = width
+        self.height = height
+        self.exif = exif
+        self.rgb = rgb
+        self.jpeg = jpeg
+
+    def get_rgb(self):
+        """return thumbnail as RGB bytes, or None if it can't be decoded"""
+        if self.rgb is None and self.jpeg is not None:
+            img = cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is not None:
+                self.rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).tobytes()
+        return self.rgb
+
+
+def dms_to_decimal(degrees, minutes, seconds, sign=b' '):
+    """Convert degrees, minutes, seconds into decimal degrees.
+
+    >>> dms_to_decimal((10, 1), (10, 1), (10, 1))
+    10.169444444444444
+    >>> dms_to_decimal((8, 1), (9, 1), (10, 1), 'S')
+    -8.152777777777779
+    """
+    return (-1 if sign in b'SWsw' else 1) * (
+        float(degrees[0])/float(degrees[1]) +
+        float(minutes[0])/float(minutes[1]) / 60.0 +
+        float(seconds[0])/float(seconds[1]) / 3600.0
+    )
+
+
+def get_temp_from_comment(comment_str):
+    """
+    Extracts the max and min temperatures and their pixels from a comment string
+    like "max:26.85(76,304);min:21.85(422,187)"
+
+    Returns temp max, X, Y, temp min, X, Y with None for values not found
+    """
+    temp_max = None
+    temp_max_x = None
+    temp_max_y = None
+    temp_min = None
+    temp_min_x = None
+    temp_min_y = None
+
+    # extract max temperature and pixel coordinates
+    match = re.search(r"max:([\d\.]+)\((\d+),(\d+)\)", comment_str)
+    if match:
+        temp_max = float(match.group(1))
+        temp_max_x = int(match.group(2))
+        temp_max_y = int(match.group(3))
+
+    # extract min temperature and pixel coordinates
+    match = re.search(r"min:([\d\.]+)\((\d+),(\d+)\)?", comment_str)
+    if match:
+        temp_min = float(match.group(1))
+        temp_min_x = int(match.group(2))
+        temp_min_y = int(match.group(3))
+
+    return temp_max, temp_max_x, temp_max_y, temp_min, temp_min_x, temp_min_y
+
+
+def read_exif(filename):
+    """read location and temperatures from an image's exif tags"""
+    info = ExifInfo()
+    try:
+        exif_dict = piexif.load(filename)
+    except Exception as ex:
+        print(prefix_str + "failed to read exif from %s: %s" % (filename, ex))
+        return info
+
+    gps = exif_dict.get("GPS", {})
+    if piexif.GPSIFD.GPSLatitudeRef in gps:
+        lat = gps[piexif.GPSIFD.GPSLatitude]
+        lon = gps[piexif.GPSIFD.GPSLongitude]
+        info.lat = dms_to_decimal(lat[0], lat[1], lat[2], gps[piexif.GPSIFD.GPSLatitudeRef])
+        info.lon = dms_to_decimal(lon[0], lon[1], lon[2], gps[piexif.GPSIFD.GPSLongitudeRef])
+        alt = gps[piexif.GPSIFD.GPSAltitude]
+        info.alt = float(alt[0])/float(alt[1])
+
+    comment_bytes = exif_dict.get("Exif", {}).get(piexif.ExifIFD.UserComment, None)
+    if comment_bytes is not None:
+        comment_str = comment_bytes.decode("utf-8", errors="replace")
+        (info.temp_max, info.temp_max_x, info.temp_max_y,
+         info.temp_min, info.temp_min_x, info.temp_min_y) = get_temp_from_comment(comment_str)
+    return info
+
+
+def make_thumbnail(filename, size):
+    """return RGB numpy array of a size x size thumbnail, or None on failure.
+    The image is decoded at the lowest resolution that is at least size pixels"""
+    for (scale, flag) in REDUCED_DECODES:
+        image = cv2.imread(filename, flag)
+        if image is None:
+            return None
+        if scale == 1 or min(image.shape[0], image.shape[1]) >= size:
+            break
+    image = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def thumbnail_worker(job_queue, result_queue, size):
+    """worker process creating thumbnails. Jobs are (filenumber, path),
+    results are (filenumber, path, stat, jpeg bytes, rgb bytes, exif)"""
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        (filenumber, path) = job
+        try:
+            st = os.stat(path)
+            rgb = make_thumbnail(path, size)
+        except Exception as ex:
+            print(prefix_str + "failed to process %s: %s" % (path, ex))
+            rgb = None
+        if rgb is None:
+            result_queue.put((filenumber, path, None, None, None, None))
+            continue
+        # a thumbnail is still useful without exif info, e.g. if a tag is missing
+        try:
+            exif = read_exif(path)
+        except Exception as ex:
+            print(prefix_str + "failed to read exif from %s: %s" % (path, ex))
+            exif = None
+        (ok, jpeg) = cv2.imencode('.jpg', cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR),
+                                  [cv2.IMWRITE_JPEG_QUALITY, CACHE_JPEG_QUALITY])
+        result_queue.put((filenumber, path, (st.st_mtime, st.st_size),
+                          jpeg.tobytes() if ok else None, rgb.tobytes(), exif))
+
+
+class ThumbnailCache:
+    """on-disk cache of thumbnails and exif info"""
+
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = mp_util.dot_mavproxy("mavpicviewer_thumbs.db")
+        self.db = sqlite3.connect(filename)
+        self.db.execute("CREATE TABLE IF NOT EXISTS thumbs ("
+                        "path TEXT PRIMARY KEY, mtime REAL, fsize INTEGER, size INTEGER, jpeg BLOB, "
+                        "lat REAL, lon REAL, alt REAL, "
+                        "temp_max REAL, temp_max_x INTEGER, temp_max_y INTEGER, "
+                        "temp_min REAL, temp_min_x INTEGER, temp_min_y INTEGER)")
+        self.db.commit()
+        self.uncommitted = 0
+
+    def lookup(self, path, size):
+        """return (jpeg bytes, ExifInfo) for an unchanged image, or None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        path = os.path.abspath(path)
+        row = self.db.execute("SELECT mtime, fsize, size, jpeg, lat, lon, alt, "
+                              "temp_max, temp_max_x, temp_max_y, temp_min, temp_min_x, temp_min_y "
+                              "FROM thumbs WHERE path=?", (path,)).fetchone()
+        if row is None or row[0] != st.st_mtime or row[1] != st.st_size or row[2] != size:
+            return None
+        return (row[3], ExifInfo(*row[4:]))
+
+    def store(self, path, stat, size, jpeg, exif):
+        """add or replace an image's entry"""
+        path = os.path.abspath(path)
+        if exif is None:
+            exif = ExifInfo()
+        self.db.execute("INSERT OR REPLACE INTO thumbs VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                        (path, stat[0], stat[1], size, jpeg,
+                         exif.lat, exif.lon, exif.alt,
+                         exif.temp_max, exif.temp_max_x, exif.temp_max_y,
+                         exif.temp_min, exif.temp_min_x, exif.temp_min_y))
+        self.uncommitted += 1
+
+    def commit(self):
+        """write out stored entries"""
+        if self.uncommitted > 0:
+            self.db.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+class ThumbnailWorker:
+    """a worker process with its own job queue, so the jobs it holds are known if it dies"""
+
+    def __init__(self, result_queue, size):
+        self.job_queue = multiproc.Queue()
+        # filenumbers sent to the worker without a result yet, in the order sent
+        self.jobs = []
+        self.process = multiproc.Process(target=thumbnail_worker, args=(self.job_queue, result_queue, size))
+        self.process.daemon = True
+        self.process.start()
+
+
+class ThumbnailLoader:
+    """loads thumbnails for a list of files using cached entries and a
+    pool of worker processes. Call poll() regularly from the GUI to
+    collect finished thumbnails. All files are loaded once, and request()
+    moves files to the front of the queue, loading them again if they
+    have already been loaded. Files that failed to load are not retried,
+    and dead workers are replaced"""
+
+    def __init__(self, filelist, size, num_workers=None, cache_filename=None):
+        self.filelist = filelist
+        self.size = size
+        if num_workers is None:
+            num_workers = max(1, min(8, (os.cpu_count() or 2) - 1))
+        self.num_workers = num_workers
+        try:
+            self.cache = ThumbnailCache(cache_filename)
+        except sqlite3.Error as ex:
+            print(prefix_str + "thumbnail cache unavailable: %s" % ex)
+            self.cache = None
+        # files still to load, the next to load last
+        self.pending = list(reversed(range(len(filelist))))
+        # files being loaded, and the worker loading them
+        self.in_progress = {}
+        self.done = set()
+        self.workers = []
+        self.result_queue = None
+        self.cache_hits = 0
+        self.decoded = 0
+        self.failed = 0
+        self.failed_paths = set()
+        # times each file was the first unfinished job of a worker that died
+        self.worker_deaths = {}
+        self.start_time = time.time()
+
+    def request(self, filenumbers):
+        """load the listed images next, in the order given, e.g. to load
+        visible images first"""
+        first = [i for i in filenumbers if i not in self.in_progress and self.filelist[i] not in self.failed_paths]
+        listed = set(first)
+        self.pending = [i for i in self.pending if i not in listed] + first[::-1]
+
+    def start_workers(self):
+        """start worker processes"""
+        self.result_queue = multiproc.Queue()
+        for i in range(self.num_workers):
+            self.workers.append(ThumbnailWorker(self.result_queue, self.size))
+
+    def finished(self):
+        """return True when all thumbnails have been loaded and no more are requested"""
+        return not self.pending and not self.in_progress
+
+    def idle(self):
+        """return True if there is nothing to poll for"""
+        return self.finished() and (self.cache is None or self.cache.uncommitted == 0)
+
+    def mark_failed(self, filenumber, path):
+        self.done.add(filenumber)
+        self.failed += 1
+        self.failed_paths.add(path)
+
+    def handle_result(self, result):
+        """handle a result from a worker, returning a Thumbnail or None"""
+        (filenumber, path, stat, jpeg, rgb, exif) = result
+        worker = self.in_progress.pop(filenumber, None)
+        if worker is not None and filenumber in worker.jobs:
+            worker.jobs.remove(filenumber)
+        if rgb is None:
+            self.mark_failed(filenumber, path)
+            return None
+        self.done.add(filenumber)
+        if self.cache is not None and jpeg is not None:
+            self.cache.store(path, stat, self.size, jpeg, exif)
+        self.decoded += 1
+        return Thumbnail(filenumber, path, self.size, self.size, exif, rgb=rgb)
+
+    def check_workers(self):
+        """replace workers that have died, e.g. crashing on a bad file, and
+        load their unfinished jobs again. The first unfinished job is probably
+        the one it died on, but the result of the job before may have been lost
+        with the worker, so a file is only marked as failed once it has been
+        the first unfinished job WORKER_DEATH_LIMIT times. Returns Thumbnails
+        from results still in flight"""
+        dead = [w for w in self.workers if not w.process.is_alive()]
+        if not dead:
+            return []
+        # collect results in flight before deciding which jobs were lost
+        ret = []
+        try:
+            while True:
+                thumb = self.handle_result(self.result_queue.get(timeout=0.1))
+                if thumb is not None:
+                    ret.append(thumb)
+        except queue.Empty:
+            pass
+        for worker in dead:
+            self.workers.remove(worker)
+            for filenumber in worker.jobs:
+                self.in_progress.pop(filenumber, None)
+            retry = worker.jobs
+            if worker.jobs:
+                first = worker.jobs[0]
+                self.worker_deaths[first] = self.worker_deaths.get(first, 0) + 1
+                if self.worker_deaths[first] >= WORKER_DEATH_LIMIT:
+                    path = self.filelist[first]
+                    print(prefix_str + "worker died processing %s: exit code %s" % (path, worker.process.exitcode))
+                    self.mark_failed(first, path)
+                    retry = worker.jobs[1:]
+            self.pending.extend(reversed(retry))
+            worker.process.join()
+            self.workers.append(ThumbnailWorker(self.result_queue, self.size))
+        return ret
+
+    def poll(self, max_results=200):
+        """return list of newly loaded Thumbnails, at most max_results"""
+        ret = []
+        # cached thumbnails, in load order
+        while self.pending and len(ret) < max_results and self.cache is not None:
+            filenumber = self.pending[-1]
+            path = self.filelist[filenumber]
+            cached = self.cache.lookup(path, self.size)
+            if cached is None or cached[0] is None:
+                break
+            self.pending.pop()
+            ret.append(Thumbnail(filenumber, path, self.size, self.size, cached[1], jpeg=cached[0]))
+            self.done.add(filenumber)
+            self.cache_hits += 1
+
+        # results from workers
+        while self.in_progress and len(ret) < max_results and not self.result_queue.empty():
+            thumb = self.handle_result(self.result_queue.get())
+            if thumb is not None:
+                ret.append(thumb)
+        if self.in_progress:
+            ret.extend(self.check_workers())
+
+        # hand out jobs, keeping only a few queued so request() takes effect quickly
+        while self.pending and len(self.in_progress) < 2 * self.num_workers:
+            filenumber = self.pending[-1]
+            if self.cache is not None and self.cache.lookup(self.filelist[filenumber], self.size) is not None:
+                # loaded from the cache on the next poll
+                break
+            self.pending.pop()
+            if not self.workers:
+                self.start_workers()
+            worker = min(self.workers, key=lambda w: len(w.jobs))
+            worker.job_queue.put((filenumber, self.filelist[filenumber]))
+            worker.jobs.append(filenumber)
+            self.in_progress[filenumber] = worker
+
+        if self.cache is not None and (self.finished() or self.cache.uncommitted >= 100):
+            self.cache.commit()
+        return ret
+
+    def status(self):
+        """return status string"""
+        return "%u/%u thumbnails (%u cached, %u decoded, %u failed) in %.1fs" % (
+            len(self.done), len(self.filelist), self.cache_hits, self.decoded, self.failed,
+            time.time() - self.start_time)
+
+    def close(self):
+        """stop workers and close the cache"""
+        for worker in self.workers:
+            worker.job_queue.put(None)
+        for worker in self.workers:
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self.workers = []
+        self.pending = []
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None